@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# fixtures.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Records the fixtures of the micro-benchmarks (see micro.py)
+## from an app directory created by synthetic.py:
+##
+## - the raw output of each aligner (blastn, hs-blastn and gmap, the stub aligners)
+##   for the FASTA queries, as barleymap reads it before filtering it,
+## - a copy of the configuration files, maps, datasets, annotations, synonyms
+##   and queries, with the paths of the app directory changed to the fixtures directory.
+##
+## Once recorded, the fixtures do not change when barleymap does, so that
+## the micro-benchmarks always measure the same input.
+
+import sys, os, json, shutil
+from subprocess import Popen, PIPE
+
+from bmap_bench.synthetic import BENCH_CONF, DB_GENOME, DB_CONTIGS, QUERIES_FASTA
+
+FIXTURES_CONF = "fixtures.json"
+
+ALIGNERS_DIR = "aligners"
+
+# Raw outputs of the aligners: (name, db)
+BLASTN_GENOME = "blastn."+DB_GENOME
+BLASTN_CONTIGS = "blastn."+DB_CONTIGS
+HSBLASTN_GENOME = "hsblastn."+DB_GENOME
+GMAP_GENOME = "gmap."+DB_GENOME
+
+# Thresholds of the aligners and of the filters (bmap_align defaults)
+THRESHOLD_ID = 98.0
+THRESHOLD_COV = 95.0
+
+# Directories and files copied from the app directory
+COPIED_DIRS = ["conf", "maps", "datasets", "datasets_annotation", "datasets_synonyms", "queries"]
+
+# Configuration files with paths to the app directory
+CONF_FILES = ["conf/paths.conf", "conf/datasets.conf"]
+
+class FixturesRecorder(object):
+    
+    _app_path = ""
+    _fixtures_path = ""
+    _verbose = False
+    
+    def __init__(self, app_path, fixtures_path, verbose = False):
+        self._app_path = os.path.abspath(app_path)+"/"
+        self._fixtures_path = os.path.abspath(fixtures_path)+"/"
+        self._verbose = verbose
+        
+        if not os.path.exists(self._app_path+BENCH_CONF):
+            raise Exception("FixturesRecorder: "+self._app_path+" was not created by the synthetic data generator.")
+    
+    def _log(self, msg):
+        sys.stderr.write("FixturesRecorder: "+msg+"\n")
+    
+    def record(self):
+        if os.path.exists(self._fixtures_path):
+            raise Exception("FixturesRecorder: "+self._fixtures_path+" already exists.")
+        
+        os.mkdir(self._fixtures_path)
+        
+        self._log("copying data from "+self._app_path)
+        for copied_dir in COPIED_DIRS:
+            shutil.copytree(self._app_path+copied_dir, self._fixtures_path+copied_dir, symlinks = False)
+        
+        for conf_file in CONF_FILES:
+            self._relocate_conf(conf_file)
+        
+        self._log("recording aligners output")
+        os.mkdir(self._fixtures_path+ALIGNERS_DIR)
+        self._record_aligners()
+        
+        with open(self._app_path+BENCH_CONF, 'r') as bench_f:
+            bench_conf = json.load(bench_f)
+        
+        fixtures_conf = {"bench_conf":bench_conf, "threshold_id":THRESHOLD_ID, "threshold_cov":THRESHOLD_COV}
+        with open(self._fixtures_path+FIXTURES_CONF, 'w') as fixtures_f:
+            json.dump(fixtures_conf, fixtures_f, indent = 4, sort_keys = True)
+            fixtures_f.write("\n")
+        
+        self._log("fixtures recorded to "+self._fixtures_path)
+        
+        return
+    
+    def _relocate_conf(self, conf_file):
+        conf_path = self._fixtures_path+conf_file
+        
+        with open(conf_path, 'r') as conf_f:
+            conf_data = conf_f.read()
+        
+        with open(conf_path, 'w') as conf_f:
+            conf_f.write(conf_data.replace(self._app_path, self._fixtures_path))
+        
+        return
+    
+    def _read_paths(self):
+        paths = {}
+        
+        with open(self._app_path+"conf/paths.conf", 'r') as paths_f:
+            for paths_line in paths_f:
+                if paths_line.startswith("#") or paths_line.strip() == "": continue
+                paths_data = paths_line.strip().split(" ")
+                paths[paths_data[0]] = paths_data[1]
+        
+        return paths
+    
+    ## Runs the aligners with the same arguments that barleymap uses
+    def _record_aligners(self):
+        paths = self._read_paths()
+        query_path = self._app_path+QUERIES_FASTA
+        
+        blast_args = ["-dust", "no", "-soft_masking", "false", "-task", "megablast",
+                      "-outfmt", "6 qseqid qlen sseqid slen length qstart qend sstart send bitscore evalue pident mismatch gapopen"]
+        
+        self._run_aligner(BLASTN_GENOME, [paths["blastn_app_path"]]+blast_args+\
+                          ["-db", paths["blastn_dbs_path"]+DB_GENOME, "-query", query_path])
+        
+        self._run_aligner(BLASTN_CONTIGS, [paths["blastn_app_path"]]+blast_args+\
+                          ["-db", paths["blastn_dbs_path"]+DB_CONTIGS, "-query", query_path])
+        
+        self._run_aligner(HSBLASTN_GENOME, [paths["hsblastn_app_path"], "align", "-outfmt", "6",
+                          "-db", paths["hsblastn_dbs_path"]+DB_GENOME, "-query", query_path])
+        
+        self._run_aligner(GMAP_GENOME, [paths["gmap_app_path"], "-t", "1", "-B", "0", "-n", "100",
+                          "--min-identity="+str(THRESHOLD_ID / 100.0),
+                          "--min-trimmed-coverage="+str(THRESHOLD_COV / 100.0),
+                          "-d", DB_GENOME, "-D", paths["gmap_dbs_path"], query_path])
+        
+        return
+    
+    def _run_aligner(self, name, cmd):
+        if self._verbose: self._log("running "+" ".join(cmd))
+        
+        output_path = self._fixtures_path+ALIGNERS_DIR+"/"+name
+        with open(output_path, 'w') as output_f:
+            p = Popen(cmd, stdout = output_f, stderr = PIPE)
+            output_err = p.communicate()[1]
+        
+        if p.returncode != 0:
+            raise Exception("FixturesRecorder: "+" ".join(cmd)+" returned "+str(p.returncode)+"\n"+str(output_err))
+        
+        return
+
+## END
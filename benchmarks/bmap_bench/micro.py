@@ -0,0 +1,687 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# micro.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Micro-benchmarks of the parsers and hot loops of barleymap
+## (aligners output filters, MappingsParser, Mappers, Enrichers, MapEnricher
+## and OutputFacade printers), run in-process on the fixtures recorded by fixtures.py.
+##
+## The input of each micro-benchmark is prepared before timing it, with barleymap code,
+## from the recorded fixtures (e.g. the map of bmap_find for the queries IDs is created
+## to obtain the intervals, features and enriched maps of the Enrichers and printers).
+## If an operation modifies its input, a fresh copy is prepared, untimed, before each call.
+##
+## Each micro-benchmark is run during at least "min_time" seconds, "repeat" times,
+## with the garbage collector disabled (as timeit does), and it reports:
+## - ops/sec: the best rate of the rounds.
+## - allocations: the number of objects allocated by one call which are still alive
+##   when it returns (the objects tracked by the garbage collector, that is, containers
+##   and class instances, of its result), counted with gc.get_objects().
+##   Python 2 has no tracemalloc, and its free lists hide most of the temporary
+##   objects from gc.get_count(), so the memory which a call keeps is what is counted.
+## A micro-benchmark is a regression if its time per operation grows more than
+## the tolerance (a percentage) over the baseline, or its allocations do.
+
+import sys, os, gc, json, traceback
+from timeit import default_timer
+
+from barleymapcore.db.ConfigBase import ConfigBase
+from barleymapcore.db.PathsConfig import PathsConfig
+from barleymapcore.db.MapsConfig import MapsConfig
+from barleymapcore.db.DatasetsConfig import DatasetsConfig
+from barleymapcore.datasets.DatasetsFacade import DatasetsFacade
+from barleymapcore.datasets.DatasetsRetriever import DatasetsRetriever
+from barleymapcore.annotators.GenesAnnotator import AnnotatorsFactory
+from barleymapcore.maps.MapMarkers import MapMarkers
+from barleymapcore.maps.reader.MapReader import MapReader
+from barleymapcore.maps.reader.MappingsParser import MappingsParser
+from barleymapcore.maps.mappers.Mappers import PhysicalMapper
+from barleymapcore.maps.enrichment.MapEnricher import MapEnricherFactory, SHOW_ON_INTERVALS, SHOW_ON_MARKERS
+from barleymapcore.output.OutputFacade import OutputFacade
+from barleymapcore.utils.alignment_utils import load_fasta_lengths
+import barleymapcore.alignment.m2p_split_blast as m2p_split_blast
+import barleymapcore.alignment.m2p_hsblastn as m2p_hsblastn
+import barleymapcore.alignment.m2p_gmap as m2p_gmap
+
+from bmap_bench.synthetic import DB_GENOME, MAP_PHYSICAL, MAP_ANCHORED, \
+                                 DATASET_MARKERS, DATASET_GENES, QUERIES_FASTA, QUERIES_IDS
+from bmap_bench.fixtures import FIXTURES_CONF, ALIGNERS_DIR, \
+                                BLASTN_GENOME, BLASTN_CONTIGS, HSBLASTN_GENOME, GMAP_GENOME
+
+# Private functions of the aligners modules (module level, so they are not mangled)
+_split_blast_filter = getattr(m2p_split_blast, "__filter_blast_results")
+_split_blast_filter_lines = getattr(m2p_split_blast, "__filter_blast_results_lines")
+_split_blast_filter_arrays = getattr(m2p_split_blast, "__filter_blast_results_arrays")
+_hsblastn_filter = getattr(m2p_hsblastn, "__filter_blast_results")
+_hsblastn_filter_lines = getattr(m2p_hsblastn, "__filter_blast_results_lines")
+_hsblastn_filter_arrays = getattr(m2p_hsblastn, "__filter_blast_results_arrays")
+_gmap_compress = getattr(m2p_gmap, "__compress")
+_gmap_filter = getattr(m2p_gmap, "__filter_gmap_results")
+
+DEFAULT_MIN_TIME = 0.5
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 10.0
+
+# Allocations within this number are not considered regressions
+MIN_ALLOCATIONS_DIFF = 10
+
+DEFAULT_SORT_PARAM = "map default"
+EXTEND_WINDOW = 0.0
+MULTIPLE_PARAM = True
+
+STATUS_OK = "ok"
+STATUS_NEW = "new"
+STATUS_FAILED = "FAILED"
+STATUS_SLOWER = "SLOWER"
+STATUS_ALLOCATIONS = "MORE ALLOCATIONS"
+
+## Name of a query in the copy number "copy" of the aligners output (see MicroFixtures)
+def _copy_query_id(query_id, copy):
+    return query_id if copy == 0 else query_id+"."+str(copy)
+
+class MicroFixtures(object):
+    
+    _fixtures_path = ""
+    _num_hits = 0
+    _verbose = False
+    
+    _fixtures_conf = None
+    _paths_config = None
+    _maps_config = None
+    _datasets_config = None
+    _datasets_facade = None
+    _output_f = None
+    
+    _cache = None
+    
+    def __init__(self, fixtures_path, num_hits = 0, verbose = False):
+        self._fixtures_path = os.path.abspath(fixtures_path)+"/"
+        self._num_hits = num_hits
+        self._verbose = verbose
+        self._cache = {}
+        
+        if not os.path.exists(self._fixtures_path+FIXTURES_CONF):
+            raise Exception("MicroFixtures: "+self._fixtures_path+" was not recorded by the fixtures recorder.")
+        
+        with open(self._fixtures_path+FIXTURES_CONF, 'r') as fixtures_f:
+            self._fixtures_conf = json.load(fixtures_f)
+        
+        self._paths_config = PathsConfig()
+        self._paths_config.load_config(self._fixtures_path+"conf")
+        
+        self._maps_config = MapsConfig(self._fixtures_path+ConfigBase.MAPS_CONF, verbose)
+        self._datasets_config = DatasetsConfig(self._fixtures_path+ConfigBase.DATASETS_CONF, verbose)
+        self._datasets_facade = DatasetsFacade(self._datasets_config, self._paths_config.get_datasets_path(),
+                                               self._paths_config.get_maps_path(), verbose)
+        
+        # The printers write to /dev/null
+        self._output_f = open(os.devnull, 'w')
+    
+    ## The number of hits is part of the fixtures of the filters micro-benchmarks
+    def get_fixtures_conf(self):
+        if self._num_hits > 0:
+            return dict(self._fixtures_conf, hits = self._num_hits)
+        
+        return self._fixtures_conf
+    
+    def get_threshold_id(self):
+        return self._fixtures_conf["threshold_id"]
+    
+    def get_threshold_cov(self):
+        return self._fixtures_conf["threshold_cov"]
+    
+    def get_datasets_facade(self):
+        return self._datasets_facade
+    
+    def get_output(self):
+        return self._output_f
+    
+    def get_maps_path(self):
+        return self._paths_config.get_maps_path()
+    
+    def close(self):
+        self._output_f.close()
+    
+    def _cached(self, key, load):
+        if not key in self._cache:
+            self._cache[key] = load()
+        
+        return self._cache[key]
+    
+    ## Output of an aligner, as read by barleymap
+    def get_aligner_output(self, name):
+        with open(self._fixtures_path+ALIGNERS_DIR+"/"+name, 'r') as output_f:
+            output = output_f.read()
+        
+        return output
+    
+    ## Lines of an aligner output, as m2p_split_blast and m2p_hsblastn keep them
+    def get_aligner_lines(self, name):
+        output = self.get_aligner_output(name)
+        
+        return [line for line in output.strip().split("\n") if line != "" and not line.startswith("#")]
+    
+    ## Lines of an aligner output replicated up to num_hits lines (if it was set),
+    ## renaming the queries of each copy, to measure the filters on large outputs
+    def get_scaled_aligner_lines(self, name):
+        lines = self.get_aligner_lines(name)
+        
+        if self._num_hits == 0 or len(lines) == 0:
+            return lines
+        
+        scaled_lines = []
+        for copy in xrange(self._get_num_copies(lines)):
+            for line in lines:
+                line_data = line.split("\t", 1)
+                scaled_lines.append(_copy_query_id(line_data[0], copy)+"\t"+line_data[1])
+        
+        return scaled_lines[:self._num_hits]
+    
+    def _get_num_copies(self, lines):
+        return (self._num_hits + len(lines) - 1) / len(lines)
+    
+    def get_query_lengths(self):
+        return self._cached("query_lengths", lambda: load_fasta_lengths(self._fixtures_path+QUERIES_FASTA))
+    
+    ## Lengths of the queries of get_scaled_aligner_lines(name)
+    def get_scaled_query_lengths(self, name):
+        query_lengths = self.get_query_lengths()
+        
+        if self._num_hits == 0:
+            return query_lengths
+        
+        scaled_lengths = {}
+        for copy in xrange(self._get_num_copies(self.get_aligner_lines(name))):
+            for query_id in query_lengths:
+                scaled_lengths[_copy_query_id(query_id, copy)] = query_lengths[query_id]
+        
+        return scaled_lengths
+    
+    def get_query_ids(self):
+        query_ids = []
+        
+        with open(self._fixtures_path+QUERIES_IDS, 'r') as query_ids_f:
+            for query_id in query_ids_f:
+                query_ids.append(query_id.strip())
+        
+        return query_ids
+    
+    def get_map_config(self, map_name):
+        map_id = self._maps_config.get_maps_ids([map_name])[0]
+        
+        return self._maps_config.get_map_config(map_id)
+    
+    def get_sort_by(self, map_config):
+        return map_config.check_sort_param(map_config, DEFAULT_SORT_PARAM, DEFAULT_SORT_PARAM)
+    
+    def get_map_reader(self, map_name):
+        return self._cached("map_reader/"+map_name,
+                            lambda: MapReader(self._paths_config.get_maps_path(), self.get_map_config(map_name), self._verbose))
+    
+    def get_dataset_path(self, dataset, map_name):
+        datasets_retriever = DatasetsRetriever(self._datasets_config, self._paths_config.get_datasets_path(),
+                                               self._paths_config.get_maps_path(), self._verbose)
+        dataset_config = self._datasets_config.get_dataset_config(dataset)
+        
+        return datasets_retriever.get_dataset_path(dataset, self.get_map_config(map_name).get_id(),
+                                                   dataset_config.get_dataset_type())
+    
+    def get_dataset_synonyms(self, dataset):
+        datasets_retriever = DatasetsRetriever(self._datasets_config, self._paths_config.get_datasets_path(),
+                                               self._paths_config.get_maps_path(), self._verbose)
+        
+        return datasets_retriever.load_synonyms(self._datasets_config.get_dataset_config(dataset).get_synonyms())
+    
+    def get_dataset_config(self, dataset):
+        return self._datasets_config.get_dataset_config(dataset)
+    
+    ## Filtered blastn hits to the genome (AlignmentResult)
+    def get_alignment_results(self):
+        return self._cached("alignment_results",
+                            lambda: _split_blast_filter(self.get_aligner_lines(BLASTN_GENOME),
+                                                        self.get_threshold_id(), self.get_threshold_cov(), DB_GENOME))
+    
+    def get_annotator(self):
+        return self._cached("annotator",
+                            lambda: AnnotatorsFactory.get_annotator(self._fixtures_path+ConfigBase.DATASETS_ANNOTATION_CONF,
+                                                                    self._fixtures_path+ConfigBase.ANNOTATION_TYPES_CONF,
+                                                                    self._paths_config.get_annot_path(), self._verbose))
+    
+    ## MapMarkers of bmap_find -k -g -m -a for the queries IDs on the physical map
+    def get_map_markers(self, collapsed_view = False):
+        return self._cached("map_markers/"+str(collapsed_view), lambda: self._load_map_markers(collapsed_view))
+    
+    def _load_map_markers(self, collapsed_view):
+        map_config = self.get_map_config(MAP_PHYSICAL)
+        datasets_ids = self._datasets_config.get_datasets_list()
+        
+        map_markers = MapMarkers(self._paths_config.get_maps_path(), map_config, self._datasets_facade, self._verbose)
+        map_markers.retrieve_mappings(self._fixtures_path+QUERIES_IDS, datasets_ids,
+                                      self.get_sort_by(map_config), MULTIPLE_PARAM)
+        map_markers.enrichment(self.get_annotator(), True, True, True, SHOW_ON_INTERVALS,
+                               self._datasets_facade, map_config.get_main_datasets(), EXTEND_WINDOW, collapsed_view)
+        
+        return map_markers
+    
+    def get_map_enricher(self, show_how):
+        map_markers = self.get_map_markers()
+        map_reader = self.get_map_reader(MAP_PHYSICAL)
+        
+        enricher = MapEnricherFactory.get_enricher_factory(show_how).get_marker_enricher(map_reader)
+        
+        return MapEnricherFactory.get_map_enricher(show_how, enricher, map_markers.get_mapping_results(), self._verbose)
+
+class MicroBenchmark(object):
+    
+    _name = ""
+    _prepare = None
+    
+    # Prepared by prepare(fixtures):
+    # op(*args), args = setup() before each call, untimed
+    _op = None
+    _setup = None
+    
+    def __init__(self, name, prepare):
+        self._name = name
+        self._prepare = prepare
+    
+    def get_name(self):
+        return self._name
+    
+    def prepare(self, fixtures):
+        prepared = self._prepare(fixtures)
+        
+        self._op = prepared[0]
+        self._setup = prepared[1] if len(prepared) > 1 else None
+    
+    ## Runs the operation once. Returns its time
+    def run_once(self):
+        args = self._setup() if self._setup else ()
+        
+        ini_time = default_timer()
+        self._op(*args)
+        op_time = default_timer() - ini_time
+        
+        return op_time
+    
+    ## Runs the operation once. Returns the number of objects
+    ## allocated by it and still alive (its result)
+    def count_allocations(self):
+        args = self._setup() if self._setup else ()
+        
+        gc.collect()
+        ini_objects = len(gc.get_objects())
+        result = self._op(*args)
+        allocations = len(gc.get_objects()) - ini_objects
+        
+        del result
+        
+        return allocations
+
+##### Micro-benchmarks
+#####
+def _alignment_split_blast_filter(blast_filter):
+    def prepare(fixtures):
+        lines = fixtures.get_scaled_aligner_lines(BLASTN_GENOME)
+    
+        return (lambda: blast_filter(lines, fixtures.get_threshold_id(), fixtures.get_threshold_cov(), DB_GENOME),)
+
+    return prepare
+    
+def _alignment_hsblastn_filter(hsblastn_filter):
+    def prepare(fixtures):
+        lines = fixtures.get_scaled_aligner_lines(HSBLASTN_GENOME)
+        qlen_dict = fixtures.get_scaled_query_lengths(HSBLASTN_GENOME)
+        
+        return (lambda: hsblastn_filter(lines, fixtures.get_threshold_id(), fixtures.get_threshold_cov(), DB_GENOME, qlen_dict),)
+    
+    return prepare
+
+def _alignment_gmap_compress(fixtures):
+    output = fixtures.get_aligner_output(GMAP_GENOME)
+    
+    return (lambda: _gmap_compress(output, DB_GENOME),)
+
+def _alignment_gmap_filter(fixtures):
+    results = _gmap_compress(fixtures.get_aligner_output(GMAP_GENOME), DB_GENOME)
+    
+    return (lambda: _gmap_filter(results, fixtures.get_threshold_id(), fixtures.get_threshold_cov(), DB_GENOME),)
+
+def _parser_parse_mapping_file(fixtures):
+    map_config = fixtures.get_map_config(MAP_PHYSICAL)
+    chrom_dict = fixtures.get_map_reader(MAP_PHYSICAL).get_chrom_dict()
+    data_path = fixtures.get_dataset_path(DATASET_MARKERS, MAP_PHYSICAL)
+    
+    return (lambda: MappingsParser().parse_mapping_file(data_path, map_config, chrom_dict),)
+
+def _parser_by_id(fixtures):
+    map_config = fixtures.get_map_config(MAP_PHYSICAL)
+    chrom_dict = fixtures.get_map_reader(MAP_PHYSICAL).get_chrom_dict()
+    data_path = fixtures.get_dataset_path(DATASET_MARKERS, MAP_PHYSICAL)
+    dataset_synonyms = fixtures.get_dataset_synonyms(DATASET_MARKERS)
+    query_ids = fixtures.get_query_ids()
+    
+    # the queries found are marked in the dict and removed from the test set
+    setup = lambda: (dict([(query_id, 0) for query_id in query_ids]), set(query_ids))
+    op = lambda query_ids_dict, test_set: MappingsParser().parse_mapping_file_by_id(query_ids_dict, data_path, map_config, chrom_dict,
+                                                                                   MULTIPLE_PARAM, dataset_synonyms, test_set)
+    
+    return (op, setup)
+
+def _parser_by_pos(fixtures):
+    map_config = fixtures.get_map_config(MAP_PHYSICAL)
+    map_sort_by = fixtures.get_sort_by(map_config)
+    chrom_dict = fixtures.get_map_reader(MAP_PHYSICAL).get_chrom_dict()
+    data_path = fixtures.get_dataset_path(DATASET_MARKERS, MAP_PHYSICAL)
+    map_intervals = fixtures.get_map_enricher(SHOW_ON_INTERVALS).map_to_intervals(EXTEND_WINDOW)
+    
+    return (lambda: MappingsParser().parse_mapping_file_by_pos(map_intervals, data_path, chrom_dict, map_config, map_sort_by),)
+
+def _parser_on_pos(fixtures):
+    map_config = fixtures.get_map_config(MAP_PHYSICAL)
+    map_sort_by = fixtures.get_sort_by(map_config)
+    chrom_dict = fixtures.get_map_reader(MAP_PHYSICAL).get_chrom_dict()
+    data_path = fixtures.get_dataset_path(DATASET_GENES, MAP_PHYSICAL)
+    dataset_config = fixtures.get_dataset_config(DATASET_GENES)
+    map_enricher = fixtures.get_map_enricher(SHOW_ON_MARKERS)
+    
+    # the features found are added to the intervals
+    setup = lambda: (map_enricher.map_to_intervals(EXTEND_WINDOW),)
+    op = lambda map_intervals: MappingsParser().parse_mapping_file_on_pos(map_intervals, data_path, chrom_dict, map_config, map_sort_by,
+                                                                          DATASET_GENES, dataset_config.get_dataset_name(),
+                                                                          dataset_config.get_dataset_type())
+    
+    return (op, setup)
+
+def _parser_by_contig(fixtures):
+    map_config = fixtures.get_map_config(MAP_ANCHORED)
+    contig_set = set([line.split("\t")[2] for line in fixtures.get_aligner_lines(BLASTN_CONTIGS)])
+    maps_path = fixtures.get_maps_path()
+    
+    # the contigs found are removed from the set
+    setup = lambda: (set(contig_set),)
+    op = lambda contigs: MappingsParser().parse_mapping_file_by_contig(contigs, map_config, maps_path, False)
+    
+    return (op, setup)
+
+def _mapper_create_positions(fixtures):
+    map_reader = fixtures.get_map_reader(MAP_PHYSICAL)
+    mapper = PhysicalMapper(map_reader)
+    markers_positions = mapper._reformatPositions(fixtures.get_alignment_results())
+    map_name = map_reader.get_map_config().get_name()
+    
+    return (lambda: mapper._createPositions(markers_positions, MULTIPLE_PARAM, map_reader.get_chrom_dict(), map_name),)
+
+def _mapper_sort_positions(fixtures):
+    map_reader = fixtures.get_map_reader(MAP_PHYSICAL)
+    mapper = PhysicalMapper(map_reader)
+    markers_positions = mapper._reformatPositions(fixtures.get_alignment_results())
+    positions_list = mapper._createPositions(markers_positions, MULTIPLE_PARAM, map_reader.get_chrom_dict(),
+                                             map_reader.get_map_config().get_name())
+    sort_by = fixtures.get_sort_by(map_reader.get_map_config())
+    
+    return (lambda: mapper._sort_positions_list(positions_list, sort_by),)
+
+def _enricher_enrich(get_enricher, collapsed_view):
+    def prepare(fixtures):
+        map_config = fixtures.get_map_config(MAP_PHYSICAL)
+        map_reader = fixtures.get_map_reader(MAP_PHYSICAL)
+        mapping_results = fixtures.get_map_markers().get_mapping_results()
+        
+        enricher = get_enricher(MapEnricherFactory.get_enricher_factory(SHOW_ON_INTERVALS), map_reader, fixtures)
+        map_intervals = fixtures.get_map_enricher(SHOW_ON_INTERVALS).map_to_intervals(EXTEND_WINDOW)
+        features = enricher.retrieve_features(map_config, map_intervals, fixtures.get_datasets_facade(),
+                                              map_config.get_main_datasets(), mapping_results.get_sort_by())
+        
+        return (lambda: enricher.enrich(mapping_results, features, collapsed_view),)
+    
+    return prepare
+
+def _map_enricher_map_intervals(show_how):
+    def prepare(fixtures):
+        map_enricher = fixtures.get_map_enricher(show_how)
+        mapping_results = map_enricher.get_mapping_results()
+        
+        return (lambda: map_enricher._map_intervals(mapping_results.get_mapped(), mapping_results.get_sort_by(), EXTEND_WINDOW),)
+    
+    return prepare
+
+def _output_printer(print_method, collapsed_view):
+    def prepare(fixtures):
+        map_config = fixtures.get_map_config(MAP_PHYSICAL)
+        mapping_results = fixtures.get_map_markers(collapsed_view).get_mapping_results()
+        
+        if collapsed_view:
+            printer = OutputFacade.get_collapsed_printer(fixtures.get_output())
+        else:
+            printer = OutputFacade.get_expanded_printer(fixtures.get_output())
+        
+        return (lambda: print_method(printer, mapping_results, map_config, fixtures),)
+    
+    return prepare
+
+_GENE_ENRICHER = lambda enricher_factory, map_reader, fixtures: enricher_factory.get_gene_enricher(map_reader, fixtures.get_annotator())
+_MARKER_ENRICHER = lambda enricher_factory, map_reader, fixtures: enricher_factory.get_marker_enricher(map_reader)
+
+_PRINT_MAP = lambda printer, mapping_results, map_config, fixtures: \
+                printer.print_map(mapping_results.get_mapped(), map_config, MULTIPLE_PARAM)
+_PRINT_MAP_WITH_GENES = lambda printer, mapping_results, map_config, fixtures: \
+                printer.print_map_with_genes(mapping_results.get_map_with_genes(), map_config, MULTIPLE_PARAM,
+                                             True, fixtures.get_annotator())
+_PRINT_MAP_WITH_MARKERS = lambda printer, mapping_results, map_config, fixtures: \
+                printer.print_map_with_markers(mapping_results.get_map_with_markers(), map_config, MULTIPLE_PARAM)
+_PRINT_MAP_WITH_ANCHORED = lambda printer, mapping_results, map_config, fixtures: \
+                printer.print_map_with_anchored(mapping_results.get_map_with_anchored(), map_config, MULTIPLE_PARAM)
+_PRINT_UNALIGNED = lambda printer, mapping_results, map_config, fixtures: \
+                printer.print_unaligned(mapping_results.get_unaligned(), map_config)
+
+MICRO_BENCHMARKS = [
+    MicroBenchmark("split_blast.filter", _alignment_split_blast_filter(_split_blast_filter)),
+    MicroBenchmark("split_blast.filter_lines", _alignment_split_blast_filter(_split_blast_filter_lines)),
+    MicroBenchmark("split_blast.filter_arrays", _alignment_split_blast_filter(_split_blast_filter_arrays)),
+    MicroBenchmark("hsblastn.filter", _alignment_hsblastn_filter(_hsblastn_filter)),
+    MicroBenchmark("hsblastn.filter_lines", _alignment_hsblastn_filter(_hsblastn_filter_lines)),
+    MicroBenchmark("hsblastn.filter_arrays", _alignment_hsblastn_filter(_hsblastn_filter_arrays)),
+    MicroBenchmark("gmap.compress", _alignment_gmap_compress),
+    MicroBenchmark("gmap.filter", _alignment_gmap_filter),
+    MicroBenchmark("parser.parse_mapping_file", _parser_parse_mapping_file),
+    MicroBenchmark("parser.by_id", _parser_by_id),
+    MicroBenchmark("parser.by_pos", _parser_by_pos),
+    MicroBenchmark("parser.on_pos", _parser_on_pos),
+    MicroBenchmark("parser.by_contig", _parser_by_contig),
+    MicroBenchmark("mapper.create_positions", _mapper_create_positions),
+    MicroBenchmark("mapper.sort_positions", _mapper_sort_positions),
+    MicroBenchmark("enricher.enrich_genes", _enricher_enrich(_GENE_ENRICHER, False)),
+    MicroBenchmark("enricher.enrich_markers", _enricher_enrich(_MARKER_ENRICHER, False)),
+    MicroBenchmark("enricher.enrich_collapsed", _enricher_enrich(_MARKER_ENRICHER, True)),
+    MicroBenchmark("map_enricher.map_intervals", _map_enricher_map_intervals(SHOW_ON_INTERVALS)),
+    MicroBenchmark("map_enricher.map_intervals_on_markers", _map_enricher_map_intervals(SHOW_ON_MARKERS)),
+    MicroBenchmark("output.print_map", _output_printer(_PRINT_MAP, False)),
+    MicroBenchmark("output.print_map_with_genes", _output_printer(_PRINT_MAP_WITH_GENES, False)),
+    MicroBenchmark("output.print_map_with_markers", _output_printer(_PRINT_MAP_WITH_MARKERS, False)),
+    MicroBenchmark("output.print_map_with_anchored", _output_printer(_PRINT_MAP_WITH_ANCHORED, False)),
+    MicroBenchmark("output.print_unaligned", _output_printer(_PRINT_UNALIGNED, False)),
+    MicroBenchmark("output.collapsed_with_genes", _output_printer(_PRINT_MAP_WITH_GENES, True)),
+    MicroBenchmark("output.collapsed_with_markers", _output_printer(_PRINT_MAP_WITH_MARKERS, True)),
+]
+
+def get_micro_benchmarks(names = None):
+    benchmarks = []
+    
+    if names == None:
+        benchmarks = list(MICRO_BENCHMARKS)
+    else:
+        benchmarks_dict = dict([(benchmark.get_name(), benchmark) for benchmark in MICRO_BENCHMARKS])
+        for name in names:
+            if not name in benchmarks_dict:
+                raise Exception("Unknown micro-benchmark "+name+". Available: "+\
+                                ",".join([benchmark.get_name() for benchmark in MICRO_BENCHMARKS]))
+            benchmarks.append(benchmarks_dict[name])
+    
+    return benchmarks
+
+class MicroBenchmarkRunner(object):
+    
+    _fixtures = None
+    _min_time = DEFAULT_MIN_TIME
+    _repeat = DEFAULT_REPEAT
+    _verbose = False
+    
+    def __init__(self, fixtures_path, min_time = DEFAULT_MIN_TIME, repeat = DEFAULT_REPEAT, num_hits = 0, verbose = False):
+        self._min_time = min_time
+        self._repeat = repeat
+        self._verbose = verbose
+        
+        self._fixtures = MicroFixtures(fixtures_path, num_hits, verbose)
+    
+    def get_fixtures_conf(self):
+        return self._fixtures.get_fixtures_conf()
+    
+    ## Runs the operation during min_time. Returns (num_ops, total_time)
+    def _run_round(self, benchmark):
+        num_ops = 0
+        total_time = 0.0
+        
+        gc.collect()
+        gc.disable()
+        try:
+            while total_time < self._min_time or num_ops == 0:
+                total_time += benchmark.run_once()
+                num_ops += 1
+        finally:
+            gc.enable()
+        
+        return (num_ops, total_time)
+    
+    def run_benchmark(self, benchmark):
+        ops_per_sec = 0.0
+        allocations = -1
+        failed = False
+        
+        # barleymap logs its steps to stderr, which is silenced here
+        # (but it is written, so that its cost is measured too)
+        stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+        try:
+            benchmark.prepare(self._fixtures)
+            
+            allocations = benchmark.count_allocations()
+            
+            for run in range(self._repeat):
+                (num_ops, total_time) = self._run_round(benchmark)
+                ops_per_sec = max(ops_per_sec, num_ops / total_time if total_time > 0 else float(num_ops))
+        
+        except Exception:
+            failed = True
+            traceback.print_exc(file=stderr)
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        
+        result = {"ops_per_sec":ops_per_sec,
+                  "allocations":allocations,
+                  "failed":failed}
+        
+        return result
+    
+    def run(self, benchmarks):
+        results = {}
+        
+        for benchmark in benchmarks:
+            sys.stderr.write("MicroBenchmarkRunner: "+benchmark.get_name()+"\n")
+            results[benchmark.get_name()] = self.run_benchmark(benchmark)
+        
+        self._fixtures.close()
+        
+        return results
+
+## Status of each micro-benchmark compared to the baseline
+def compare_results(results, baseline, tolerance = DEFAULT_TOLERANCE):
+    comparison = {}
+    
+    baseline_results = baseline["benchmarks"] if baseline != None else {}
+    
+    for name in results:
+        result = results[name]
+        status = []
+        
+        if result["failed"]:
+            status.append(STATUS_FAILED)
+        
+        elif name in baseline_results:
+            baseline_result = baseline_results[name]
+            
+            # the time per operation grows more than the tolerance
+            min_ops_per_sec = baseline_result["ops_per_sec"] / (1 + tolerance / 100.0)
+            if result["ops_per_sec"] < min_ops_per_sec:
+                status.append(STATUS_SLOWER)
+            
+            max_allocations = baseline_result["allocations"] * (1 + tolerance / 100.0)
+            if result["allocations"] > max_allocations and \
+               result["allocations"] - baseline_result["allocations"] > MIN_ALLOCATIONS_DIFF:
+                status.append(STATUS_ALLOCATIONS)
+            
+            if len(status) == 0:
+                status.append(STATUS_OK)
+        else:
+            status.append(STATUS_NEW)
+        
+        comparison[name] = status
+    
+    return comparison
+
+def is_regression(comparison):
+    return any([status not in [STATUS_OK, STATUS_NEW] for name in comparison for status in comparison[name]])
+
+def _diff(value, baseline_value):
+    if baseline_value > 0:
+        diff = "%+.1f%%" % ((value - baseline_value) * 100.0 / baseline_value)
+    else:
+        diff = "-"
+    
+    return diff
+
+def print_report(results, baseline, comparison, output = sys.stdout):
+    baseline_results = baseline["benchmarks"] if baseline != None else {}
+    
+    output.write("#"+"\t".join(["benchmark", "ops/sec", "baseline", "diff",
+                                "allocations", "baseline", "diff", "status"])+"\n")
+    
+    for name in sorted(results):
+        result = results[name]
+        
+        if name in baseline_results:
+            baseline_result = baseline_results[name]
+            ops_fields = ["%.2f" % result["ops_per_sec"], "%.2f" % baseline_result["ops_per_sec"],
+                          _diff(result["ops_per_sec"], baseline_result["ops_per_sec"])]
+            allocations_fields = [str(result["allocations"]), str(baseline_result["allocations"]),
+                                  _diff(result["allocations"], baseline_result["allocations"])]
+        else:
+            ops_fields = ["%.2f" % result["ops_per_sec"], "-", "-"]
+            allocations_fields = [str(result["allocations"]), "-", "-"]
+        
+        output.write("\t".join([name]+ops_fields+allocations_fields+[",".join(comparison[name])])+"\n")
+    
+    return
+
+def load_baseline(baseline_path):
+    with open(baseline_path, 'r') as baseline_f:
+        baseline = json.load(baseline_f)
+    
+    return baseline
+
+## Results of the micro-benchmarks already in the baseline and not run now are kept
+def save_baseline(baseline_path, results, fixtures_conf, baseline = None):
+    benchmarks = dict(baseline["benchmarks"]) if baseline != None else {}
+    benchmarks.update(results)
+    
+    with open(baseline_path, 'w') as baseline_f:
+        json.dump({"fixtures_conf":fixtures_conf, "benchmarks":benchmarks}, baseline_f, indent = 4, sort_keys = True)
+        baseline_f.write("\n")
+    
+    return
+
+## END
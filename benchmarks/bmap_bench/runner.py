@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# runner.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Runs the benchmark scenarios on an app directory created by synthetic.py,
+## recording for each one the wall time, the peak RSS (of the tool and the
+## aligners it ran) and the MD5 of its output, and compares them with a baseline.
+##
+## Each scenario is run "repeat" times: the minimum wall time
+## and the maximum peak RSS are kept.
+## A scenario is a regression if its time or its memory grows more than
+## the tolerance (a percentage) over the baseline, and its output
+## must be the same as in the baseline.
+
+import sys, os, time, json, hashlib
+from subprocess import Popen
+
+from bmap_bench.synthetic import BENCH_CONF
+
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 10.0
+
+# Results within this time are not considered regressions
+# (noise of short runs), in seconds
+MIN_TIME_DIFF = 0.05
+
+RUNS_DIR = "bench_runs"
+
+STATUS_OK = "ok"
+STATUS_NEW = "new"
+STATUS_FAILED = "FAILED"
+STATUS_SLOWER = "SLOWER"
+STATUS_MEMORY = "MORE MEMORY"
+STATUS_OUTPUT = "OUTPUT CHANGED"
+
+class BenchmarkRunner(object):
+    
+    _app_path = ""
+    _python = ""
+    _repeat = DEFAULT_REPEAT
+    _profile = False
+    _verbose = False
+    
+    def __init__(self, app_path, python = sys.executable, repeat = DEFAULT_REPEAT, profile = False, verbose = False):
+        self._app_path = os.path.abspath(app_path)+"/"
+        self._python = python
+        self._repeat = repeat
+        self._profile = profile
+        self._verbose = verbose
+        
+        if not os.path.exists(self._app_path+BENCH_CONF):
+            raise Exception("BenchmarkRunner: "+self._app_path+" was not created by the synthetic data generator.")
+        
+        if not os.path.exists(self._app_path+RUNS_DIR):
+            os.mkdir(self._app_path+RUNS_DIR)
+    
+    def get_bench_conf(self):
+        with open(self._app_path+BENCH_CONF, 'r') as bench_f:
+            bench_conf = json.load(bench_f)
+        
+        return bench_conf
+    
+    ## Runs the tool once. Returns (wall_time, max_rss, returncode)
+    def _run_once(self, scenario, output_path, error_path):
+        cmd = [self._python, self._app_path+"bin/"+scenario.get_tool()]+scenario.get_args(self._app_path)
+        
+        if self._profile:
+            cmd.append("--profile="+self._app_path+RUNS_DIR+"/"+scenario.get_name()+".profile.json")
+        
+        if self._verbose: sys.stderr.write("BenchmarkRunner: running "+" ".join(cmd)+"\n")
+        
+        with open(output_path, 'w') as output_f:
+            with open(error_path, 'w') as error_f:
+                ini_time = time.time()
+                p = Popen(cmd, stdout = output_f, stderr = error_f)
+                # the resource usage of this child only (wait4),
+                # which includes the aligners it waited for
+                (pid, status, rusage) = os.wait4(p.pid, 0)
+                wall_time = time.time() - ini_time
+        
+        p.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        
+        return (wall_time, rusage.ru_maxrss, p.returncode)
+    
+    def run_scenario(self, scenario):
+        output_path = self._app_path+RUNS_DIR+"/"+scenario.get_name()+".out"
+        error_path = self._app_path+RUNS_DIR+"/"+scenario.get_name()+".err"
+        
+        wall_times = []
+        max_rss = 0
+        failed = False
+        
+        for run in range(self._repeat):
+            (wall_time, run_max_rss, returncode) = self._run_once(scenario, output_path, error_path)
+            
+            with open(error_path, 'r') as error_f:
+                error_log = error_f.read()
+            
+            # bmap_ tools report their errors but exit normally
+            if returncode != 0 or "reports an error" in error_log or "An error was detected" in error_log:
+                failed = True
+                break
+            
+            wall_times.append(wall_time)
+            max_rss = max(max_rss, run_max_rss)
+        
+        output_md5 = hashlib.md5()
+        with open(output_path, 'rb') as output_f:
+            output_md5.update(output_f.read())
+        
+        result = {"wall_time":min(wall_times) if len(wall_times) > 0 else -1.0,
+                  "max_rss":max_rss,
+                  "output_md5":output_md5.hexdigest(),
+                  "failed":failed}
+        
+        return result
+    
+    def run(self, scenarios):
+        results = {}
+        
+        for scenario in scenarios:
+            sys.stderr.write("BenchmarkRunner: "+str(scenario)+"\n")
+            results[scenario.get_name()] = self.run_scenario(scenario)
+        
+        return results
+
+## Status of each scenario compared to the baseline
+def compare_results(results, baseline, tolerance = DEFAULT_TOLERANCE):
+    comparison = {}
+    
+    baseline_results = baseline["scenarios"] if baseline != None else {}
+    
+    for name in results:
+        result = results[name]
+        status = []
+        
+        if result["failed"]:
+            status.append(STATUS_FAILED)
+        
+        elif name in baseline_results:
+            baseline_result = baseline_results[name]
+            
+            max_time = baseline_result["wall_time"] * (1 + tolerance / 100.0)
+            if result["wall_time"] > max_time and result["wall_time"] - baseline_result["wall_time"] > MIN_TIME_DIFF:
+                status.append(STATUS_SLOWER)
+            
+            if result["max_rss"] > baseline_result["max_rss"] * (1 + tolerance / 100.0):
+                status.append(STATUS_MEMORY)
+            
+            if result["output_md5"] != baseline_result["output_md5"]:
+                status.append(STATUS_OUTPUT)
+            
+            if len(status) == 0:
+                status.append(STATUS_OK)
+        else:
+            status.append(STATUS_NEW)
+        
+        comparison[name] = status
+    
+    return comparison
+
+def is_regression(comparison):
+    return any([status not in [STATUS_OK, STATUS_NEW] for name in comparison for status in comparison[name]])
+
+def _diff(value, baseline_value):
+    if baseline_value > 0:
+        diff = "%+.1f%%" % ((value - baseline_value) * 100.0 / baseline_value)
+    else:
+        diff = "-"
+    
+    return diff
+
+def print_report(results, baseline, comparison, output = sys.stdout):
+    baseline_results = baseline["scenarios"] if baseline != None else {}
+    
+    output.write("#"+"\t".join(["scenario", "wall_time(s)", "baseline", "diff",
+                                "max_rss(KB)", "baseline", "diff", "status"])+"\n")
+    
+    for name in sorted(results):
+        result = results[name]
+        
+        if name in baseline_results:
+            baseline_result = baseline_results[name]
+            time_fields = ["%.3f" % result["wall_time"], "%.3f" % baseline_result["wall_time"],
+                           _diff(result["wall_time"], baseline_result["wall_time"])]
+            rss_fields = [str(result["max_rss"]), str(baseline_result["max_rss"]),
+                          _diff(result["max_rss"], baseline_result["max_rss"])]
+        else:
+            time_fields = ["%.3f" % result["wall_time"], "-", "-"]
+            rss_fields = [str(result["max_rss"]), "-", "-"]
+        
+        output.write("\t".join([name]+time_fields+rss_fields+[",".join(comparison[name])])+"\n")
+    
+    return
+
+def load_baseline(baseline_path):
+    with open(baseline_path, 'r') as baseline_f:
+        baseline = json.load(baseline_f)
+    
+    return baseline
+
+## Results of the scenarios already in the baseline and not run now are kept
+def save_baseline(baseline_path, results, bench_conf, baseline = None):
+    scenarios = dict(baseline["scenarios"]) if baseline != None else {}
+    scenarios.update(results)
+    
+    with open(baseline_path, 'w') as baseline_f:
+        json.dump({"bench_conf":bench_conf, "scenarios":scenarios}, baseline_f, indent = 4, sort_keys = True)
+        baseline_f.write("\n")
+    
+    return
+
+## END
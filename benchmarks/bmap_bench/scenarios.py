@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# scenarios.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Benchmark scenarios: a bmap_ tool run with its options
+## on the queries of the synthetic data (see synthetic.py)
+
+from bmap_bench.synthetic import MAP_PHYSICAL, MAP_ANCHORED, QUERIES_FASTA, QUERIES_IDS, QUERIES_POSITIONS
+
+BOTH_MAPS = "--maps="+MAP_PHYSICAL+","+MAP_ANCHORED
+
+# Enrichment with genes, markers and anchored features
+# (markers are printed, if requested, instead of genes or anchored features)
+ENRICHMENT = ["-g", "-m", "-a"]
+GENES = ["-g"]
+
+class Scenario(object):
+    
+    _name = ""
+    _tool = ""
+    _options = None
+    _query_path = ""
+    
+    def __init__(self, name, tool, options, query_path):
+        self._name = name
+        self._tool = tool
+        self._options = options
+        self._query_path = query_path
+    
+    def get_name(self):
+        return self._name
+    
+    def get_tool(self):
+        return self._tool
+    
+    def get_options(self):
+        return self._options
+    
+    def get_query_path(self):
+        return self._query_path
+    
+    ## Command line arguments of the tool, with the query file relative to app_path
+    def get_args(self, app_path):
+        return self._options+[app_path+self._query_path]
+    
+    def __str__(self):
+        return self._name+": "+" ".join([self._tool]+self._options+[self._query_path])
+
+SCENARIOS = [
+    Scenario("align", "bmap_align", [BOTH_MAPS], QUERIES_FASTA),
+    Scenario("align_blastn", "bmap_align", [BOTH_MAPS, "--aligner=blastn"], QUERIES_FASTA),
+    Scenario("align_hsblastn", "bmap_align", [BOTH_MAPS, "--aligner=hsblastn"], QUERIES_FASTA),
+    Scenario("align_multiple", "bmap_align", [BOTH_MAPS, "--aligner=gmap,blastn", "-k", "-u"], QUERIES_FASTA),
+    Scenario("align_prescreen", "bmap_align", [BOTH_MAPS, "--prescreen=0.1"], QUERIES_FASTA),
+    Scenario("align_genes", "bmap_align", [BOTH_MAPS]+GENES, QUERIES_FASTA),
+    Scenario("align_enriched", "bmap_align", [BOTH_MAPS, "-k"]+ENRICHMENT, QUERIES_FASTA),
+    Scenario("find", "bmap_find", [BOTH_MAPS, "-k"], QUERIES_IDS),
+    Scenario("find_genes", "bmap_find", [BOTH_MAPS]+GENES, QUERIES_IDS),
+    Scenario("find_enriched", "bmap_find", [BOTH_MAPS, "-k"]+ENRICHMENT, QUERIES_IDS),
+    Scenario("find_enriched_markers", "bmap_find", [BOTH_MAPS, "-k", "-o", "-e", "1"]+ENRICHMENT, QUERIES_IDS),
+    Scenario("locate", "bmap_locate", ["--maps="+MAP_PHYSICAL], QUERIES_POSITIONS),
+    Scenario("locate_genes", "bmap_locate", ["--maps="+MAP_PHYSICAL]+GENES, QUERIES_POSITIONS),
+    Scenario("locate_enriched", "bmap_locate", ["--maps="+MAP_PHYSICAL]+ENRICHMENT, QUERIES_POSITIONS),
+]
+
+def get_scenarios(names = None):
+    scenarios = []
+    
+    if names == None:
+        scenarios = list(SCENARIOS)
+    else:
+        scenarios_dict = dict([(scenario.get_name(), scenario) for scenario in SCENARIOS])
+        for name in names:
+            if not name in scenarios_dict:
+                raise Exception("Unknown scenario "+name+". Available: "+\
+                                ",".join([scenario.get_name() for scenario in SCENARIOS]))
+            scenarios.append(scenarios_dict[name])
+    
+    return scenarios
+
+## END
@@ -0,0 +1,524 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# synthetic.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Generates a complete barleymap installation with synthetic data
+## (app directory, configuration files, databases, maps, datasets and queries)
+## to run the benchmarks without real genomes nor aligners.
+##
+## - Databases: a genome ("genome") with NUM_CHROMS random chromosomes,
+##   and its contigs ("contigs"). Alongside each database FASTA the files
+##   checked by barleymap for each aligner are created empty,
+##   and a ".hits" file with the hits of every sequence which the stub aligners print
+##   (see benchmarks/stubs/stub_aligners.py).
+## - Maps: a physical map of the genome (PhysMap) and a genetic/physical map
+##   with the contigs anchored to it (AnchMap).
+## - Datasets: markers (FASTA, with synonyms), genes (GTF, with annotations)
+##   and anchored features (FASTA), built with bmap_build_datasets.
+## - Queries: a FASTA file (bmap_align), a file of IDs (bmap_find)
+##   and a file of positions (bmap_locate).
+##
+## Sequences are taken from the genome, so that the primary hits are true.
+## A few of them are copied elsewhere in the genome (multiple hits)
+## and others have a weaker hit somewhere else, which barleymap filters out.
+## Sizes are multiplied by the scale, and the same seed creates the same data.
+
+import sys, os, json, random, bisect, binascii, shutil
+from subprocess import Popen
+
+DEFAULT_SCALE = 1
+DEFAULT_SEED = 1
+
+# bmap_ tools linked from the app directory
+BMAP_TOOLS = ["bmap_align", "bmap_align_to_db", "bmap_align_to_map", "bmap_build_datasets",
+              "bmap_config", "bmap_convert", "bmap_datasets_index", "bmap_find", "bmap_locate"]
+
+# Sizes at scale 1
+NUM_CHROMS = 7
+CHROM_SIZE = 1000000
+CHROM_CM = (120.0, 180.0)
+CONTIG_SIZE = (5000, 15000)
+NUM_MARKERS = 4000
+MARKER_SIZE = (121, 301)
+NUM_GENES = 3000
+GENE_SIZE = (1000, 8000)
+NUM_ANCHORED = 1500
+ANCHORED_SIZE = (400, 1500)
+NUM_QUERIES = 1000
+QUERY_SIZE = (100, 600)
+NUM_QUERY_IDS = 2000
+NUM_QUERY_POSITIONS = 500
+
+# Fractions of sequences, contigs, ...
+UNANCHORED_CONTIGS = 0.1
+UNMAPPED_SEQS = 0.05
+MULTIPLE_HITS = 0.03
+SECONDARY_HITS = 0.1
+MARKERS_SYNONYMS = 0.2
+QUERY_IDS_SYNONYMS = 0.1
+QUERY_IDS_UNKNOWN = 0.05
+
+DB_GENOME = "genome"
+DB_CONTIGS = "contigs"
+MAP_PHYSICAL = "PhysMap"
+MAP_ANCHORED = "AnchMap"
+
+DATASET_MARKERS = "markers"
+DATASET_GENES = "genes"
+DATASET_ANCHORED = "anchored"
+
+QUERIES_FASTA = "queries/queries.fasta"
+QUERIES_IDS = "queries/queries.ids"
+QUERIES_POSITIONS = "queries/queries.pos"
+
+# Parameters of the generated data
+BENCH_CONF = "bench.json"
+
+ANNOTATION_TYPES = [("desc", "txt", ["Protein kinase", "Transcription factor", "Transporter",
+                                     "Disease resistance protein", "Unknown protein"]),
+                    ("class", "class", ["HC", "LC"]),
+                    ("go", "go", ["GO:0003735", "GO:0005524", "GO:0006412", "GO:0008270", "GO:0016020"]),
+                    ("pfam", "pfam", ["PF00069", "PF00076", "PF00931", "PF07714"]),
+                    ("ipr", "ipr", ["IPR000719", "IPR002885", "IPR011009", "IPR017441"])]
+
+_NUCLEOTIDES = bytes(bytearray([ord("ACGT"[i & 3]) for i in range(256)]))
+_COMPLEMENT = dict(zip("ACGT", "TGCA"))
+
+class SyntheticGenerator(object):
+    
+    _app_path = ""
+    _barleymap_path = ""
+    _scale = DEFAULT_SCALE
+    _seed = DEFAULT_SEED
+    _python = ""
+    _verbose = False
+    
+    _random = None
+    _chroms = None # [(name, size, cm_size)]
+    _chroms_sizes = None # {chrom: size}
+    _genome = None # {chrom: bytearray}
+    _contigs = None # [(contig_id, chrom, start, end)]
+    _contigs_starts = None # {chrom: ([start], [contig index])}
+    _hits = None # {db: [hit rows]}
+    
+    def __init__(self, app_path, barleymap_path, scale = DEFAULT_SCALE, seed = DEFAULT_SEED,
+                 python = sys.executable, verbose = False):
+        self._app_path = os.path.abspath(app_path)+"/"
+        self._barleymap_path = os.path.abspath(barleymap_path)+"/"
+        self._scale = scale
+        self._seed = seed
+        self._python = python
+        self._verbose = verbose
+    
+    def _log(self, msg):
+        sys.stderr.write("SyntheticGenerator: "+msg+"\n")
+    
+    def _size(self, size):
+        return int(size * self._scale)
+    
+    def _path(self, *rel_path):
+        return os.path.join(self._app_path, *rel_path)
+    
+    def generate(self):
+        self._random = random.Random(self._seed)
+        self._hits = {DB_GENOME:[], DB_CONTIGS:[]}
+        
+        if os.path.exists(self._app_path):
+            raise Exception("SyntheticGenerator: "+self._app_path+" already exists.")
+        
+        self._log("creating app directory "+self._app_path)
+        self._create_app_dir()
+        
+        self._log("creating genome and contigs")
+        self._create_genome()
+        self._create_contigs()
+        
+        self._log("creating features")
+        markers = self._create_features("M", self._size(NUM_MARKERS), MARKER_SIZE)
+        genes = self._create_features("G", self._size(NUM_GENES), GENE_SIZE, with_hits = False)
+        anchored = self._create_features("A", self._size(NUM_ANCHORED), ANCHORED_SIZE)
+        queries = self._create_features("Q", self._size(NUM_QUERIES), QUERY_SIZE)
+        
+        # copies of sequences have to be in the genome before the sequences are read
+        self._copy_multiple_hits(markers+anchored+queries)
+        
+        self._log("writing databases")
+        self._write_databases()
+        
+        self._log("writing maps")
+        self._write_maps()
+        
+        self._log("writing datasets")
+        self._write_fasta(self._path("sources", "markers.fasta"), markers)
+        self._write_fasta(self._path("sources", "anchored.fasta"), anchored)
+        self._write_gtf(self._path("sources", "genes.gtf"), genes)
+        synonyms = self._write_synonyms(self._path("datasets_synonyms", "markers.syns"), markers)
+        self._write_annotations(genes)
+        self._write_conf()
+        
+        self._log("writing queries")
+        self._write_fasta(self._path(QUERIES_FASTA), queries)
+        self._write_query_ids(self._path(QUERIES_IDS), markers, genes, anchored, synonyms)
+        self._write_query_positions(self._path(QUERIES_POSITIONS))
+        
+        self._log("building datasets")
+        for dataset in [DATASET_MARKERS, DATASET_GENES, DATASET_ANCHORED]:
+            self._build_dataset(dataset)
+        
+        with open(self._path(BENCH_CONF), 'w') as bench_f:
+            json.dump({"scale":self._scale, "seed":self._seed}, bench_f, indent = 4, sort_keys = True)
+            bench_f.write("\n")
+        
+        self._log("finished")
+        
+        return
+    
+    ## App directory: bin/ with the bmap_ tools (see src/README) and paths.conf,
+    ## app_aux/ with split_blast.pl and conf/, maps/, datasets/, ...
+    def _create_app_dir(self):
+        os.makedirs(self._app_path)
+        
+        for app_dir in ["bin", "app_aux", "conf", "dbs", "maps", "datasets", "datasets_annotation",
+                        "datasets_synonyms", "sources", "queries", "tmp_files"]:
+            os.mkdir(self._path(app_dir))
+        
+        for bmap_tool in BMAP_TOOLS:
+            os.symlink(self._barleymap_path+"src/"+bmap_tool+".py", self._path("bin", bmap_tool))
+        
+        os.symlink("../conf/paths.conf", self._path("bin", "paths.conf"))
+        
+        stubs_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "stubs")
+        os.symlink(os.path.join(stubs_path, "split_blast.pl"), self._path("app_aux", "split_blast.pl"))
+        
+        with open(self._path("conf", "paths.conf"), 'w') as paths_f:
+            paths_f.write("# paths.conf created by the benchmarks synthetic data generator\n")
+            paths_f.write("app_path "+self._app_path+"\n")
+            paths_f.write("genmap_path app_aux/\n")
+            paths_f.write("split_blast_path app_aux/\n")
+            paths_f.write("tmp_files_path "+self._path("tmp_files")+"\n")
+            paths_f.write("datasets_path "+self._path("datasets")+"/\n")
+            paths_f.write("annot_path "+self._path("datasets_annotation")+"/\n")
+            paths_f.write("maps_path "+self._path("maps")+"/\n")
+            paths_f.write("blastn_app_path "+os.path.join(stubs_path, "blastn")+"\n")
+            paths_f.write("blastn_dbs_path "+self._path("dbs")+"/\n")
+            paths_f.write("gmap_app_path "+os.path.join(stubs_path, "gmap")+"\n")
+            paths_f.write("gmap_dbs_path "+self._path("dbs")+"\n")
+            paths_f.write("gmapl_app_path "+os.path.join(stubs_path, "gmapl")+"\n")
+            paths_f.write("hsblastn_app_path "+os.path.join(stubs_path, "hs-blastn")+"\n")
+            paths_f.write("hsblastn_dbs_path "+self._path("dbs")+"/\n")
+            paths_f.write("exact_dbs_path "+self._path("dbs")+"\n")
+            paths_f.write("citation synthetic_data\n")
+            paths_f.write("stdalone_app none\n")
+        
+        shutil.copy(self._barleymap_path+"conf/annotation_types.conf", self._path("conf", "annotation_types.conf"))
+        
+        return
+    
+    def _random_seq(self, size):
+        random_bytes = binascii.unhexlify("%0*x" % (2 * size, self._random.getrandbits(8 * size)))
+        return bytearray(random_bytes.translate(_NUCLEOTIDES))
+    
+    def _create_genome(self):
+        self._chroms = []
+        self._chroms_sizes = {}
+        self._genome = {}
+        
+        for chrom_num in range(1, NUM_CHROMS + 1):
+            chrom = "chr"+str(chrom_num)+"H"
+            chrom_size = self._size(CHROM_SIZE)
+            
+            self._chroms.append((chrom, chrom_size, round(self._random.uniform(*CHROM_CM), 2)))
+            self._chroms_sizes[chrom] = chrom_size
+            self._genome[chrom] = self._random_seq(chrom_size)
+        
+        return
+    
+    def _create_contigs(self):
+        self._contigs = []
+        self._contigs_starts = {}
+        
+        for (chrom, chrom_size, cm_size) in self._chroms:
+            starts = []
+            indexes = []
+            
+            start = 1
+            while start <= chrom_size:
+                end = min(start + self._random.randint(*CONTIG_SIZE) - 1, chrom_size)
+                
+                starts.append(start)
+                indexes.append(len(self._contigs))
+                self._contigs.append(("ctg_%06d" % (len(self._contigs) + 1), chrom, start, end))
+                
+                start = end + 1
+            
+            self._contigs_starts[chrom] = (starts, indexes)
+        
+        return
+    
+    def _random_position(self, size):
+        (chrom, chrom_size, cm_size) = self._random.choice(self._chroms)
+        start = self._random.randint(1, chrom_size - size + 1)
+        
+        return (chrom, start, start + size - 1)
+    
+    def _create_features(self, prefix, num_features, size_range, with_hits = True):
+        features = []
+        
+        for feature_num in range(1, num_features + 1):
+            size = self._random.randint(*size_range)
+            (chrom, start, end) = self._random_position(size)
+            
+            feature = {"id":prefix+"%06d" % feature_num, "chrom":chrom, "start":start, "end":end,
+                       "strand":self._random.choice("+-"), "size":size, "copy":None}
+            
+            if with_hits:
+                draw = self._random.random()
+                if draw < UNMAPPED_SEQS:
+                    feature["chrom"] = None
+                    feature["seq"] = self._random_seq(size)
+                else:
+                    self._add_hits(feature, chrom, start, end, 1, size, 100.0)
+                    
+                    if draw < UNMAPPED_SEQS + MULTIPLE_HITS:
+                        (copy_chrom, copy_start, copy_end) = self._random_position(size)
+                        feature["copy"] = (copy_chrom, copy_start)
+                        self._add_hits(feature, copy_chrom, copy_start, copy_end, 1, size, 100.0)
+                    
+                    elif draw < UNMAPPED_SEQS + MULTIPLE_HITS + SECONDARY_HITS:
+                        hit_size = int(size * self._random.uniform(0.4, 0.9))
+                        (hit_chrom, hit_start, hit_end) = self._random_position(hit_size)
+                        self._add_hits(feature, hit_chrom, hit_start, hit_end, 1, hit_size,
+                                       round(self._random.uniform(85.0, 97.0), 2))
+            
+            features.append(feature)
+        
+        return features
+    
+    ## Hits of a sequence to the genome and to the contig in which it starts
+    def _add_hits(self, feature, chrom, start, end, qstart, qend, pident):
+        query_id = feature["id"]
+        qsize = str(feature["size"])
+        forward = feature["strand"] == "+"
+        
+        chrom_size = self._chroms_sizes[chrom]
+        
+        self._hits[DB_GENOME].append([query_id, qsize, chrom, str(chrom_size), str(qstart), str(qend),
+                                      str(start if forward else end), str(end if forward else start), str(pident)])
+        
+        (starts, indexes) = self._contigs_starts[chrom]
+        (contig_id, contig_chrom, contig_start, contig_end) = self._contigs[indexes[bisect.bisect_right(starts, start) - 1]]
+        
+        local_start = start - contig_start + 1
+        local_end = min(end, contig_end) - contig_start + 1
+        
+        self._hits[DB_CONTIGS].append([query_id, qsize, contig_id, str(contig_end - contig_start + 1),
+                                       str(qstart), str(qstart + local_end - local_start),
+                                       str(local_start if forward else local_end),
+                                       str(local_end if forward else local_start), str(pident)])
+        
+        return
+    
+    def _copy_multiple_hits(self, features):
+        for feature in features:
+            if feature["copy"] == None: continue
+            
+            (copy_chrom, copy_start) = feature["copy"]
+            sequence = self._genome[feature["chrom"]][feature["start"] - 1:feature["end"]]
+            self._genome[copy_chrom][copy_start - 1:copy_start - 1 + len(sequence)] = sequence
+        
+        return
+    
+    def _get_seq(self, feature):
+        if feature["chrom"] == None:
+            sequence = feature["seq"].decode("ascii")
+        else:
+            sequence = self._genome[feature["chrom"]][feature["start"] - 1:feature["end"]].decode("ascii")
+            if feature["strand"] == "-":
+                sequence = "".join([_COMPLEMENT[nucleotide] for nucleotide in reversed(sequence)])
+        
+        return sequence
+    
+    def _write_seq(self, fasta_f, seq_id, sequence, line_size = 60):
+        fasta_f.write(">"+seq_id+"\n")
+        for seq_pos in range(0, len(sequence), line_size):
+            fasta_f.write(sequence[seq_pos:seq_pos + line_size]+"\n")
+        
+        return
+    
+    def _write_fasta(self, fasta_path, features):
+        with open(fasta_path, 'w') as fasta_f:
+            for feature in features:
+                self._write_seq(fasta_f, feature["id"], self._get_seq(feature))
+        
+        return
+    
+    ## FASTA files, hits and the (empty) files checked for each aligner
+    def _write_databases(self):
+        with open(self._path("dbs", DB_GENOME+".fa"), 'w') as genome_f:
+            for (chrom, chrom_size, cm_size) in self._chroms:
+                self._write_seq(genome_f, chrom, self._genome[chrom].decode("ascii"))
+        
+        with open(self._path("dbs", DB_CONTIGS+".fa"), 'w') as contigs_f:
+            for (contig_id, chrom, start, end) in self._contigs:
+                self._write_seq(contigs_f, contig_id, self._genome[chrom][start - 1:end].decode("ascii"))
+        
+        for db in [DB_GENOME, DB_CONTIGS]:
+            with open(self._path("dbs", db+".hits"), 'w') as hits_f:
+                for hit in self._hits[db]:
+                    hits_f.write("\t".join(hit)+"\n")
+            
+            # blastn, hs-blastn and gmap databases
+            open(self._path("dbs", db+".nsq"), 'w').close()
+            open(self._path("dbs", db+".bwt"), 'w').close()
+            os.mkdir(self._path("dbs", db))
+            open(self._path("dbs", db, db+".ref153positions"), 'w').close()
+        
+        return
+    
+    def _write_maps(self):
+        physical_dir = MAP_PHYSICAL.lower()
+        anchored_dir = MAP_ANCHORED.lower()
+        
+        os.mkdir(self._path("maps", physical_dir))
+        os.mkdir(self._path("maps", anchored_dir))
+        
+        with open(self._path("maps", physical_dir, physical_dir+".chrom"), 'w') as chrom_f:
+            for chrom_num, (chrom, chrom_size, cm_size) in enumerate(self._chroms):
+                chrom_f.write(chrom+"\t"+str(chrom_num + 1)+"\t"+str(chrom_size)+"\n")
+        
+        with open(self._path("maps", anchored_dir, anchored_dir+".chrom"), 'w') as chrom_f:
+            for chrom_num, (chrom, chrom_size, cm_size) in enumerate(self._chroms):
+                chrom_f.write(chrom+"\t"+str(chrom_num + 1)+"\t"+str(cm_size)+"\t"+str(chrom_size)+"\n")
+        
+        chroms_dict = dict([(chrom, (chrom_size, cm_size)) for (chrom, chrom_size, cm_size) in self._chroms])
+        
+        # contigs by chromosome and position, as the contigs are created
+        with open(self._path("maps", anchored_dir, anchored_dir+"."+DB_CONTIGS), 'w') as map_f:
+            map_f.write(">"+MAP_ANCHORED+"\n")
+            map_f.write("#Marker\tchr\tcM\tbp\tmultiple_positions\tother_alignments\n")
+            
+            for (contig_id, chrom, start, end) in self._contigs:
+                if self._random.random() < UNANCHORED_CONTIGS: continue
+                
+                (chrom_size, cm_size) = chroms_dict[chrom]
+                cm_pos = round(float(start) / chrom_size * cm_size, 2)
+                map_f.write("\t".join([contig_id, chrom, str(cm_pos), str(start), "No", "No"])+"\n")
+        
+        return
+    
+    def _write_gtf(self, gtf_path, genes):
+        with open(gtf_path, 'w') as gtf_f:
+            for gene in sorted(genes, key = lambda gene: (gene["chrom"], gene["start"])):
+                gene_id = gene["id"]
+                for (feature_type, feature_id) in [("gene", gene_id), ("transcript", gene_id+".1")]:
+                    gtf_f.write("\t".join([gene["chrom"], "synthetic", feature_type, str(gene["start"]), str(gene["end"]),
+                                           ".", gene["strand"], ".",
+                                           'gene_id "'+gene_id+'"; transcript_id "'+gene_id+'.1";'])+"\n")
+        
+        return
+    
+    ## Returns the synonyms of each marker
+    def _write_synonyms(self, synonyms_path, markers):
+        synonyms = {}
+        
+        with open(synonyms_path, 'w') as synonyms_f:
+            for marker in markers:
+                if self._random.random() >= MARKERS_SYNONYMS: continue
+                
+                marker_id = marker["id"]
+                synonyms[marker_id] = ["SNP_"+marker_id[1:], "BOPA_"+marker_id[1:]]
+                synonyms_f.write("\t".join([marker_id]+synonyms[marker_id])+"\n")
+        
+        return synonyms
+    
+    def _write_annotations(self, genes):
+        for (annot_id, annot_type, annot_values) in ANNOTATION_TYPES:
+            with open(self._path("datasets_annotation", DATASET_GENES+"."+annot_id+".tab"), 'w') as annot_f:
+                for gene in genes:
+                    num_values = 1 if annot_type in ["txt", "class"] else self._random.randint(0, 3)
+                    for annot_value in self._random.sample(annot_values, num_values):
+                        annot_f.write(gene["id"]+"\t"+annot_value+"\n")
+        
+        return
+    
+    def _write_conf(self):
+        with open(self._path("conf", "databases.conf"), 'w') as databases_f:
+            databases_f.write("# name unique_id type\n")
+            databases_f.write("Genome "+DB_GENOME+" std\n")
+            databases_f.write("Contigs "+DB_CONTIGS+" std\n")
+        
+        main_datasets = ",".join([DATASET_MARKERS, DATASET_GENES, DATASET_ANCHORED])
+        with open(self._path("conf", "maps.conf"), 'w') as maps_f:
+            maps_f.write("# name id has_cm has_bp default_pos_type map_type search_type db_list folder_name main_datasets\n")
+            maps_f.write(" ".join([MAP_PHYSICAL, MAP_PHYSICAL.lower(), "cm_false", "bp_true", "bp", "physical", "greedy",
+                                   DB_GENOME, MAP_PHYSICAL.lower(), main_datasets])+"\n")
+            maps_f.write(" ".join([MAP_ANCHORED, MAP_ANCHORED.lower(), "cm_true", "bp_true", "cm", "anchored", "greedy",
+                                   DB_CONTIGS, MAP_ANCHORED.lower(), main_datasets])+"\n")
+        
+        with open(self._path("conf", "datasets.conf"), 'w') as datasets_f:
+            datasets_f.write("#name unique_id type filename file_type db_list synonyms_file records_prefix\n")
+            datasets_f.write(" ".join(["Markers", DATASET_MARKERS, "genetic_marker", self._path("sources", "markers.fasta"),
+                                       "fna", "ANY", self._path("datasets_synonyms", "markers.syns"), "no"])+"\n")
+            datasets_f.write(" ".join(["Genes", DATASET_GENES, "gene", self._path("sources", "genes.gtf"),
+                                       "gtf", DB_GENOME, "no", "no"])+"\n")
+            datasets_f.write(" ".join(["Anchored", DATASET_ANCHORED, "anchored", self._path("sources", "anchored.fasta"),
+                                       "fna", "ANY", "no", "no"])+"\n")
+        
+        with open(self._path("conf", "datasets_annotation.conf"), 'w') as annot_f:
+            annot_f.write("# name unique_id dataset_unique_id filename type\n")
+            for (annot_id, annot_type, annot_values) in ANNOTATION_TYPES:
+                annot_f.write(" ".join([DATASET_GENES.capitalize()+"_"+annot_id, DATASET_GENES+"_"+annot_id, DATASET_GENES,
+                                        DATASET_GENES+"."+annot_id+".tab", annot_type])+"\n")
+        
+        return
+    
+    ## IDs from all the datasets, some of them by a synonym, and some unknown IDs
+    def _write_query_ids(self, query_ids_path, markers, genes, anchored, synonyms):
+        features = markers+genes+anchored
+        
+        with open(query_ids_path, 'w') as query_ids_f:
+            for query_num in range(1, self._size(NUM_QUERY_IDS) + 1):
+                draw = self._random.random()
+                if draw < QUERY_IDS_UNKNOWN:
+                    query_id = "U%06d" % query_num
+                elif draw < QUERY_IDS_UNKNOWN + QUERY_IDS_SYNONYMS and len(synonyms) > 0:
+                    query_id = self._random.choice(synonyms[self._random.choice(sorted(synonyms))])
+                else:
+                    query_id = self._random.choice(features)["id"]
+                
+                query_ids_f.write(query_id+"\n")
+        
+        return
+    
+    def _write_query_positions(self, query_pos_path):
+        with open(query_pos_path, 'w') as query_pos_f:
+            for query_num in range(self._size(NUM_QUERY_POSITIONS)):
+                (chrom, start, end) = self._random_position(1)
+                query_pos_f.write(chrom+"\t"+str(start)+"\n")
+        
+        return
+    
+    def _build_dataset(self, dataset):
+        dataset_name = dataset.capitalize()
+        self._log("building dataset "+dataset_name)
+        
+        log_path = self._path("tmp_files", "build_"+dataset+".log")
+        with open(log_path, 'w') as log_f:
+            p = Popen([self._python, self._path("bin", "bmap_build_datasets"), "--dataset", dataset_name],
+                      stdout = log_f, stderr = log_f)
+            p.communicate()
+        
+        # bmap_ tools report their errors but exit normally
+        with open(log_path, 'r') as log_f:
+            build_log = log_f.read()
+        
+        if p.returncode != 0 or "reports an error" in build_log or "An error was detected" in build_log:
+            raise Exception("SyntheticGenerator: dataset "+dataset_name+" could not be built. "+\
+                            "See "+log_path)
+        
+        return
+
+## END
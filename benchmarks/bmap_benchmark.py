@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bmap_benchmark.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+############################################
+# This script creates a barleymap installation with synthetic data
+# and stub aligners (generate) and runs on it the benchmark scenarios
+# of bmap_align, bmap_find and bmap_locate (run), comparing
+# their time and memory with a baseline.
+############################################
+
+import sys, os, traceback
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bmap_bench.synthetic import SyntheticGenerator, DEFAULT_SCALE, DEFAULT_SEED
+from bmap_bench.scenarios import get_scenarios, SCENARIOS
+from bmap_bench.runner import BenchmarkRunner, compare_results, is_regression, print_report, \
+                              load_baseline, save_baseline, DEFAULT_REPEAT, DEFAULT_TOLERANCE
+
+_SCRIPT = os.path.basename(__file__)
+
+BARLEYMAP_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMAND_GENERATE = "generate"
+COMMAND_RUN = "run"
+
+BASELINE_FILE = "baseline.json"
+
+exit_code = 0
+
+try:
+    ## Argument parsing
+    __usage = "usage: "+_SCRIPT+" "+COMMAND_GENERATE+" [OPTIONS] APP_DIR\n"+\
+              "       "+_SCRIPT+" "+COMMAND_RUN+" [OPTIONS] APP_DIR\n\n"+\
+              "scenarios: "+",".join([scenario.get_name() for scenario in SCENARIOS])
+    optParser = OptionParser(__usage)
+    
+    optParser.add_option('--scale', action='store', dest='scale', type='string',
+                    help='generate: multiplies the size of the genome, datasets and queries (default '+str(DEFAULT_SCALE)+').')
+    
+    optParser.add_option('--seed', action='store', dest='seed', type='string',
+                    help='generate: seed of the random data (default '+str(DEFAULT_SEED)+').')
+    
+    optParser.add_option('--scenarios', action='store', dest='scenarios', type='string',
+                    help='run: comma delimited list of scenarios to run (default all).')
+    
+    optParser.add_option('--repeat', action='store', dest='repeat', type='string',
+                    help='run: times each scenario is run; the minimum time is kept (default '+str(DEFAULT_REPEAT)+').')
+    
+    optParser.add_option('--baseline', action='store', dest='baseline_path', type='string',
+                    help='run: baseline file to compare with (default APP_DIR/'+BASELINE_FILE+').')
+    
+    optParser.add_option('--save-baseline', action='store_true', dest='save_baseline',
+                    help='run: store the results in the baseline file.')
+    
+    optParser.add_option('--tolerance', action='store', dest='tolerance', type='string',
+                    help='run: percentage of time or memory over the baseline which is reported as a regression '+\
+                    '(default '+str(DEFAULT_TOLERANCE)+').')
+    
+    optParser.add_option('--profile', action='store_true', dest='profile',
+                    help='run: write also the --profile report of each scenario to APP_DIR/bench_runs/.')
+    
+    optParser.add_option('--python', action='store', dest='python', type='string',
+                    help='Python interpreter to run the bmap_ tools (default the one running '+_SCRIPT+').')
+    
+    optParser.add_option('-v', '--verbose', action='store_true', dest='verbose', help='More information printed.')
+    
+    (options, arguments) = optParser.parse_args()
+    
+    if len(arguments) != 2 or not arguments[0] in [COMMAND_GENERATE, COMMAND_RUN]:
+        optParser.exit(0, "You may wish to run '-help' option.\n")
+    
+    (command, app_dir) = arguments
+    
+    verbose_param = options.verbose if options.verbose else False
+    
+    python = options.python if options.python else sys.executable
+    
+    if command == COMMAND_GENERATE:
+        scale = float(options.scale) if options.scale else DEFAULT_SCALE
+        seed = int(options.seed) if options.seed else DEFAULT_SEED
+        
+        generator = SyntheticGenerator(app_dir, BARLEYMAP_PATH, scale, seed, python, verbose_param)
+        generator.generate()
+    
+    elif command == COMMAND_RUN:
+        scenarios = get_scenarios(options.scenarios.split(",") if options.scenarios else None)
+        repeat = int(options.repeat) if options.repeat else DEFAULT_REPEAT
+        tolerance = float(options.tolerance) if options.tolerance else DEFAULT_TOLERANCE
+        baseline_path = options.baseline_path if options.baseline_path else os.path.join(app_dir, BASELINE_FILE)
+        profile = options.profile if options.profile else False
+        
+        runner = BenchmarkRunner(app_dir, python, repeat, profile, verbose_param)
+        bench_conf = runner.get_bench_conf()
+        
+        baseline = None
+        if os.path.exists(baseline_path):
+            baseline = load_baseline(baseline_path)
+            if baseline["bench_conf"] != bench_conf:
+                raise Exception("Baseline "+baseline_path+" is from other synthetic data ("+str(baseline["bench_conf"])+").")
+        
+        results = runner.run(scenarios)
+        comparison = compare_results(results, baseline, tolerance)
+        
+        print_report(results, baseline, comparison)
+        
+        if options.save_baseline:
+            if any([results[name]["failed"] for name in results]):
+                raise Exception("Some scenarios failed. The baseline was not saved.")
+            
+            save_baseline(baseline_path, results, bench_conf, baseline)
+            sys.stderr.write(_SCRIPT+": baseline saved to "+baseline_path+"\n")
+        
+        elif is_regression(comparison):
+            exit_code = 1
+
+except Exception as e:
+    sys.stderr.write("\n")
+    sys.stderr.write('An error was detected. If you can not solve it please contact compbio@eead.csic.es ('+\
+                                   'laboratory of computational biology at EEAD).\n')
+    sys.stderr.write("\n")
+    traceback.print_exc(file=sys.stderr)
+    exit_code = 2
+
+sys.stderr.write("\n")
+sys.stderr.write(_SCRIPT+": Finished.\n")
+sys.stderr.write("\n")
+
+sys.exit(exit_code)
+
+## END
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bmap_microbench.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+############################################
+# This script records the fixtures of the micro-benchmarks from an
+# app directory created by bmap_benchmark.py generate (record)
+# and runs on them the micro-benchmarks of the parsers and hot loops
+# of barleymap (run), comparing their ops/sec and allocations with a baseline.
+############################################
+
+import sys, os, traceback
+from optparse import OptionParser
+
+BARLEYMAP_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BARLEYMAP_PATH, "src"))
+
+from bmap_bench.fixtures import FixturesRecorder
+from bmap_bench.micro import MicroBenchmarkRunner, get_micro_benchmarks, MICRO_BENCHMARKS, \
+                             compare_results, is_regression, print_report, load_baseline, save_baseline, \
+                             DEFAULT_MIN_TIME, DEFAULT_REPEAT, DEFAULT_TOLERANCE
+
+_SCRIPT = os.path.basename(__file__)
+
+COMMAND_RECORD = "record"
+COMMAND_RUN = "run"
+
+BASELINE_FILE = "micro_baseline.json"
+
+exit_code = 0
+
+try:
+    ## Argument parsing
+    __usage = "usage: "+_SCRIPT+" "+COMMAND_RECORD+" [OPTIONS] APP_DIR FIXTURES_DIR\n"+\
+              "       "+_SCRIPT+" "+COMMAND_RUN+" [OPTIONS] FIXTURES_DIR\n\n"+\
+              "benchmarks: "+",".join([benchmark.get_name() for benchmark in MICRO_BENCHMARKS])
+    optParser = OptionParser(__usage)
+    
+    optParser.add_option('--benchmarks', action='store', dest='benchmarks', type='string',
+                    help='run: comma delimited list of micro-benchmarks to run (default all).')
+    
+    optParser.add_option('--min-time', action='store', dest='min_time', type='string',
+                    help='run: seconds each micro-benchmark is run in each round (default '+str(DEFAULT_MIN_TIME)+').')
+    
+    optParser.add_option('--repeat', action='store', dest='repeat', type='string',
+                    help='run: rounds of each micro-benchmark; the best ops/sec is kept (default '+str(DEFAULT_REPEAT)+').')
+    
+    optParser.add_option('--baseline', action='store', dest='baseline_path', type='string',
+                    help='run: baseline file to compare with (default FIXTURES_DIR/'+BASELINE_FILE+').')
+    
+    optParser.add_option('--save-baseline', action='store_true', dest='save_baseline',
+                    help='run: store the results in the baseline file.')
+    
+    optParser.add_option('--tolerance', action='store', dest='tolerance', type='string',
+                    help='run: percentage of time per operation or allocations over the baseline '+\
+                    'which is reported as a regression (default '+str(DEFAULT_TOLERANCE)+').')
+    
+    optParser.add_option('--hits', action='store', dest='num_hits', type='string',
+                    help='run: number of hits of the aligners output for the filters micro-benchmarks; '+\
+                    'the recorded output is replicated up to it (default the recorded output).')
+    
+    optParser.add_option('-v', '--verbose', action='store_true', dest='verbose', help='More information printed.')
+    
+    (options, arguments) = optParser.parse_args()
+    
+    if len(arguments) < 2 or \
+       not (arguments[0] == COMMAND_RECORD and len(arguments) == 3 or arguments[0] == COMMAND_RUN and len(arguments) == 2):
+        optParser.exit(0, "You may wish to run '-help' option.\n")
+    
+    command = arguments[0]
+    
+    verbose_param = options.verbose if options.verbose else False
+    
+    if command == COMMAND_RECORD:
+        (app_dir, fixtures_dir) = arguments[1:]
+        
+        recorder = FixturesRecorder(app_dir, fixtures_dir, verbose_param)
+        recorder.record()
+    
+    elif command == COMMAND_RUN:
+        fixtures_dir = arguments[1]
+        
+        benchmarks = get_micro_benchmarks(options.benchmarks.split(",") if options.benchmarks else None)
+        min_time = float(options.min_time) if options.min_time else DEFAULT_MIN_TIME
+        repeat = int(options.repeat) if options.repeat else DEFAULT_REPEAT
+        tolerance = float(options.tolerance) if options.tolerance else DEFAULT_TOLERANCE
+        num_hits = int(options.num_hits) if options.num_hits else 0
+        baseline_path = options.baseline_path if options.baseline_path else os.path.join(fixtures_dir, BASELINE_FILE)
+        
+        runner = MicroBenchmarkRunner(fixtures_dir, min_time, repeat, num_hits, verbose_param)
+        fixtures_conf = runner.get_fixtures_conf()
+        
+        baseline = None
+        if os.path.exists(baseline_path):
+            baseline = load_baseline(baseline_path)
+            if baseline["fixtures_conf"] != fixtures_conf:
+                raise Exception("Baseline "+baseline_path+" is from other fixtures ("+str(baseline["fixtures_conf"])+").")
+        
+        results = runner.run(benchmarks)
+        comparison = compare_results(results, baseline, tolerance)
+        
+        print_report(results, baseline, comparison)
+        
+        if options.save_baseline:
+            if any([results[name]["failed"] for name in results]):
+                raise Exception("Some micro-benchmarks failed. The baseline was not saved.")
+            
+            save_baseline(baseline_path, results, fixtures_conf, baseline)
+            sys.stderr.write(_SCRIPT+": baseline saved to "+baseline_path+"\n")
+        
+        elif is_regression(comparison):
+            exit_code = 1
+
+except Exception as e:
+    sys.stderr.write("\n")
+    sys.stderr.write('An error was detected. If you can not solve it please contact compbio@eead.csic.es ('+\
+                                   'laboratory of computational biology at EEAD).\n')
+    sys.stderr.write("\n")
+    traceback.print_exc(file=sys.stderr)
+    exit_code = 2
+
+sys.stderr.write("\n")
+sys.stderr.write(_SCRIPT+": Finished.\n")
+sys.stderr.write("\n")
+
+sys.exit(exit_code)
+
+## END
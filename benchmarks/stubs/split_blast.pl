@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# split_blast.pl is part of Barleymap benchmarks (see stub_aligners.py).
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+import sys, os
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import stub_aligners
+
+sys.exit(stub_aligners.main("split_blast.pl"))
+
+## END
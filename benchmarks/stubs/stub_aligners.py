@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# stub_aligners.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Stand-ins of the aligners used by barleymap (blastn, gmap, gmapl, hs-blastn)
+## and of split_blast.pl, for the benchmarks.
+##
+## They do not align anything: the hits of each query sequence are read
+## from a file with the same path of the database plus ".hits" (written by
+## the synthetic data generator) and printed in the output format of the
+## real aligner, with the same command line arguments barleymap uses.
+##
+## The identity and query coverage filters of blastn and hs-blastn
+## (-perc_identity, -qcov_hsp_perc) are applied as the real aligners do,
+## and listed in their help (-help), which barleymap checks before using them.
+## gmap reads the queries from stdin when no FASTA file is given,
+## as the workers of barleymap run it (see AlignerWorkers).
+##
+## Rows of a ".hits" file (tab separated):
+## qid qlen sid slen qstart qend sstart send pident
+## with sstart > send for hits on the minus strand.
+##
+## This module works with python 2 and python 3.
+
+import sys, os
+
+HITS_EXT = ".hits"
+
+# Bit score per aligned base of megablast for a perfect match (approx.)
+BITSCORE_PER_BASE = 1.85
+
+def read_fasta_lengths(fasta_path):
+    queries = []
+    lengths = {}
+    
+    query_id = None
+    with open(fasta_path, 'r') as fasta_f:
+        for fasta_line in fasta_f:
+            if fasta_line.startswith(">"):
+                query_id = fasta_line[1:].strip().split(" ")[0]
+                queries.append(query_id)
+                lengths[query_id] = 0
+            elif query_id != None:
+                lengths[query_id] += len(fasta_line.strip())
+    
+    return (queries, lengths)
+
+## Hits of the given queries (all if query_set is None), by query ID
+def read_hits(hits_path, query_set):
+    hits = {}
+    
+    if not os.path.exists(hits_path): return hits
+    
+    with open(hits_path, 'r') as hits_f:
+        for hits_line in hits_f:
+            hit_data = hits_line.rstrip("\n").split("\t")
+            query_id = hit_data[0]
+            if query_set != None and not query_id in query_set: continue
+            
+            hit = {"qlen":int(hit_data[1]), "sid":hit_data[2], "slen":int(hit_data[3]),
+                   "qstart":int(hit_data[4]), "qend":int(hit_data[5]),
+                   "sstart":int(hit_data[6]), "send":int(hit_data[7]),
+                   "pident":float(hit_data[8])}
+            hit["length"] = hit["qend"] - hit["qstart"] + 1
+            hit["mismatch"] = int(round(hit["length"] * (100.0 - hit["pident"]) / 100.0))
+            hit["bitscore"] = BITSCORE_PER_BASE * (hit["length"] - 2 * hit["mismatch"])
+            
+            if query_id in hits:
+                hits[query_id].append(hit)
+            else:
+                hits[query_id] = [hit]
+    
+    # best hits first, as the aligners report them
+    for query_id in hits:
+        hits[query_id].sort(key = lambda hit: -hit["bitscore"])
+    
+    return hits
+
+def get_evalue(hit):
+    if hit["bitscore"] > 400:
+        evalue = "0.0"
+    else:
+        evalue = "%.0e" % (2.0 ** (-hit["bitscore"] / 2.0))
+    
+    return evalue
+
+def get_option(args, option, default = None):
+    value = default
+    
+    for i, arg in enumerate(args):
+        if arg == option and i + 1 < len(args):
+            value = args[i + 1]
+        elif arg.startswith(option+"="):
+            value = arg[len(option)+1:]
+    
+    return value
+
+BLASTN_HELP = "USAGE\n  blastn [-h] [-help] [-query input_file] [-db database_name] [-outfmt format]\n"+\
+              "    [-task task_name] [-dust DUST_options] [-soft_masking soft_masking]\n"+\
+              "    [-perc_identity float_value] [-qcov_hsp_perc float_value]\n"
+
+HSBLASTN_HELP = "USAGE\n  hs-blastn align [-h] [-help] [-query input_file] [-db database_name] [-outfmt format]\n"+\
+                "    [-num_threads int_value] [-dust DUST_options] [-perc_identity float_value]\n"
+
+## Hits which pass the -perc_identity and -qcov_hsp_perc filters
+## (the coverage of the query span of the hit)
+def prefilter_hits(args, query_hits, qlen):
+    perc_identity = float(get_option(args, "-perc_identity", "0.0"))
+    qcov_hsp_perc = float(get_option(args, "-qcov_hsp_perc", "0.0"))
+    
+    return [hit for hit in query_hits
+            if hit["pident"] >= perc_identity and (hit["qend"] - hit["qstart"] + 1) * 100.0 / qlen >= qcov_hsp_perc]
+
+def _load(fasta_path, db_path):
+    (queries, lengths) = read_fasta_lengths(fasta_path)
+    hits = read_hits(db_path+HITS_EXT, set(queries))
+    
+    return (queries, lengths, hits)
+
+## blastn -outfmt "6 qseqid qlen sseqid slen length qstart qend sstart send bitscore evalue pident mismatch gapopen"
+def blastn(args, output):
+    if "-help" in args:
+        output.write(BLASTN_HELP)
+        return 0
+    
+    (queries, lengths, hits) = _load(get_option(args, "-query"), get_option(args, "-db"))
+    
+    for query_id in queries:
+        for hit in prefilter_hits(args, hits.get(query_id, []), lengths[query_id]):
+            output.write("\t".join([query_id, str(lengths[query_id]), hit["sid"], str(hit["slen"]),
+                                    str(hit["length"]), str(hit["qstart"]), str(hit["qend"]),
+                                    str(hit["sstart"]), str(hit["send"]),
+                                    "%.1f" % hit["bitscore"], get_evalue(hit), "%.2f" % hit["pident"],
+                                    str(hit["mismatch"]), "0"])+"\n")
+    
+    return 0
+
+## hs-blastn align -outfmt 6
+## qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore
+def hsblastn(args, output):
+    if "-help" in args:
+        output.write(HSBLASTN_HELP)
+        return 0
+    
+    (queries, lengths, hits) = _load(get_option(args, "-query"), get_option(args, "-db"))
+    
+    for query_id in queries:
+        for hit in prefilter_hits(args, hits.get(query_id, []), lengths[query_id]):
+            output.write("\t".join([query_id, hit["sid"], "%.2f" % hit["pident"],
+                                    str(hit["length"]), str(hit["mismatch"]), "0",
+                                    str(hit["qstart"]), str(hit["qend"]),
+                                    str(hit["sstart"]), str(hit["send"]),
+                                    get_evalue(hit), "%.1f" % hit["bitscore"]])+"\n")
+    
+    return 0
+
+def _gmap_range(start, end):
+    return "{0:,}..{1:,}".format(start, end)
+
+GMAP_HELP = "Usage: gmap [OPTIONS...] <FASTA files...>, or\n"+\
+            "       cat <FASTA files...> | gmap [OPTIONS...]\n\n"+\
+            "  -D, --dir=directory            Genome directory\n"+\
+            "  -d, --db=STRING                Genome database\n"+\
+            "  -t, --nthreads=INT             Number of worker threads\n"+\
+            "  --ordered                      Print output in same order as input\n"+\
+            "  -B, --batch=INT                Batch mode (default = 2)\n"+\
+            "  -n, --npaths=INT               Maximum number of paths to show\n"+\
+            "  --min-trimmed-coverage=FLOAT   Do not print alignments with trimmed coverage less than this value\n"+\
+            "  --min-identity=FLOAT           Do not print alignments with identity less than this value\n"
+
+# Options of gmap followed by their value
+GMAP_VALUE_OPTIONS = ["-t", "-B", "-n", "-d", "-D"]
+
+## FASTA records (query_id, length) read from a file descriptor.
+## As GMAP, a record is returned once the next one starts, or at the end of the input,
+## so that it can be used with queries written to a pipe as they are needed.
+def read_fasta_stream(input_fd):
+    data = ""
+    
+    while True:
+        chunk = os.read(input_fd, 65536)
+        if not isinstance(chunk, str): chunk = chunk.decode()
+        
+        data += chunk
+        
+        record_end = data.find("\n>")
+        while record_end != -1:
+            yield _fasta_record(data[:record_end])
+            data = data[record_end+1:]
+            record_end = data.find("\n>")
+        
+        if chunk == "":
+            break
+    
+    if data.strip() not in ["", ">"]:
+        yield _fasta_record(data)
+
+def _fasta_record(record):
+    record_lines = record.strip().split("\n")
+    query_id = record_lines[0][1:].strip().split(" ")[0]
+    
+    return (query_id, sum([len(seq_line.strip()) for seq_line in record_lines[1:]]))
+
+## gmap -t N -B 0 -n N --min-identity=X --min-trimmed-coverage=Y -d db -D dir [fasta]
+## Summary of the paths of each query, as GMAP default output.
+## Without a fasta file, the queries are read from stdin,
+## and the output of each one is written as soon as it is aligned.
+def gmap(args, output):
+    if "--help" in args:
+        output.write(GMAP_HELP)
+        return 0
+    
+    db_name = get_option(args, "-d")
+    db_dir = get_option(args, "-D")
+    min_identity = float(get_option(args, "--min-identity", "0.0")) * 100.0
+    min_coverage = float(get_option(args, "--min-trimmed-coverage", "0.0")) * 100.0
+    
+    fasta_paths = [arg for i, arg in enumerate(args)
+                   if not arg.startswith("-") and (i == 0 or not args[i - 1] in GMAP_VALUE_OPTIONS)]
+    
+    if len(fasta_paths) > 0:
+        (queries, lengths, hits) = _load(fasta_paths[0], db_dir+"/"+db_name)
+        
+        for query_id in queries:
+            _gmap_query(output, query_id, lengths[query_id], hits.get(query_id, []), db_name, min_identity, min_coverage)
+    else:
+        hits = read_hits(db_dir+"/"+db_name+HITS_EXT, None)
+        
+        for (query_id, qlen) in read_fasta_stream(sys.stdin.fileno()):
+            _gmap_query(output, query_id, qlen, hits.get(query_id, []), db_name, min_identity, min_coverage)
+            output.flush()
+        
+    return 0
+            
+def _gmap_query(output, query_id, qlen, query_hits, db_name, min_identity, min_coverage):
+    paths = []
+    for hit in query_hits:
+        coverage = hit["length"] * 100.0 / qlen
+        if hit["pident"] >= min_identity and coverage >= min_coverage:
+            paths.append((hit, coverage))
+        
+    output.write(">"+query_id+"\n")
+    output.write("Paths ("+str(len(paths))+"):\n")
+    
+    for path_num, (hit, coverage) in enumerate(paths):
+        strand = "+" if hit["sstart"] <= hit["send"] else "-"
+        genomic_range = _gmap_range(hit["sstart"], hit["send"])
+        
+        output.write("  Path "+str(path_num + 1)+": query "+str(hit["qstart"])+".."+str(hit["qend"])+\
+                     " ("+str(hit["length"])+" bp) => genome "+hit["sid"]+":"+genomic_range+\
+                     " ("+str(hit["length"])+" bp)\n")
+        output.write("    cDNA direction: "+("sense" if strand == "+" else "antisense")+"\n")
+        output.write("    Genomic pos: "+db_name+":"+genomic_range+" ("+strand+" strand)\n")
+        output.write("    Accessions: "+hit["sid"]+":"+genomic_range+" (out of "+str(hit["slen"])+" bp)\n")
+        output.write("    Number of exons: 1\n")
+        output.write("    Coverage: %.1f (query length: %d bp)\n" % (coverage, qlen))
+        output.write("    Trimmed coverage: %.1f (trimmed length: %d bp, trimmed region: %d..%d)\n" % \
+                     (coverage, qlen, 1, qlen))
+        output.write("    Percent identity: %.1f (%d matches, %d mismatches, 0 indels, 0 unknowns)\n" % \
+                     (hit["pident"], hit["length"] - hit["mismatch"], hit["mismatch"]))
+        output.write("    Translation: 1..%d (%d aa)\n" % (hit["length"] / 3, hit["length"] / 3))
+        output.write("    Amino acid changes: \n")
+        output.write("\n")
+    
+    output.write("\n")
+    
+    return
+
+## split_blast.pl <cores> <batch size> <blast command>
+## runs the blast command at once
+def split_blast(args, output):
+    blast_args = args[2:]
+    
+    output.write("# split_blast.pl: "+str(args[0])+" cores, batch size "+str(args[1])+"\n")
+    output.flush()
+    
+    os.execv(blast_args[0], blast_args)
+
+ALIGNERS = {"blastn":blastn, "hs-blastn":hsblastn, "gmap":gmap, "gmapl":gmap, "split_blast.pl":split_blast}
+
+def main(aligner):
+    return ALIGNERS[aligner](sys.argv[1:], sys.stdout)
+
+## END
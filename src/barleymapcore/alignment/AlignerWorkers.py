@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# AlignerWorkers.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Long-lived aligner processes, which keep the index of a database loaded
+## to align every batch of queries sent to them.
+##
+## A GMAPWorker runs "gmap" (or "gmapl") reading the queries from its stdin.
+## Each batch is the FASTA of the queries followed by a sentinel query,
+## and its output is what GMAP prints before the header of the sentinel.
+## GMAP reads a query until the next header starts, so each batch is sent
+## without the ">" of its first header, which is sent at the end of the
+## previous batch (or when the worker starts), right after the sentinel.
+## GMAP output goes to a pseudo-terminal, so that it is written line by line
+## instead of once its buffer is full.
+##
+## HS-Blastn and Blastn have no workers: their tabular output has no lines
+## for queries without hits, and so the end of a batch can not be told.
+##
+## An AlignerWorkersPool keeps a worker for each (aligner, database, parameters),
+## checking that it still answers before reusing it, restarting it if it does not,
+## and stopping the workers which have been idle for longer than idle_timeout,
+## or the least recently used one when max_workers are already running.
+## Several threads can use the pool at once (e.g. speculative hierarchical searches),
+## but each worker aligns a single batch at a time, and workers in use are never stopped.
+
+import sys, os, time, select, errno, fcntl, pty, tty, atexit, threading
+from subprocess import Popen, PIPE
+
+from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+
+DEFAULT_MAX_WORKERS = 2
+DEFAULT_IDLE_TIMEOUT = 600 # seconds
+
+# Seconds to wait for the answer to a health check, and for a worker to stop
+PING_TIMEOUT = 60
+STOP_TIMEOUT = 10
+
+# Sentinel query which ends every batch
+SENTINEL_ID = "bmap_worker_sentinel"
+SENTINEL_SEQ = "ACGTTGCATGCAACGTACGTTGCATGCAACGTACGTTGCA"
+
+READ_SIZE = 65536
+
+class GMAPWorker(object):
+    
+    _cmd = None
+    _verbose = False
+    
+    _process = None
+    _output_fd = None
+    _stderr_f = None
+    
+    # Output read after the header of the last sentinel
+    _pending = ""
+    _num_batches = 0
+    _last_used = 0
+    
+    def __init__(self, cmd, verbose = False):
+        self._cmd = cmd
+        self._verbose = verbose
+        self._pending = ""
+        self._num_batches = 0
+        self._last_used = time.time()
+    
+    def _log(self, msg):
+        sys.stderr.write("GMAPWorker: "+msg+"\n")
+    
+    def get_cmd(self):
+        return self._cmd
+    
+    def get_last_used(self):
+        return self._last_used
+    
+    def start(self):
+        if self._verbose: self._log("starting '"+" ".join(self._cmd)+"'")
+        
+        (output_fd, terminal_fd) = pty.openpty()
+        tty.setraw(terminal_fd)
+        
+        if self._verbose:
+            self._stderr_f = None
+        else:
+            self._stderr_f = open(os.devnull, 'w')
+        
+        try:
+            self._process = Popen(self._cmd, stdin=PIPE, stdout=terminal_fd, stderr=self._stderr_f, close_fds=True)
+        except OSError as e:
+            os.close(output_fd)
+            raise m2pException("GMAPWorker: could not run '"+" ".join(self._cmd)+"': "+str(e))
+        finally:
+            os.close(terminal_fd)
+        
+        self._output_fd = output_fd
+        
+        input_fd = self._process.stdin.fileno()
+        fcntl.fcntl(input_fd, fcntl.F_SETFL, fcntl.fcntl(input_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        
+        # the ">" of the first header of the first batch
+        self._write_all(">")
+        
+        return
+    
+    def is_alive(self):
+        return self._process != None and self._process.poll() == None
+    
+    ## Health check: the worker is running and aligns an empty batch in time
+    def ping(self, timeout = PING_TIMEOUT):
+        if not self.is_alive():
+            return False
+        
+        try:
+            self._align_batch("", timeout)
+        except m2pException as m2pe:
+            if self._verbose: self._log(m2pe.msg)
+            return False
+        
+        return True
+    
+    ## GMAP output for the queries of the FASTA file
+    def align(self, fasta_path):
+        with open(fasta_path, 'r') as fasta_file:
+            fasta = fasta_file.read().lstrip()
+        
+        if fasta != "" and not fasta.startswith(">"):
+            raise m2pException("GMAPWorker: "+fasta_path+" is not a FASTA file.")
+        
+        return self._align_batch(fasta, None)
+    
+    def _align_batch(self, fasta, timeout):
+        self._num_batches += 1
+        sentinel_id = SENTINEL_ID+"_"+str(os.getpid())+"_"+str(self._num_batches)
+        
+        # the ">" of the first header was already sent
+        if fasta != "":
+            if not fasta.endswith("\n"): fasta += "\n"
+            batch = fasta[1:]+">"+sentinel_id+"\n"+SENTINEL_SEQ+"\n>"
+        else:
+            batch = sentinel_id+"\n"+SENTINEL_SEQ+"\n>"
+        
+        output = self._communicate(batch, ">"+sentinel_id+"\n", timeout)
+        
+        self._last_used = time.time()
+        
+        return output
+    
+    ## Writes the batch and reads the output until the header of the sentinel
+    def _communicate(self, batch, sentinel_header, timeout):
+        input_fd = self._process.stdin.fileno()
+        
+        # the lines of the previous sentinel, which was not printed
+        # completely when its header was found, precede the output of this batch
+        output = self._pending
+        skip_pos = 0
+        
+        while True:
+            write_fds = [input_fd] if batch != "" else []
+            (read_ready, write_ready, error_ready) = select.select([self._output_fd], write_fds, [], timeout)
+            
+            if len(read_ready) == 0 and len(write_ready) == 0:
+                raise m2pException("GMAPWorker: no answer from '"+" ".join(self._cmd)+"' after "+str(timeout)+" seconds.")
+            
+            if len(write_ready) > 0:
+                batch = batch[self._write(batch):]
+            
+            if len(read_ready) > 0:
+                data = self._read()
+                if data == "":
+                    raise m2pException("GMAPWorker: '"+" ".join(self._cmd)+"' finished unexpectedly.")
+                
+                output += data
+                
+                if output.startswith(sentinel_header):
+                    sentinel_pos = 0
+                else:
+                    sentinel_pos = output.find("\n"+sentinel_header, skip_pos)
+                    if sentinel_pos != -1: sentinel_pos += 1
+                
+                if sentinel_pos != -1:
+                    break
+                
+                # the header could be split between two reads
+                skip_pos = max(len(output) - len(sentinel_header) - 1, 0)
+        
+        self._pending = output[sentinel_pos+len(sentinel_header):]
+        output = output[:sentinel_pos]
+        
+        # lines of the previous sentinel
+        if not output.startswith(">"):
+            first_header = output.find("\n>")
+            output = output[first_header+1:] if first_header != -1 else ""
+        
+        return output
+    
+    def _write(self, data):
+        try:
+            return os.write(self._process.stdin.fileno(), data[:READ_SIZE])
+        except OSError as e:
+            if e.errno == errno.EAGAIN: return 0
+            raise m2pException("GMAPWorker: '"+" ".join(self._cmd)+"' does not accept queries: "+str(e))
+    
+    def _write_all(self, data):
+        while data != "":
+            select.select([], [self._process.stdin.fileno()], [])
+            data = data[self._write(data):]
+        
+        return
+    
+    def _read(self):
+        try:
+            return os.read(self._output_fd, READ_SIZE)
+        except OSError as e:
+            # the terminal is closed once the aligner finishes
+            if e.errno == errno.EIO: return ""
+            raise
+    
+    def stop(self):
+        if self._process != None:
+            if self._verbose: self._log("stopping '"+" ".join(self._cmd)+"'")
+            
+            try:
+                self._process.stdin.close()
+            except (IOError, OSError):
+                pass
+            
+            ini_time = time.time()
+            while self._process.poll() == None and time.time() - ini_time < STOP_TIMEOUT:
+                time.sleep(0.1)
+            
+            if self._process.poll() == None:
+                self._process.kill()
+                self._process.wait()
+            
+            self._process = None
+        
+        if self._output_fd != None:
+            os.close(self._output_fd)
+            self._output_fd = None
+        
+        if self._stderr_f != None:
+            self._stderr_f.close()
+            self._stderr_f = None
+        
+        return
+
+class AlignerWorkersPool(object):
+    
+    _max_workers = DEFAULT_MAX_WORKERS
+    _idle_timeout = DEFAULT_IDLE_TIMEOUT
+    _verbose = False
+    
+    # worker by key
+    _workers = None
+    # keys of the workers aligning a batch, and the condition to wait for them
+    _busy = None
+    _lock = None
+    
+    def __init__(self, max_workers = DEFAULT_MAX_WORKERS, idle_timeout = DEFAULT_IDLE_TIMEOUT, verbose = False):
+        self._max_workers = max_workers
+        self._idle_timeout = idle_timeout
+        self._verbose = verbose
+        self._workers = {}
+        self._busy = set()
+        self._lock = threading.Condition()
+    
+    def _log(self, msg):
+        sys.stderr.write("AlignerWorkersPool: "+msg+"\n")
+    
+    def get_num_workers(self):
+        return len(self._workers)
+    
+    ## Aligns the FASTA file with the worker of the key,
+    ## which is started with cmd if it is not running yet.
+    ## A worker which fails is stopped and removed from the pool.
+    ## If the worker is aligning a batch for another thread, it waits for it to finish.
+    def align(self, key, cmd, fasta_path):
+        with self._lock:
+            while key in self._busy:
+                self._lock.wait()
+            
+            worker = self._get_worker(key, cmd)
+            self._busy.add(key)
+        
+        try:
+            output = worker.align(fasta_path)
+        except Exception:
+            with self._lock:
+                self._remove_worker(key)
+            raise
+        finally:
+            with self._lock:
+                self._busy.discard(key)
+                self._lock.notify_all()
+        
+        return output
+    
+    def _get_worker(self, key, cmd):
+        self.evict_idle()
+        
+        worker = self._workers.get(key)
+        
+        if worker != None:
+            if worker.ping():
+                profile_utils.count("aligner_workers/reused")
+                return worker
+            
+            self._log("worker '"+" ".join(worker.get_cmd())+"' is not answering. It will be restarted.")
+            self._remove_worker(key)
+            profile_utils.count("aligner_workers/restarted")
+        
+        # workers in use are not stopped, even if there are already max_workers
+        while len(self._workers) >= self._max_workers:
+            idle_keys = [worker_key for worker_key in self._workers if worker_key not in self._busy]
+            if len(idle_keys) == 0: break
+            lru_key = min(idle_keys, key=lambda worker_key: self._workers[worker_key].get_last_used())
+            self._remove_worker(lru_key)
+        
+        worker = GMAPWorker(cmd, self._verbose)
+        with profile_utils.timer("aligner_workers/start"):
+            worker.start()
+        
+        self._workers[key] = worker
+        profile_utils.count("aligner_workers/started")
+        
+        return worker
+    
+    def _remove_worker(self, key):
+        worker = self._workers.pop(key)
+        worker.stop()
+        
+        return
+    
+    ## Stops the workers idle for longer than idle_timeout
+    def evict_idle(self):
+        now = time.time()
+        
+        for key in self._workers.keys():
+            if key in self._busy: continue
+            if now - self._workers[key].get_last_used() > self._idle_timeout:
+                if self._verbose: self._log("stopping idle worker '"+" ".join(self._workers[key].get_cmd())+"'")
+                self._remove_worker(key)
+                profile_utils.count("aligner_workers/evicted")
+        
+        return
+    
+    def close(self):
+        for key in self._workers.keys():
+            self._remove_worker(key)
+        
+        return
+
+## The pool of the process, if enabled (see configure)
+_workers_pool = None
+
+def configure(max_workers = DEFAULT_MAX_WORKERS, idle_timeout = DEFAULT_IDLE_TIMEOUT, verbose = False):
+    global _workers_pool
+    
+    if _workers_pool != None:
+        _workers_pool.close()
+    else:
+        atexit.register(close_workers)
+    
+    _workers_pool = AlignerWorkersPool(max_workers, idle_timeout, verbose)
+    
+    return _workers_pool
+
+def get_workers_pool():
+    return _workers_pool
+
+def close_workers():
+    if _workers_pool != None:
+        _workers_pool.close()
+    
+    return
+
+## END
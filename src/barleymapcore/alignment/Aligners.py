@@ -6,16 +6,37 @@
 # Copyright (C)  2016-2017  Carlos P Cantalapiedra.
 # (terms of use can be found within the distributed LICENSE file).
 
-import os, sys
+import os, sys, time, threading
 
-import m2p_split_blast, m2p_gmap, m2p_hsblastn
+import m2p_split_blast, m2p_gmap, m2p_hsblastn, m2p_exact
+import AlignerWorkers, RawHitsStore
 import barleymapcore.utils.alignment_utils as alignment_utils
 from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.job_checkpoints as job_checkpoints
+import barleymapcore.utils.file_utils as file_utils
 from barleymapcore.db.DatabasesConfig import REF_TYPE_STD, REF_TYPE_BIG, DatabasesConfig
 
 ALIGNER_BLASTN = "blastn"
 ALIGNER_GMAP = "gmap"
 ALIGNER_HSBLASTN = "hsblastn"
+ALIGNER_EXACT = "exact"
+
+## Length threshold of the routing of queries in ListAligner, if enabled (see configure_routing)
+_routing_length = None
+
+def configure_routing(routing_length):
+    global _routing_length
+    
+    if routing_length != None and routing_length <= 0:
+        raise m2pException("The length for the routing of queries has to be greater than 0.")
+    
+    _routing_length = routing_length
+    
+    return
+
+def get_routing_length():
+    return _routing_length
 
 class AlignersFactory(object):
     
@@ -25,7 +46,8 @@ class AlignersFactory(object):
         blastn_dbs_path = paths_config.get_blastn_dbs_path()
         split_blast_path = paths_config.get_split_blast_path()
         
-        aligner = SplitBlastnAligner(blastn_app_path, n_threads, blastn_dbs_path, split_blast_path, verbose)
+        aligner = SplitBlastnAligner(blastn_app_path, n_threads, blastn_dbs_path, split_blast_path, verbose,
+                                     RawHitsStore.get_hits_store())
         
         return aligner
     
@@ -34,7 +56,7 @@ class AlignersFactory(object):
         hsblastn_app_path = paths_config.get_hsblastn_app_path()
         hsblastn_dbs_path = paths_config.get_hsblastn_dbs_path()
         
-        aligner = HSBlastnAligner(hsblastn_app_path, n_threads, hsblastn_dbs_path, verbose)
+        aligner = HSBlastnAligner(hsblastn_app_path, n_threads, hsblastn_dbs_path, verbose, RawHitsStore.get_hits_store())
         
         return aligner
     
@@ -49,7 +71,26 @@ class AlignersFactory(object):
         # once that ref_type of each given DB is obtained
         # or through ref_type_param when using DBs not configured (--databases-ids)
         
-        aligner = GMAPAligner(gmap_app_path, gmapl_app_path, n_threads, gmap_dbs_path, verbose)
+        # GMAP processes which keep running with the database loaded,
+        # if the workers pool is enabled (see AlignerWorkers)
+        workers_pool = AlignerWorkers.get_workers_pool()
+        
+        aligner = GMAPAligner(gmap_app_path, gmapl_app_path, n_threads, gmap_dbs_path, verbose, workers_pool,
+                              RawHitsStore.get_hits_store())
+        
+        return aligner
+    
+    @staticmethod
+    def get_aligner_exact(paths_config, n_threads, verbose):
+        exact_dbs_path = paths_config.get_exact_dbs_path()
+        
+        if exact_dbs_path == "":
+            raise m2pException("The path to the FASTA files of the databases (exact_dbs_path) is not configured.")
+        
+        if not m2p_exact.is_available():
+            raise m2pException("The "+ALIGNER_EXACT+" aligner requires NumPy.")
+        
+        aligner = ExactMatchAligner(n_threads, exact_dbs_path, verbose)
         
         return aligner
     
@@ -73,7 +114,7 @@ class AlignersFactory(object):
                 except m2pException:
                     sys.stderr.write("WARNING: exception obtaining "+aligner_name+".\nSkipping to next aligner.\n")
                 
-            aligner = ListAligner(aligners, tmp_files_dir)
+            aligner = ListAligner(aligners, tmp_files_dir, _routing_length)
             
         else:
             aligner_name = aligner_list[0]
@@ -89,6 +130,10 @@ class AlignersFactory(object):
                 
                 aligner = AlignersFactory.get_aligner_hsblastn(paths_config, n_threads, verbose)
                 
+            elif aligner_name == ALIGNER_EXACT:
+                
+                aligner = AlignersFactory.get_aligner_exact(paths_config, n_threads, verbose)
+                
             else:
                 raise m2pException("Unknown aligner type "+str(aligner_name)+" when requesting aligner.")
         
@@ -120,10 +165,12 @@ class BaseAligner(object):
     
 class SplitBlastnAligner(BaseAligner):
     _split_blast_path = ""
+    _hits_store = None
     
-    def __init__(self, app_path, n_threads, dbs_path, split_blast_path, verbose = False):
+    def __init__(self, app_path, n_threads, dbs_path, split_blast_path, verbose = False, hits_store = None):
         BaseAligner.__init__(self, app_path, n_threads, dbs_path, verbose)
         self._split_blast_path = split_blast_path
+        self._hits_store = hits_store
     
     def align(self, fasta_path, db, ref_type, threshold_id, threshold_cov):
         
@@ -137,7 +184,7 @@ class SplitBlastnAligner(BaseAligner):
         # get_best_score_hits from m2p_split_blast.py
         self._results_hits = m2p_split_blast.get_best_score_hits(self._split_blast_path, self._app_path, self._n_threads, \
                                                  fasta_path, self._dbs_path, db, threshold_id, threshold_cov, \
-                                                 self._verbose)
+                                                 self._verbose, self._hits_store)
         
         query_list = [a.get_query_id() for a in self._results_hits]
         
@@ -152,11 +199,15 @@ class SplitBlastnAligner(BaseAligner):
 class GMAPAligner(BaseAligner):
     
     _gmapl_app_path = None
+    _workers_pool = None
+    _hits_store = None
     
-    def __init__(self, app_path, gmapl_app_path, n_threads, dbs_path, verbose = False):
+    def __init__(self, app_path, gmapl_app_path, n_threads, dbs_path, verbose = False, workers_pool = None, hits_store = None):
         
         BaseAligner.__init__(self, app_path, n_threads, dbs_path, verbose)
         self._gmapl_app_path = gmapl_app_path
+        self._workers_pool = workers_pool
+        self._hits_store = hits_store
     
     def align(self, fasta_path, db, ref_type, threshold_id, threshold_cov):
         
@@ -178,7 +229,7 @@ class GMAPAligner(BaseAligner):
         # get_hits from m2p_gmap.py
         self._results_hits = m2p_gmap.get_best_score_hits(app_path, self._n_threads, fasta_path, self._dbs_path, db,
                                       threshold_id, threshold_cov, \
-                                      self._verbose)
+                                      self._verbose, self._workers_pool, self._hits_store)
         
         query_list = [a.get_query_id() for a in self._results_hits]
         
@@ -191,9 +242,11 @@ class GMAPAligner(BaseAligner):
         return self.get_hits()
 
 class HSBlastnAligner(BaseAligner):
+    _hits_store = None
     
-    def __init__(self, app_path, n_threads, dbs_path, verbose = False):
+    def __init__(self, app_path, n_threads, dbs_path, verbose = False, hits_store = None):
         BaseAligner.__init__(self, app_path, n_threads, dbs_path, verbose)
+        self._hits_store = hits_store
     
     def align(self, fasta_path, db, ref_type, threshold_id, threshold_cov):
         
@@ -207,7 +260,7 @@ class HSBlastnAligner(BaseAligner):
         # get_best_score_hits from m2p_hs_blast.py
         self._results_hits = m2p_hsblastn.get_best_score_hits(self._app_path, self._n_threads, fasta_path, self._dbs_path, db, \
                                                  threshold_id, threshold_cov, \
-                                                 self._verbose)
+                                                 self._verbose, self._hits_store)
         
         query_list = [a.get_query_id() for a in self._results_hits]
         
@@ -219,22 +272,71 @@ class HSBlastnAligner(BaseAligner):
         
         return self.get_hits()
 
+## Resolves the queries with exact matches in the database without running any aligner
+## (see m2p_exact). The other queries are reported as unaligned, and so in a ListAligner
+## (e.g. "exact,gmap") only those are aligned by the next aligners.
+class ExactMatchAligner(BaseAligner):
+    
+    def __init__(self, n_threads, dbs_path, verbose = False):
+        BaseAligner.__init__(self, "", n_threads, dbs_path, verbose)
+    
+    def align(self, fasta_path, db, ref_type, threshold_id, threshold_cov):
+        
+        sys.stderr.write("\n")
+        
+        fasta_headers = alignment_utils.get_fasta_headers(fasta_path)
+        
+        sys.stderr.write("ExactMatchAligner: DB --> "+str(db)+"\n")
+        sys.stderr.write("ExactMatchAligner: to align "+str(len(fasta_headers))+"\n")
+        
+        # get_best_score_hits from m2p_exact.py
+        self._results_hits = m2p_exact.get_best_score_hits(fasta_path, self._dbs_path, db, \
+                                                 threshold_id, threshold_cov, \
+                                                 self._verbose)
+        
+        query_list = [a.get_query_id() for a in self._results_hits]
+        
+        sys.stderr.write("ExactMatchAligner: aligned "+str(len(set([a.split(" ")[0] for a in query_list])))+"\n")
+        
+        self._results_unaligned = alignment_utils.filter_list(fasta_headers, query_list)
+        
+        sys.stderr.write("ExactMatchAligner: no hits "+str(len(self._results_unaligned))+"\n")
+        
+        return self.get_hits()
+
+## Tries the aligners in order, each one with the queries not aligned by the previous ones.
+##
+## With a routing_length, each query is tried first with the aligners for its length:
+## Blastn and HS-Blastn for queries shorter than routing_length (e.g. probes),
+## GMAP for the others (e.g. transcripts), after the aligners without preference (exact),
+## and then with the rest of them, as fallback of the queries still unaligned.
+## At each step, the aligners run at the same time, each one with its own queries.
 class ListAligner(BaseAligner):
     _aligner_list = []
     _blastn_hits = []
     _gmap_hits = []
     _tmp_files_dir = ""
+    _routing_length = None
     
-    def __init__(self, aligner_list, tmp_files_dir):
+    def __init__(self, aligner_list, tmp_files_dir, routing_length = None):
         self._aligner_list = aligner_list
         self._tmp_files_dir = tmp_files_dir
+        self._routing_length = routing_length
         
     def align(self, fasta_path, db, ref_type, threshold_id, threshold_cov):
+        
+        if self._routing_length != None:
+            return self._align_routed(fasta_path, db, ref_type, threshold_id, threshold_cov)
+        
         fasta_to_align = fasta_path
         
         prev_aligner_to_align = fasta_to_align
         fasta_created = False
         
+        # hits of this database only
+        self._results_hits = []
+        self._results_unaligned = []
+        
         try:
             for aligner in self._aligner_list:
                 if self._verbose: sys.stderr.write("ListAligner: "+str(aligner)+"\n")
@@ -246,6 +348,10 @@ class ListAligner(BaseAligner):
                     sys.stderr.write("\tContinuing with next aligner...\n")
                     continue
                 
+                # the fasta of the previous aligner is not needed anymore
+                if fasta_created: os.remove(prev_aligner_to_align)
+                fasta_created = False
+                
                 prev_aligner_to_align = alignment_utils.extract_fasta_headers(fasta_path,
                                                                               aligner.get_unaligned(), self._tmp_files_dir)
                 fasta_created = True
@@ -262,5 +368,291 @@ class ListAligner(BaseAligner):
             if fasta_created: os.remove(prev_aligner_to_align)
             
         return self.get_hits()
+    
+    ## Indexes of the aligners in the order in which they are tried
+    ## for short (shorter than routing_length) and long queries
+    def _get_routes(self):
+        short_route = []
+        long_route = []
+        
+        for (aligner_index, aligner) in enumerate(self._aligner_list):
+            if isinstance(aligner, (SplitBlastnAligner, HSBlastnAligner)):
+                short_route.append((0, aligner_index))
+                long_route.append((1, aligner_index))
+            elif isinstance(aligner, GMAPAligner):
+                short_route.append((1, aligner_index))
+                long_route.append((0, aligner_index))
+            else:
+                short_route.append((0, aligner_index))
+                long_route.append((0, aligner_index))
+        
+        short_route = [aligner_index for (fallback, aligner_index) in sorted(short_route)]
+        long_route = [aligner_index for (fallback, aligner_index) in sorted(long_route)]
+        
+        return (short_route, long_route)
+    
+    def _align_routed(self, fasta_path, db, ref_type, threshold_id, threshold_cov):
+        
+        (short_route, long_route) = self._get_routes()
+        
+        # queries still unaligned, in the order of the fasta, and their route
+        pending = []
+        routes = {}
+        for (query_id, query_seq) in alignment_utils.read_fasta_sequences(fasta_path):
+            if query_id in routes: continue
+            pending.append(query_id)
+            routes[query_id] = short_route if len(query_seq) < self._routing_length else long_route
+        
+        num_short = len([query_id for query_id in pending if routes[query_id] is short_route])
+        sys.stderr.write("ListAligner: "+str(num_short)+" queries shorter than "+str(self._routing_length)+\
+                         ", "+str(len(pending) - num_short)+" queries longer\n")
+        profile_utils.count("list_aligner/routed_short", num_short)
+        profile_utils.count("list_aligner/routed_long", len(pending) - num_short)
+        
+        # hits of this database only
+        self._results_hits = []
+        self._results_unaligned = []
+        
+        for step in xrange(len(self._aligner_list)):
+            if len(pending) == 0: break
+            
+            partitions = {}
+            for query_id in pending:
+                partitions.setdefault(routes[query_id][step], []).append(query_id)
+            
+            threads = []
+            try:
+                for aligner_index in sorted(partitions):
+                    partition_fasta_path = alignment_utils.extract_fasta_headers(fasta_path, partitions[aligner_index],
+                                                                                 self._tmp_files_dir)
+                    threads.append(AlignerThread(self._aligner_list[aligner_index], partition_fasta_path,
+                                                  db, ref_type, threshold_id, threshold_cov))
+                
+                # a single partition is aligned in this thread, which can be stopped as usual
+                if len(threads) == 1:
+                    threads[0].align()
+                else:
+                    for thread in threads: thread.start()
+                    for thread in threads: thread.join()
+                
+            finally:
+                for thread in threads:
+                    os.remove(thread.get_fasta_path())
+            
+            # merged in the order of the aligners, which is always the same
+            aligned = set()
+            for thread in threads:
+                error = thread.get_error()
+                if isinstance(error, m2pException):
+                    sys.stderr.write("\t"+error.msg+"\n")
+                    sys.stderr.write("\tContinuing with next aligner...\n")
+                    continue
+                elif error != None:
+                    raise error
+                
+                hits = thread.get_aligner().get_hits()
+                sys.stderr.write("ListAligner: hits "+str(len(hits))+"\n")
+                
+                self._results_hits = self._results_hits + hits
+                aligned.update([hit.get_query_id().split(" ")[0] for hit in hits])
+            
+            pending = [query_id for query_id in pending if query_id not in aligned]
+        
+        self._results_unaligned = pending
+        
+        return self.get_hits()
+
+## Runs the alignment of an aligner, keeping the error raised, if any.
+## The aligner commands of the thread are stopped along with those of the thread
+## which created it (e.g. the partitions of a ListAligner run in a speculative AlignerThread).
+class AlignerThread(threading.Thread):
+    _aligner = None
+    _fasta_path = ""
+    _align_args = None
+    _error = None
+    _seconds = 0.0
+    _stopped = False
+    _parent_id = None
+    
+    def __init__(self, aligner, fasta_path, db, ref_type, threshold_id, threshold_cov):
+        threading.Thread.__init__(self)
+        self._aligner = aligner
+        self._fasta_path = fasta_path
+        self._align_args = (db, ref_type, threshold_id, threshold_cov)
+        self._error = None
+        self._stopped = False
+        self._parent_id = threading.current_thread().ident
+    
+    def get_aligner(self):
+        return self._aligner
+    
+    def get_fasta_path(self):
+        return self._fasta_path
+    
+    def get_error(self):
+        return self._error
+    
+    def get_seconds(self):
+        return self._seconds
+    
+    ## Stops the alignment, killing the aligner commands running, if any, in it and in the threads it started
+    ## (the in-process aligners and the workers of AlignerWorkers run until they finish)
+    def stop(self):
+        self._stopped = True
+        alignment_utils.stop_aligner_commands(self.ident)
+        
+        return
+    
+    def run(self):
+        alignment_utils.begin_aligner_commands(self._parent_id)
+        try:
+            self.align()
+        finally:
+            alignment_utils.end_aligner_commands()
+        
+        return
+    
+    ## Runs the alignment in the current thread, instead of starting this one
+    def align(self):
+        ini_time = time.time()
+        try:
+            if not self._stopped:
+                self._aligner.align(self._fasta_path, *self._align_args)
+        except Exception as e:
+            self._error = e
+        
+        self._seconds = time.time() - ini_time
+        
+        return
+
+## This aligner wraps another aligner and aligns to each database only the queries
+## selected by the pre-screen of databases (see DatabasesPrescreen),
+## reporting the others as unaligned.
+class PrescreenAligner(BaseAligner):
+    _aligner = None
+    _prescreen = None
+    _tmp_files_dir = ""
+    
+    def __init__(self, aligner, prescreen, tmp_files_dir, verbose = False):
+        self._aligner = aligner
+        self._prescreen = prescreen
+        self._tmp_files_dir = tmp_files_dir
+        self._verbose = verbose
+        self._results_hits = []
+        self._results_unaligned = []
+    
+    def align(self, fasta_path, db, ref_type, threshold_id, threshold_cov):
+        
+        selected_queries = self._prescreen.select_queries(fasta_path, db)
+        
+        if selected_queries == None:
+            self._results_hits = self._aligner.align(fasta_path, db, ref_type, threshold_id, threshold_cov)
+            self._results_unaligned = self._aligner.get_unaligned()
+            return self.get_hits()
+        
+        fasta_headers = alignment_utils.get_fasta_headers(fasta_path)
+        
+        sys.stderr.write("PrescreenAligner: DB --> "+str(db)+", "+str(len(selected_queries))+\
+                         " of "+str(len(fasta_headers))+" queries pass the pre-screen\n")
+        
+        if len(selected_queries) == len(fasta_headers):
+            self._results_hits = self._aligner.align(fasta_path, db, ref_type, threshold_id, threshold_cov)
+            
+        elif len(selected_queries) > 0:
+            selected_fasta_path = alignment_utils.extract_fasta_headers(fasta_path, selected_queries, self._tmp_files_dir)
+            try:
+                self._results_hits = self._aligner.align(selected_fasta_path, db, ref_type, threshold_id, threshold_cov)
+            finally:
+                os.remove(selected_fasta_path)
+            
+        else:
+            self._results_hits = []
+        
+        query_list = [a.get_query_id() for a in self._results_hits]
+        self._results_unaligned = alignment_utils.filter_list(fasta_headers, query_list)
+        
+        return self.get_hits()
+
+## This aligner wraps another aligner and keeps, for each database,
+## the hits of the whole query fasta. Subsequent requests to the same database,
+## even with a subset of the queries (e.g. hierarchical or exhaustive searches),
+## are resolved from the stored hits instead of aligning again.
+class CachedAligner(BaseAligner):
+    _aligner = None
+    _aligner_key = ""
+    _query_fasta_path = ""
+    _alignments_cache = None
+    
+    def __init__(self, aligner, aligner_key, query_fasta_path, alignments_cache, verbose = False):
+        self._aligner = aligner
+        self._aligner_key = aligner_key
+        self._query_fasta_path = query_fasta_path
+        self._alignments_cache = alignments_cache
+        self._verbose = verbose
+        self._results_hits = []
+        self._results_unaligned = []
+    
+    def align(self, fasta_path, db, ref_type, threshold_id, threshold_cov):
+        
+        cache_key = (self._aligner_key, db, ref_type, float(threshold_id), float(threshold_cov))
+        
+        if cache_key in self._alignments_cache:
+            sys.stderr.write("CachedAligner: DB --> "+str(db)+" (already aligned)\n")
+            (db_hits, db_unaligned) = self._alignments_cache[cache_key]
+        else:
+            # Always the whole query fasta, so that the hits can be reused later
+            db_hits = list(self._aligner.align(self._query_fasta_path, db, ref_type, threshold_id, threshold_cov))
+            db_unaligned = list(self._aligner.get_unaligned())
+            self._alignments_cache[cache_key] = (db_hits, db_unaligned)
+        
+        if fasta_path == self._query_fasta_path:
+            self._results_hits = db_hits
+            self._results_unaligned = db_unaligned
+        else:
+            fasta_headers = alignment_utils.get_fasta_headers(fasta_path)
+            queries_set = set([a.split(" ")[0] for a in fasta_headers])
+            
+            self._results_hits = [a for a in db_hits if a.get_query_id().split(" ")[0] in queries_set]
+            
+            query_list = [a.get_query_id() for a in self._results_hits]
+            self._results_unaligned = alignment_utils.filter_list(fasta_headers, query_list)
+        
+        if self._verbose:
+            sys.stderr.write("CachedAligner: hits "+str(len(self._results_hits))+\
+                             ", no hits "+str(len(self._results_unaligned))+"\n")
+        
+        return self.get_hits()
+ 
+## This aligner wraps another aligner and saves the hits and unaligned queries
+## of each database to a checkpoint of the job (see job_checkpoints), so that
+## a job run again after an interruption restores them instead of aligning again.
+class CheckpointAligner(BaseAligner):
+    _aligner = None
+    _aligner_key = ""
+    
+    def __init__(self, aligner, aligner_key, verbose = False):
+        self._aligner = aligner
+        self._aligner_key = aligner_key
+        self._verbose = verbose
+        self._results_hits = []
+        self._results_unaligned = []
+    
+    def align(self, fasta_path, db, ref_type, threshold_id, threshold_cov):
+        
+        checkpoint_key = (self._aligner_key, db, str(ref_type), str(float(threshold_id)), str(float(threshold_cov)),
+                          file_utils.get_file_hash(fasta_path))
+        
+        checkpoint = job_checkpoints.load(job_checkpoints.ALIGNMENTS, checkpoint_key)
+        
+        if checkpoint != None:
+            sys.stderr.write("CheckpointAligner: DB --> "+str(db)+" (restored from the job checkpoints)\n")
+            (self._results_hits, self._results_unaligned) = checkpoint
+        else:
+            self._results_hits = list(self._aligner.align(fasta_path, db, ref_type, threshold_id, threshold_cov))
+            self._results_unaligned = list(self._aligner.get_unaligned())
+            
+            job_checkpoints.save(job_checkpoints.ALIGNMENTS, checkpoint_key, (self._results_hits, self._results_unaligned))
+        
+        return self.get_hits()
  
 ##
\ No newline at end of file
@@ -5,32 +5,66 @@
 # Copyright (C)  2017  Carlos P Cantalapiedra.
 # (terms of use can be found within the distributed LICENSE file).
 
+import heapq, time
+from itertools import groupby
+
 from barleymapcore.m2p_exception import m2pException
 from barleymapcore.db.MapsConfig import MapsConfig
 from Aligners import *
+import DatabasesPrescreen
 from AlignmentResult import AlignmentResults
+import barleymapcore.utils.sort_utils as sort_utils
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.search_stats as search_stats
+import barleymapcore.utils.job_checkpoints as job_checkpoints
 
 ALIGNMENT_TYPE_GREEDY = "greedy"
 ALIGNMENT_TYPE_HIERARCHICAL = "hierarchical"
 ALIGNMENT_TYPE_BEST_SCORE = "best_score"
 
+## Number of databases aligned at the same time in hierarchical searches (see configure_speculative)
+_speculative_dbs = 1
+
+def configure_speculative(num_dbs):
+    global _speculative_dbs
+    
+    if num_dbs < 1:
+        raise m2pException("The number of databases to align at the same time has to be at least 1.")
+    
+    _speculative_dbs = num_dbs
+    
+    return
+
+# Order of the alignment results: query, subject and subject positions
+def _results_sort_key(alignment_result):
+    return (alignment_result.get_query_id(), alignment_result.get_subject_id(),
+            alignment_result.get_local_position(), alignment_result.get_end_position())
+
+def _keyed_results(db_results, db_index):
+    for (result_index, alignment_result) in enumerate(db_results):
+        yield (_results_sort_key(alignment_result), db_index, result_index, alignment_result)
+
 class AlignmentEnginesFactory(object):
     @staticmethod
-    def get_alignment_engine(search_type, aligner_list, paths_config, ref_type_param, n_threads, verbose):
+    def get_alignment_engine(search_type, aligner_list, paths_config, ref_type_param, n_threads, verbose,
+                             cache_fasta_path = None, alignments_cache = None):
         
         alignment_engine = None
         
         if search_type == ALIGNMENT_TYPE_GREEDY:
             
-            alignment_engine = GreedyEngine(aligner_list, paths_config, ref_type_param, n_threads, verbose)
+            alignment_engine = GreedyEngine(aligner_list, paths_config, ref_type_param, n_threads, verbose,
+                                            cache_fasta_path, alignments_cache)
             
         elif search_type == ALIGNMENT_TYPE_HIERARCHICAL:
             
-            alignment_engine = HierarchicalEngine(aligner_list, paths_config, ref_type_param, n_threads, verbose)
+            alignment_engine = HierarchicalEngine(aligner_list, paths_config, ref_type_param, n_threads, verbose,
+                                                  cache_fasta_path, alignments_cache)
             
         elif search_type == ALIGNMENT_TYPE_BEST_SCORE:
             
-            alignment_engine = BestScoreEngine(aligner_list, paths_config, ref_type_param, n_threads, verbose)
+            alignment_engine = BestScoreEngine(aligner_list, paths_config, ref_type_param, n_threads, verbose,
+                                               cache_fasta_path, alignments_cache)
             
         else:
             raise m2pException("Unrecognized search type "+search_type+".")
@@ -47,27 +81,72 @@ class AlignmentEngine(object):
     _verbose = False
     
     _aligner = None
+    _aligner_args = None
     
-    def __init__(self, aligner_list, paths_config, ref_type_param, n_threads, verbose):
+    def __init__(self, aligner_list, paths_config, ref_type_param, n_threads, verbose,
+                 cache_fasta_path = None, alignments_cache = None):
         self._paths_config = paths_config
         self._ref_type_param = ref_type_param
         self._n_threads = n_threads
         self._verbose = verbose
         
-        self._load_aligner(aligner_list)
+        self._load_aligner(aligner_list, cache_fasta_path, alignments_cache)
     
-    def _load_aligner(self, aligner_list):
+    def _load_aligner(self, aligner_list, cache_fasta_path = None, alignments_cache = None):
         self._aligner = None # reset aligner
         
+        self._aligner_args = (aligner_list, cache_fasta_path, alignments_cache)
+        self._aligner = self._create_aligner(aligner_list, cache_fasta_path, alignments_cache)
+        
+        return
+    
+    ## A new aligner, with its own results, for the aligners of the list
+    def _create_aligner(self, aligner_list, cache_fasta_path = None, alignments_cache = None):
+        
         aligner = AlignersFactory.get_aligner(aligner_list, self._n_threads, self._paths_config, self._verbose)
         
-        self._aligner = aligner
+        # Align to each DB only the queries which pass the pre-screen, if enabled
+        prescreen = DatabasesPrescreen.get_prescreen()
+        if prescreen != None:
+            aligner = PrescreenAligner(aligner, prescreen, self._paths_config.get_tmp_files_path(), self._verbose)
+        
+        # Save the alignments to each DB to the job checkpoints, or restore them, if enabled (--resume)
+        # (the key of the aligner has the options which change its results)
+        if job_checkpoints.is_enabled():
+            checkpoint_key = ",".join(aligner_list)
+            if get_routing_length() != None: checkpoint_key += " routing:"+str(get_routing_length())
+            if prescreen != None: checkpoint_key += " prescreen:"+str(prescreen.get_threshold())
+            
+            aligner = CheckpointAligner(aligner, checkpoint_key, self._verbose)
         
-        return
+        # Reuse the alignments of the whole fasta to each DB (see AlignmentFacade.enable_cache)
+        if alignments_cache is not None:
+            aligner = CachedAligner(aligner, ",".join(aligner_list), cache_fasta_path, alignments_cache, self._verbose)
+        
+        return aligner
     
     def perform_alignment(self, query_fasta_path, dbs_list, databases_config, threshold_id, threshold_cov):
         raise m2pException("SearchEngine is an abstract class. 'perform_alignment' must be implemented in a child class.")
     
+    ## Aligns to the DB, recording its hit statistics (see search_stats)
+    def _align_db(self, fasta_to_align, db, ref_type, threshold_id, threshold_cov):
+        
+        ini_time = time.time()
+        
+        hits = self._aligner.align(fasta_to_align, db, ref_type, threshold_id, threshold_cov)
+        
+        self._record_db_stats(db, self._aligner, time.time() - ini_time)
+        
+        return hits
+    
+    def _record_db_stats(self, db, aligner, seconds):
+        if not search_stats.is_enabled(): return
+        
+        num_found = len(set([a.get_query_id().split(" ")[0] for a in aligner.get_hits()]))
+        search_stats.record(search_stats.DATABASES, db, num_found + len(aligner.get_unaligned()), num_found, seconds)
+        
+        return
+    
     def get_alignment_results(self, ):
         return self._alignment_results
     
@@ -88,35 +167,29 @@ class AlignmentEngine(object):
         ###### best score filtering
         # chooses the best score from alignments
         # to ALL databases for a given query
+        # The results must come grouped by query (as _merge_results yields them),
+        # so that only the alignments of the current query are kept
         
-        best_score_filtering = {}
+        best_results = []
         
-        for alignment_result in results:
-            query_id = alignment_result.get_query_id()
+        for (query_id, query_results) in groupby(results, key=lambda alignment_result: alignment_result.get_query_id()):
+            query_best = []
+            query_best_score = None
             
-            align_score = float(alignment_result.get_align_score())
-            
-            if query_id in best_score_filtering:
-                query_best = best_score_filtering[query_id]
-                query_best_score = query_best["best_score"]
+            for alignment_result in query_results:
+                align_score = float(alignment_result.get_align_score())
                 
                 # update best score if needed
-                if align_score > query_best_score:
-                    query_best["results"] = [alignment_result]
-                    query_best["best_score"] = align_score
+                if query_best_score == None or align_score > query_best_score:
+                    query_best = [alignment_result]
+                    query_best_score = align_score
                     
                 elif align_score == query_best_score:
-                    query_best["results"].append(alignment_result)
+                    query_best.append(alignment_result)
                     
                 #else: # align_score < query_best_score --> continue
                 
-            else:
-                best_score_filtering[query_id] = {"results":[alignment_result], "best_score":align_score}   
-        
-        best_results = []
-        for query_id in best_score_filtering:
-            for alignment_result in best_score_filtering[query_id]["results"]:
-                best_results.append(alignment_result)
+            best_results.extend(query_best)
         
         return best_results
     
@@ -166,10 +239,19 @@ class AlignmentEngine(object):
         return best_results
     
     def _sort_results(self, results):
-        sorted_results = sorted(results, key=lambda x:(x.get_query_id(),x.get_subject_id(),
-                                                       x.get_local_position(),x.get_end_position()))
+        sorted_results = sort_utils.sort_records(results, _results_sort_key)
         
         return sorted_results
+    
+    # Lazy k-way merge of the results of each DB, already sorted with _sort_results.
+    # Ties keep the order of the DBs, as sorting all the results at once would do.
+    def _merge_results(self, dbs_results):
+        
+        if len(dbs_results) == 1:
+            return iter(dbs_results[0])
+        
+        return (keyed_result[3] for keyed_result in \
+                heapq.merge(*[_keyed_results(db_results, db_index) for (db_index, db_results) in enumerate(dbs_results)]))
 
 class GreedyEngine(AlignmentEngine):
     
@@ -191,7 +273,7 @@ class GreedyEngine(AlignmentEngine):
         
         fasta_to_align = query_fasta_path
         
-        results = []
+        dbs_results = []
         
         if self._verbose: sys.stderr.write("GreedyEngine: performing alignment...\n")
         
@@ -204,15 +286,15 @@ class GreedyEngine(AlignmentEngine):
             try:
                 ## Alignment of fasta sequences to the DB
                 ##
-                hits = self._aligner.align(fasta_to_align, db, ref_type, threshold_id, threshold_cov)
+                hits = self._align_db(fasta_to_align, db, ref_type, threshold_id, threshold_cov)
                 
-                results.extend(hits)
+                dbs_results.append(self._sort_results(hits))
                 
             except m2pException as m2pe:
                 sys.stderr.write("\t"+m2pe.msg+"\n")
                 sys.stderr.write("\tContinuing with alignments to next DB...\n")
         
-        results = self._sort_results(results)
+        results = list(self._merge_results(dbs_results))
         
         ## Recover unmapped queries
         unaligned = self._get_unaligned(query_fasta_path, results)
@@ -224,13 +306,26 @@ class GreedyEngine(AlignmentEngine):
 ## This Engine iterates over databases.
 ## Once a query hits a databases, is not searched
 ## in subsequent DBs
+##
+## In speculative mode (see configure_speculative), up to _speculative_dbs databases are aligned
+## at the same time: each database starts, as soon as there is room for it, with the queries
+## without hits in the databases already finished, which are at least those it would be
+## aligned with otherwise. Once the previous databases finish, the hits of queries found
+## in any of them are discarded, so that the results are the same, in less time.
 class HierarchicalEngine(AlignmentEngine):
     
     def perform_alignment(self, query_fasta_path, dbs_list, databases_config, threshold_id, threshold_cov):
         
+        # the order of the DBs changes the results, so it is only recommended
+        search_stats.recommend_order(search_stats.DATABASES, dbs_list, "hierarchical")
+        
+        if _speculative_dbs > 1 and len(dbs_list) > 1:
+            return self._perform_speculative_alignment(query_fasta_path, dbs_list, databases_config,
+                                                       threshold_id, threshold_cov)
+        
         fasta_to_align = query_fasta_path
         
-        results = []
+        dbs_results = []
         
         if self._verbose: sys.stderr.write("HierarchicalEngine: performing alignment...\n")
         
@@ -242,9 +337,9 @@ class HierarchicalEngine(AlignmentEngine):
                 ref_type = self.get_reftype(db, databases_config)
                 
                 try:
-                    db_hits = self._aligner.align(fasta_to_align, db, ref_type, threshold_id, threshold_cov)
+                    db_hits = self._align_db(fasta_to_align, db, ref_type, threshold_id, threshold_cov)
                     
-                    results.extend(db_hits)
+                    dbs_results.append(self._sort_results(db_hits))
                     
                     ## Recover unmapped queries if needed
                     unmapped = self._aligner.get_unaligned()
@@ -265,7 +360,7 @@ class HierarchicalEngine(AlignmentEngine):
             for tmp_file in tmp_files_list:
                 os.remove(tmp_file)
         
-        results = self._sort_results(results)
+        results = list(self._merge_results(dbs_results))
         
         ## Recover unmapped queries from last DB which was queried
         unaligned = self._aligner.get_unaligned()
@@ -273,6 +368,93 @@ class HierarchicalEngine(AlignmentEngine):
         alignment_results = AlignmentResults(results, unaligned) # reset alignment results
         
         return alignment_results
+    
+    def _perform_speculative_alignment(self, query_fasta_path, dbs_list, databases_config, threshold_id, threshold_cov):
+        
+        if self._verbose: sys.stderr.write("HierarchicalEngine: performing speculative alignment...\n")
+        
+        fasta_headers = alignment_utils.get_fasta_headers(query_fasta_path)
+        num_queries = len(set([a.split(" ")[0] for a in fasta_headers]))
+        
+        # an aligner for each database running at the same time
+        free_aligners = [self._aligner]
+        for i in xrange(min(_speculative_dbs, len(dbs_list)) - 1):
+            free_aligners.append(self._create_aligner(*self._aligner_args))
+        
+        # queries with hits in the databases already finished
+        found = set()
+        dbs_results = []
+        
+        # alignment of each database running, by index of the database
+        running = {}
+        next_db_index = 0
+        tmp_files_dir = self._paths_config.get_tmp_files_path()
+        try:
+            for (db_index, db) in enumerate(dbs_list):
+                
+                if len(found) == num_queries: break # Once all queries have been found in DBs
+                
+                while next_db_index < len(dbs_list) and len(free_aligners) > 0:
+                    next_db = dbs_list[next_db_index]
+                    
+                    if len(found) > 0:
+                        fasta_to_align = alignment_utils.extract_fasta_headers(query_fasta_path,
+                                                                               alignment_utils.filter_list(fasta_headers, found),
+                                                                               tmp_files_dir)
+                    else:
+                        fasta_to_align = query_fasta_path
+                    
+                    thread = AlignerThread(free_aligners.pop(), fasta_to_align,
+                                           next_db, self.get_reftype(next_db, databases_config), threshold_id, threshold_cov)
+                    running[next_db_index] = thread
+                    thread.start()
+                    
+                    if next_db_index > db_index: profile_utils.count("hierarchical/speculative_dbs")
+                    next_db_index += 1
+                
+                thread = running.pop(db_index)
+                thread.join()
+                
+                free_aligners.append(thread.get_aligner())
+                if thread.get_fasta_path() != query_fasta_path: os.remove(thread.get_fasta_path())
+                
+                error = thread.get_error()
+                if isinstance(error, m2pException):
+                    sys.stderr.write("\t"+error.msg+"\n")
+                    sys.stderr.write("\tContinuing with alignments to next DB...\n")
+                    continue
+                elif error != None:
+                    raise error
+                
+                self._record_db_stats(db, thread.get_aligner(), thread.get_seconds())
+                
+                # hits of queries already found in previous DBs
+                db_hits = [a for a in thread.get_aligner().get_hits() if a.get_query_id().split(" ")[0] not in found]
+                profile_utils.count("hierarchical/speculative_hits_discarded", len(thread.get_aligner().get_hits()) - len(db_hits))
+                
+                dbs_results.append(self._sort_results(db_hits))
+                found.update([a.get_query_id().split(" ")[0] for a in db_hits])
+            
+        except Exception:
+            raise
+        finally:
+            # alignments not needed anymore, since all the queries were found before
+            for db_index in sorted(running):
+                running[db_index].stop()
+                profile_utils.count("hierarchical/speculative_dbs_stopped")
+            
+            for db_index in sorted(running):
+                thread = running[db_index]
+                thread.join()
+                if thread.get_fasta_path() != query_fasta_path: os.remove(thread.get_fasta_path())
+        
+        results = list(self._merge_results(dbs_results))
+        
+        unaligned = alignment_utils.filter_list(fasta_headers, found)
+        
+        alignment_results = AlignmentResults(results, unaligned) # reset alignment results
+        
+        return alignment_results
 
 class BestScoreEngine(AlignmentEngine):
     
@@ -294,7 +476,7 @@ class BestScoreEngine(AlignmentEngine):
         
         fasta_to_align = query_fasta_path
         
-        results = []
+        dbs_results = []
         
         if self._verbose: sys.stderr.write("BestScoreEngine: performing alignment...\n")
         
@@ -307,16 +489,15 @@ class BestScoreEngine(AlignmentEngine):
             try:
                 ## Alignment of fasta sequences to the DB
                 ##
-                hits = self._aligner.align(fasta_to_align, db, ref_type, threshold_id, threshold_cov)
+                hits = self._align_db(fasta_to_align, db, ref_type, threshold_id, threshold_cov)
                 
-                results.extend(hits)
+                dbs_results.append(self._sort_results(hits))
                 
             except m2pException as m2pe:
                 sys.stderr.write("\t"+m2pe.msg+"\n")
                 sys.stderr.write("\tContinuing with alignments to next DB...\n")
         
-        results = self._best_score(results)
-        results = self._sort_results(results)
+        results = self._best_score(self._merge_results(dbs_results))
         
         ## Recover unmapped queries
         unaligned = self._get_unaligned(query_fasta_path, results)
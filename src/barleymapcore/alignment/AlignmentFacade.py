@@ -6,9 +6,12 @@
 # Copyright (C)  2016-2017 Carlos P Cantalapiedra.
 # (terms of use can be found within the distributed LICENSE file).
 
-import os, sys
+import os, sys, copy
 
 from barleymapcore.db.DatabasesConfig import REF_TYPE_STD
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.alignment_utils as alignment_utils
+import barleymapcore.utils.sort_utils as sort_utils
 
 from AlignmentEngines import AlignmentEnginesFactory
 from AlignmentResult import AlignmentResults, AlignmentResult
@@ -19,11 +22,120 @@ class AlignmentFacade():
     
     _alignment_results = None
     
+    _cache_fasta_path = None
+    _alignments_cache = None
+    # Queries of the cached fasta without repeated sequences (see _deduplicate_queries)
+    _cache_dedup = None
+    _cache_representatives = None
+    
     _verbose = False
     
     def __init__(self, paths_config, verbose = False):
         self._paths_config = paths_config
         self._verbose = verbose
+        self._cache_fasta_path = None
+        self._alignments_cache = None
+        self._cache_dedup = None
+        self._cache_representatives = None
+    
+    # While enabled, the query fasta is aligned only once to each DB
+    # and the hits are reused by every later call to perform_alignment
+    # with this fasta (or a fasta with a subset of its sequences)
+    def enable_cache(self, query_fasta_path):
+        self.disable_cache()
+        
+        dedup = self._deduplicate_queries(query_fasta_path)
+        
+        self._cache_fasta_path = dedup[0]
+        self._alignments_cache = {}
+        self._cache_dedup = (query_fasta_path,)+dedup
+        # the subsets of the fasta use the same representatives, which are those in the cache
+        self._cache_representatives = dict([(seq_hash, representative) for (seq_hash, representative, query_ids) in dedup[1]])
+    
+    def disable_cache(self):
+        if self._cache_dedup != None and self._cache_dedup[1] != self._cache_dedup[0]:
+            os.remove(self._cache_dedup[1])
+        
+        self._cache_fasta_path = None
+        self._alignments_cache = None
+        self._cache_dedup = None
+        self._cache_representatives = None
+    
+    ## Queries with the same sequence are aligned only once.
+    ## Returns the fasta to align, with one sequence for each group of identical sequences,
+    ## the groups, as (sequence hash, representative, identifiers) in the order of the fasta,
+    ## and the (identifier, representative) of each query in the order of the fasta.
+    ## The representative is the first identifier of the group, or that given in representatives_dict
+    ## for the sequence hash. If there are no identical sequences the fasta to align is query_fasta_path.
+    def _deduplicate_queries(self, query_fasta_path, representatives_dict = None):
+        query_groups = []
+        groups_dict = {}
+        queries_representatives = []
+        
+        with profile_utils.timer("query/deduplicate"):
+            for (query_id, seq_hash) in alignment_utils.iter_fasta_hashes(query_fasta_path):
+                if seq_hash in groups_dict:
+                    groups_dict[seq_hash][2].append(query_id)
+                else:
+                    if representatives_dict != None and seq_hash in representatives_dict:
+                        representative = representatives_dict[seq_hash]
+                    else:
+                        representative = query_id
+                    
+                    query_group = (seq_hash, representative, [query_id])
+                    groups_dict[seq_hash] = query_group
+                    query_groups.append(query_group)
+                
+                queries_representatives.append((query_id, groups_dict[seq_hash][1]))
+            
+            num_queries = len(queries_representatives)
+            
+            # Repeated identifiers could not be told apart in the results
+            num_ids = len(set([query_id for (query_id, representative) in queries_representatives]))
+            
+            if num_ids < num_queries or \
+               all([query_group[2] == [query_group[1]] for query_group in query_groups]):
+                return (query_fasta_path, query_groups, queries_representatives)
+            
+            representatives = dict([(query_ids[0], representative) for (seq_hash, representative, query_ids) in query_groups])
+            fasta_to_align = alignment_utils.write_fasta_representatives(query_fasta_path, representatives,
+                                                                         self._paths_config.get_tmp_files_path())
+        
+        profile_utils.count("query/duplicates", num_queries - len(query_groups))
+        
+        if self._verbose: sys.stderr.write("AlignmentFacade: "+str(len(query_groups))+" distinct sequences of "+\
+                                           str(num_queries)+" queries\n")
+        
+        return (fasta_to_align, query_groups, queries_representatives)
+    
+    ## Results of the representatives copied to every identifier of their group,
+    ## in the same order as if every query had been aligned
+    def _fan_out_results(self, alignment_results, query_groups, queries_representatives):
+        group_ids = {}
+        for (seq_hash, representative, query_ids) in query_groups:
+            group_ids[representative] = query_ids
+        
+        aligned = []
+        for alignment_result in alignment_results.get_aligned():
+            representative = alignment_result.get_query_id()
+            for query_id in group_ids.get(representative, [representative]):
+                if query_id == representative:
+                    aligned.append(alignment_result)
+                else:
+                    query_result = copy.copy(alignment_result)
+                    query_result.set_query_id(query_id)
+                    aligned.append(query_result)
+        
+        # the results of the engines are sorted by query (see AlignmentEngines._results_sort_key),
+        # and the stable sort keeps the order of the results of each one
+        aligned = sort_utils.sort_records(aligned, lambda alignment_result: alignment_result.get_query_id())
+        
+        # unaligned queries in the order of the fasta
+        unaligned_representatives = set(alignment_results.get_unaligned())
+        unaligned = [query_id for (query_id, representative) in queries_representatives \
+                     if representative in unaligned_representatives]
+        
+        return AlignmentResults(aligned, unaligned)
     
     def _create_alignment_results(self, query_path):
         results = []
@@ -71,7 +183,8 @@ class AlignmentFacade():
     # Creates AlignmentResults directly from positions
     def create_alignment_results(self, query_path):
         
-        results = self._create_alignment_results(query_path)
+        with profile_utils.timer("query/parse"):
+            results = self._create_alignment_results(query_path)
         unaligned = []
         alignment_results = AlignmentResults(results, unaligned) # reset alignment results
         
@@ -84,10 +197,25 @@ class AlignmentFacade():
         
         ## Create the SearchEngine (greedy, hierarchical, exhaustive searches on top of splitblast, gmap,...)
         alignment_engine = AlignmentEnginesFactory.get_alignment_engine(search_type, aligner_list, self._paths_config, 
-                                                               ref_type_param, n_threads, self._verbose)
+                                                               ref_type_param, n_threads, self._verbose,
+                                                               self._cache_fasta_path, self._alignments_cache)
+        
+        ## Align only one query of each group of identical sequences
+        if self._cache_dedup != None and query_fasta_path == self._cache_dedup[0]:
+            (fasta_to_align, query_groups, queries_representatives) = self._cache_dedup[1:]
+        else:
+            (fasta_to_align, query_groups, queries_representatives) = self._deduplicate_queries(query_fasta_path,
+                                                                                               self._cache_representatives)
         
         ## Perform the search and alignments
-        alignment_results = alignment_engine.perform_alignment(query_fasta_path, dbs_list, databases_config, threshold_id, threshold_cov)
+        try:
+            alignment_results = alignment_engine.perform_alignment(fasta_to_align, dbs_list, databases_config, threshold_id, threshold_cov)
+        finally:
+            if fasta_to_align != query_fasta_path and (self._cache_dedup == None or fasta_to_align != self._cache_dedup[1]):
+                os.remove(fasta_to_align)
+        
+        if fasta_to_align != query_fasta_path:
+            alignment_results = self._fan_out_results(alignment_results, query_groups, queries_representatives)
         
         self._alignment_results = alignment_results
         
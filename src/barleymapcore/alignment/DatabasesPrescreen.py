@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# DatabasesPrescreen.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Pre-screen of the queries to align to each database, with sketches of sampled minimizers.
+##
+## The minimizer of a window of WINDOW consecutive K-mers is the one with the lowest hash value
+## (of the K-mer or its reverse complement, whichever is lower, so that both strands agree),
+## and only those with a hash value multiple of SCALE are kept (as in MinHash, but checking the
+## lower bits, since the upper ones are biased towards 0 in the minimizers),
+## so that the sketch of a database, the sorted array of those hash values, is a small
+## fraction of its size. It is created from the FASTA of the database (<dbs_path>/<db>.fa)
+## the first time it is used, and saved as <dbs_path>/<db>.sketch.npz (rebuilt if the FASTA is newer).
+##
+## The sketch of a query is computed in the same way, and its containment in a database
+## is the fraction of its sampled minimizers found in the sketch of the database.
+## Only the queries with a containment of at least the threshold are aligned to the database,
+## besides those too short to have any sampled minimizer (K+WINDOW-1 nucleotides at least,
+## and usually more), which are always aligned.
+## Note that a mismatch changes the K-mers which overlap it, and so alignments with lower identity
+## have lower containment: the threshold should be well below the fraction of K-mers without
+## mismatches expected for the minimum identity.
+##
+## It requires NumPy. The pre-screen of the process, if any, is enabled with configure().
+
+import sys, os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.alignment_utils as alignment_utils
+import barleymapcore.utils.file_utils as file_utils
+
+K = 21
+WINDOW = 11
+SCALE = 2
+
+DEFAULT_THRESHOLD = 0.1
+
+SKETCH_SUFFIX = ".sketch.npz"
+
+# Nucleotides of a database sequence processed at once
+CHUNK_SIZE = 4 * 1024 * 1024
+
+def is_available():
+    return np != None
+
+if np != None:
+    _CODES = np.full(256, 4, dtype=np.uint8)
+    for (code, nucleotide) in enumerate("ACGT"):
+        _CODES[ord(nucleotide)] = code
+    
+    _HASH_SEED = np.uint64(0x9e3779b97f4a7c15)
+    _HASH_MULT_1 = np.uint64(0xbf58476d1ce4e5b9)
+    _HASH_MULT_2 = np.uint64(0x94d049bb133111eb)
+    _MAX_HASH = np.uint64(2**64 - 1)
+
+## Hash values of the K-mers which start at each position of the codes
+## (the maximum value for those with letters other than ACGT)
+def _kmer_hashes(codes):
+    num_kmers = len(codes) - K + 1
+    if num_kmers <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    
+    forward = np.zeros(num_kmers, dtype=np.uint64)
+    reverse = np.zeros(num_kmers, dtype=np.uint64)
+    invalid = np.zeros(num_kmers, dtype=np.bool_)
+    for i in xrange(K):
+        nucleotides = codes[i:i+num_kmers]
+        invalid |= nucleotides > 3
+        nucleotides = (nucleotides & 3).astype(np.uint64)
+        forward = (forward << np.uint64(2)) | nucleotides
+        reverse |= (np.uint64(3) - nucleotides) << np.uint64(2 * i)
+    
+    hashes = np.minimum(forward, reverse) + _HASH_SEED
+    hashes *= _HASH_MULT_1
+    hashes ^= hashes >> np.uint64(31)
+    hashes *= _HASH_MULT_2
+    hashes ^= hashes >> np.uint64(29)
+    hashes[invalid] = _MAX_HASH
+    
+    return hashes
+
+## Sampled minimizers of the codes, as the position of the last K-mer
+## of their window and their hash value
+def _sampled_minimizers(codes):
+    hashes = _kmer_hashes(codes)
+    
+    num_windows = len(hashes) - WINDOW + 1
+    if num_windows <= 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64))
+    
+    minimizers = hashes[:num_windows].copy()
+    for i in xrange(1, WINDOW):
+        np.minimum(minimizers, hashes[i:i+num_windows], out=minimizers)
+    
+    sampled = np.flatnonzero((minimizers % np.uint64(SCALE) == 0) & (minimizers != _MAX_HASH))
+    
+    return (sampled + (WINDOW - 1), minimizers[sampled])
+
+## Sorted hash values of the sampled minimizers of the sequences of a FASTA file
+def build_sketch(fasta_path):
+    sketch_parts = []
+    
+    overlap = K + WINDOW - 2
+    for (seq_id, seq) in alignment_utils.read_fasta_sequences(fasta_path):
+        for chunk_start in xrange(0, max(len(seq) - overlap, 1), CHUNK_SIZE):
+            chunk = seq[chunk_start:chunk_start+CHUNK_SIZE+overlap]
+            (positions, hashes) = _sampled_minimizers(_CODES[np.frombuffer(chunk, dtype=np.uint8)])
+            sketch_parts.append(np.unique(hashes))
+    
+    if len(sketch_parts) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    
+    return np.unique(np.concatenate(sketch_parts))
+
+class DatabasesPrescreen(object):
+    
+    _dbs_path = ""
+    _threshold = DEFAULT_THRESHOLD
+    _verbose = False
+    
+    # sketch by database (None for databases without FASTA file)
+    _sketches = None
+    # sketches of the queries of the last FASTA file (see _get_queries_sketches)
+    _queries_sketches = None
+    
+    def __init__(self, dbs_path, threshold = DEFAULT_THRESHOLD, verbose = False):
+        self._dbs_path = dbs_path
+        self._threshold = threshold
+        self._verbose = verbose
+        self._sketches = {}
+        self._queries_sketches = None
+    
+    def _log(self, msg):
+        sys.stderr.write("DatabasesPrescreen: "+msg+"\n")
+    
+    def get_threshold(self):
+        return self._threshold
+    
+    ## Sketch of the database, loaded from its file if it is up to date
+    ## or built and saved otherwise, or None if there is no FASTA file of the database
+    def get_sketch(self, db):
+        if db in self._sketches:
+            return self._sketches[db]
+        
+        fasta_path = os.path.join(self._dbs_path, db+".fa")
+        sketch_path = os.path.join(self._dbs_path, db+SKETCH_SUFFIX)
+        
+        sketch = None
+        
+        if not os.path.isfile(fasta_path):
+            self._log("WARNING, there is no FASTA file "+fasta_path+". All the queries will be aligned to "+db+".")
+        
+        elif os.path.exists(sketch_path) and os.path.getmtime(sketch_path) >= os.path.getmtime(fasta_path):
+            if self._verbose: self._log("loading sketch "+sketch_path)
+            with profile_utils.timer("prescreen/load_sketch"):
+                sketch_file = np.load(sketch_path)
+                if sketch_file["params"].tolist() == [K, WINDOW, SCALE]:
+                    sketch = sketch_file["hashes"]
+                sketch_file.close()
+        
+        if sketch is None and os.path.isfile(fasta_path):
+            self._log("building sketch of "+fasta_path)
+            with profile_utils.timer("prescreen/build_sketch"):
+                sketch = build_sketch(fasta_path)
+            
+            self._save_sketch(sketch, sketch_path)
+        
+        self._sketches[db] = sketch
+        
+        return sketch
+    
+    ## Saves the sketch (see file_utils.write_file_atomic)
+    def _save_sketch(self, sketch, sketch_path):
+        try:
+            file_utils.write_file_atomic(sketch_path,
+                                         lambda sketch_file: np.savez(sketch_file, hashes=sketch,
+                                                                      params=np.array([K, WINDOW, SCALE], dtype=np.int64)),
+                                         SKETCH_SUFFIX)
+        
+        except (IOError, OSError) as e:
+            self._log("WARNING, the sketch could not be saved to "+sketch_path+": "+str(e))
+        
+        return
+    
+    ## Identifiers of the queries of a FASTA file, and the query index
+    ## and hash value of each of their sampled minimizers (without repeating them)
+    def _get_queries_sketches(self, fasta_path):
+        fasta_mtime = os.path.getmtime(fasta_path)
+        
+        if self._queries_sketches != None and self._queries_sketches[0] == (fasta_path, fasta_mtime):
+            return self._queries_sketches[1]
+        
+        query_ids = []
+        query_seqs = []
+        for (query_id, query_seq) in alignment_utils.read_fasta_sequences(fasta_path):
+            query_ids.append(query_id)
+            query_seqs.append(query_seq)
+        
+        # the queries separated by a letter other than ACGT, so that
+        # no window of K-mers has K-mers of two queries (K >= WINDOW)
+        starts = np.cumsum([0]+[len(query_seq) + 1 for query_seq in query_seqs])[:-1]
+        codes = _CODES[np.frombuffer("N".join(query_seqs), dtype=np.uint8)]
+        
+        (positions, hashes) = _sampled_minimizers(codes)
+        query_indexes = np.searchsorted(starts, positions, side='right') - 1
+        
+        order = np.lexsort((hashes, query_indexes))
+        query_indexes = query_indexes[order]
+        hashes = hashes[order]
+        
+        distinct = np.ones(len(hashes), dtype=np.bool_)
+        distinct[1:] = (query_indexes[1:] != query_indexes[:-1]) | (hashes[1:] != hashes[:-1])
+        
+        queries_sketches = (query_ids, query_indexes[distinct], hashes[distinct])
+        self._queries_sketches = ((fasta_path, fasta_mtime), queries_sketches)
+        
+        return queries_sketches
+    
+    ## Identifiers of the queries of the FASTA file to align to the database,
+    ## or None if all of them have to be aligned (there is no sketch of the database)
+    def select_queries(self, fasta_path, db):
+        
+        sketch = self.get_sketch(db)
+        if sketch is None:
+            return None
+        
+        with profile_utils.timer("prescreen/select"):
+            (query_ids, query_indexes, hashes) = self._get_queries_sketches(fasta_path)
+            
+            sketch_pos = np.searchsorted(sketch, hashes)
+            found = sketch[np.minimum(sketch_pos, len(sketch) - 1)] == hashes if len(sketch) > 0 \
+                    else np.zeros(len(hashes), dtype=np.bool_)
+            
+            num_minimizers = np.bincount(query_indexes, minlength=len(query_ids))
+            num_found = np.bincount(query_indexes, weights=found, minlength=len(query_ids))
+            
+            selected = (num_minimizers == 0) | (num_found >= self._threshold * num_minimizers)
+            
+            selected_ids = [query_ids[query_index] for query_index in np.flatnonzero(selected).tolist()]
+        
+        profile_utils.count("prescreen/queries", len(query_ids))
+        profile_utils.count("prescreen/skipped", len(query_ids) - len(selected_ids))
+        
+        return selected_ids
+
+## The pre-screen of the process, if enabled (see configure)
+_prescreen = None
+
+def configure(dbs_path, threshold = DEFAULT_THRESHOLD, verbose = False):
+    global _prescreen
+    
+    if not is_available():
+        raise m2pException("DatabasesPrescreen: the pre-screen of databases requires NumPy.")
+    
+    if dbs_path == "":
+        raise m2pException("DatabasesPrescreen: the path to the FASTA files of the databases (exact_dbs_path) is not configured.")
+    
+    _prescreen = DatabasesPrescreen(dbs_path, threshold, verbose)
+    
+    return _prescreen
+
+def get_prescreen():
+    return _prescreen
+
+## END
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# RawHitsStore.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Store of the raw hits of the aligners (their output before the filters of barleymap),
+## so that aligning the same queries to the same database again, with other thresholds,
+## only needs to filter the stored hits.
+##
+## The raw hits of each (aligner, database, query FASTA) are saved to a file of the store
+## directory, named after the SHA-1 of the aligner, its paths, the database, the size and
+## modification time of the files of the database (so that the raw hits of a database which
+## is indexed again are not used) and the content of the query FASTA,
+## along with the thresholds given to the aligner when they were obtained
+## (the capture thresholds). The aligners filter their output with those thresholds
+## (GMAP --min-identity and --min-trimmed-coverage, Blastn and HS-Blastn -perc_identity
+## and -qcov_hsp_perc, relaxed) which barleymap applies again afterwards, and so the raw hits
+## captured with some thresholds contain those of any higher thresholds, and are used
+## for thresholds equal or higher than them. With lower thresholds, the queries are aligned
+## again and the new raw hits replace the stored ones.
+##
+## The file is the list of raw hits, saved with file_utils.save_compressed_pickle.
+## The store of the process, if any, is enabled with configure().
+
+import sys, os, glob, hashlib
+
+from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.file_utils as file_utils
+
+STORE_SUFFIX = ".hits"
+
+class RawHitsStore(object):
+    
+    _store_path = ""
+    _verbose = False
+    
+    def __init__(self, store_path, verbose = False):
+        self._store_path = store_path
+        self._verbose = verbose
+    
+    def _log(self, msg):
+        sys.stderr.write("RawHitsStore: "+msg+"\n")
+    
+    ## Size and modification time of the files of the database: those named after it
+    ## (Blastn and HS-Blastn, e.g. db_name.nsq) and those of its directory (GMAP, db_name/)
+    def _get_db_stamp(self, dbs_path, db_name):
+        db_path = os.path.join(dbs_path, db_name)
+        
+        db_files = []
+        for file_path in glob.glob(db_path)+glob.glob(db_path+".*"):
+            if os.path.isdir(file_path):
+                for (dir_path, dir_names, file_names) in os.walk(file_path):
+                    db_files.extend([os.path.join(dir_path, file_name) for file_name in file_names])
+            else:
+                db_files.append(file_path)
+        
+        db_stamp = []
+        for file_path in sorted(db_files):
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                continue
+            db_stamp.append((os.path.relpath(file_path, dbs_path), file_stat.st_size, file_stat.st_mtime))
+        
+        return hashlib.sha1(repr(db_stamp)).hexdigest()
+    
+    ## Key and path of the raw hits of the queries of the FASTA file to the database
+    def _get_entry(self, aligner, app_path, dbs_path, db_name, query_fasta_path):
+        
+        key = (aligner, app_path, dbs_path, db_name, self._get_db_stamp(dbs_path, db_name), file_utils.get_file_hash(query_fasta_path))
+        entry_name = hashlib.sha1("\t".join(key)).hexdigest()
+        
+        return (key, os.path.join(self._store_path, entry_name+STORE_SUFFIX))
+    
+    ## The raw hits stored for the queries of the FASTA file to the database,
+    ## or None if there are none captured with thresholds equal or lower than the given ones
+    def load(self, aligner, app_path, dbs_path, db_name, query_fasta_path, threshold_id, threshold_cov):
+        
+        (key, entry_path) = self._get_entry(aligner, app_path, dbs_path, db_name, query_fasta_path)
+        
+        raw_hits = None
+        
+        if os.path.exists(entry_path):
+            with profile_utils.timer("hits_store/load"):
+                try:
+                    entry = file_utils.load_compressed_pickle(entry_path)
+                except file_utils.PICKLE_ERRORS as e:
+                    self._log("WARNING, could not read "+entry_path+": "+str(e))
+                    entry = None
+            
+            if entry != None and entry["key"] == key and \
+               entry["threshold_id"] <= float(threshold_id) and entry["threshold_cov"] <= float(threshold_cov):
+                raw_hits = entry["raw_hits"]
+        
+        if raw_hits != None:
+            if self._verbose: self._log(str(len(raw_hits))+" raw hits of "+aligner+" to "+db_name+" from "+entry_path)
+            profile_utils.count("hits_store/found")
+        else:
+            profile_utils.count("hits_store/not_found")
+        
+        return raw_hits
+    
+    ## Saves the raw hits, obtained with the given thresholds,
+    ## replacing the entry of the queries of the FASTA file to the database
+    def save(self, aligner, app_path, dbs_path, db_name, query_fasta_path, threshold_id, threshold_cov, raw_hits):
+        
+        (key, entry_path) = self._get_entry(aligner, app_path, dbs_path, db_name, query_fasta_path)
+        
+        entry = {"key":key, "threshold_id":float(threshold_id), "threshold_cov":float(threshold_cov),
+                 "raw_hits":list(raw_hits)}
+        
+        try:
+            with profile_utils.timer("hits_store/save"):
+                file_utils.save_compressed_pickle(entry_path, entry, STORE_SUFFIX)
+            
+            if self._verbose: self._log(str(len(raw_hits))+" raw hits of "+aligner+" to "+db_name+" saved to "+entry_path)
+        
+        except (IOError, OSError) as e:
+            self._log("WARNING, the raw hits could not be saved to "+entry_path+": "+str(e))
+        
+        return
+
+## The store of the process, if enabled (see configure)
+_hits_store = None
+
+def configure(store_path, verbose = False):
+    global _hits_store
+    
+    if not os.path.isdir(store_path):
+        try:
+            os.makedirs(store_path)
+        except OSError as e:
+            raise m2pException("RawHitsStore: could not create the directory "+store_path+": "+str(e))
+    
+    _hits_store = RawHitsStore(store_path, verbose)
+    
+    return _hits_store
+
+def get_hits_store():
+    return _hits_store
+
+## END
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# m2p_exact.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Exact matches of the queries, full-length and at 100% identity,
+## searched in-process with a k-mer index of the FASTA of each database.
+##
+## The index has the K-mers which start every STEP positions of the database sequences
+## (2 bits per nucleotide, those with other letters are skipped), sorted to be searched
+## with numpy.searchsorted. Any occurrence of a query of K+STEP-1 or more nucleotides
+## includes one of those K-mers, at an offset lower than STEP of the query, and so
+## looking up the K-mers at the first STEP offsets of the query (and of its reverse
+## complement) gives every candidate start, which is then compared with the database sequence.
+##
+## Queries shorter than that, with letters other than ACGT, without exact matches
+## or with too many of them, are not resolved, and are left for the next aligner.
+## The queries resolved are not aligned by the next aligners, and so their alignments
+## below 100% identity (e.g. to paralogs) are not reported, even if they pass threshold_id.
+##
+## The index is built the first time a database is searched and saved to the directory
+## <exact_dbs_path>/<db>.exact/ (rebuilt if the FASTA is newer), so that later runs
+## just map its arrays in memory. It requires NumPy.
+
+import sys, os, string
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from AlignmentResult import *
+from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.alignment_utils as alignment_utils
+import barleymapcore.utils.file_utils as file_utils
+
+ALIGNER = "Exact"
+
+K = 16
+STEP = 8
+
+# Queries with more exact matches than this are left for the next aligner,
+# which reports only some of them (see MAX_NUMBER_PATHS_PER_QUERY of m2p_gmap)
+MAX_HITS_PER_QUERY = 100
+
+# K-mers at more positions than this are not looked up
+MAX_KMER_POSITIONS = 10000
+
+INDEX_SUFFIX = ".exact"
+INDEX_FILES = ["kmers.npy", "positions.npy", "seq.npy", "starts.npy", "names.txt", "params.npy"]
+
+_BASE4 = string.maketrans("ACGT", "0123")
+_COMPLEMENT = string.maketrans("ACGT", "TGCA")
+
+# Indexes already loaded, by FASTA path
+_indexes = {}
+
+def is_available():
+    return np != None
+
+def _reverse_complement(seq):
+    return seq.translate(_COMPLEMENT)[::-1]
+
+class ExactMatchIndex(object):
+    
+    _kmers = None
+    _positions = None
+    # sequences of the database, one after the other, separated by "N"
+    _seq = None
+    _starts = None
+    _names = None
+    
+    def __init__(self, kmers, positions, seq, starts, names):
+        self._kmers = kmers
+        self._positions = positions
+        self._seq = seq
+        self._starts = starts
+        self._names = names
+    
+    @staticmethod
+    def build(fasta_path):
+        names = []
+        starts = []
+        seqs = []
+        
+        seq_len = 0
+        for (seq_id, seq) in alignment_utils.read_fasta_sequences(fasta_path):
+            names.append(seq_id)
+            starts.append(seq_len)
+            seqs.append(seq)
+            seq_len += len(seq) + 1
+        
+        seq = np.frombuffer("N".join(seqs), dtype=np.uint8)
+        del seqs
+        
+        codes = np.full(256, 4, dtype=np.uint8)
+        for (code, nucleotide) in enumerate("ACGT"):
+            codes[ord(nucleotide)] = code
+        
+        pos_type = np.uint32 if len(seq) < 2**32 else np.int64
+        positions = np.arange(0, max(len(seq) - K + 1, 0), STEP, dtype=pos_type)
+        
+        kmers = np.zeros(len(positions), dtype=np.uint32)
+        invalid = np.zeros(len(positions), dtype=np.bool_)
+        for i in xrange(K):
+            nucleotides = codes[seq[positions + i]]
+            invalid |= nucleotides > 3
+            kmers = (kmers << 2) | (nucleotides & 3)
+        
+        positions = positions[~invalid]
+        kmers = kmers[~invalid]
+        
+        kmers_order = np.argsort(kmers, kind='mergesort')
+        
+        return ExactMatchIndex(kmers[kmers_order], positions[kmers_order], seq,
+                               np.array(starts, dtype=np.int64), names)
+    
+    def save(self, index_path):
+        np.save(os.path.join(index_path, "kmers.npy"), self._kmers)
+        np.save(os.path.join(index_path, "positions.npy"), self._positions)
+        np.save(os.path.join(index_path, "seq.npy"), self._seq)
+        np.save(os.path.join(index_path, "starts.npy"), self._starts)
+        np.save(os.path.join(index_path, "params.npy"), np.array([K, STEP], dtype=np.int64))
+        
+        with open(os.path.join(index_path, "names.txt"), 'w') as names_file:
+            for name in self._names:
+                names_file.write(name+"\n")
+        
+        return
+    
+    ## The index saved in index_path, or None if it was created with other K or STEP
+    @staticmethod
+    def load(index_path):
+        params = np.load(os.path.join(index_path, "params.npy")).tolist()
+        if params != [K, STEP]:
+            return None
+        
+        kmers = np.load(os.path.join(index_path, "kmers.npy"), mmap_mode='r')
+        positions = np.load(os.path.join(index_path, "positions.npy"), mmap_mode='r')
+        seq = np.load(os.path.join(index_path, "seq.npy"), mmap_mode='r')
+        starts = np.load(os.path.join(index_path, "starts.npy"))
+        
+        with open(os.path.join(index_path, "names.txt"), 'r') as names_file:
+            names = [name.strip() for name in names_file]
+        
+        return ExactMatchIndex(kmers, positions, seq, starts, names)
+    
+    ## Start positions (0-based, in the concatenated sequences) of the exact matches
+    ## of each of the sequences, or None for those which can not be searched
+    ## or whose K-mers are too frequent
+    def search(self, seqs):
+        min_len = K + STEP - 1
+        
+        # K-mers at the first STEP offsets of each sequence
+        lookup_seqs = []
+        lookup_offsets = []
+        lookup_kmers = []
+        searchable = []
+        for (seq_index, seq) in enumerate(seqs):
+            if len(seq) < min_len or seq.translate(None, "ACGT") != "":
+                searchable.append(False)
+                continue
+            
+            searchable.append(True)
+            for offset in xrange(STEP):
+                lookup_seqs.append(seq_index)
+                lookup_offsets.append(offset)
+                lookup_kmers.append(int(seq[offset:offset+K].translate(_BASE4), 4))
+        
+        candidates = [set() for seq in seqs]
+        
+        if len(lookup_kmers) > 0:
+            lookup_kmers = np.array(lookup_kmers, dtype=np.uint32)
+            first = np.searchsorted(self._kmers, lookup_kmers, side='left')
+            last = np.searchsorted(self._kmers, lookup_kmers, side='right')
+            num_positions = last - first
+            
+            for lookup in np.flatnonzero(num_positions).tolist():
+                seq_index = lookup_seqs[lookup]
+                if not searchable[seq_index]: continue
+                
+                if num_positions[lookup] > MAX_KMER_POSITIONS:
+                    searchable[seq_index] = False
+                    continue
+                
+                offset = lookup_offsets[lookup]
+                seq_candidates = candidates[seq_index]
+                for position in self._positions[first[lookup]:last[lookup]].tolist():
+                    seq_candidates.add(position - offset)
+        
+        matches = []
+        for (seq_index, seq) in enumerate(seqs):
+            if not searchable[seq_index]:
+                matches.append(None)
+                continue
+            
+            seq_len = len(seq)
+            seq_matches = []
+            for start in sorted(candidates[seq_index]):
+                if start >= 0 and self._seq[start:start+seq_len].tostring() == seq:
+                    seq_matches.append(start)
+            
+            matches.append(seq_matches)
+        
+        return matches
+    
+    ## Sequence name and 1-based position of a start position
+    def locate(self, start):
+        seq_index = int(np.searchsorted(self._starts, start, side='right')) - 1
+        return (self._names[seq_index], start - int(self._starts[seq_index]) + 1)
+
+def __check_db(exact_dbs_path, db_name):
+    
+    fasta_path = exact_dbs_path + "/" + db_name + ".fa"
+    sys.stderr.write("Checking database: "+fasta_path+" DB exists for "+ALIGNER+".\n")
+    
+    if not (os.path.exists(fasta_path) and os.path.isfile(fasta_path)):
+        raise m2pException("DB path "+fasta_path+" for "+ALIGNER+" aligner NOT FOUND.")
+    
+    return fasta_path
+
+## The index of the FASTA, loaded from index_path if it is up to date,
+## or built and saved there otherwise
+def __get_index(fasta_path, index_path, verbose = False):
+    
+    if fasta_path in _indexes:
+        return _indexes[fasta_path]
+    
+    index = None
+    
+    kmers_path = os.path.join(index_path, INDEX_FILES[0])
+    if all([os.path.exists(os.path.join(index_path, index_file)) for index_file in INDEX_FILES]) \
+       and os.path.getmtime(kmers_path) >= os.path.getmtime(fasta_path):
+        
+        if verbose: sys.stderr.write("m2p_exact: loading index "+index_path+"\n")
+        with profile_utils.timer("exact/load_index"):
+            index = ExactMatchIndex.load(index_path)
+    
+    if index == None:
+        sys.stderr.write("m2p_exact: building index of "+fasta_path+"\n")
+        with profile_utils.timer("exact/build_index"):
+            index = ExactMatchIndex.build(fasta_path)
+        
+        __save_index(index, index_path)
+    
+    _indexes[fasta_path] = index
+    
+    return index
+
+## Saves the index so that other processes never load an index partially written
+def __save_index(index, index_path):
+    
+    try:
+        file_utils.write_dir_atomic(index_path, index.save, INDEX_SUFFIX)
+    except (IOError, OSError) as e:
+        sys.stderr.write("m2p_exact: WARNING, the index could not be saved to "+index_path+": "+str(e)+"\n")
+    
+    return
+
+## Exact matches of the queries, which are always full-length alignments with 100% identity
+## and therefore pass any threshold_id and threshold_cov, and all have the best score of the query.
+def get_best_score_hits(query_fasta_path, exact_dbs_path, db_name, threshold_id, threshold_cov, verbose = False):
+    
+    if not is_available():
+        raise m2pException("m2p_exact: the "+ALIGNER+" aligner requires NumPy.")
+    
+    fasta_path = __check_db(exact_dbs_path, db_name)
+    
+    index = __get_index(fasta_path, os.path.join(exact_dbs_path, db_name+INDEX_SUFFIX), verbose)
+    
+    queries = list(alignment_utils.read_fasta_sequences(query_fasta_path))
+    
+    forward_seqs = [query_seq for (query_id, query_seq) in queries]
+    reverse_seqs = [_reverse_complement(query_seq) for query_seq in forward_seqs]
+    
+    with profile_utils.timer("exact/search"):
+        forward_matches = index.search(forward_seqs)
+        reverse_matches = index.search(reverse_seqs)
+    
+    algorithm = "exact"
+    
+    results = []
+    for (query_index, (query_id, query_seq)) in enumerate(queries):
+        query_forward = forward_matches[query_index]
+        query_reverse = reverse_matches[query_index]
+        
+        if query_forward == None or query_reverse == None: continue
+        
+        # a palindromic query (its own reverse complement) matches at the same starts on both strands
+        if query_seq == reverse_seqs[query_index]: query_reverse = []
+        
+        num_matches = len(query_forward) + len(query_reverse)
+        if num_matches == 0 or num_matches > MAX_HITS_PER_QUERY: continue
+        
+        query_len = len(query_seq)
+        align_ident = 100.0
+        query_cov = 100.0
+        align_score = (query_len - 1) * (align_ident / 100)
+        
+        for (strand, strand_matches) in [("+", query_forward), ("-", query_reverse)]:
+            for start in strand_matches:
+                (subject_id, local_position) = index.locate(start)
+                
+                result_tuple = AlignmentResult()
+                result_tuple.create_from_attributes(query_id, subject_id,
+                                                    align_ident, query_cov, align_score,
+                                                    strand, 1, query_len, local_position, local_position + query_len - 1,
+                                                    db_name, algorithm)
+                results.append(result_tuple)
+    
+    profile_utils.count("exact/queries", len(queries))
+    profile_utils.count("exact/hits", len(results))
+    
+    if verbose: sys.stderr.write("m2p_exact: "+str(len(results))+" exact hits in "+db_name+"\n")
+    
+    return results
+
+## END
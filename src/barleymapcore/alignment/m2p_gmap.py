@@ -5,18 +5,19 @@
 # Copyright (C)  2013-2014  Carlos P Cantalapiedra.
 # (terms of use can be found within the distributed LICENSE file).
 
-import sys, re, os
-from subprocess import Popen, PIPE
+import sys, re, os, math
 
 from AlignmentResult import *
 from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.alignment_utils as alignment_utils
 
 #from Aligners import SELECTION_BEST_SCORE, SELECTION_NONE
 
 ALIGNER = "GMAP"
 MAX_NUMBER_PATHS_PER_QUERY = 100
 
-def __gmap(gmap_app_path, n_threads, threshold_id, threshold_cov, query_fasta_path, gmap_dbs_path, db_name, verbose = False):
+def __check_db(gmap_dbs_path, db_name):
     
     # CPCantalapiedra 201701
     ###### Check that DB is available for this aligner
@@ -27,6 +28,12 @@ def __gmap(gmap_app_path, n_threads, threshold_id, threshold_cov, query_fasta_pa
     if not (os.path.exists(dbpathfile) and os.path.isfile(dbpathfile)):
         raise m2pException("DB path "+dbpath+" for "+ALIGNER+" aligner NOT FOUND.")
     
+    return
+
+def __gmap(gmap_app_path, n_threads, threshold_id, threshold_cov, query_fasta_path, gmap_dbs_path, db_name, verbose = False):
+    
+    __check_db(gmap_dbs_path, db_name)
+    
     # GMAP
     __command = "".join([gmap_app_path, \
                 " -t ", str(n_threads), \
@@ -48,15 +55,7 @@ def __gmap(gmap_app_path, n_threads, threshold_id, threshold_cov, query_fasta_pa
     
     retValue = 0
     FNULL = open(os.devnull, 'w')
-    if verbose:
-        p = Popen(gmap_cmd, shell=True, stdout=PIPE, stderr=sys.stderr)
-    else:
-        p = Popen(gmap_cmd, shell=True, stdout=PIPE, stderr=PIPE)
-    
-    com_list = p.communicate()
-    output = com_list[0]
-    output_err = com_list[1]
-    retValue = p.returncode
+    (output, output_err, retValue) = alignment_utils.run_aligner_command(gmap_cmd, verbose)
     
     if retValue != 0:
         if verbose:
@@ -74,6 +73,35 @@ def __gmap(gmap_app_path, n_threads, threshold_id, threshold_cov, query_fasta_pa
     
     return results
 
+## Same as __gmap, but the queries are aligned by a worker of the pool
+## (see AlignerWorkers), which reads them from its stdin and keeps running,
+## with the database loaded, for the next alignments to the same database.
+def __gmap_worker(gmap_app_path, n_threads, threshold_id, threshold_cov, query_fasta_path, gmap_dbs_path, db_name,
+                  workers_pool, verbose = False):
+    
+    __check_db(gmap_dbs_path, db_name)
+    
+    # The output of several threads must be in the order of the queries,
+    # so that the sentinel of each batch is the last one
+    if "--ordered" in alignment_utils.aligner_options(gmap_app_path+" --help"):
+        worker_threads = ["-t", str(n_threads), "--ordered"]
+    else:
+        worker_threads = ["-t", "1"]
+    
+    gmap_cmd = [gmap_app_path]+worker_threads+["-B", "0", "-n", str(MAX_NUMBER_PATHS_PER_QUERY),
+                "--min-identity="+str(float(threshold_id) / 100.0),
+                "--min-trimmed-coverage="+str(float(threshold_cov) / 100.0),
+                "-d", db_name, "-D", gmap_dbs_path]
+    
+    if verbose: sys.stderr.write("m2p_gmap: Aligning with worker '"+" ".join(gmap_cmd)+"'\n")
+    
+    worker_key = (ALIGNER, gmap_app_path, gmap_dbs_path, db_name, n_threads, float(threshold_id), float(threshold_cov))
+    output = workers_pool.align(worker_key, gmap_cmd, query_fasta_path)
+    
+    results = __compress(output, db_name)
+    
+    return results
+
 # NOTE that this method could create an different format
 # but that has been created like this for further compatibility with
 # existing GMAP -Z (compressed) format.
@@ -209,12 +237,24 @@ def __compress(output, db_name):
     
     return compressed
 
-def __filter_gmap_results(results, threshold_id, threshold_cov, db_name, verbose = False):
+def __filter_gmap_results(results, threshold_id, threshold_cov, db_name, stored = False, verbose = False):
     filtered_results = []
     
     chimera_num = 0 #chimera_dict = set([])
     filter_dict = {}
     
+    # GMAP already filters its alignments with the thresholds (see __gmap).
+    # GMAP output has 1 decimal, and so the thresholds are rounded down to 1 decimal,
+    # so that no alignment which passes the GMAP filters is filtered out.
+    # The raw hits of the store (see RawHitsStore) could have been obtained with lower thresholds,
+    # and so they are filtered with the thresholds as given.
+    if stored:
+        thres_id = float(threshold_id)
+        thres_cov = float(threshold_cov)
+    else:
+        thres_id = math.floor(float(threshold_id) * 10) / 10.0
+        thres_cov = math.floor(float(threshold_cov) * 10) / 10.0
+    
     #debug = True
     
     strand_exp = re.compile("([0-9]+)..([0-9]+)")
@@ -241,6 +281,9 @@ def __filter_gmap_results(results, threshold_id, threshold_cov, db_name, verbose
         align_ident = float(line_data[6])
         query_cov = float(line_data[5])
         
+        if align_ident < thres_id or query_cov < thres_cov:
+            continue
+        
         strand = line_data[10]
         
         strand = line_data[10]
@@ -340,17 +383,39 @@ def __filter_gmap_results(results, threshold_id, threshold_cov, db_name, verbose
     return filtered_results
 
 def get_best_score_hits(gmap_app_path, n_threads, query_fasta_path, gmap_dbs_path, db_name, \
-             threshold_id, threshold_cov, verbose = False):
-    results = []
+             threshold_id, threshold_cov, verbose = False, workers_pool = None, hits_store = None):
+    results = None
     
     if verbose: sys.stderr.write("m2p_gmap: "+query_fasta_path+" against "+db_name+"\n")
     
-    results = __gmap(gmap_app_path, n_threads, threshold_id, threshold_cov, query_fasta_path,
-                     gmap_dbs_path, db_name, verbose)
+    # raw hits of a previous alignment of the same queries (see RawHitsStore)
+    if hits_store != None:
+        results = hits_store.load(ALIGNER, gmap_app_path, gmap_dbs_path, db_name, query_fasta_path, threshold_id, threshold_cov)
+    
+    stored = results != None
+    
+    if results == None:
+        with profile_utils.timer("align/gmap/"+db_name):
+            if workers_pool != None:
+                results = __gmap_worker(gmap_app_path, n_threads, threshold_id, threshold_cov, query_fasta_path,
+                                        gmap_dbs_path, db_name, workers_pool, verbose)
+            else:
+                results = __gmap(gmap_app_path, n_threads, threshold_id, threshold_cov, query_fasta_path,
+                                 gmap_dbs_path, db_name, verbose)
+        
+        # empty raw hits are not stored, since they could also come from an error of the aligner
+        if hits_store != None and len(results) > 0:
+            hits_store.save(ALIGNER, gmap_app_path, gmap_dbs_path, db_name, query_fasta_path, threshold_id, threshold_cov, results)
+    
+    profile_utils.count("databases/"+db_name+"/gmap/raw_hits", len(results))
     
     if verbose: sys.stderr.write("m2p_gmap: raw results --> "+str(len(results))+"\n")
     if len(results)>0:
-        results = __filter_gmap_results(results, threshold_id, threshold_cov, db_name, verbose)
+        with profile_utils.timer("filter/gmap/"+db_name):
+            results = __filter_gmap_results(results, threshold_id, threshold_cov, db_name, stored, verbose)
+    
+    profile_utils.count("databases/"+db_name+"/gmap/hits", len(results))
+    
     if verbose: sys.stderr.write("m2p_gmap: pass-filter results --> "+str(len(results))+"\n")
     #sys.stderr.write(str(results)+"\n")
     
@@ -6,10 +6,12 @@
 # (terms of use can be found within the distributed LICENSE file).
 
 import sys, os
-from subprocess import Popen, PIPE
 
 from barleymapcore.utils.alignment_utils import load_fasta_lengths
+import barleymapcore.utils.alignment_utils as alignment_utils
 from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.tabular_utils as tabular_utils
 from AlignmentResult import *
 
 #from Aligners import SELECTION_BEST_SCORE, SELECTION_NONE
@@ -25,8 +27,28 @@ ALIGN_SSTART = 8
 ALIGN_SEND = 9
 ALIGN_SCORE = 11
 # ALIGN_QLEN = there is no query len in HS-Blastn tabular results
+NUM_FIELDS = 12
 
-def __hs_blast(hsblastn_app_path, n_threads, query_fasta_path, hsblastn_dbs_path, db_name, verbose = False):
+## Identity filter of HS-Blastn, if its version supports it
+## (see alignment_utils.blast_prefilter_thresholds). The hits are filtered
+## by barleymap afterwards anyway (see __filter_blast_results).
+def __prefilter_options(hsblastn_app_path, threshold_id, threshold_cov, verbose = False):
+    prefilter_options = []
+    
+    hsblastn_options = alignment_utils.aligner_options(hsblastn_app_path+" align -help")
+    (prefilter_id, prefilter_cov) = alignment_utils.blast_prefilter_thresholds(threshold_id, threshold_cov)
+    
+    if "-perc_identity" in hsblastn_options:
+        prefilter_options.append("-perc_identity "+str(prefilter_id))
+    
+    if "-qcov_hsp_perc" in hsblastn_options:
+        prefilter_options.append("-qcov_hsp_perc "+str(prefilter_cov))
+    
+    if verbose: sys.stderr.write(os.path.basename(__file__)+": Prefilter options: '"+" ".join(prefilter_options)+"'\n")
+    
+    return " ".join(prefilter_options)
+
+def __hs_blast(hsblastn_app_path, n_threads, threshold_id, threshold_cov, query_fasta_path, hsblastn_dbs_path, db_name, verbose = False):
     results = []
     
     # CPCantalapiedra 201701
@@ -42,6 +64,7 @@ def __hs_blast(hsblastn_app_path, n_threads, query_fasta_path, hsblastn_dbs_path
     blast_command = " ".join([hsblastn_app_path, " align ", \
                             " -num_threads ", str(n_threads), \
                 "-dust no ", \
+                __prefilter_options(hsblastn_app_path, threshold_id, threshold_cov, verbose), \
                 '-outfmt 6'])
                 #'-outfmt \"6 qseqid qlen sseqid slen length qstart qend sstart send bitscore evalue pident mismatch gapopen\"'])
     
@@ -54,15 +77,7 @@ def __hs_blast(hsblastn_app_path, n_threads, query_fasta_path, hsblastn_dbs_path
     
     retValue = 0
     FNULL = open(os.devnull, 'w')
-    if verbose:
-        p = Popen(blast_cmd, shell=True, stdout=PIPE, stderr=sys.stderr)
-    else:
-        p = Popen(blast_cmd, shell=True, stdout=PIPE, stderr=PIPE)
-    
-    com_list = p.communicate()
-    output = com_list[0]
-    output_err = com_list[1]
-    retValue = p.returncode
+    (output, output_err, retValue) = alignment_utils.run_aligner_command(blast_cmd, verbose)
     
     if retValue != 0:
         if verbose:
@@ -82,8 +97,69 @@ def __hs_blast(hsblastn_app_path, n_threads, query_fasta_path, hsblastn_dbs_path
     
     return results
 
+def __create_result(line_data, align_ident, query_cov, db_name, algorithm):
+    
+    query_id = line_data[ALIGN_QUERY]
+    subject_id = line_data[ALIGN_SUBJECT]
+    align_score = float(line_data[ALIGN_SCORE])
+    
+    # strand and local position
+    if line_data[ALIGN_SSTART]>line_data[ALIGN_SEND]:
+        strand = "-"
+        local_position = long(line_data[ALIGN_SEND])
+        end_position = long(line_data[ALIGN_SSTART])
+    else:
+        strand = "+"
+        local_position = long(line_data[ALIGN_SSTART])
+        end_position = long(line_data[ALIGN_SEND])
+    
+    qstart_pos = long(line_data[ALIGN_QSTART])
+    qend_pos = long(line_data[ALIGN_QEND])
+    
+    result_tuple = AlignmentResult()
+    result_tuple.create_from_attributes(query_id, subject_id,
+                                    align_ident, query_cov, align_score,
+                                    strand, qstart_pos, qend_pos, local_position, end_position,
+                                    db_name, algorithm)
+    
+    return result_tuple
+
 def __filter_blast_results(results, threshold_id, threshold_cov, db_name, qlen_dict, verbose = False):
     
+    if tabular_utils.is_available() and len(results) >= tabular_utils.MIN_ROWS:
+        filtered_results = __filter_blast_results_arrays(results, threshold_id, threshold_cov, db_name, qlen_dict, verbose)
+        
+        if filtered_results != None:
+            return filtered_results
+    
+    return __filter_blast_results_lines(results, threshold_id, threshold_cov, db_name, qlen_dict, verbose)
+
+## Filters the lines in bulk (see tabular_utils),
+## creating AlignmentResults only for those which pass the filters.
+## Returns None if the lines are not in the expected format.
+def __filter_blast_results_arrays(results, threshold_id, threshold_cov, db_name, qlen_dict, verbose = False):
+    
+    filtered_rows = tabular_utils.filter_best_score_rows(results, NUM_FIELDS, ALIGN_QUERY, ALIGN_PIDENT, ALIGN_LENGTH, ALIGN_SCORE,
+                                                         threshold_id, threshold_cov, qlen_dict = qlen_dict)
+    
+    if filtered_rows == None: return None
+    
+    filtered_results = []
+    
+    algorithm = "hsblastn"
+    
+    for row in filtered_rows:
+        line_data = results[row].split("\t")
+        
+        align_ident = float(line_data[ALIGN_PIDENT])
+        query_cov = (int(line_data[ALIGN_LENGTH])/float(qlen_dict[line_data[ALIGN_QUERY]]))*100
+        
+        filtered_results.append(__create_result(line_data, align_ident, query_cov, db_name, algorithm))
+    
+    return filtered_results
+
+def __filter_blast_results_lines(results, threshold_id, threshold_cov, db_name, qlen_dict, verbose = False):
+    
     filtered_results = []
     
     # assert: if an int is passed to the method, the comparison fails
@@ -115,27 +191,9 @@ def __filter_blast_results(results, threshold_id, threshold_cov, db_name, qlen_d
         if query_cov < thres_cov:
             continue
         
-        subject_id = line_data[ALIGN_SUBJECT]
         align_score = float(line_data[ALIGN_SCORE])
         
-        # strand and local position
-        if line_data[ALIGN_SSTART]>line_data[ALIGN_SEND]:
-            strand = "-"
-            local_position = long(line_data[ALIGN_SEND])
-            end_position = long(line_data[ALIGN_SSTART])
-        else:
-            strand = "+"
-            local_position = long(line_data[ALIGN_SSTART])
-            end_position = long(line_data[ALIGN_SEND])
-        
-        qstart_pos = long(line_data[ALIGN_QSTART])
-        qend_pos = long(line_data[ALIGN_QEND])
-        
-        result_tuple = AlignmentResult()
-        result_tuple.create_from_attributes(query_id, subject_id,
-                                        align_ident, query_cov, align_score,
-                                        strand, qstart_pos, qend_pos, local_position, end_position,
-                                        db_name, algorithm)
+        result_tuple = __create_result(line_data, align_ident, query_cov, db_name, algorithm)
         
         # For a given DB, keep always the best score
         #if selection == SELECTION_BEST_SCORE:
@@ -161,17 +219,34 @@ def __filter_blast_results(results, threshold_id, threshold_cov, db_name, qlen_d
     return filtered_results
 
 def get_best_score_hits(hsblastn_app_path, n_threads, query_fasta_path, hsblastn_dbs_path, db_name, \
-                        threshold_id, threshold_cov, verbose = False):
+                        threshold_id, threshold_cov, verbose = False, hits_store = None):
+    results = None
     
     if verbose: sys.stderr.write(os.path.basename(__file__)+": "+query_fasta_path+" against "+db_name+"\n")
     
-    results = __hs_blast(hsblastn_app_path, n_threads, query_fasta_path, hsblastn_dbs_path, db_name, verbose)
+    # raw hits of a previous alignment of the same queries (see RawHitsStore)
+    if hits_store != None:
+        results = hits_store.load(ALIGNER, hsblastn_app_path, hsblastn_dbs_path, db_name, query_fasta_path, threshold_id, threshold_cov)
+    
+    if results == None:
+        with profile_utils.timer("align/hsblastn/"+db_name):
+            results = __hs_blast(hsblastn_app_path, n_threads, threshold_id, threshold_cov,
+                                 query_fasta_path, hsblastn_dbs_path, db_name, verbose)
+        
+        # empty raw hits are not stored, since they could also come from an error of the aligner
+        if hits_store != None and len(results) > 0:
+            hits_store.save(ALIGNER, hsblastn_app_path, hsblastn_dbs_path, db_name, query_fasta_path, threshold_id, threshold_cov, results)
+    
+    profile_utils.count("databases/"+db_name+"/hsblastn/raw_hits", len(results))
     
     if verbose: sys.stderr.write(os.path.basename(__file__)+": raw results --> "+str(len(results))+"\n")
     
     if len(results)>0:
-        qlen_dict = load_fasta_lengths(query_fasta_path)
-        results = __filter_blast_results(results, threshold_id, threshold_cov, db_name, qlen_dict, verbose)
+        with profile_utils.timer("filter/hsblastn/"+db_name):
+            qlen_dict = load_fasta_lengths(query_fasta_path)
+            results = __filter_blast_results(results, threshold_id, threshold_cov, db_name, qlen_dict, verbose)
+    
+    profile_utils.count("databases/"+db_name+"/hsblastn/hits", len(results))
         
     if verbose: sys.stderr.write(os.path.basename(__file__)+": pass-filter results --> "+str(len(results))+"\n")
     #sys.stderr.write(str(len(results))+"\n")
@@ -9,13 +9,35 @@ import sys, os
 from subprocess import Popen, PIPE
 
 from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.tabular_utils as tabular_utils
+import barleymapcore.utils.alignment_utils as alignment_utils
 from AlignmentResult import *
 
 #from Aligners import SELECTION_BEST_SCORE, SELECTION_NONE
 
 ALIGNER = "Blastn(SplitBlast)-Megablast"
 
-def __split_blast(split_blast_path, blast_app_path, n_threads, query_fasta_path, blast_dbs_path, db_name, verbose = False):
+## Identity and query coverage filters of blast, if the blastn version supports them
+## (see alignment_utils.blast_prefilter_thresholds). The hits are filtered
+## by barleymap afterwards anyway (see __filter_blast_results).
+def __prefilter_options(blast_app_path, threshold_id, threshold_cov, verbose = False):
+    prefilter_options = []
+    
+    blast_options = alignment_utils.aligner_options(blast_app_path+" -help")
+    (prefilter_id, prefilter_cov) = alignment_utils.blast_prefilter_thresholds(threshold_id, threshold_cov)
+    
+    if "-perc_identity" in blast_options:
+        prefilter_options.append("-perc_identity "+str(prefilter_id))
+    
+    if "-qcov_hsp_perc" in blast_options:
+        prefilter_options.append("-qcov_hsp_perc "+str(prefilter_cov))
+    
+    if verbose: sys.stderr.write("m2p_split_blast: Prefilter options: '"+" ".join(prefilter_options)+"'\n")
+    
+    return " ".join(prefilter_options)
+
+def __split_blast(split_blast_path, blast_app_path, n_threads, threshold_id, threshold_cov, query_fasta_path, blast_dbs_path, db_name, verbose = False):
     results = []
     
     # CPCantalapiedra 201701
@@ -46,6 +68,7 @@ def __split_blast(split_blast_path, blast_app_path, n_threads, query_fasta_path,
     ###### Split blast
     blast_command = " ".join([split_blast_path+"split_blast.pl", str(n_threads), str(split_blast_bins), blast_app_path, \
                 "-dust no -soft_masking false -task megablast", \
+                __prefilter_options(blast_app_path, threshold_id, threshold_cov, verbose), \
                 '-outfmt \\"6 qseqid qlen sseqid slen length qstart qend sstart send bitscore evalue pident mismatch gapopen\\"'])
     
     blast_db = "".join(["-db ", dbpath]) # blast_db = "".join(["-db ", blast_dbs_path, db_name , ".fa"]) # 
@@ -57,15 +80,7 @@ def __split_blast(split_blast_path, blast_app_path, n_threads, query_fasta_path,
     
     retValue = 0
     FNULL = open(os.devnull, 'w')
-    if verbose:
-        p = Popen(blast_cmd, shell=True, stdout=PIPE, stderr=sys.stderr)
-    else:
-        p = Popen(blast_cmd, shell=True, stdout=PIPE, stderr=PIPE)
-    
-    com_list = p.communicate()
-    output = com_list[0]
-    output_err = com_list[1]
-    retValue = p.returncode
+    (output, output_err, retValue) = alignment_utils.run_aligner_command(blast_cmd, verbose)
     
     if retValue != 0:
         if verbose:
@@ -86,8 +101,77 @@ def __split_blast(split_blast_path, blast_app_path, n_threads, query_fasta_path,
     
     return results
 
+# Fields of the -outfmt 6 lines (see __split_blast)
+NUM_FIELDS = 14
+ALIGN_QUERY = 0
+ALIGN_QLEN = 1
+ALIGN_LENGTH = 4
+ALIGN_SCORE = 9
+ALIGN_PIDENT = 11
+
+def __create_result(line_data, align_ident, query_cov, db_name, algorithm):
+    
+    query_id = line_data[0]
+    subject_id = line_data[2]
+    align_score = float(line_data[9])
+    
+    # strand and local position
+    if line_data[7]>line_data[8]:
+        strand = "-"
+        local_position = long(line_data[8])
+        end_position = long(line_data[7])
+    else:
+        strand = "+"
+        local_position = long(line_data[7])
+        end_position = long(line_data[8])
+    
+    qstart_pos = long(line_data[5])
+    qend_pos = long(line_data[6])
+    
+    result_tuple = AlignmentResult()
+    result_tuple.create_from_attributes(query_id, subject_id,
+                                        align_ident, query_cov, align_score,
+                                        strand, qstart_pos, qend_pos, local_position, end_position,
+                                        db_name, algorithm)
+    
+    return result_tuple
+
 def __filter_blast_results(results, threshold_id, threshold_cov, db_name, verbose = False):
     
+    if tabular_utils.is_available() and len(results) >= tabular_utils.MIN_ROWS:
+        filtered_results = __filter_blast_results_arrays(results, threshold_id, threshold_cov, db_name, verbose)
+        
+        if filtered_results != None:
+            return filtered_results
+    
+    return __filter_blast_results_lines(results, threshold_id, threshold_cov, db_name, verbose)
+
+## Filters the lines in bulk (see tabular_utils),
+## creating AlignmentResults only for those which pass the filters.
+## Returns None if the lines are not in the expected format.
+def __filter_blast_results_arrays(results, threshold_id, threshold_cov, db_name, verbose = False):
+    
+    filtered_rows = tabular_utils.filter_best_score_rows(results, NUM_FIELDS, ALIGN_QUERY, ALIGN_PIDENT, ALIGN_LENGTH, ALIGN_SCORE,
+                                                         threshold_id, threshold_cov, col_query_len = ALIGN_QLEN)
+    
+    if filtered_rows == None: return None
+    
+    filtered_results = []
+    
+    algorithm = "blastn"
+    
+    for row in filtered_rows:
+        line_data = results[row].split("\t")
+        
+        align_ident = float(line_data[ALIGN_PIDENT])
+        query_cov = (int(line_data[ALIGN_LENGTH])/float(int(line_data[ALIGN_QLEN])))*100
+        
+        filtered_results.append(__create_result(line_data, align_ident, query_cov, db_name, algorithm))
+    
+    return filtered_results
+
+def __filter_blast_results_lines(results, threshold_id, threshold_cov, db_name, verbose = False):
+    
     filtered_results = []
     
     # assert: if an int is passed to the method, the comparison fails
@@ -115,27 +199,9 @@ def __filter_blast_results(results, threshold_id, threshold_cov, db_name, verbos
             continue
         
         query_id = line_data[0]
-        subject_id = line_data[2]
         align_score = float(line_data[9])
         
-        # strand and local position
-        if line_data[7]>line_data[8]:
-            strand = "-"
-            local_position = long(line_data[8])
-            end_position = long(line_data[7])
-        else:
-            strand = "+"
-            local_position = long(line_data[7])
-            end_position = long(line_data[8])
-        
-        qstart_pos = long(line_data[5])
-        qend_pos = long(line_data[6])
-        
-        result_tuple = AlignmentResult()
-        result_tuple.create_from_attributes(query_id, subject_id,
-                                            align_ident, query_cov, align_score,
-                                            strand, qstart_pos, qend_pos, local_position, end_position,
-                                            db_name, algorithm)
+        result_tuple = __create_result(line_data, align_ident, query_cov, db_name, algorithm)
         
         # For a given DB, keep always the best score
         if query_id in filter_dict:
@@ -160,16 +226,33 @@ def __filter_blast_results(results, threshold_id, threshold_cov, db_name, verbos
     return filtered_results
 
 def get_best_score_hits(split_blast_path, blast_app_path, n_threads, query_fasta_path, blast_dbs_path, db_name, \
-                        threshold_id, threshold_cov, verbose = False):
+                        threshold_id, threshold_cov, verbose = False, hits_store = None):
+    results = None
     
     if verbose: sys.stderr.write("m2p_split_blast: "+query_fasta_path+" against "+db_name+"\n")
     
-    results = __split_blast(split_blast_path, blast_app_path, n_threads, query_fasta_path, blast_dbs_path, db_name, verbose)
+    # raw hits of a previous alignment of the same queries (see RawHitsStore)
+    if hits_store != None:
+        results = hits_store.load(ALIGNER, blast_app_path, blast_dbs_path, db_name, query_fasta_path, threshold_id, threshold_cov)
+    
+    if results == None:
+        with profile_utils.timer("align/blastn/"+db_name):
+            results = __split_blast(split_blast_path, blast_app_path, n_threads, threshold_id, threshold_cov,
+                                    query_fasta_path, blast_dbs_path, db_name, verbose)
+        
+        # empty raw hits are not stored, since they could also come from an error of the aligner
+        if hits_store != None and len(results) > 0:
+            hits_store.save(ALIGNER, blast_app_path, blast_dbs_path, db_name, query_fasta_path, threshold_id, threshold_cov, results)
+    
+    profile_utils.count("databases/"+db_name+"/blastn/raw_hits", len(results))
     
     if verbose: sys.stderr.write("m2p_split_blast: raw results --> "+str(len(results))+"\n")
     
     if len(results)>0:
-        results = __filter_blast_results(results, threshold_id, threshold_cov, db_name, verbose)
+        with profile_utils.timer("filter/blastn/"+db_name):
+            results = __filter_blast_results(results, threshold_id, threshold_cov, db_name, verbose)
+    
+    profile_utils.count("databases/"+db_name+"/blastn/hits", len(results))
         
     if verbose: sys.stderr.write("m2p_split_blast: pass-filter results --> "+str(len(results))+"\n")
     #sys.stderr.write(str(len(results))+"\n")
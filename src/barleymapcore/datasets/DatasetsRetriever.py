@@ -5,12 +5,14 @@
 # Copyright (C)  2017  Carlos P Cantalapiedra.
 # (terms of use can be found within the distributed LICENSE file).
 
-import sys, os
+import sys, os, time
 
 from barleymapcore.db.DatasetsConfig import DatasetsConfig
 from barleymapcore.maps.reader.MappingsParser import MappingsParser
 from barleymapcore.maps.enrichment.FeatureMapping import FeaturesFactory
 from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.search_stats as search_stats
 
 class DatasetsRetriever(object):
     
@@ -101,13 +103,21 @@ class DatasetsRetriever(object):
         # Load list of queries to search for
         initial_num_queries = 0
         query_ids_dict = {}
-        for query_ids in open(query_ids_path, 'r'):
-            query_ids_dict[query_ids.strip()] = 0
-            initial_num_queries += 1
+        with profile_utils.timer("query/parse"):
+            for query_ids in open(query_ids_path, 'r'):
+                query_ids_dict[query_ids.strip()] = 0
+                initial_num_queries += 1
         
         num_results = 0
         num_queries_left = initial_num_queries
         
+        # The datasets which find more queries per second first, so that the search stops sooner.
+        # Note that a query is searched only until it is found, and so the order of the datasets
+        # changes the results of those queries found in more than one of them
+        if search_stats.is_adaptive():
+            dataset_list = search_stats.sort_by_yield(search_stats.DATASETS, dataset_list)
+            if self._verbose: sys.stderr.write("DatasetsRetriever: datasets order "+",".join(dataset_list)+"\n")
+        
         for dataset in dataset_list:
             
             sys.stderr.write("\t dataset: "+dataset+"\n")
@@ -169,8 +179,15 @@ class DatasetsRetriever(object):
                 if self._verbose: sys.stderr.write("\t\t parsing dataset file\n")
                 
                 mappings_parser = MappingsParser()
-                map_results = mappings_parser.parse_mapping_file_by_id(temp_query_dict, dataset_map_path, map_config, chrom_dict,
-                                                      multiple_param, dataset_synonyms, test_set)
+                ini_time = time.time()
+                with profile_utils.timer("datasets/"+dataset+"/by_id"):
+                    map_results = mappings_parser.parse_mapping_file_by_id(temp_query_dict, dataset_map_path, map_config, chrom_dict,
+                                                          multiple_param, dataset_synonyms, test_set)
+                
+                # (test_set is emptied by the parser as queries are found)
+                search_stats.record(search_stats.DATASETS, dataset, len(temp_query_dict),
+                                    len([query for query in temp_query_dict if temp_query_dict[query] != 0]),
+                                    time.time() - ini_time)
                 
             else:
                 # TODO refactor to handled exception
@@ -237,7 +254,8 @@ class DatasetsRetriever(object):
                 if self._verbose: sys.stderr.write("DatasetsRetriever: loading features from map data: "+dataset_map_path+"\n")
                 
                 mappings_parser = MappingsParser()
-                mapping_results_list = mappings_parser.parse_mapping_file_by_pos(map_intervals, dataset_map_path, chrom_dict, map_config, map_sort_by)
+                with profile_utils.timer("datasets/"+dataset+"/by_pos"):
+                    mapping_results_list = mappings_parser.parse_mapping_file_by_pos(map_intervals, dataset_map_path, chrom_dict, map_config, map_sort_by)
                 
                 for mapping_result in mapping_results_list:
                     marker_id = mapping_result.get_marker_id()
@@ -288,8 +306,9 @@ class DatasetsRetriever(object):
                 if self._verbose: sys.stderr.write("DatasetsRetriever: loading features from map data: "+dataset_map_path+"\n")
                 
                 mappings_parser = MappingsParser()
-                featured_map_intervals = mappings_parser.parse_mapping_file_on_pos(map_intervals, dataset_map_path, chrom_dict, map_config, map_sort_by,
-                                                                                   dataset, dataset_name, feature_type)
+                with profile_utils.timer("datasets/"+dataset+"/on_pos"):
+                    featured_map_intervals = mappings_parser.parse_mapping_file_on_pos(map_intervals, dataset_map_path, chrom_dict, map_config, map_sort_by,
+                                                                                       dataset, dataset_name, feature_type)
         
         return featured_map_intervals
 
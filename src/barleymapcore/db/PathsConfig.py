@@ -28,9 +28,11 @@ class PathsConfig(object):
     _GMAPL_APP_PATH = "gmapl_app_path"
     _HSBLASTN_APP_PATH = "hsblastn_app_path"
     _HSBLASTN_DBS_PATH = "hsblastn_dbs_path"
+    _EXACT_DBS_PATH = "exact_dbs_path" # optional
     
     # Aux dirs
     _TMP_FILES_PATH = "tmp_files_path"
+    _JOBS_PATH = "jobs_path" # optional
     
     _CITATION = "citation"
     _STDALONE_APP = "stdalone_app"
@@ -40,6 +42,7 @@ class PathsConfig(object):
     _genmap_path = ""
     _split_blast_path = ""
     _tmp_files_path = ""
+    _jobs_path = ""
     _datasets_path = ""
     _maps_path = ""
     _annot_path = ""
@@ -50,6 +53,7 @@ class PathsConfig(object):
     _gmapl_app_path = ""
     _hsblastn_app_path = ""
     _hsblastn_dbs_path = ""
+    _exact_dbs_path = ""
     _citation = ""
     _stdalone_app = ""
     
@@ -64,6 +68,7 @@ class PathsConfig(object):
         self._genmap_path = self._config_path_dict[self._GENMAP_PATH]
         self._split_blast_path = self._config_path_dict[self._SPLIT_BLAST_PATH]
         self._tmp_files_path = self._config_path_dict[self._TMP_FILES_PATH]
+        self._jobs_path = self._config_path_dict.get(self._JOBS_PATH, "")
         self._datasets_path = self._config_path_dict[self._DATASETS_PATH]
         self._maps_path = self._config_path_dict[self._MAPS_PATH]
         self._annot_path = self._config_path_dict[self._ANNOTATION_PATH]
@@ -74,6 +79,7 @@ class PathsConfig(object):
         self._gmapl_app_path = self._config_path_dict[self._GMAPL_APP_PATH]
         self._hsblastn_app_path = self._config_path_dict[self._HSBLASTN_APP_PATH]
         self._hsblastn_dbs_path = self._config_path_dict[self._HSBLASTN_DBS_PATH]
+        self._exact_dbs_path = self._config_path_dict.get(self._EXACT_DBS_PATH, "")
         self._citation = self._config_path_dict[self._CITATION]
         self._stdalone_app = self._config_path_dict[self._STDALONE_APP]
         
@@ -84,6 +90,7 @@ class PathsConfig(object):
                              self._GENMAP_PATH:self._genmap_path,
                              self._SPLIT_BLAST_PATH:self._split_blast_path,
                              self._TMP_FILES_PATH:self._tmp_files_path,
+                             self._JOBS_PATH:self._jobs_path,
                              self._DATASETS_PATH:self._datasets_path,
                              self._MAPS_PATH:self._maps_path,
                              self._ANNOTATION_PATH:self._annot_path,
@@ -94,6 +101,7 @@ class PathsConfig(object):
                              self._GMAPL_APP_PATH:self._gmapl_app_path,
                              self._HSBLASTN_APP_PATH:self._hsblastn_app_path,
                              self._HSBLASTN_DBS_PATH:self._hsblastn_dbs_path,
+                             self._EXACT_DBS_PATH:self._exact_dbs_path,
                              self._CITATION:self._citation,
                              self._STDALONE_APP:self._stdalone_app}
         
@@ -108,6 +116,7 @@ class PathsConfig(object):
         paths_config._genmap_path = config_path_dict[paths_config._GENMAP_PATH]
         paths_config._split_blast_path = config_path_dict[paths_config._SPLIT_BLAST_PATH]
         paths_config._tmp_files_path = config_path_dict[paths_config._TMP_FILES_PATH]
+        paths_config._jobs_path = config_path_dict.get(paths_config._JOBS_PATH, "")
         paths_config._datasets_path = config_path_dict[paths_config._DATASETS_PATH]
         paths_config._maps_path = config_path_dict[paths_config._MAPS_PATH]
         paths_config._annot_path = config_path_dict[paths_config._ANNOTATION_PATH]
@@ -118,6 +127,7 @@ class PathsConfig(object):
         paths_config._gmapl_app_path = config_path_dict[paths_config._GMAPL_APP_PATH]
         paths_config._hsblastn_app_path = config_path_dict[paths_config._HSBLASTN_APP_PATH]
         paths_config._hsblastn_dbs_path = config_path_dict[paths_config._HSBLASTN_DBS_PATH]
+        paths_config._exact_dbs_path = config_path_dict.get(paths_config._EXACT_DBS_PATH, "")
         paths_config._citation = config_path_dict[paths_config._CITATION]
         paths_config._stdalone_app = config_path_dict[paths_config._STDALONE_APP]
         
@@ -138,6 +148,9 @@ class PathsConfig(object):
     def get_tmp_files_path(self):
         return self._tmp_files_path
     
+    def get_jobs_path(self):
+        return self._jobs_path
+    
     def get_datasets_path(self):
         return self._datasets_path
     
@@ -168,6 +181,9 @@ class PathsConfig(object):
     def get_hsblastn_dbs_path(self):
         return self._hsblastn_dbs_path
     
+    def get_exact_dbs_path(self):
+        return self._exact_dbs_path
+    
     # Other
     def get_citation(self):
         return self._citation
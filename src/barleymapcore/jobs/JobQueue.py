@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# JobQueue.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Persistent queue of jobs of the bmap_* tools (see bmap_jobs), so that a client
+## (e.g. the web front end) submits a job and gets its result later, instead of
+## waiting for the tool, while a pool of workers (see JobWorkers) runs the jobs.
+##
+## The queue is a directory with an SQLite database (jobs.db) with the state of each job,
+## the input files of the jobs waiting to be run (inputs/) and their results (results/,
+## the output and the log of the tool). Every process (clients and workers) opens the
+## database on its own, and a job is taken by only one worker, in a single transaction.
+##
+## The jobs are run by priority (lower first), and then in order of submission.
+## By default, the lookups of identifiers and positions (bmap_find, bmap_locate)
+## have higher priority than the alignments (bmap_align), which take much longer.
+## The result of a job is kept for its TTL (seconds) after it finishes,
+## and then removed by purge_expired(), keeping only its state (expired).
+##
+## The options of the jobs are limited to those of TOOLS_OPTIONS, so that a client
+## can not make the tools read or write other files (e.g. --hit-store, --resume, --profile).
+
+import sys, os, time, uuid, shutil, json, sqlite3, signal
+
+from barleymapcore.m2p_exception import m2pException
+
+DB_FILE = "jobs.db"
+INPUTS_DIR = "inputs"
+RESULTS_DIR = "results"
+
+OUTPUT_SUFFIX = ".out"
+LOG_SUFFIX = ".log"
+
+## Status of the jobs
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_EXPIRED = "expired"
+
+## Tools which can be run, and their default priority
+TOOL_ALIGN = "bmap_align"
+TOOL_FIND = "bmap_find"
+TOOL_LOCATE = "bmap_locate"
+
+PRIORITY_LOOKUP = 0
+PRIORITY_ALIGNMENT = 10
+
+TOOLS_PRIORITIES = {TOOL_FIND:PRIORITY_LOOKUP,
+                    TOOL_LOCATE:PRIORITY_LOOKUP,
+                    TOOL_ALIGN:PRIORITY_ALIGNMENT}
+
+## Options which the jobs of each tool can have
+_LOOKUP_OPTIONS = ["--maps", "--sort", "-k", "--show-multiples", "-a", "--anchored", "-g", "--genes",
+                   "-m", "--markers", "-d", "--show-all-features", "-o", "--show-on-markers", "--extend",
+                   "-u", "--show-unmapped", "-c", "--collapse", "-f", "--shard", "-v", "--verbose"]
+
+_ALIGN_OPTIONS = ["--aligner", "--thres-id", "--thres-cov", "--threads", "-b", "--best-score",
+                  "--chunk-size", "--aligner-workers", "--prescreen", "--route-by-length", "--speculative"]
+
+TOOLS_OPTIONS = {TOOL_FIND:_LOOKUP_OPTIONS,
+                 TOOL_LOCATE:_LOOKUP_OPTIONS,
+                 TOOL_ALIGN:_LOOKUP_OPTIONS+_ALIGN_OPTIONS}
+
+# Seconds a result is kept after its job finishes
+DEFAULT_RESULT_TTL = 24 * 60 * 60
+
+# Seconds to wait for the lock of the database
+DB_TIMEOUT = 60
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS jobs (
+                 job_id TEXT PRIMARY KEY,
+                 tool TEXT NOT NULL,
+                 args TEXT NOT NULL,
+                 priority INTEGER NOT NULL,
+                 status TEXT NOT NULL,
+                 result_ttl REAL NOT NULL,
+                 submitted REAL NOT NULL,
+                 started REAL,
+                 finished REAL,
+                 expires REAL,
+                 worker_pid INTEGER,
+                 tool_pgid INTEGER,
+                 return_code INTEGER);
+             CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (status, priority, submitted);"""
+
+## The fields of the state of a job returned by get_status()
+_STATUS_FIELDS = ["job_id", "tool", "args", "priority", "status", "result_ttl",
+                  "submitted", "started", "finished", "expires", "worker_pid", "tool_pgid", "return_code"]
+
+class JobQueue(object):
+    
+    _queue_path = ""
+    _verbose = False
+    
+    _conn = None
+    
+    def __init__(self, queue_path, verbose = False):
+        self._queue_path = queue_path
+        self._verbose = verbose
+        
+        for queue_dir in [queue_path, self._get_inputs_path(), self._get_results_path()]:
+            if not os.path.isdir(queue_dir):
+                try:
+                    os.makedirs(queue_dir)
+                except OSError as e:
+                    if not os.path.isdir(queue_dir):
+                        raise m2pException("JobQueue: could not create the directory "+queue_dir+": "+str(e))
+        
+        # (autocommit; the transactions are started explicitly)
+        self._conn = sqlite3.connect(os.path.join(queue_path, DB_FILE), timeout = DB_TIMEOUT, isolation_level = None)
+        self._conn.executescript(_SCHEMA)
+        
+        # (queues created by previous versions)
+        columns = [column[1] for column in self._conn.execute("PRAGMA table_info(jobs)").fetchall()]
+        if not "tool_pgid" in columns:
+            try:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN tool_pgid INTEGER")
+            except sqlite3.OperationalError:
+                pass # added meanwhile by another process
+    
+    def _log(self, msg):
+        sys.stderr.write("JobQueue: "+msg+"\n")
+    
+    def close(self):
+        self._conn.close()
+    
+    def get_queue_path(self):
+        return self._queue_path
+    
+    def _get_inputs_path(self):
+        return os.path.join(self._queue_path, INPUTS_DIR)
+    
+    def _get_results_path(self):
+        return os.path.join(self._queue_path, RESULTS_DIR)
+    
+    def get_input_path(self, job_id):
+        return os.path.join(self._get_inputs_path(), job_id)
+    
+    def get_output_path(self, job_id):
+        return os.path.join(self._get_results_path(), job_id+OUTPUT_SUFFIX)
+    
+    def get_log_path(self, job_id):
+        return os.path.join(self._get_results_path(), job_id+LOG_SUFFIX)
+    
+    ############ Client API
+    
+    ## Adds a job of the tool (TOOL_ALIGN, TOOL_FIND or TOOL_LOCATE) with the given options
+    ## (e.g. ["--maps=MorexGenome", "-u"]) for the queries of input_path, which is copied to the queue.
+    ## Returns the ID of the job.
+    def submit(self, tool, input_path, args, priority = None, result_ttl = DEFAULT_RESULT_TTL):
+        
+        if tool not in TOOLS_PRIORITIES:
+            raise m2pException("JobQueue: unknown tool "+str(tool)+". It has to be one of "+", ".join(sorted(TOOLS_PRIORITIES))+".")
+        
+        _check_options(tool, args)
+        
+        if not os.path.isfile(input_path):
+            raise m2pException("JobQueue: the input file "+input_path+" does not exist.")
+        
+        if priority == None: priority = TOOLS_PRIORITIES[tool]
+        
+        job_id = uuid.uuid4().hex
+        
+        shutil.copyfile(input_path, self.get_input_path(job_id))
+        
+        self._conn.execute("INSERT INTO jobs (job_id, tool, args, priority, status, result_ttl, submitted) "+\
+                           "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (job_id, tool, json.dumps(list(args)), int(priority), STATUS_QUEUED, float(result_ttl), time.time()))
+        
+        if self._verbose: self._log("job "+job_id+" ("+tool+", priority "+str(priority)+") submitted")
+        
+        return job_id
+    
+    ## The state of the job (a dict with the fields of _STATUS_FIELDS and, for queued jobs,
+    ## "jobs_before", the number of queued jobs which will be run before it), or None if it does not exist
+    def get_status(self, job_id):
+        
+        row = self._conn.execute("SELECT "+", ".join(_STATUS_FIELDS)+" FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        
+        if row == None:
+            return None
+        
+        job_status = dict(zip(_STATUS_FIELDS, row))
+        job_status["args"] = [arg.encode("utf-8") for arg in json.loads(job_status["args"])]
+        
+        if job_status["status"] == STATUS_QUEUED:
+            (jobs_before,) = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND "+\
+                                                "(priority < ? OR (priority = ? AND submitted < ?))",
+                                                (STATUS_QUEUED, job_status["priority"],
+                                                 job_status["priority"], job_status["submitted"])).fetchone()
+            job_status["jobs_before"] = jobs_before
+        
+        return job_status
+    
+    ## Writes the output of a finished job (or its log, if get_log) to output_desc
+    def fetch(self, job_id, output_desc, get_log = False):
+        
+        job_status = self.get_status(job_id)
+        
+        if job_status == None:
+            raise m2pException("JobQueue: job "+job_id+" does not exist.")
+        
+        if job_status["status"] not in [STATUS_DONE, STATUS_FAILED]:
+            raise m2pException("JobQueue: job "+job_id+" has no result (status "+job_status["status"]+").")
+        
+        result_path = self.get_log_path(job_id) if get_log else self.get_output_path(job_id)
+        
+        # the result could have been purged meanwhile
+        try:
+            with open(result_path, 'r') as result_file:
+                shutil.copyfileobj(result_file, output_desc)
+        except IOError as e:
+            raise m2pException("JobQueue: the result of job "+job_id+" could not be read: "+str(e))
+        
+        return
+    
+    ############ Workers API
+    
+    ## Takes the next job to be run, with priority max_priority or higher (any if None),
+    ## and marks it as run by worker_pid. Returns its state, or None if there are no jobs queued.
+    def take_next(self, worker_pid, max_priority = None):
+        
+        query = "SELECT job_id FROM jobs WHERE status = ?"
+        params = [STATUS_QUEUED]
+        if max_priority != None:
+            query += " AND priority <= ?"
+            params.append(max_priority)
+        query += " ORDER BY priority, submitted LIMIT 1"
+        
+        # (the lock is taken before reading, so that no other worker takes the same job)
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(query, params).fetchone()
+            
+            if row != None:
+                (job_id,) = row
+                self._conn.execute("UPDATE jobs SET status = ?, started = ?, worker_pid = ? WHERE job_id = ?",
+                                   (STATUS_RUNNING, time.time(), worker_pid, job_id))
+            
+            self._conn.execute("COMMIT")
+        except:
+            self._conn.execute("ROLLBACK")
+            raise
+        
+        if row == None:
+            return None
+        
+        return self.get_status(job_id)
+    
+    ## Records the process group of the tool running the job, to stop it if its worker is killed
+    def set_tool_pgid(self, job_id, tool_pgid):
+        
+        self._conn.execute("UPDATE jobs SET tool_pgid = ? WHERE job_id = ?", (tool_pgid, job_id))
+        
+        return
+    
+    ## Marks the job as done (or failed), whose result expires after its TTL
+    def finish(self, job_id, return_code, failed = False):
+        
+        finished = time.time()
+        
+        self._conn.execute("UPDATE jobs SET status = ?, finished = ?, expires = ? + result_ttl, return_code = ? WHERE job_id = ?",
+                           (STATUS_FAILED if failed else STATUS_DONE, finished, finished, return_code, job_id))
+        
+        input_path = self.get_input_path(job_id)
+        if os.path.exists(input_path): os.remove(input_path)
+        
+        if self._verbose: self._log("job "+job_id+" "+(STATUS_FAILED if failed else STATUS_DONE))
+        
+        return
+    
+    ## Queues again the job, e.g. when its worker is stopped
+    def requeue(self, job_id):
+        
+        self._conn.execute("UPDATE jobs SET status = ?, started = NULL, worker_pid = NULL, tool_pgid = NULL WHERE job_id = ? AND status = ?",
+                           (STATUS_QUEUED, job_id, STATUS_RUNNING))
+        
+        if self._verbose: self._log("job "+job_id+" queued again")
+        
+        return
+    
+    ## Queues again the jobs running in processes which do not exist anymore (e.g. killed, or the machine restarted),
+    ## stopping first their tools, which could be still running
+    def requeue_orphans(self):
+        
+        num_jobs = 0
+        
+        for (job_id, worker_pid, tool_pgid) in self._conn.execute("SELECT job_id, worker_pid, tool_pgid FROM jobs WHERE status = ?",
+                                                                  (STATUS_RUNNING,)).fetchall():
+            if not _process_exists(worker_pid):
+                _kill_tool(tool_pgid, self.get_input_path(job_id))
+                self.requeue(job_id)
+                num_jobs += 1
+        
+        return num_jobs
+    
+    ## Removes the results of the jobs whose TTL has passed. Returns the number of jobs expired.
+    def purge_expired(self):
+        
+        now = time.time()
+        
+        expired = [job_id for (job_id,) in \
+                   self._conn.execute("SELECT job_id FROM jobs WHERE status IN (?, ?) AND expires < ?",
+                                      (STATUS_DONE, STATUS_FAILED, now)).fetchall()]
+        
+        for job_id in expired:
+            self._conn.execute("UPDATE jobs SET status = ? WHERE job_id = ?", (STATUS_EXPIRED, job_id))
+            
+            for result_path in [self.get_output_path(job_id), self.get_log_path(job_id)]:
+                if os.path.exists(result_path): os.remove(result_path)
+        
+        if self._verbose and len(expired) > 0: self._log(str(len(expired))+" results expired")
+        
+        return len(expired)
+
+## Options of the jobs of the tool: those of TOOLS_OPTIONS, given as
+## --option=value if they have a value, and the short ones one by one (-k -u, not -ku)
+def _check_options(tool, args):
+    
+    for arg in args:
+        # the input file is the only argument which is not an option
+        if not arg.startswith("-"):
+            raise m2pException("JobQueue: wrong option "+arg+". The options with a value have to be given as --option=value.")
+        
+        if not arg.split("=", 1)[0] in TOOLS_OPTIONS[tool]:
+            raise m2pException("JobQueue: option "+arg+" is not allowed for "+tool+" jobs. "+\
+                               "It has to be one of "+", ".join(TOOLS_OPTIONS[tool])+".")
+    
+    return
+
+## Kills the process group of a tool, unless its ID is now of another process
+## (whose command line does not have the input file of the job)
+def _kill_tool(tool_pgid, input_path):
+    if tool_pgid == None: return
+    
+    try:
+        with open(os.path.join("/proc", str(tool_pgid), "cmdline"), 'r') as cmdline_file:
+            if not input_path in cmdline_file.read().split("\0"): return
+    except IOError:
+        pass # the tool exited, leaving the aligners of its group, or there is no /proc
+    
+    try:
+        os.killpg(tool_pgid, signal.SIGKILL)
+    except OSError:
+        pass
+    
+    return
+
+def _process_exists(pid):
+    if pid == None: return False
+    
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    
+    return True
+
+## END
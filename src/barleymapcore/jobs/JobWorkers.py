@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# JobWorkers.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Pool of worker processes which run the jobs of a JobQueue (see bmap_jobs).
+##
+## Each worker takes the next job of the queue and runs its tool (bin/<tool> of barleymap)
+## with the options of the job, writing its output and log to the results of the queue.
+## Some of the workers can be reserved for the lookups (jobs with priority PRIORITY_LOOKUP
+## or higher, by default bmap_find and bmap_locate), so that they are not delayed by
+## long alignments even when these occupy the rest of the workers.
+##
+## The main process restarts the workers which exit, queues again the jobs of the workers
+## which were killed (stopping their tools) and removes the expired results. When it is stopped (SIGTERM or SIGINT),
+## the workers stop their tools and queue their jobs again, to be run when the pool is started again.
+
+import sys, os, time, signal
+from subprocess import Popen
+from multiprocessing import Process
+
+from barleymapcore.m2p_exception import m2pException
+from barleymapcore.jobs.JobQueue import JobQueue, PRIORITY_LOOKUP
+
+DEFAULT_NUM_WORKERS = 2
+DEFAULT_LOOKUP_WORKERS = 1
+
+# Seconds between checks of the queue of an idle worker
+DEFAULT_POLL_INTERVAL = 2
+
+# Seconds between the maintenance of the queue (jobs of killed workers, expired results)
+MAINTENANCE_INTERVAL = 30
+
+# bmap_ tools report their errors but exit normally
+ERROR_MARKERS = ["There was an error.", "reports an error", "An error was detected"]
+
+## Stop requested by a signal, in the main process or in a worker
+_stopping = False
+## Tool being run by the worker
+_tool_process = None
+
+def _stop_handler(signum, frame):
+    global _stopping
+    
+    _stopping = True
+    
+    # the tool and the aligners it runs
+    if _tool_process != None and _tool_process.poll() == None:
+        try:
+            os.killpg(_tool_process.pid, signal.SIGTERM)
+        except OSError:
+            pass
+    
+    return
+
+## Runs the tool of a job, returning whether it failed
+def _run_job(job_queue, job_status, app_path, python, verbose):
+    global _tool_process
+    
+    job_id = job_status["job_id"]
+    
+    cmd = [python, os.path.join(app_path, "bin", job_status["tool"])]+job_status["args"]+[job_queue.get_input_path(job_id)]
+    
+    if verbose: sys.stderr.write("JobWorkers: "+str(os.getpid())+" running job "+job_id+": "+" ".join(cmd)+"\n")
+    
+    with open(job_queue.get_output_path(job_id), 'w') as output_file:
+        with open(job_queue.get_log_path(job_id), 'w') as log_file:
+            # (in a process group of its own, to be stopped with the aligners it runs)
+            _tool_process = Popen(cmd, stdout = output_file, stderr = log_file, close_fds = True, preexec_fn = os.setsid)
+            # (to be stopped when the queue finds that this worker was killed, see JobQueue.requeue_orphans)
+            job_queue.set_tool_pgid(job_id, _tool_process.pid)
+            return_code = _tool_process.wait()
+            _tool_process = None
+    
+    with open(job_queue.get_log_path(job_id), 'r') as log_file:
+        job_log = log_file.read()
+    
+    failed = return_code != 0 or any([error_marker in job_log for error_marker in ERROR_MARKERS])
+    
+    return (return_code, failed)
+
+def _worker_main(queue_path, app_path, python, max_priority, poll_interval, verbose):
+    
+    signal.signal(signal.SIGTERM, _stop_handler)
+    signal.signal(signal.SIGINT, _stop_handler)
+    
+    job_queue = JobQueue(queue_path, verbose)
+    
+    try:
+        while not _stopping:
+            job_status = job_queue.take_next(os.getpid(), max_priority)
+            
+            if job_status == None:
+                time.sleep(poll_interval)
+                continue
+            
+            (return_code, failed) = _run_job(job_queue, job_status, app_path, python, verbose)
+            
+            if _stopping:
+                job_queue.requeue(job_status["job_id"])
+            else:
+                job_queue.finish(job_status["job_id"], return_code, failed)
+    finally:
+        job_queue.close()
+    
+    return
+
+class JobWorkers(object):
+    
+    _queue_path = ""
+    _app_path = ""
+    _python = ""
+    _num_workers = DEFAULT_NUM_WORKERS
+    _lookup_workers = DEFAULT_LOOKUP_WORKERS
+    _poll_interval = DEFAULT_POLL_INTERVAL
+    _verbose = False
+    
+    # the worker processes, and the max_priority of each one
+    _workers = None
+    
+    def __init__(self, queue_path, app_path, python, num_workers = DEFAULT_NUM_WORKERS, lookup_workers = DEFAULT_LOOKUP_WORKERS,
+                 poll_interval = DEFAULT_POLL_INTERVAL, verbose = False):
+        
+        if num_workers < 1:
+            raise m2pException("JobWorkers: there has to be at least 1 worker.")
+        
+        if lookup_workers < 0 or lookup_workers >= num_workers:
+            raise m2pException("JobWorkers: the workers reserved for lookups ("+str(lookup_workers)+") "+\
+                               "have to be less than the workers ("+str(num_workers)+"), so that the other jobs are run.")
+        
+        self._queue_path = queue_path
+        self._app_path = app_path
+        self._python = python
+        self._num_workers = num_workers
+        self._lookup_workers = lookup_workers
+        self._poll_interval = poll_interval
+        self._verbose = verbose
+        
+        self._workers = []
+    
+    def _log(self, msg):
+        sys.stderr.write("JobWorkers: "+msg+"\n")
+    
+    def _start_worker(self, max_priority):
+        worker = Process(target = _worker_main,
+                         args = (self._queue_path, self._app_path, self._python, max_priority, self._poll_interval, self._verbose))
+        worker.start()
+        
+        if self._verbose: self._log("worker "+str(worker.pid)+" started"+\
+                                    (" (lookups)" if max_priority != None else ""))
+        
+        return worker
+    
+    ## Jobs of killed workers and expired results
+    def _maintenance(self):
+        # (a connection of its own, so that it is never shared with the workers)
+        job_queue = JobQueue(self._queue_path, self._verbose)
+        try:
+            num_orphans = job_queue.requeue_orphans()
+            if num_orphans > 0: self._log(str(num_orphans)+" jobs of stopped workers queued again")
+            
+            job_queue.purge_expired()
+        finally:
+            job_queue.close()
+        
+        return
+    
+    ## Runs the workers until a SIGTERM or SIGINT is received
+    def run(self):
+        
+        signal.signal(signal.SIGTERM, _stop_handler)
+        signal.signal(signal.SIGINT, _stop_handler)
+        
+        self._maintenance()
+        
+        for worker_index in xrange(self._num_workers):
+            max_priority = PRIORITY_LOOKUP if worker_index < self._lookup_workers else None
+            self._workers.append((self._start_worker(max_priority), max_priority))
+        
+        self._log(str(self._num_workers)+" workers ("+str(self._lookup_workers)+" for lookups) "+\
+                  "running the jobs of "+self._queue_path)
+        
+        try:
+            last_maintenance = time.time()
+            while not _stopping:
+                time.sleep(1)
+                
+                for (worker_index, (worker, max_priority)) in enumerate(self._workers):
+                    if not worker.is_alive() and not _stopping:
+                        self._log("worker "+str(worker.pid)+" exited ("+str(worker.exitcode)+"), starting a new one")
+                        self._workers[worker_index] = (self._start_worker(max_priority), max_priority)
+                
+                if time.time() - last_maintenance >= MAINTENANCE_INTERVAL:
+                    self._maintenance()
+                    last_maintenance = time.time()
+        finally:
+            self._log("stopping the workers")
+            
+            for (worker, max_priority) in self._workers:
+                if worker.is_alive(): worker.terminate()
+            
+            for (worker, max_priority) in self._workers:
+                worker.join()
+        
+        return
+
+## END
@@ -9,7 +9,8 @@ import sys
 
 from SearchEngines import SearchEnginesFactory
 from reader.MapReader import MapReader
-from mappers.Mappers import Mappers
+from mappers.Mappers import Mappers, Mapper
+from MappingResults import MappingResults
 from enrichment.MapEnricher import MapEnricherFactory, MapEnricher
 from enrichment.Enrichers import EnricherFactory
 
@@ -17,6 +18,9 @@ from barleymapcore.datasets.DatasetsFacade import DatasetsFacade
 from barleymapcore.alignment.AlignmentResult import *
 from barleymapcore.db.MapsConfig import MapsConfig
 from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.alignment_utils as alignment_utils
+import barleymapcore.utils.sort_utils as sort_utils
 
 ## Read conf file
 ALIGN_ACTION = "align"
@@ -33,6 +37,7 @@ class MapMarkers(object):
     
     _mapping_results = None
     _maps_data = {}
+    _runs_list = None
     
     def __init__(self, maps_path, map_config, facade = None, verbose = False):
         self._maps_path = maps_path
@@ -99,6 +104,68 @@ class MapMarkers(object):
         
         return mapping_results
     
+    ## As perform_mappings, but aligning and mapping the queries in chunks of chunk_size sequences.
+    ## The positions, unmapped and unaligned of each chunk are spilled to sorted runs
+    ## in tmp_files_dir, and the MappingResults returned merges them lazily (once),
+    ## so that memory depends on chunk_size rather than on the number of queries.
+    def perform_mappings_by_chunks(self, query_fasta_path, chunk_size, databases_ids, databases_config, aligner_list,
+                                threshold_id, threshold_cov, n_threads,
+                                best_score_param, sort_param, multiple_param, tmp_files_dir):
+        
+        positions_sort_key = Mapper.get_positions_sort_key(sort_param)
+        unmapped_sort_key = Mapper.get_unmapped_sort_key()
+        
+        mapped_runs = []
+        unmapped_runs = []
+        unaligned_runs = []
+        
+        try:
+            num_chunk = 0
+            for chunk_path in alignment_utils.split_fasta(query_fasta_path, chunk_size, tmp_files_dir):
+                num_chunk += 1
+                sys.stderr.write("MapMarkers: chunk "+str(num_chunk)+" of "+str(chunk_size)+" queries\n")
+                
+                chunk_results = self.perform_mappings(chunk_path, databases_ids, databases_config, aligner_list,
+                                                      threshold_id, threshold_cov, n_threads,
+                                                      best_score_param, sort_param, multiple_param, tmp_files_dir)
+                
+                with profile_utils.timer("map/spill_runs"):
+                    mapped = sorted(chunk_results.get_mapped(), key=positions_sort_key)
+                    mapped_runs.append(sort_utils.write_records_run(mapped, tmp_files_dir))
+                    
+                    unmapped = sorted(chunk_results.get_unmapped() or [], key=unmapped_sort_key)
+                    unmapped_runs.append(sort_utils.write_records_run(unmapped, tmp_files_dir))
+                    
+                    unaligned = sorted(chunk_results.get_unaligned() or [])
+                    unaligned_runs.append(sort_utils.write_records_run(unaligned, tmp_files_dir))
+                
+                profile_utils.count("map/chunks")
+        
+        except Exception:
+            sort_utils.remove_runs(mapped_runs+unmapped_runs+unaligned_runs)
+            raise
+        
+        self._runs_list = mapped_runs+unmapped_runs+unaligned_runs
+        
+        mapping_results = MappingResults()
+        mapping_results.set_mapped(sort_utils.merge_records_runs(mapped_runs, positions_sort_key))
+        mapping_results.set_unmapped(sort_utils.merge_records_runs(unmapped_runs, unmapped_sort_key))
+        mapping_results.set_unaligned(sort_utils.merge_records_runs(unaligned_runs, lambda unaligned: unaligned))
+        mapping_results.set_sort_by(sort_param)
+        mapping_results.set_map_config(self._map_config)
+        
+        self._mapping_results = mapping_results
+        
+        return mapping_results
+    
+    ## Removes the runs of perform_mappings_by_chunks which were not merged
+    def remove_runs(self):
+        if self._runs_list:
+            sort_utils.remove_runs(self._runs_list)
+            self._runs_list = None
+        
+        return
+    
     ### Create a map from AlignmentResult list
     ### (do not remove, used in bmap_build_datasets.py)
     def create_map(self, alignment_results, unaligned, sort_param, multiple_param):
@@ -111,7 +178,8 @@ class MapMarkers(object):
         
         mapper = Mappers.get_alignments_mapper(map_as_physical, self._mapReader, self._verbose)
         
-        self._mapping_results = mapper.create_map(alignment_results, unaligned, map_config, sort_param, multiple_param)
+        with profile_utils.timer("map/create_map"):
+            self._mapping_results = mapper.create_map(alignment_results, unaligned, map_config, sort_param, multiple_param)
         
         sys.stderr.write("MapMarkers: Map "+map_config.get_name()+" created.\n")
         sys.stderr.write("\n")
@@ -152,7 +220,8 @@ class MapMarkers(object):
             enricher = enricher_factory.get_anchored_enricher(self._mapReader)
             map_enricher = MapEnricherFactory.get_map_enricher(show_how, enricher, mapping_results, self._verbose)
             
-            enriched_map = self._get_enriched_map(map_enricher, datasets_facade, datasets_ids, extend_window, collapsed_view, constrain_fine_mapping)
+            with profile_utils.timer("enrichment/anchored"):
+                enriched_map = self._get_enriched_map(map_enricher, datasets_facade, datasets_ids, extend_window, collapsed_view, constrain_fine_mapping)
             mapping_results.set_map_with_anchored(enriched_map)
         
         if show_genes:
@@ -161,7 +230,8 @@ class MapMarkers(object):
             enricher = enricher_factory.get_gene_enricher(self._mapReader, annotator)
             map_enricher = MapEnricherFactory.get_map_enricher(show_how, enricher, mapping_results, self._verbose)
             
-            enriched_map = self._get_enriched_map(map_enricher, datasets_facade, datasets_ids, extend_window, collapsed_view, constrain_fine_mapping)
+            with profile_utils.timer("enrichment/genes"):
+                enriched_map = self._get_enriched_map(map_enricher, datasets_facade, datasets_ids, extend_window, collapsed_view, constrain_fine_mapping)
             mapping_results.set_map_with_genes(enriched_map)
         
         if show_markers:
@@ -170,7 +240,8 @@ class MapMarkers(object):
             enricher = enricher_factory.get_marker_enricher(self._mapReader)
             map_enricher = MapEnricherFactory.get_map_enricher(show_how, enricher, mapping_results, self._verbose)
             
-            enriched_map = self._get_enriched_map(map_enricher, datasets_facade, datasets_ids, extend_window, collapsed_view, constrain_fine_mapping)
+            with profile_utils.timer("enrichment/markers"):
+                enriched_map = self._get_enriched_map(map_enricher, datasets_facade, datasets_ids, extend_window, collapsed_view, constrain_fine_mapping)
             mapping_results.set_map_with_markers(enriched_map)
         
         sys.stderr.write("MapMarkers: added other features.\n")
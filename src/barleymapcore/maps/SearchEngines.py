@@ -12,6 +12,7 @@ from mappers.Mappers import Mappers
 from barleymapcore.db.MapsConfig import MapsConfig
 from barleymapcore.m2p_exception import m2pException
 import barleymapcore.utils.alignment_utils as alignment_utils
+import barleymapcore.utils.profile_utils as profile_utils
 
 from barleymapcore.alignment.AlignmentEngines import ALIGNMENT_TYPE_GREEDY, ALIGNMENT_TYPE_HIERARCHICAL, ALIGNMENT_TYPE_BEST_SCORE
 
@@ -94,7 +95,8 @@ class SearchEnginePositions(SearchEngine):
         
         mapper = Mappers.get_alignments_mapper(map_as_physical, map_reader, self._verbose)
         
-        mapping_results = mapper.create_map(aligned, unaligned, map_config, sort_param, multiple_param)
+        with profile_utils.timer("map/create_map"):
+            mapping_results = mapper.create_map(aligned, unaligned, map_config, sort_param, multiple_param)
         
         sys.stderr.write("SearchEnginePositions:"+str(len(mapping_results.get_mapped()))+"\n")
         
@@ -120,7 +122,8 @@ class SearchEngineDatasets(SearchEngine):
         # Obtain Mapper
         mapper = Mappers.get_mappings_mapper(map_reader, self._verbose)
         
-        mapping_results = mapper.create_map(mapping_results, mapping_unmapped, map_config, sort_param)
+        with profile_utils.timer("map/create_map"):
+            mapping_results = mapper.create_map(mapping_results, mapping_unmapped, map_config, sort_param)
         
         sys.stderr.write("SearchEngineDatasets:"+str(len(mapping_results.get_mapped()))+"\n")
         
@@ -167,7 +170,8 @@ class SearchEngineGreedy(SearchEngineAlignments):
         
         mapper = Mappers.get_alignments_mapper(map_as_physical, map_reader, self._verbose)
         
-        mapping_results = mapper.create_map(aligned, unaligned, map_config, sort_param, multiple_param)
+        with profile_utils.timer("map/create_map"):
+            mapping_results = mapper.create_map(aligned, unaligned, map_config, sort_param, multiple_param)
         
         sys.stderr.write("SearchEngineGreedy: mapped "+str(len(mapping_results.get_mapped()))+"\n")
         
@@ -199,7 +203,8 @@ class SearchEngineExhaustive(SearchEngineAlignments):
                 aligned = alignment_results.get_aligned()
                 unaligned = alignment_results.get_unaligned()
                 
-                mapping_results = mapper.create_map(aligned, unaligned, map_config, sort_param, multiple_param)
+                with profile_utils.timer("map/create_map"):
+                    mapping_results = mapper.create_map(aligned, unaligned, map_config, sort_param, multiple_param)
                 
                 sys.stderr.write("SearchEngineExhaustive: mapped "+str(len(mapping_results.get_mapped()))+"\n")
                 
@@ -12,6 +12,8 @@ from barleymapcore.db.DatasetsConfig import DatasetsConfig
 from barleymapcore.maps.enrichment.FeatureMapping import FeaturesFactory, FeatureMapping
 from barleymapcore.maps.MappingResults import MappingResult
 from barleymapcore.maps.MapInterval import MapInterval
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.sort_utils as sort_utils
 
 ROW_TYPE_POSITION = "pos"
 ROW_TYPE_FEATURE = "feature"
@@ -50,7 +52,7 @@ class Enricher(object):
         raise m2pException("Method 'retrieve_features' should be implemented in a class inheriting Enricher.")
     
     def sort_features(self, features, map_sort_by):
-        features = sorted(features, key=lambda feature_mapping: \
+        features = sort_utils.sort_records(features, lambda feature_mapping: \
                         (int(feature_mapping.get_chrom_order()),
                          float(feature_mapping.get_sort_pos(map_sort_by)), float(feature_mapping.get_sort_end_pos(map_sort_by)),
                         feature_mapping.get_dataset_name(), feature_mapping.get_feature_id()))
@@ -305,7 +307,8 @@ class GeneEnricher(Enricher):
         
         # 4) If required, annotate genes
         if self._annotator:
-            features = self._annotator.annotate_features(features)
+            with profile_utils.timer("annotation"):
+                features = self._annotator.annotate_features(features)
         
         #print "ENRICHERS"
         #for gene_mapping in features:
@@ -11,6 +11,8 @@ from barleymapcore.db.DatasetsConfig import DatasetsConfig
 from barleymapcore.maps.enrichment.FeatureMapping import FeaturesFactory, FeatureMapping
 from barleymapcore.maps.MappingResults import MappingResult
 from barleymapcore.maps.MapInterval import MapInterval
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.sort_utils as sort_utils
 
 ROW_TYPE_POSITION = "pos"
 ROW_TYPE_FEATURE = "feature"
@@ -49,7 +51,7 @@ class Enricher(object):
         raise m2pException("Method 'retrieve_features' should be implemented in a class inheriting Enricher.")
     
     def sort_features(self, features, map_sort_by):
-        features = sorted(features, key=lambda feature_mapping: \
+        features = sort_utils.sort_records(features, lambda feature_mapping: \
                         (int(feature_mapping.get_chrom_order()),
                          float(feature_mapping.get_sort_pos(map_sort_by)), float(feature_mapping.get_sort_end_pos(map_sort_by)),
                         feature_mapping.get_dataset_name(), feature_mapping.get_feature_id()))
@@ -229,7 +231,8 @@ class GeneEnricher(Enricher):
             features = self.sort_features(features, map_sort_by)
             featured_map_interval.set_features(features)
             if self._annotator:
-                features = self._annotator.annotate_features(features)
+                with profile_utils.timer("annotation"):
+                    features = self._annotator.annotate_features(features)
         
         #sys.stderr.write("GeneEnricher\n")
         #
@@ -10,6 +10,7 @@ import sys
 from barleymapcore.maps.MappingResults import MappingResult, MappingResults
 
 from barleymapcore.db.MapsConfig import MapsConfig
+import barleymapcore.utils.sort_utils as sort_utils
 
 NUM_FIELDS = 7
 
@@ -136,15 +137,25 @@ class Mapper(object):
         
         return positions_list
     
+    # The order of the map positions: chromosome, position, secondary position and marker
+    @staticmethod
+    def get_positions_sort_key(sort_param):
+        return lambda mapping_result: \
+                    (int(mapping_result.get_chrom_order()), float(mapping_result.get_sort_pos(sort_param)),
+                     float(mapping_result.get_sort_sec_pos(sort_param)), mapping_result.get_marker_id())
+    
     def _sort_positions_list(self, positions_list, sort_param):
         sorted_list = []
         
-        sorted_list = sorted(positions_list, key=lambda mapping_result: \
-                             (int(mapping_result.get_chrom_order()), float(mapping_result.get_sort_pos(sort_param)),
-                              float(mapping_result.get_sort_sec_pos(sort_param)), mapping_result.get_marker_id()))
+        sorted_list = sort_utils.sort_records(positions_list, Mapper.get_positions_sort_key(sort_param))
         
         return sorted_list
     
+    # The order of the unmapped records: marker, contig, has_other_contigs_with_map_position
+    @staticmethod
+    def get_unmapped_sort_key():
+        return lambda unmapped_record: (unmapped_record[0], unmapped_record[1], unmapped_record[2])
+    
     def _get_unmapped_markers(self, markers_positions):
         positions_list = []
         
@@ -160,7 +171,7 @@ class Mapper(object):
                 # marker contig has_other_contigs_with_map_position
                 positions_list.append([marker_id, contig, num_marker_pos > 0])
         
-        positions_list = sorted(positions_list, key=lambda sorting: (sorting[0], sorting[1], sorting[2]))
+        positions_list = sort_utils.sort_records(positions_list, Mapper.get_unmapped_sort_key())
         
         return positions_list
     
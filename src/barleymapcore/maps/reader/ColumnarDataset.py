@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ColumnarDataset.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+import sys, os, shutil
+import cPickle
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from barleymapcore.m2p_exception import m2pException
+from barleymapcore.maps.MapsBase import MapTypes
+from barleymapcore.maps.MappingResults import MappingResult
+from barleymapcore.utils.bgzf_utils import open_data_file
+
+from MapFiles import MapFile
+
+COLUMNAR_EXT = ".cols"
+META_FILE = "meta.pkl"
+
+KIND_DATASET = "dataset" # rows of MappingResult (datasets/<dataset>/<dataset>.<map>)
+KIND_MAP = "map" # rows of MapFile (maps/<map>/<map>.<db>)
+
+# Columns (a .npy file each)
+COL_IDS = "ids"
+COL_IDS_SORTED = "ids_sorted" # ID string table, sorted
+COL_IDS_ROWS = "ids_rows" # row of each ID in ids_sorted
+COL_CHROM = "chrom" # code of the chromosome (position in meta "chroms")
+COL_CM_POS = "cm_pos"
+COL_BP_POS = "bp_pos"
+COL_BP_END_POS = "bp_end_pos"
+COL_STRAND = "strand" # code of the strand (position in meta "strands")
+COL_FLAGS = "flags"
+COL_SORT_MAX_END = "sort_max_end" # cumulative maximum of end positions within each chromosome
+COL_FILE_ROWS = "file_rows" # row of each row in the text file
+
+FLAG_MULTIPLE_POS = 1
+FLAG_OTHER_ALIGNMENTS = 2
+
+## Columnar version of a dataset or map file, stored in a <data_path>.cols directory
+## with a NumPy array (.npy) for each column, which are memory mapped when read.
+## Rows of datasets are sorted by chromosome and position (meta "sort_by"),
+## so that intervals are queried with np.searchsorted instead of parsing every row.
+## Numeric positions are normalized (e.g. "12.50" is read back as "12.5").
+## It requires NumPy. Otherwise, the plain text files are used.
+class ColumnarDataset(object):
+    
+    _cols_path = ""
+    _meta = None
+    _columns = None
+    
+    def __init__(self, cols_path, meta):
+        self._cols_path = cols_path
+        self._meta = meta
+        self._columns = {}
+    
+    @staticmethod
+    def is_available():
+        return np != None
+    
+    @staticmethod
+    def get_path(data_path):
+        return data_path+COLUMNAR_EXT
+    
+    # Returns None if there is no columnar version of data_path
+    # or it is older than data_path.
+    @staticmethod
+    def load(data_path, kind = KIND_DATASET):
+        columnar = None
+        
+        if not ColumnarDataset.is_available(): return columnar
+        
+        cols_path = ColumnarDataset.get_path(data_path)
+        meta_path = cols_path+"/"+META_FILE
+        if os.path.exists(meta_path) and os.path.isfile(meta_path):
+            
+            if os.path.exists(data_path) and os.path.getmtime(data_path) > os.path.getmtime(meta_path):
+                sys.stderr.write("ColumnarDataset: "+cols_path+" is older than "+data_path+" and will not be used.\n")
+            else:
+                with open(meta_path, 'r') as meta_f:
+                    meta = cPickle.load(meta_f)
+                
+                if meta["kind"] == kind:
+                    columnar = ColumnarDataset(cols_path, meta)
+        
+        return columnar
+    
+    def get_column(self, column):
+        if not column in self._columns:
+            self._columns[column] = np.load(self._cols_path+"/"+column+".npy", mmap_mode='r')
+        
+        return self._columns[column]
+    
+    def get_sort_by(self):
+        return self._meta["sort_by"]
+    
+    def get_num_rows(self):
+        return self._meta["num_rows"]
+    
+    def get_chrom_name(self, chrom_code):
+        return self._meta["chroms"][chrom_code]
+    
+    ## Rows (numpy array) of the IDs in query_list,
+    ## in the order of query_list and, for each ID, of the file.
+    def get_rows_by_id(self, query_list):
+        
+        if len(query_list) == 0 or self.get_num_rows() == 0:
+            return np.zeros(0, dtype=np.int64)
+        
+        ids_sorted = self.get_column(COL_IDS_SORTED)
+        ids_rows = self.get_column(COL_IDS_ROWS)
+        
+        queries = np.array(query_list, dtype=str)
+        ini_pos = np.searchsorted(ids_sorted, queries, side='left')
+        end_pos = np.searchsorted(ids_sorted, queries, side='right')
+        
+        rows_list = [ids_rows[ini:end] for (ini, end) in zip(ini_pos, end_pos) if end > ini]
+        
+        return np.concatenate(rows_list) if len(rows_list) > 0 else np.zeros(0, dtype=np.int64)
+    
+    ## Rows sorted in the order of the text file
+    ## (the same as the columnar one if the file was sorted, as bmap_build_datasets writes it)
+    def sort_rows_as_file(self, rows):
+        
+        if self._meta.get("has_file_rows", False):
+            rows = rows[np.argsort(self.get_column(COL_FILE_ROWS)[rows], kind='mergesort')]
+        else:
+            rows = np.sort(rows)
+        
+        return rows
+    
+    ## Rows (numpy array, sorted) which overlap the interval chrom_name:ini_pos-end_pos
+    def get_rows_by_pos(self, chrom_name, ini_pos, end_pos):
+        
+        chrom_range = self._meta["chrom_ranges"].get(chrom_name)
+        if not chrom_range: return np.zeros(0, dtype=np.int64)
+        
+        (chrom_ini, chrom_end) = chrom_range
+        
+        sort_pos = self._get_sort_pos_column()[chrom_ini:chrom_end]
+        sort_end_pos = self._get_sort_end_pos_column()[chrom_ini:chrom_end]
+        sort_max_end = self.get_column(COL_SORT_MAX_END)[chrom_ini:chrom_end]
+        
+        # rows starting before the end of the interval...
+        last_row = np.searchsorted(sort_pos, float(end_pos), side='right')
+        # ...and which could end after its start
+        first_row = np.searchsorted(sort_max_end, float(ini_pos), side='left')
+        
+        if first_row >= last_row: return np.zeros(0, dtype=np.int64)
+        
+        overlap = np.flatnonzero(sort_end_pos[first_row:last_row] >= float(ini_pos))
+        
+        return overlap + (chrom_ini + first_row)
+    
+    def _get_sort_pos_column(self):
+        if self.get_sort_by() == MapTypes.MAP_SORT_PARAM_CM:
+            column = self.get_column(COL_CM_POS)
+        else:
+            column = self.get_column(COL_BP_POS)
+        
+        return column
+    
+    def _get_sort_end_pos_column(self):
+        if self.get_sort_by() == MapTypes.MAP_SORT_PARAM_CM:
+            column = self.get_column(COL_CM_POS)
+        else:
+            column = self.get_column(COL_BP_END_POS)
+        
+        return column
+    
+    ## Fields of a row, as they are in the text file
+    def get_row_data(self, row):
+        meta = self._meta
+        
+        row_data = [str(self.get_column(COL_IDS)[row]), meta["chroms"][self.get_column(COL_CHROM)[row]]]
+        
+        # map files have always both cM and bp fields
+        if meta["has_cm_pos"] or meta["kind"] == KIND_MAP: row_data.append(repr(float(self.get_column(COL_CM_POS)[row])))
+        if meta["has_bp_pos"] or meta["kind"] == KIND_MAP: row_data.append(str(self.get_column(COL_BP_POS)[row]))
+        
+        if meta["kind"] == KIND_DATASET:
+            if meta["as_physical"]:
+                row_data.append(str(self.get_column(COL_BP_END_POS)[row]))
+                row_data.append(meta["strands"][self.get_column(COL_STRAND)[row]])
+            
+            flags = int(self.get_column(COL_FLAGS)[row])
+            row_data.append("Yes" if flags & FLAG_MULTIPLE_POS else "No")
+            row_data.append("Yes" if flags & FLAG_OTHER_ALIGNMENTS else "No")
+        
+        return row_data
+    
+    def get_mapping_result(self, row, map_name, chrom_dict):
+        meta = self._meta
+        
+        return MappingResult.init_from_data(self.get_row_data(row), map_name, chrom_dict,
+                                            meta["as_physical"], meta["has_cm_pos"], meta["has_bp_pos"])
+    
+    ########### Conversion from text files
+    ###########
+    
+    @staticmethod
+    def _new_meta(kind, map_config, sort_by, data_path):
+        
+        # physical maps have only bp positions in datasets
+        if kind == KIND_DATASET and map_config.as_physical():
+            has_cm_pos = False
+            has_bp_pos = True
+        else:
+            has_cm_pos = map_config.has_cm_pos()
+            has_bp_pos = map_config.has_bp_pos()
+        
+        return {"kind":kind, "source":os.path.basename(data_path), "sort_by":sort_by,
+                "as_physical":map_config.as_physical(), "has_cm_pos":has_cm_pos, "has_bp_pos":has_bp_pos,
+                "num_rows":0, "chroms":[], "chrom_ranges":{}, "strands":[], "headers":[]}
+    
+    ## Creates the columnar version of a dataset file,
+    ## sorted by chromosome (chrom_dict) and sort_by position.
+    @staticmethod
+    def convert_dataset(data_path, map_config, chrom_dict, sort_by, verbose = False):
+        
+        if not ColumnarDataset.is_available():
+            raise m2pException("ColumnarDataset: NumPy is required to create columnar files.")
+        
+        meta = ColumnarDataset._new_meta(KIND_DATASET, map_config, sort_by, data_path)
+        
+        map_name = map_config.get_name()
+        
+        ids_list = []
+        chrom_list = []
+        chrom_order_list = []
+        cm_list = []
+        bp_list = []
+        bp_end_list = []
+        strand_list = []
+        flags_list = []
+        
+        chrom_codes = {}
+        strand_codes = {}
+        
+        for hit in open_data_file(data_path):
+            if hit.startswith(">") or hit.startswith("#"):
+                meta["headers"].append(hit)
+                continue
+            
+            hit_data = hit.strip().split("\t")
+            
+            mapping_result = MappingResult.init_from_data(hit_data, map_name, chrom_dict, map_config.as_physical(),
+                                                          map_config.has_cm_pos(), map_config.has_bp_pos())
+            
+            chrom_name = mapping_result.get_chrom_name()
+            if not chrom_name in chrom_codes:
+                chrom_codes[chrom_name] = len(meta["chroms"])
+                meta["chroms"].append(chrom_name)
+            
+            ids_list.append(mapping_result.get_marker_id())
+            chrom_list.append(chrom_codes[chrom_name])
+            chrom_order_list.append(int(mapping_result.get_chrom_order()))
+            cm_list.append(float(mapping_result.get_cm_pos()))
+            bp_list.append(int(mapping_result.get_bp_pos()))
+            bp_end_list.append(int(mapping_result.get_bp_end_pos()))
+            strand = mapping_result.get_strand()
+            if not strand in strand_codes:
+                strand_codes[strand] = len(meta["strands"])
+                meta["strands"].append(strand)
+            strand_list.append(strand_codes[strand])
+            
+            flags = 0
+            if mapping_result.has_multiple_pos(): flags |= FLAG_MULTIPLE_POS
+            if mapping_result.has_other_alignments(): flags |= FLAG_OTHER_ALIGNMENTS
+            flags_list.append(flags)
+        
+        columns = {COL_IDS:np.array(ids_list, dtype=str),
+                   COL_CHROM:np.array(chrom_list, dtype=np.int32),
+                   COL_CM_POS:np.array(cm_list, dtype=np.float64),
+                   COL_BP_POS:np.array(bp_list, dtype=np.int64),
+                   COL_BP_END_POS:np.array(bp_end_list, dtype=np.int64),
+                   COL_STRAND:np.array(strand_list, dtype=np.int8),
+                   COL_FLAGS:np.array(flags_list, dtype=np.uint8)}
+        
+        chrom_orders = np.array(chrom_order_list, dtype=np.int64)
+        
+        if sort_by == MapTypes.MAP_SORT_PARAM_CM:
+            sort_pos = columns[COL_CM_POS]
+            sort_end_pos = columns[COL_CM_POS]
+        else:
+            sort_pos = columns[COL_BP_POS]
+            sort_end_pos = columns[COL_BP_END_POS]
+        
+        # stable sort: rows with the same position keep the order of the file
+        rows_order = np.lexsort((sort_pos, chrom_orders))
+        for column in columns:
+            columns[column] = columns[column][rows_order]
+        columns[COL_FILE_ROWS] = rows_order.astype(np.int64)
+        meta["has_file_rows"] = True
+        chrom_orders = chrom_orders[rows_order]
+        sort_end_pos = sort_end_pos[rows_order].astype(np.float64)
+        
+        # rows of each chromosome, and maximum end position up to each row within it
+        sort_max_end = np.empty(len(rows_order), dtype=np.float64)
+        chrom_codes_sorted = columns[COL_CHROM]
+        for chrom_name in meta["chroms"]:
+            chrom_code = chrom_codes[chrom_name]
+            chrom_ini = int(np.searchsorted(chrom_orders, int(chrom_dict[chrom_name]), side='left'))
+            chrom_end = int(np.searchsorted(chrom_orders, int(chrom_dict[chrom_name]), side='right'))
+            
+            if np.any(chrom_codes_sorted[chrom_ini:chrom_end] != chrom_code):
+                raise m2pException("ColumnarDataset: chromosomes with the same order are not supported ("+chrom_name+").")
+            
+            meta["chrom_ranges"][chrom_name] = [chrom_ini, chrom_end]
+            sort_max_end[chrom_ini:chrom_end] = np.maximum.accumulate(sort_end_pos[chrom_ini:chrom_end])
+        
+        columns[COL_SORT_MAX_END] = sort_max_end
+        
+        ColumnarDataset._write(data_path, meta, columns, verbose)
+        
+        return
+    
+    ## Creates the columnar version of a map file (contig, chromosome, cM and/or bp)
+    @staticmethod
+    def convert_map(map_path, map_config, verbose = False):
+        
+        if not ColumnarDataset.is_available():
+            raise m2pException("ColumnarDataset: NumPy is required to create columnar files.")
+        
+        meta = ColumnarDataset._new_meta(KIND_MAP, map_config, map_config.get_default_sort_by(), map_path)
+        
+        ids_list = []
+        chrom_list = []
+        cm_list = []
+        bp_list = []
+        
+        chrom_codes = {}
+        
+        for map_line in open_data_file(map_path):
+            if map_line.startswith(">") or map_line.startswith("#"):
+                meta["headers"].append(map_line)
+                continue
+            
+            if map_line.strip() == "": continue
+            
+            map_data = map_line.strip().split("\t")
+            
+            chrom_name = map_data[MapFile.MAP_FILE_CHR]
+            if not chrom_name in chrom_codes:
+                chrom_codes[chrom_name] = len(meta["chroms"])
+                meta["chroms"].append(chrom_name)
+            
+            ids_list.append(map_data[MapFile.MAP_FILE_CONTIG])
+            chrom_list.append(chrom_codes[chrom_name])
+            cm_list.append(float(map_data[MapFile.MAP_FILE_CM]) if meta["has_cm_pos"] else -1.0)
+            bp_list.append(int(map_data[MapFile.MAP_FILE_BP]) if meta["has_bp_pos"] else -1)
+        
+        columns = {COL_IDS:np.array(ids_list, dtype=str),
+                   COL_CHROM:np.array(chrom_list, dtype=np.int32),
+                   COL_CM_POS:np.array(cm_list, dtype=np.float64),
+                   COL_BP_POS:np.array(bp_list, dtype=np.int64)}
+        
+        ColumnarDataset._write(map_path, meta, columns, verbose)
+        
+        return
+    
+    @staticmethod
+    def _write(data_path, meta, columns, verbose):
+        
+        cols_path = ColumnarDataset.get_path(data_path)
+        tmp_cols_path = cols_path+".tmp"
+        
+        if os.path.exists(tmp_cols_path): shutil.rmtree(tmp_cols_path)
+        os.mkdir(tmp_cols_path)
+        
+        # ID string table, sorted, to find IDs with np.searchsorted
+        ids_rows = np.argsort(columns[COL_IDS], kind='mergesort')
+        columns[COL_IDS_SORTED] = columns[COL_IDS][ids_rows]
+        columns[COL_IDS_ROWS] = ids_rows.astype(np.int64)
+        
+        meta["num_rows"] = len(columns[COL_IDS])
+        
+        for column in columns:
+            np.save(tmp_cols_path+"/"+column+".npy", columns[column])
+        
+        # meta is written last: it is the file checked when loading
+        with open(tmp_cols_path+"/"+META_FILE, 'w') as meta_f:
+            cPickle.dump(meta, meta_f, protocol = 2)
+        
+        ColumnarDataset.remove(data_path)
+        os.rename(tmp_cols_path, cols_path)
+        
+        if verbose:
+            sys.stderr.write("ColumnarDataset: "+str(meta["num_rows"])+" rows written to "+cols_path+"\n")
+        
+        return
+    
+    @staticmethod
+    def remove(data_path):
+        cols_path = ColumnarDataset.get_path(data_path)
+        if os.path.exists(cols_path): shutil.rmtree(cols_path)
+        
+        return
+
+## END
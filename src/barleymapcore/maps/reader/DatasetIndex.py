@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# DatasetIndex.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+import sys, os
+import cPickle, heapq, itertools
+
+from barleymapcore.maps.MappingResults import MappingResult
+from barleymapcore.utils.sort_utils import external_sort_lines
+from barleymapcore.utils.bgzf_utils import BgzfWriter, open_data_file
+
+ID_INDEX_EXT = ".idx"
+POS_INDEX_EXT = ".pidx"
+RECORDS_EXT = ".records"
+
+DEFAULT_BLOCK_ROWS = 1000
+
+# Keys of the ID index which are not IDs (rows starting with "#" are headers)
+ID_INDEX_FORMAT = "#format"
+ID_INDEX_MULTIPLE = "#multiple"
+ID_INDEX_VERSION = 2
+
+# Fields of each block in the positional index
+BLOCK_CHROM = 0
+BLOCK_POS = 1
+BLOCK_MAX_END = 2
+BLOCK_OFFSET = 3
+
+## Indexes of a dataset file (datasets/<dataset>/<dataset>.<map>):
+##  - ID index (.idx): query_id --> byte offset of its (first) row,
+##      as the indexes of bmap_datasets_index of previous versions, so that these can still read it,
+##      and, under ID_INDEX_MULTIPLE, query_id --> list of offsets of the queries with several rows.
+##      For block compressed files (bgzf_utils) offsets are virtual offsets.
+##  - Positional index (.pidx): a block of rows every block_rows rows,
+##      with the chromosome, first position, maximum end position and byte offset
+##      of the block, so that readers can seek to the first block
+##      which could overlap a given interval.
+class DatasetIndex(object):
+    
+    @staticmethod
+    def load_id_index(data_path):
+        index = None
+        
+        index_path = data_path+ID_INDEX_EXT
+        if os.path.exists(index_path) and os.path.isfile(index_path):
+            with open(index_path, 'r') as index_f:
+                index = cPickle.load(index_f)
+        
+        return index
+    
+    ## Offsets of the rows of query_id in an ID index (empty if it is not there)
+    @staticmethod
+    def get_id_offsets(index, query_id):
+        offsets = []
+        
+        if query_id in index and not query_id.startswith("#"):
+            multiple = index.get(ID_INDEX_MULTIPLE)
+            if multiple != None and query_id in multiple:
+                offsets = multiple[query_id]
+            else:
+                offsets = [index[query_id]]
+        
+        return offsets
+    
+    ## IDs of an ID index
+    @staticmethod
+    def get_id_index_ids(index):
+        return [query_id for query_id in index if not query_id.startswith("#")]
+    
+    ## Writes the ID index (query_id --> offset, or list of offsets) of data_path
+    @staticmethod
+    def write_id_index(data_path, id_index):
+        index = {ID_INDEX_FORMAT:ID_INDEX_VERSION, ID_INDEX_MULTIPLE:{}}
+        
+        for query_id in id_index:
+            offsets = id_index[query_id]
+            if isinstance(offsets, list):
+                index[query_id] = offsets[0]
+                index[ID_INDEX_MULTIPLE][query_id] = offsets
+            else:
+                index[query_id] = offsets
+        
+        with open(data_path+ID_INDEX_EXT, 'w') as index_f:
+            cPickle.dump(index, index_f, protocol = 2)
+        
+        return
+    
+    # Returns the positional index only if it was built
+    # with the same sort (cm or bp) which will be used to read the file
+    @staticmethod
+    def load_pos_index(data_path, map_sort_by):
+        pos_index = None
+        
+        index_path = data_path+POS_INDEX_EXT
+        if os.path.exists(index_path) and os.path.isfile(index_path):
+            with open(index_path, 'r') as index_f:
+                pos_index = cPickle.load(index_f)
+            
+            if pos_index["sort_by"] != map_sort_by or not pos_index["sorted"]:
+                pos_index = None
+        
+        return pos_index
+    
+    # Byte offset of the first block which could have rows
+    # overlapping the interval, or -1 if there is no such block
+    @staticmethod
+    def get_block_offset(pos_index, chrom_name, ini_pos):
+        offset = -1
+        
+        chrom_blocks = pos_index["chroms"].get(chrom_name)
+        if chrom_blocks:
+            blocks = pos_index["blocks"]
+            for block_pos in xrange(chrom_blocks[0], chrom_blocks[1]):
+                block = blocks[block_pos]
+                if float(block[BLOCK_MAX_END]) >= float(ini_pos):
+                    offset = block[BLOCK_OFFSET]
+                    break
+        
+        return offset
+    
+    ## Records (source IDs and their hash) already processed
+    ## for this data file, used to update the dataset incrementally.
+    ## A hash of "-" means that it is not known.
+    @staticmethod
+    def load_records(data_path):
+        records = None
+        
+        records_path = data_path+RECORDS_EXT
+        if os.path.exists(records_path) and os.path.isfile(records_path):
+            records = {}
+            for line in open(records_path, 'r'):
+                line_data = line.strip().split("\t")
+                records[line_data[0]] = line_data[1]
+        
+        return records
+    
+    @staticmethod
+    def write_records(data_path, records):
+        
+        with open(data_path+RECORDS_EXT, 'w') as records_f:
+            for record_id in sorted(records):
+                records_f.write(record_id+"\t"+str(records[record_id])+"\n")
+        
+        return
+
+## A file-like object which writes to output_desc (a file or a BgzfWriter)
+## while creating the ID and positional indexes of the rows written,
+## and checking that rows are sorted as expected by MappingsParser.parse_mapping_file_by_pos
+class DatasetIndexWriter(object):
+    
+    _output_desc = None
+    _map_config = None
+    _chrom_dict = None
+    _sort_by = ""
+    _block_rows = DEFAULT_BLOCK_ROWS
+    _verbose = False
+    
+    _offset = 0
+    _pending = ""
+    _num_rows = 0
+    _block_first_row = 0
+    _is_sorted = True
+    _prev_key = None
+    _id_index = None
+    _blocks = None
+    _chroms = None
+    
+    def __init__(self, output_desc, map_config, chrom_dict, sort_by, block_rows = DEFAULT_BLOCK_ROWS, verbose = False):
+        self._output_desc = output_desc
+        self._map_config = map_config
+        self._chrom_dict = chrom_dict
+        self._sort_by = sort_by
+        self._block_rows = block_rows
+        self._verbose = verbose
+        
+        self.reset()
+    
+    def reset(self):
+        self._offset = 0
+        self._pending = ""
+        self._num_rows = 0
+        self._block_first_row = 0
+        self._is_sorted = True
+        self._prev_key = None
+        self._id_index = {}
+        self._blocks = []
+        self._chroms = {}
+    
+    def is_sorted(self):
+        return self._is_sorted
+    
+    def get_num_rows(self):
+        return self._num_rows
+    
+    # Rows are written to output_desc once they are complete,
+    # so that the offset of each one is known
+    def write(self, text):
+        lines = (self._pending+text).split("\n")
+        self._pending = lines.pop() # incomplete line, if any
+        
+        for line in lines:
+            self._write_line(line+"\n")
+        
+        return
+    
+    # Writes the last line, if it has no line break
+    def flush(self):
+        if self._pending != "":
+            self._write_line(self._pending)
+            self._pending = ""
+        
+        return
+    
+    def _write_line(self, line):
+        if isinstance(self._output_desc, BgzfWriter):
+            line_offset = self._output_desc.tell()
+        else:
+            line_offset = self._offset
+        
+        self._output_desc.write(line)
+        self._offset += len(line)
+        
+        self._index_line(line, line_offset)
+        
+        return
+    
+    def _index_line(self, line, line_offset):
+        
+        if line.startswith(">") or line.startswith("#"): return
+        
+        hit_data = line.strip().split("\t")
+        
+        mapping_result = MappingResult.init_from_data(hit_data, self._map_config.get_name(), self._chrom_dict,
+                                                      self._map_config.as_physical(),
+                                                      self._map_config.has_cm_pos(), self._map_config.has_bp_pos())
+        
+        marker_id = mapping_result.get_marker_id()
+        chrom_name = mapping_result.get_chrom_name()
+        map_pos = mapping_result.get_sort_pos(self._sort_by)
+        map_end_pos = mapping_result.get_sort_end_pos(self._sort_by)
+        
+        ## ID index
+        if marker_id in self._id_index:
+            prev_offsets = self._id_index[marker_id]
+            if isinstance(prev_offsets, list):
+                prev_offsets.append(line_offset)
+            else:
+                self._id_index[marker_id] = [prev_offsets, line_offset]
+        else:
+            self._id_index[marker_id] = line_offset
+        
+        ## Sortedness
+        try:
+            row_key = (int(mapping_result.get_chrom_order()), float(map_pos))
+        except ValueError:
+            row_key = None
+        
+        if row_key == None or (self._prev_key != None and row_key < self._prev_key):
+            if self._is_sorted and self._verbose:
+                sys.stderr.write("DatasetIndexWriter: unsorted row found: "+line)
+            self._is_sorted = False
+        
+        self._prev_key = row_key
+        
+        ## Positional index
+        if self._is_sorted:
+            last_block = self._blocks[-1] if len(self._blocks) > 0 else None
+            
+            if last_block == None or last_block[BLOCK_CHROM] != chrom_name or \
+               self._num_rows - self._block_first_row >= self._block_rows:
+                
+                if last_block == None or last_block[BLOCK_CHROM] != chrom_name:
+                    self._chroms[chrom_name] = [len(self._blocks), len(self._blocks)]
+                
+                self._blocks.append([chrom_name, map_pos, map_end_pos, line_offset])
+                self._chroms[chrom_name][1] = len(self._blocks)
+                self._block_first_row = self._num_rows
+            
+            elif float(map_end_pos) > float(last_block[BLOCK_MAX_END]):
+                last_block[BLOCK_MAX_END] = map_end_pos
+        
+        self._num_rows += 1
+        
+        return
+    
+    def write_indexes(self, data_path):
+        
+        DatasetIndex.write_id_index(data_path, self._id_index)
+        
+        pos_index = {"sort_by":self._sort_by, "sorted":self._is_sorted, "block_rows":self._block_rows,
+                     "blocks":self._blocks, "chroms":self._chroms}
+        
+        with open(data_path+POS_INDEX_EXT, 'w') as index_f:
+            cPickle.dump(pos_index, index_f, protocol = 2)
+        
+        if self._verbose:
+            sys.stderr.write("DatasetIndexWriter: "+str(self._num_rows)+" rows, "+str(len(self._id_index))+" ids, "+\
+                             str(len(self._blocks))+" blocks indexed for "+data_path+"\n")
+        
+        return
+    
+    def _get_row_key(self, line):
+        hit_data = line.strip().split("\t")
+        
+        mapping_result = MappingResult.init_from_data(hit_data, self._map_config.get_name(), self._chrom_dict,
+                                                      self._map_config.as_physical(),
+                                                      self._map_config.has_cm_pos(), self._map_config.has_bp_pos())
+        
+        return (int(mapping_result.get_chrom_order()), float(mapping_result.get_sort_pos(self._sort_by)),
+                float(mapping_result.get_sort_end_pos(self._sort_by)), mapping_result.get_marker_id())
+    
+    def _keyed_rows(self, data_path, removed_ids = None):
+        with open_data_file(data_path) as data_f:
+            for line in data_f:
+                if line.startswith(">") or line.startswith("#"): continue
+                if removed_ids and line.split("\t", 1)[0] in removed_ids: continue
+                
+                yield (self._get_row_key(line), line)
+    
+    # Writes the lines to data_path (block compressed if compress)
+    # and indexes them, if they are sorted
+    def _rewrite_and_index(self, data_path, lines, compress = False):
+        
+        tmp_path = data_path+".tmp"
+        
+        output_desc = self._output_desc
+        self._output_desc = BgzfWriter(tmp_path) if compress else open(tmp_path, 'w')
+        try:
+            self.reset()
+            for line in lines:
+                self.write(line)
+            self.flush()
+        finally:
+            self._output_desc.close()
+            self._output_desc = output_desc
+        
+        os.rename(tmp_path, data_path)
+        
+        if self.is_sorted():
+            self.write_indexes(data_path)
+        
+        return
+    
+    # Sorts the data file (external merge sort) and indexes it again.
+    # Used only when the rows written were not sorted.
+    def sort_and_index(self, data_path, tmp_files_dir = None, compress = False):
+        
+        sys.stderr.write("DatasetIndexWriter: sorting "+data_path+"\n")
+        
+        sorted_path = data_path+".sorted"
+        external_sort_lines(data_path, sorted_path, self._get_row_key, tmp_files_dir = tmp_files_dir)
+        try:
+            with open(sorted_path, 'r') as sorted_f:
+                self._rewrite_and_index(data_path, sorted_f, compress)
+        finally:
+            os.remove(sorted_path)
+        
+        return
+    
+    # Merges the rows of a (sorted) delta file into the (sorted) data file,
+    # dropping the rows of removed_ids from the latter,
+    # and indexes the resulting file in the same pass.
+    def merge_and_index(self, data_path, delta_path, removed_ids = None, tmp_files_dir = None, compress = False):
+        
+        sys.stderr.write("DatasetIndexWriter: merging "+delta_path+" into "+data_path+"\n")
+        
+        # Headers of the current data file
+        header_lines = []
+        with open_data_file(data_path) as data_f:
+            for line in data_f:
+                if not (line.startswith(">") or line.startswith("#")): break
+                header_lines.append(line)
+        
+        merged_rows = heapq.merge(self._keyed_rows(data_path, removed_ids), self._keyed_rows(delta_path))
+        
+        self._rewrite_and_index(data_path, itertools.chain(header_lines, (line for (row_key, line) in merged_rows)), compress)
+        
+        if not self.is_sorted():
+            self.sort_and_index(data_path, tmp_files_dir, compress)
+        
+        return
+    
+    # Rewrites the data file block compressed, with its indexes
+    def compress_and_index(self, data_path):
+        
+        with open_data_file(data_path) as data_f:
+            self._rewrite_and_index(data_path, data_f, compress = True)
+        
+        if not self.is_sorted():
+            self.write_indexes(data_path)
+        
+        return
+
+## END
@@ -9,14 +9,81 @@ import sys, os
 import cPickle
 
 from barleymapcore.maps.MappingResults import MappingResult
-from barleymapcore.maps.MapInterval import MapInterval
 from barleymapcore.maps.enrichment.FeatureMapping import FeaturesFactory
+from barleymapcore.utils.bgzf_utils import open_data_file
+import barleymapcore.utils.profile_utils as profile_utils
 
 from MapFiles import MapFile
+from DatasetIndex import DatasetIndex
+from ColumnarDataset import ColumnarDataset, KIND_MAP
+
+## Intervals overlapping the rows of a dataset file, which are read in order
+## (sorted by chromosome and position, as written by bmap_build_datasets).
+## An interval is active from the first row of its chromosome which ends after its start
+## to the first row which starts after its end, so that each row is checked only
+## against the active intervals, however the intervals overlap each other.
+class IntervalsSweep(object):
+    
+    _map_intervals = None
+    # (chromosome order, first position, last position, position in map_intervals) of each interval, sorted
+    _intervals = None
+    _next_pos = 0
+    _active = None
+    _sought_pos = -1
+    
+    def __init__(self, map_intervals, chrom_dict):
+        self._map_intervals = map_intervals
+        self._intervals = sorted([(int(chrom_dict[map_interval.get_chrom()]), float(map_interval.get_ini_pos()),
+                                   float(map_interval.get_end_pos()), interval_pos)
+                                  for (interval_pos, map_interval) in enumerate(map_intervals)])
+        self._next_pos = 0
+        self._active = []
+        self._sought_pos = -1
+    
+    # No rows can overlap the intervals left
+    def is_finished(self):
+        return len(self._active) == 0 and self._next_pos >= len(self._intervals)
+    
+    # The next interval, when there are no active intervals
+    # and it has not been returned before, or None
+    def get_interval_to_seek(self):
+        next_interval = None
+        
+        if len(self._active) == 0 and self._next_pos < len(self._intervals) and self._next_pos != self._sought_pos:
+            self._sought_pos = self._next_pos
+            next_interval = self._map_intervals[self._intervals[self._next_pos][3]]
+        
+        return next_interval
+    
+    # Positions in map_intervals of the intervals which overlap the row
+    def get_overlapping(self, mapping_result, map_sort_by):
+        chrom_order = int(mapping_result.get_chrom_order())
+        map_pos = float(mapping_result.get_sort_pos(map_sort_by))
+        map_end_pos = float(mapping_result.get_sort_end_pos(map_sort_by))
+        
+        intervals = self._intervals
+        while self._next_pos < len(intervals):
+            interval = intervals[self._next_pos]
+            if interval[0] > chrom_order or (interval[0] == chrom_order and interval[1] > map_end_pos): break
+            
+            # (there are no rows left for the intervals of previous chromosomes)
+            if interval[0] == chrom_order: self._active.append(interval)
+            self._next_pos += 1
+        
+        if len(self._active) > 0:
+            self._active = [interval for interval in self._active if interval[0] == chrom_order and interval[2] >= map_pos]
+        
+        return [interval[3] for interval in self._active if interval[1] <= map_end_pos]
 
 ### Class to obtain mapping results from pre-calculated datasets
 ### "mapping results" are those which have already map positions
 ### like those resulting from running bmap_align to a map
+### Data files can be plain text or block compressed (bgzf_utils)
+### If there is a columnar version of a file (ColumnarDataset, bmap_convert)
+### and NumPy is available, it is used instead.
+### The rows and bytes read from each file are counted for the --profile report
+### (profile_utils.count_scan; no bytes are counted for columnar files),
+### only when profiling is enabled, so that reading the rows does not pay for it.
 class MappingsParser(object):
     
     def parse_mapping_file(self, data_path, map_config, chrom_dict):
@@ -27,17 +94,58 @@ class MappingsParser(object):
         map_has_bp_pos = map_config.has_bp_pos()
         map_is_physical = map_config.as_physical()
         
-        for hit in open(data_path, 'r'):
+        columnar = ColumnarDataset.load(data_path)
+        if columnar:
+            for row in xrange(columnar.get_num_rows()):
+                mapping_results_list.append(columnar.get_mapping_result(row, map_name, chrom_dict))
+            
+            profile_utils.count_scan(data_path, len(mapping_results_list), len(mapping_results_list), 0)
+            
+            return mapping_results_list
+        
+        profiling = profile_utils.is_enabled()
+        num_bytes = 0
+        for hit in open_data_file(data_path):
+            if profiling: num_bytes += len(hit)
             if hit.startswith(">") or hit.startswith("#"): continue
             hit_data = hit.strip().split("\t")
             
             mapping_result = MappingResult.init_from_data(hit_data, map_name, chrom_dict, map_is_physical, map_has_cm_pos, map_has_bp_pos)
             mapping_results_list.append(mapping_result)
         
+        profile_utils.count_scan(data_path, len(mapping_results_list), len(mapping_results_list), num_bytes)
+        
         return mapping_results_list
     
     def _parse_mapping_file_by_id(self, query_ids_dict, data_path, map_config, chrom_dict,
                                         multiple_param, dataset_synonyms = {}, test_set = None):
+        
+        scan_counts = [0, 0]
+        mapping_results_list = self._parse_hits_by_id(self._split_hits(open_data_file(data_path), scan_counts),
+                                                      query_ids_dict, map_config, chrom_dict,
+                                                      multiple_param, dataset_synonyms, test_set)
+        
+        profile_utils.count_scan(data_path, scan_counts[0], len(mapping_results_list), scan_counts[1])
+        
+        return mapping_results_list
+    
+    # Fields of the rows (hits) of a data file, skipping the headers.
+    # The rows and bytes read are added to scan_counts, if profiling.
+    def _split_hits(self, hits, scan_counts):
+        profiling = profile_utils.is_enabled()
+        for hit in hits:
+            if hit.startswith(">") or hit.startswith("#"):
+                if profiling: scan_counts[1] += len(hit)
+                continue
+            if profiling:
+                scan_counts[0] += 1
+                scan_counts[1] += len(hit)
+            yield hit.strip().split("\t")
+    
+    # Mapping results of the rows (hits_data, the fields of each one) of the queries in test_set,
+    # or of the IDs which have any of them as synonym
+    def _parse_hits_by_id(self, hits_data, query_ids_dict, map_config, chrom_dict,
+                                multiple_param, dataset_synonyms, test_set):
         mapping_results_list = []
         
         map_name = map_config.get_name()
@@ -45,11 +153,9 @@ class MappingsParser(object):
         map_has_bp_pos = map_config.has_bp_pos()
         map_is_physical = map_config.as_physical()
         
-        for hit in open(data_path, 'r'):
+        for hit_data in hits_data:
             #sys.stderr.write(" ONE**************************\n")
-            #sys.stderr.write(str(hit)+"\n")
-            if hit.startswith(">") or hit.startswith("#"): continue
-            hit_data = hit.strip().split("\t")
+            #sys.stderr.write(str(hit_data)+"\n")
             
             #sys.stderr.write("data\n")
             
@@ -108,47 +214,61 @@ class MappingsParser(object):
         
         return mapping_results_list
     
-    def _parse_index_file_by_id(self, query_ids_dict, index_path, data_path, map_config, chrom_dict,
-                                                                    multiple_param, dataset_synonyms, test_set):
-        mapping_results_list = []
+    # IDs of the rows of the queries: the queries and the IDs which have any of them as synonym
+    def _get_hits_ids(self, dataset_synonyms, test_set):
+        hits_ids = set([query for query in test_set if not query in dataset_synonyms])
         
-        ## TODO: DO SOMETHING WITH THE SYNONYMS!!!
-        ##
+        for hit_id in dataset_synonyms:
+            if not test_set.isdisjoint(dataset_synonyms[hit_id]):
+                hits_ids.add(hit_id)
         
-        map_name = map_config.get_name()
-        map_has_cm_pos = map_config.has_cm_pos()
-        map_has_bp_pos = map_config.has_bp_pos()
-        map_is_physical = map_config.as_physical()
+        return hits_ids
+    
+    # The rows of the index of the queries (and of the IDs which have them as synonyms)
+    # are read in the order of the file, and filtered as when reading the whole file
+    def _parse_index_file_by_id(self, query_ids_dict, index_path, data_path, map_config, chrom_dict,
+                                                                    multiple_param, dataset_synonyms, test_set):
         
         sys.stderr.write("MappingsParser: loading index "+str(index_path)+"...\n")
         
-        with open(index_path, 'r') as index_f:
-            index = cPickle.load(index_f)
+        index = DatasetIndex.load_id_index(data_path)
         
         sys.stderr.write("MappingsParser: loaded index with "+str(len(index))+" entries.\n")
         
         sys.stderr.write("MappingsParser: obtaining index of queries...\n")
-        queries_bytes = []
-        for query in test_set:
-            if query in index:
-                query_bytes = index[query]
-                
-                query_ids_dict[query] = 1 # found
-                
-                queries_bytes.append(query_bytes)
-        
-        with open(data_path, 'r') as data_f:
-            for query_bytes in queries_bytes:
-                data_f.seek(query_bytes)
-                mapping_line = data_f.readline()
-                mapping_data = mapping_line.strip().split("\t")
-                mapping_result = MappingResult.init_from_data(mapping_data, map_name, chrom_dict, map_is_physical, map_has_cm_pos, map_has_bp_pos)
-                
-                if mapping_result.has_multiple_pos():
-                    if multiple_param == False:
-                        continue
-                
-                mapping_results_list.append(mapping_result)
+        hits_ids = self._get_hits_ids(dataset_synonyms, test_set)
+        
+        queries_bytes = sorted([query_bytes for hit_id in hits_ids for query_bytes in DatasetIndex.get_id_offsets(index, hit_id)])
+        
+        scan_counts = [0, 0]
+        with open_data_file(data_path) as data_f:
+            mapping_results_list = self._parse_hits_by_id(self._split_hits(self._read_hits(data_f, queries_bytes), scan_counts),
+                                                          query_ids_dict, map_config, chrom_dict,
+                                                          multiple_param, dataset_synonyms, test_set)
+        
+        profile_utils.count_scan(data_path, scan_counts[0], len(mapping_results_list), scan_counts[1])
+        
+        return mapping_results_list
+    
+    # Rows of the data file at the given offsets
+    def _read_hits(self, data_f, queries_bytes):
+        for query_bytes in queries_bytes:
+            data_f.seek(query_bytes)
+            yield data_f.readline()
+    
+    # As _parse_index_file_by_id, with the ID string table of the columnar version
+    def _parse_columnar_by_id(self, query_ids_dict, data_path, columnar, map_config, chrom_dict,
+                                    multiple_param, dataset_synonyms, test_set):
+        
+        hits_ids = self._get_hits_ids(dataset_synonyms, test_set)
+        
+        rows = columnar.sort_rows_as_file(columnar.get_rows_by_id(list(hits_ids)))
+            
+        mapping_results_list = self._parse_hits_by_id((columnar.get_row_data(row) for row in rows),
+                                                      query_ids_dict, map_config, chrom_dict,
+                                                      multiple_param, dataset_synonyms, test_set)
+        
+        profile_utils.count_scan(data_path, len(rows), len(mapping_results_list), 0)
         
         return mapping_results_list
     
@@ -156,9 +276,13 @@ class MappingsParser(object):
                                         multiple_param, dataset_synonyms = {}, test_set = None):
         mapping_results_list = []
         
-        # check if there is an index
+        # check if there is a columnar version or an index
+        columnar = ColumnarDataset.load(data_path)
         index_path = data_path+".idx"
-        if os.path.exists(index_path) and os.path.isfile(index_path):
+        if columnar:
+            mapping_results_list = self._parse_columnar_by_id(query_ids_dict, data_path, columnar, map_config, chrom_dict,
+                                                              multiple_param, dataset_synonyms, test_set)
+        elif os.path.exists(index_path) and os.path.isfile(index_path):
             mapping_results_list = self._parse_index_file_by_id(query_ids_dict, index_path, data_path, map_config, chrom_dict,
                                                                     multiple_param, dataset_synonyms, test_set)
         else:
@@ -175,57 +299,72 @@ class MappingsParser(object):
         map_has_cm_pos = map_config.has_cm_pos()
         map_has_bp_pos = map_config.has_bp_pos()
         
-        current_interval_pos = 0
-        current_interval = map_intervals[current_interval_pos]
+        columnar = ColumnarDataset.load(data_path)
+        if columnar and columnar.get_sort_by() == map_sort_by:
+            # rows overlapping any interval, in the order of the file
+            rows_list = [columnar.get_rows_by_pos(map_interval.get_chrom(), map_interval.get_ini_pos(), map_interval.get_end_pos())
+                         for map_interval in map_intervals]
+            
+            for row in sorted(set().union(*rows_list)):
+                mapping_results_list.append(columnar.get_mapping_result(row, map_name, chrom_dict))
+            
+            profile_utils.count_scan(data_path, len(mapping_results_list), len(mapping_results_list), 0)
+            
+            return mapping_results_list
         
+        intervals_sweep = IntervalsSweep(map_intervals, chrom_dict)
+        
+        # Positional index (built by bmap_build_datasets), to skip
+        # the rows which can not overlap the intervals
+        pos_index = DatasetIndex.load_pos_index(data_path, map_sort_by)
+        
+        data_f = open_data_file(data_path)
+        
+        profiling = profile_utils.is_enabled()
+        num_rows = 0
+        num_bytes = 0
         # Find all the hits for this map
-        for hit in open(data_path, 'r'):
-            if hit.startswith(">") or hit.startswith("#"): continue
+        while not intervals_sweep.is_finished():
+            self._seek_interval(data_f, pos_index, intervals_sweep)
+            
+            hit = data_f.readline()
+            if not hit: break
+            
+            if hit.startswith(">") or hit.startswith("#"):
+                if profiling: num_bytes += len(hit)
+                continue
+            if profiling:
+                num_rows += 1
+                num_bytes += len(hit)
             hit_data = hit.strip().split("\t")
             
             #sys.stderr.write(hit+"\n")
-            #sys.stderr.write("\t"+str(current_interval)+"\n")
             
             mapping_result = MappingResult.init_from_data(hit_data, map_name, chrom_dict, map_is_physical, map_has_cm_pos, map_has_bp_pos)
             
-            chrom_name = mapping_result.get_chrom_name()
-            
-            if chrom_name != current_interval.get_chrom(): continue
-            
-            map_end_pos = mapping_result.get_sort_end_pos(map_sort_by)
-            
-            if float(map_end_pos) < float(current_interval.get_ini_pos()): continue
-            
-            marker_id = mapping_result.get_marker_id()
-            chrom_order = mapping_result.get_chrom_order()
-            map_pos = mapping_result.get_sort_pos(map_sort_by)#float(mapping_result.get_sort_pos(map_sort_by))
-            
-            while (float(map_pos) > float(current_interval.get_end_pos())):
-                current_interval_pos += 1
-                if current_interval_pos >= len(map_intervals):
-                    break
-                current_interval = map_intervals[current_interval_pos]
-                if current_interval.get_chrom() != chrom_name:
-                    break
-            
-            if current_interval_pos >= len(map_intervals): break
-            
-            if chrom_name != current_interval.get_chrom(): continue
-            
-            if float(map_end_pos) < float(current_interval.get_ini_pos()): continue
-            
-            dataset_interval = MapInterval(chrom_name, map_pos, map_end_pos)
-            
-            #sys.stderr.write("MappingsParser: by_pos "+str(dataset_interval)+" - "+str(current_interval)+"\n")
-            
-            does_overlap = MapInterval.intervals_overlap(dataset_interval, current_interval)
-            
             # Check if alignment overlaps with some mapping interval
-            if does_overlap:
+            if len(intervals_sweep.get_overlapping(mapping_result, map_sort_by)) > 0:
                 mapping_results_list.append(mapping_result)
         
+        data_f.close()
+        
+        profile_utils.count_scan(data_path, num_rows, len(mapping_results_list), num_bytes)
+        
         return mapping_results_list
     
+    # Moves forward the data file to the first block (positional index)
+    # which could overlap the next interval, when no interval is being read
+    def _seek_interval(self, data_f, pos_index, intervals_sweep):
+        
+        if pos_index:
+            next_interval = intervals_sweep.get_interval_to_seek()
+            if next_interval != None:
+                offset = DatasetIndex.get_block_offset(pos_index, next_interval.get_chrom(), next_interval.get_ini_pos())
+                if offset > data_f.tell():
+                    data_f.seek(offset)
+        
+        return
+    
     def parse_mapping_file_on_pos(self, map_intervals, data_path, chrom_dict, map_config, map_sort_by,
                                   dataset, dataset_name, feature_type):
         
@@ -234,68 +373,66 @@ class MappingsParser(object):
         map_has_cm_pos = map_config.has_cm_pos()
         map_has_bp_pos = map_config.has_bp_pos()
         
-        current_interval_pos = 0
-        featured_current_interval = map_intervals[current_interval_pos]
-        current_interval = featured_current_interval.get_map_interval()
-        current_features = featured_current_interval.get_features()
+        columnar = ColumnarDataset.load(data_path)
+        if columnar and columnar.get_sort_by() == map_sort_by:
+            mapping_results_dict = {} # a single MappingResult for each row, as when reading the text file
+            for featured_map_interval in map_intervals:
+                map_interval = featured_map_interval.get_map_interval()
+                features = featured_map_interval.get_features()
+                
+                for row in columnar.get_rows_by_pos(map_interval.get_chrom(), map_interval.get_ini_pos(), map_interval.get_end_pos()):
+                    if not row in mapping_results_dict:
+                        mapping_results_dict[row] = columnar.get_mapping_result(row, map_name, chrom_dict)
+                    mapping_result = mapping_results_dict[row]
+                    
+                    feature = FeaturesFactory.get_feature(mapping_result.get_marker_id(), dataset, dataset_name, feature_type, mapping_result)
+                    features.append(feature)
+            
+            profile_utils.count_scan(data_path, len(mapping_results_dict), len(mapping_results_dict), 0)
+            
+            return map_intervals
+        
+        intervals_sweep = IntervalsSweep([featured_map_interval.get_map_interval() for featured_map_interval in map_intervals],
+                                         chrom_dict)
+        
+        pos_index = DatasetIndex.load_pos_index(data_path, map_sort_by)
         
-        #sys.stderr.write("MappingsParser \n")
-        #sys.stderr.write("\t"+str(current_interval)+"\n")
-        #sys.stderr.write("\t"+str(len(current_features))+"\n")
-        #for feature in current_features:
-        #    sys.stderr.write("\t\t"+str(feature)+"\n")
+        data_f = open_data_file(data_path)
         
+        profiling = profile_utils.is_enabled()
+        num_rows = 0
+        num_matched = 0
+        num_bytes = 0
         # Find all the hits for this map
-        for hit in open(data_path, 'r'):
-            if hit.startswith(">") or hit.startswith("#"): continue
+        while not intervals_sweep.is_finished():
+            self._seek_interval(data_f, pos_index, intervals_sweep)
+            
+            hit = data_f.readline()
+            if not hit: break
+            
+            if hit.startswith(">") or hit.startswith("#"):
+                if profiling: num_bytes += len(hit)
+                continue
+            if profiling:
+                num_rows += 1
+                num_bytes += len(hit)
             hit_data = hit.strip().split("\t")
             
             #sys.stderr.write(hit+"\n")
-            #sys.stderr.write("\t"+str(current_interval)+"\n")
             
             mapping_result = MappingResult.init_from_data(hit_data, map_name, chrom_dict, map_is_physical, map_has_cm_pos, map_has_bp_pos)
             
-            chrom_name = mapping_result.get_chrom_name()
-            
-            if chrom_name != current_interval.get_chrom(): continue
-            
-            map_end_pos = mapping_result.get_sort_end_pos(map_sort_by)
-            
-            if float(map_end_pos) < float(current_interval.get_ini_pos()): continue
-            
-            marker_id = mapping_result.get_marker_id()
-            chrom_order = mapping_result.get_chrom_order()
-            map_pos = mapping_result.get_sort_pos(map_sort_by)#float(mapping_result.get_sort_pos(map_sort_by))
-            
-            dataset_interval = MapInterval(chrom_name, map_pos, map_end_pos)
-            
-            does_overlap = MapInterval.intervals_overlap(dataset_interval, current_interval)
-            # This if-else could be unnecessary, but hopefully is useful to read the code
-            if does_overlap:
-                next_interval_pos = current_interval_pos
-                next_interval = current_interval
-                next_features = current_features
-                while (does_overlap):
+            overlapping = intervals_sweep.get_overlapping(mapping_result, map_sort_by)
+            if len(overlapping) > 0:
+                if profiling: num_matched += 1
+                marker_id = mapping_result.get_marker_id()
+                for interval_pos in overlapping:
                     feature = FeaturesFactory.get_feature(marker_id, dataset, dataset_name, feature_type, mapping_result)
-                    next_features.append(feature)
-                    
-                    next_interval_pos += 1
-                    if next_interval_pos >= len(map_intervals):
-                        break
-                    featured_next_interval = map_intervals[next_interval_pos]
-                    next_interval = featured_next_interval.get_map_interval()
-                    next_features = featured_next_interval.get_features()
-                    
-                    does_overlap = MapInterval.intervals_overlap(dataset_interval, next_interval)
-                    
-            else:
-                while (float(map_pos) > float(current_interval.get_end_pos())):
-                    current_interval_pos += 1
-                    if current_interval_pos >= len(map_intervals):
-                        break
-                    featured_current_interval = map_intervals[current_interval_pos]
-                    current_interval = featured_current_interval.get_map_interval()
-                    current_features = featured_current_interval.get_features()
+                    map_intervals[interval_pos].get_features().append(feature)
+        
+        data_f.close()
+        
+        profile_utils.count_scan(data_path, num_rows, num_matched, num_bytes)
         
         #sys.stderr.write("MappingsParser generated intervals\n")
         #for featured_map_interval in map_intervals:
@@ -321,17 +458,48 @@ class MappingsParser(object):
         
         #contig_set = set(contig_list) # A clone of contig_list. Used to shorten the search of contigs
         
+        profiling = profile_utils.is_enabled()
+        
         # For this genetic_map, read the info related to each database of contigs
         for db in map_db_list:
             db_records_read = 0
+            db_records_found = 0
+            db_bytes_read = 0
             
             # File with map-DB positions
             map_path = maps_path+map_dir+"/"+map_dir+"."+db
             if verbose: sys.stderr.write("\tMappingsParser: map file --> "+map_path+"\n")
             
+            columnar = ColumnarDataset.load(map_path, KIND_MAP)
+            if columnar:
+                if verbose: sys.stderr.write("\tMappingsParser: columnar map file --> "+map_path+"\n")
+                
+                rows = columnar.get_rows_by_id(list(contig_set))
+                for row in rows:
+                    row_data = columnar.get_row_data(row)
+                    contig_id = row_data[MapFile.MAP_FILE_CONTIG]
+                    
+                    # only the first row of each contig, as when reading the text file
+                    if not contig_id in contig_set: continue
+                    
+                    if not contig_id in positions_dict:
+                        positions_dict[contig_id] = {}
+                    
+                    positions_dict[contig_id]["chr"] = row_data[MapFile.MAP_FILE_CHR]
+                    positions_dict[contig_id]["cm_pos"] = row_data[MapFile.MAP_FILE_CM] if map_config.has_cm_pos() else -1.0
+                    positions_dict[contig_id]["bp_pos"] = row_data[MapFile.MAP_FILE_BP] if map_config.has_bp_pos() else -1
+                    
+                    contig_set.remove(contig_id)
+                    db_records_found += 1
+                
+                profile_utils.count_scan(map_path, len(rows), db_records_found, 0)
+                
+                continue
+            
             # Map data for this database
-            for map_line in open(map_path, 'r'):
+            for map_line in open_data_file(map_path):
                 db_records_read += 1
+                if profiling: db_bytes_read += len(map_line)
                 map_data = map_line.strip().split("\t")
                 
                 contig_id = map_data[MapFile.MAP_FILE_CONTIG]
@@ -359,6 +527,7 @@ class MappingsParser(object):
                         positions_dict[contig_id]["bp_pos"] = -1
                         
                     contig_set.remove(contig_id)
+                    db_records_found += 1
                     
                     if len(contig_set) == 0:
                         if verbose: sys.stderr.write("\t\t all sequences found -->")
@@ -366,6 +535,8 @@ class MappingsParser(object):
             
             if verbose: sys.stderr.write("\t\t records read: "+str(db_records_read)+"\n")
             
+            profile_utils.count_scan(map_path, db_records_read, db_records_found, db_bytes_read)
+            
         return positions_dict
 
 ## END
\ No newline at end of file
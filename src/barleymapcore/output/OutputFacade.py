@@ -6,10 +6,12 @@
 # (terms of use can be found within the distributed LICENSE file).
 
 import sys
+from operator import methodcaller, itemgetter
 
 from barleymapcore.db.DatasetsConfig import DatasetsConfig
 from barleymapcore.maps.MapsBase import MapTypes
 from barleymapcore.m2p_exception import m2pException
+from barleymapcore.output.OutputWriter import OutputWriter, RowTemplate, related_field
 
 from barleymapcore.alignment.AlignmentEngines import ALIGNMENT_TYPE_GREEDY, ALIGNMENT_TYPE_HIERARCHICAL, ALIGNMENT_TYPE_BEST_SCORE
 
@@ -78,6 +80,53 @@ class AnnotFields(object):
     
     GENES_ANNOT_FIELDS = 5
 
+## Functions to obtain the fields of the rows (see OutputWriter.RowTemplate)
+
+def _decimal_field(field):
+    return lambda record: "%0.2f" % float(field(record))
+
+def _multiple_field(pos):
+    if pos.is_empty(): return "-"
+    elif pos.has_multiple_pos(): return "Yes"
+    else: return "No"
+
+def _other_alignments_field(pos):
+    if pos.is_empty(): return "-"
+    elif pos.has_other_alignments(): return "Yes"
+    else: return "No"
+
+## The annotation columns of a feature, one for each annotation
+## or "-" if the feature lacks annotations of a type
+def _annots_tail(anntypes_ids):
+    
+    def annots_tail(feature):
+        annots_data = {}
+        for gene_annot in feature.get_annots():
+            anntype_id = gene_annot.get_anntype().get_anntype_id()
+            if anntype_id in annots_data:
+                annots_data[anntype_id].append(",".join(gene_annot.get_annot_data()))
+            else:
+                annots_data[anntype_id] = [",".join(gene_annot.get_annot_data())]
+        
+        annots_row = []
+        for anntype_id in anntypes_ids:
+            if anntype_id in annots_data:
+                annots_row.extend(annots_data[anntype_id])
+            else:
+                annots_row.append("-")
+        
+        return "".join(["\t"+annot_data for annot_data in annots_row])
+    
+    return annots_tail
+
+## The loaded annotation types, in the order of the configuration,
+## so that all the records share columns (and header titles)
+def _loaded_anntypes_ids(annotator):
+    anntypes_list = annotator.get_anntypes_config().get_anntypes_list()
+    loaded_anntypes = annotator.get_loaded_anntypes()
+    
+    return [anntype_id for anntype_id in anntypes_list if anntype_id in loaded_anntypes]
+
 class OutputFacade(object):
     
     @staticmethod
@@ -111,56 +160,58 @@ class OutputFacade(object):
 class AlignmentsPrinter(object):
     
     _databases_config = None
+    _writer = None
     
     def __init__(self, databases_config):
         self._databases_config = databases_config
+        self._writer = OutputWriter(sys.stdout)
     
     def output_results(self, aligned, databases_ids = None):
         raise Exception("To be implemented in child classes inheriting from AlignmentsPrinter")
     
     def print_header(self):
-        sys.stdout.write("#"+"\t".join(["query_id", "subject_id", "identity", "query_coverage", \
+        self._writer.write("#"+"\t".join(["query_id", "subject_id", "identity", "query_coverage", \
                                         "score", "strand", "qstart", "qend", "sstart", "send",
                                         "database", "algorithm"])+"\n")
     
     def print_records_db(self, aligned, db_entry, db_name):
         # records
-        for alignment_result in aligned: #db_results:
-            
-            if alignment_result.get_db_id() != db_entry: continue
+        db_aligned = (alignment_result for alignment_result in aligned if alignment_result.get_db_id() == db_entry)
             
-            self.print_record(alignment_result, db_name)
+        self._writer.write_rows(db_aligned, self._alignments_template(lambda alignment_result: db_name))
         
         return
     
     def print_records(self, aligned):
         # records
-        for alignment_result in aligned: #db_results:
+        get_database_name = self._databases_config.get_database_name
+        get_db_name = lambda alignment_result: get_database_name(alignment_result.get_db_id())
             
-            db_name = self._databases_config.get_database_name(alignment_result.get_db_id())
-            
-            self.print_record(alignment_result, db_name)
+        self._writer.write_rows(aligned, self._alignments_template(get_db_name))
         
         return
     
     def print_record(self, alignment_result, db_name = None):
-        sys.stdout.write("\t".join([
-                alignment_result.get_query_id(),
-                alignment_result.get_subject_id(),
-                str("%0.2f" % float(alignment_result.get_align_ident())),
-                str("%0.2f" % float(alignment_result.get_query_cov())),
-                str(alignment_result.get_align_score()),
-                str(alignment_result.get_strand()),
-                str(alignment_result.get_qstart_pos()),
-                str(alignment_result.get_qend_pos()),
-                str(alignment_result.get_local_position()),
-                str(alignment_result.get_end_position()),
-                str(db_name),
-                str(alignment_result.get_algorithm())
-            ]))
-        sys.stdout.write("\n")
+        self._writer.write(self._alignments_template(lambda alignment_result: db_name).format_row(alignment_result))
         
         return
+    
+    def flush(self):
+        self._writer.flush()
+    
+    def _alignments_template(self, get_db_name):
+        return RowTemplate([methodcaller("get_query_id"),
+                            methodcaller("get_subject_id"),
+                            _decimal_field(methodcaller("get_align_ident")),
+                            _decimal_field(methodcaller("get_query_cov")),
+                            methodcaller("get_align_score"),
+                            methodcaller("get_strand"),
+                            methodcaller("get_qstart_pos"),
+                            methodcaller("get_qend_pos"),
+                            methodcaller("get_local_position"),
+                            methodcaller("get_end_position"),
+                            get_db_name,
+                            methodcaller("get_algorithm")])
 
 class AlignmentsGreedyPrinter(AlignmentsPrinter):
     
@@ -172,33 +223,41 @@ class AlignmentsGreedyPrinter(AlignmentsPrinter):
             
             db_name = self._databases_config.get_database_name(db_entry)
             
-            sys.stdout.write(">"+str(db_name)+"\n")
+            self._writer.write(">"+str(db_name)+"\n")
             self.print_header()
             self.print_records_db(aligned, db_entry, db_name)
         
+        self.flush()
+        
         return
 
 class AlignmentsHierarchicalPrinter(AlignmentsPrinter):
     
     def output_results(self, aligned, databases_ids = None):
-        sys.stdout.write(">Alignments\n")
+        self._writer.write(">Alignments\n")
         self.print_header()
         self.print_records(aligned)
+        self.flush()
         
         return
     
 class AlignmentsBestScorePrinter(AlignmentsPrinter):
     
     def output_results(self, aligned, databases_ids = None):
-        sys.stdout.write(">Alignments\n")
+        self._writer.write(">Alignments\n")
         self.print_header()
         self.print_records(aligned)
+        self.flush()
         
         return
 
 ########## OutputPrinter base output printer class
 ########## This should be treated as an Abstract class
 ########## to be fully implemented in children classes
+##
+########## The rows of each map are formatted with a RowTemplate,
+########## created once for the whole map, and written through
+########## an OutputWriter (see OutputWriter.py)
 class OutputPrinter(object):
     
     _output_desc = None
@@ -219,7 +278,7 @@ class OutputPrinter(object):
     def output_features_header(self, map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param, load_annot = False, annotator = None):
         raise m2pException("Method has to be implemented in child class inheriting from OutputPrinter")
     
-    def output_features_pos(self, pos, map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param, load_annot = False, annotator = None):
+    def features_row_template(self, map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param, load_annot = False, annotator = None):
         raise m2pException("Method has to be implemented in child class inheriting from OutputPrinter")
     
     def print_maps(self, maps_dict, show_genes, show_markers, show_anchored, show_unmapped, show_unaligned, multiple_param, load_annot, annotator):
@@ -258,8 +317,8 @@ class OutputPrinter(object):
         
         ######
     
-    def _print_map_header(self, map_name, map_title = ""):
-        self._output_desc.write(">"+map_name+map_title+"\n")
+    def _print_map_header(self, writer, map_name, map_title = ""):
+        writer.write(">"+map_name+map_title+"\n")
         
         return
     
@@ -268,8 +327,10 @@ class OutputPrinter(object):
         
         sys.stderr.write("OutputFacade: creating output for map "+str(map_name)+"\n")
         
+        writer = OutputWriter(self._output_desc)
+        
         map_title = MAPPED_TITLE
-        self._print_map_header(map_name, map_title)
+        self._print_map_header(writer, map_name, map_title)
         
         map_as_physical = map_config.as_physical()
         map_has_cm_pos = map_config.has_cm_pos()
@@ -281,18 +342,17 @@ class OutputPrinter(object):
         if self._show_headers:
             headers_row = self.output_base_header(map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param)
             
-            self._output_desc.write("#"+"\t".join(headers_row)+"\n")
+            writer.write("#"+"\t".join(headers_row)+"\n")
         
         ## Rows
-        positions = mapping_results#.get_mapped()
-        for pos in positions:
-            current_row = self.output_base_pos(pos, map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param)
+        row_template = self.base_row_template(map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param)
+        num_rows = writer.write_rows(mapping_results, row_template)
             
-            self._output_desc.write("\t".join([str(x) for x in current_row])+"\n")
+        writer.flush()
         
         sys.stderr.write("\tgenetic maps printed.\n")
         
-        if self._verbose: sys.stderr.write("\tlines printed "+str(len(positions))+"\n")
+        if self._verbose: sys.stderr.write("\tlines printed "+str(num_rows)+"\n")
         
         return
     
@@ -302,8 +362,10 @@ class OutputPrinter(object):
         
         sys.stderr.write("OutputFacade: creating output for map with genes "+str(map_name)+"\n")
         
+        writer = OutputWriter(self._output_desc)
+        
         map_title = MAP_WITH_GENES_TITLE
-        self._print_map_header(map_name, map_title)
+        self._print_map_header(writer, map_name, map_title)
         
         map_as_physical = map_config.as_physical()
         #map_sort_by = mapping_results.get_sort_by()
@@ -316,20 +378,18 @@ class OutputPrinter(object):
             headers_row = self.output_features_header(map_as_physical, map_has_cm_pos, map_has_bp_pos,
                                                       multiple_param, load_annot, annotator)
             
-            self._output_desc.write("#"+"\t".join(headers_row)+"\n")
+            writer.write("#"+"\t".join(headers_row)+"\n")
         
         ## Rows
-        positions = mapping_results#.get_map_with_genes()
-        for pos in positions:
-            
-            current_row = self.output_features_pos(pos, map_as_physical, map_has_cm_pos, map_has_bp_pos,
-                                                    multiple_param, load_annot, annotator)
+        row_template = self.features_row_template(map_as_physical, map_has_cm_pos, map_has_bp_pos,
+                                                  multiple_param, load_annot, annotator)
+        num_rows = writer.write_rows(mapping_results, row_template)
             
-            self._output_desc.write("\t".join([str(x) for x in current_row])+"\n")
+        writer.flush()
             
         sys.stderr.write("OutputFacade: map with genes printed.\n")
         
-        if self._verbose: sys.stderr.write("\tlines printed "+str(len(positions))+"\n")
+        if self._verbose: sys.stderr.write("\tlines printed "+str(num_rows)+"\n")
         
         return
     
@@ -339,8 +399,10 @@ class OutputPrinter(object):
         
         sys.stderr.write("OutputFacade: creating output for map with markers "+str(map_name)+"\n")
         
+        writer = OutputWriter(self._output_desc)
+        
         map_title = MAP_WITH_MARKERS_TITLE
-        self._print_map_header(map_name, map_title)
+        self._print_map_header(writer, map_name, map_title)
         
         map_as_physical = map_config.as_physical()
         #map_sort_by = mapping_results.get_sort_by()
@@ -352,20 +414,17 @@ class OutputPrinter(object):
             
             headers_row = self.output_features_header(map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param)
             
-            self._output_desc.write("#"+"\t".join(headers_row)+"\n")
+            writer.write("#"+"\t".join(headers_row)+"\n")
         
         ## Rows
-        positions = mapping_results#.get_map_with_markers()
-        for pos in positions:
-            
-            current_row = self.output_features_pos(pos, map_as_physical, map_has_cm_pos, map_has_bp_pos,
-                                                    multiple_param)
+        row_template = self.features_row_template(map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param)
+        num_rows = writer.write_rows(mapping_results, row_template)
             
-            self._output_desc.write("\t".join([str(x) for x in current_row])+"\n")
+        writer.flush()
             
         sys.stderr.write("OutputFacade: map with markers printed.\n")
         
-        if self._verbose: sys.stderr.write("\tlines printed "+str(len(positions))+"\n")
+        if self._verbose: sys.stderr.write("\tlines printed "+str(num_rows)+"\n")
         
         return
     
@@ -375,8 +434,10 @@ class OutputPrinter(object):
         
         sys.stderr.write("OutputFacade: creating output for map with anchored features "+str(map_name)+"\n")
         
+        writer = OutputWriter(self._output_desc)
+        
         map_title = MAP_WITH_ANCHORED_TITLE
-        self._print_map_header(map_name, map_title)
+        self._print_map_header(writer, map_name, map_title)
         
         map_as_physical = map_config.as_physical()
         #map_sort_by = mapping_results.get_sort_by()
@@ -388,20 +449,17 @@ class OutputPrinter(object):
             
             headers_row = self.output_features_header(map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param)
             
-            self._output_desc.write("#"+"\t".join(headers_row)+"\n")
+            writer.write("#"+"\t".join(headers_row)+"\n")
         
         ## Rows
-        positions = mapping_results#.get_map_with_markers()
-        for pos in positions:
-            
-            current_row = self.output_features_pos(pos, map_as_physical, map_has_cm_pos, map_has_bp_pos,
-                                                    multiple_param)
+        row_template = self.features_row_template(map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param)
+        num_rows = writer.write_rows(mapping_results, row_template)
             
-            self._output_desc.write("\t".join([str(x) for x in current_row])+"\n")
+        writer.flush()
             
         sys.stderr.write("OutputFacade: map with anchored features printed.\n")
         
-        if self._verbose: sys.stderr.write("\tlines printed "+str(len(positions))+"\n")
+        if self._verbose: sys.stderr.write("\tlines printed "+str(num_rows)+"\n")
         
         return
     
@@ -417,26 +475,32 @@ class OutputPrinter(object):
         # never lack map position
         if not map_as_physical:
             ############ UNMAPPED
+            writer = OutputWriter(self._output_desc)
+            
             map_title = UNMAPPED_TITLE
-            self._print_map_header(map_name, map_title)
+            self._print_map_header(writer, map_name, map_title)
             
             unmapped_records = mapping_results#.get_unmapped()
             if unmapped_records != None: # those obtained from mapping results have no unmapped records
-                self._output_unmapped(unmapped_records)
+                self._output_unmapped(writer, unmapped_records)
+            
+            writer.flush()
         
         return
     
-    def _output_unmapped(self, unmapped_records):
+    def _output_unmapped(self, writer, unmapped_records):
         sys.stderr.write("\tprinting unmapped...\n")
         
         #self._output_desc.write("##"+section_name+"\n")
         if self._show_headers:
-            self._output_desc.write("#marker\tcontig\thas_pos_maps\n")
-        for pos in unmapped_records:
-            self._output_desc.write("\t".join([str(a) for a in pos])+"\n")
+            writer.write("#marker\tcontig\thas_pos_maps\n")
+        
+        # marker, contig, has_pos_maps
+        row_template = RowTemplate([itemgetter(0), itemgetter(1), itemgetter(2)])
+        num_rows = writer.write_rows(unmapped_records, row_template)
             
         sys.stderr.write("\tunmapped printed.\n")
-        if self._verbose: sys.stderr.write("\tUnmapped records: "+str(len(unmapped_records))+"\n")
+        if self._verbose: sys.stderr.write("\tUnmapped records: "+str(num_rows)+"\n")
         
         return
     
@@ -448,26 +512,30 @@ class OutputPrinter(object):
         
         sys.stderr.write("OutputFacade: creating output for unaligned of "+str(map_name)+" map\n")
         
+        writer = OutputWriter(self._output_desc)
+        
         ########### UNALIGNED
         map_title = UNALIGNED_TITLE
-        self._print_map_header(map_name, map_title)
+        self._print_map_header(writer, map_name, map_title)
         
         unaligned_records = mapping_results#.get_unaligned()
-        self._output_unaligned(unaligned_records)
+        self._output_unaligned(writer, unaligned_records)
+        
+        writer.flush()
         
         return
     
-    def _output_unaligned(self, unaligned_records):
+    def _output_unaligned(self, writer, unaligned_records):
         sys.stderr.write("\tprinting unaligned...\n")
         
         #self._output_desc.write("##"+section_name+"\n")
         if self._show_headers:
-            self._output_desc.write("#marker\n")
-        for pos in unaligned_records:
-            self._output_desc.write(str(pos)+"\n")
+            writer.write("#marker\n")
+        
+        num_rows = writer.write_lines((str(pos) for pos in unaligned_records))
         
         sys.stderr.write("\tunaligned printed.\n")
-        if self._verbose: sys.stderr.write("Unaligned records: "+str(len(unaligned_records))+"\n")
+        if self._verbose: sys.stderr.write("Unaligned records: "+str(num_rows)+"\n")
         
         return
     
@@ -504,56 +572,60 @@ class OutputPrinter(object):
         
         return current_row
     
-    def output_base_pos(self, pos, map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param):
+    def base_row_template(self, map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param):
+        return RowTemplate(self.base_fields(map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param))
         
-        current_row = []
+    def base_fields(self, map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param):
         
-        ## Marker ID
-        current_row.append(str(pos.get_marker_id())) #[MapFields.MARKER_NAME_POS]))
+        ## Marker ID and chromosome
+        fields = [methodcaller("get_marker_id"), methodcaller("get_chrom_name")]
         
-        ## Chromosome
-        chrom = pos.get_chrom_name() #[MapFields.MARKER_CHR_POS]
-        current_row.append(str(chrom))
+        ## Positions
+        fields.extend(self._position_fields(map_as_physical, map_has_cm_pos, map_has_bp_pos))
         
         # Physical map
         if map_as_physical:
-            current_row.append(pos.get_bp_pos())
-            current_row.append(pos.get_bp_end_pos())
-            current_row.append(pos.get_strand())
+            fields.append(methodcaller("get_strand"))
             
+        ## Multiple
+        if multiple_param:
+            fields.append(_multiple_field)
+        
+        ## Other alignments
+        fields.append(_other_alignments_field)
+        
+        return fields
+    
+    ## start and end for physical maps, cM and/or bp otherwise
+    def _position_fields(self, map_as_physical, map_has_cm_pos, map_has_bp_pos):
+        
+        fields = []
+        
+        if map_as_physical:
+            fields.append(methodcaller("get_bp_pos"))
+            fields.append(methodcaller("get_bp_end_pos"))
         else:
-            ## cM
             if map_has_cm_pos:
-                cm = pos.get_cm_pos() #[MapFields.MARKER_CM_POS]
-                if cm != "-":
-                    if self._beauty_nums:
-                        current_row.append(str("%0.2f" % float(cm)))
-                    else:
-                        current_row.append(cm)
-                else:
-                    current_row.append(cm)
+                fields.append(self._cm_field(methodcaller("get_cm_pos")))
             
-            ## bp
             if map_has_bp_pos:
-                bp = pos.get_bp_pos() #[MapFields.MARKER_BP_POS]
-                current_row.append(str(bp))
+                fields.append(methodcaller("get_bp_pos"))
         
-        if pos.is_empty():
-            if multiple_param:
-                current_row.append("-") # multiple positions
-            current_row.append("-") # other alignments
-        else:
-            ## Multiple
-            if multiple_param:
-                mult = pos.has_multiple_pos() #[MapFields.MULTIPLE_POS]
-                if mult: current_row.append("Yes")
-                else: current_row.append("No")
-                
-            ## Other alignments
-            if pos.has_other_alignments(): current_row.append("Yes")
-            else: current_row.append("No")
+        return fields
+    
+    def _cm_field(self, get_cm_pos):
         
-        return current_row
+        if self._beauty_nums:
+            def cm_field(record):
+                cm = get_cm_pos(record)
+                if cm != "-":
+                    return "%0.2f" % float(cm)
+                else:
+                    return cm
+        else:
+            cm_field = get_cm_pos
+            
+        return cm_field
     
 ## A printer to show MappingResults to the left
 ## and FeatureMappings (genes, markers, ) to the right
@@ -592,62 +664,29 @@ class ExpandedPrinter(OutputPrinter):
         
         return headers_row
     
-    def output_features_pos(self, pos, map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param,
-                            load_annot = False, annotator = None):
+    def features_row_template(self, map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param,
+                              load_annot = False, annotator = None):
         
-        #current_row = []
-        feature = pos.get_feature()
-        current_row = [feature.get_row_type()]
-        base_row = self.output_base_pos(pos, map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param)
-        current_row.extend(base_row)
+        get_feature = methodcaller("get_feature")
         
-        feature_data = []
+        fields = [related_field(get_feature, methodcaller("get_row_type"))]
+        fields.extend(self.base_fields(map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param))
         
-        feature_data.append(feature.get_feature_id())
-        #feature_data.append(feature.get_feature_type())
-        feature_data.append(feature.get_dataset_name())
-        feature_data.append(feature.get_chrom_name())
+        feature_fields = []
         
-        if map_as_physical:
-            feature_data.append(str(feature.get_bp_pos()))
-            feature_data.append(str(feature.get_bp_end_pos()))
-        else:
-            if map_has_cm_pos:
-                feature_cm = feature.get_cm_pos()
-                if feature_cm != "-":
-                    if self._beauty_nums:
-                        cm_pos = str("%0.2f" % float(feature_cm))
-                    else:
-                        cm_pos = feature_cm
-                else:
-                    cm_pos = feature_cm
-                feature_data.append(cm_pos)
+        feature_fields.append(methodcaller("get_feature_id"))
+        #feature_fields.append(methodcaller("get_feature_type"))
+        feature_fields.append(methodcaller("get_dataset_name"))
+        feature_fields.append(methodcaller("get_chrom_name"))
+        feature_fields.extend(self._position_fields(map_as_physical, map_has_cm_pos, map_has_bp_pos))
                 
-            if map_has_bp_pos:
-                feature_data.append(str(feature.get_bp_pos()))
+        fields.extend([related_field(get_feature, feature_field) for feature_field in feature_fields])
             
+        tail = None
         if load_annot:
-            gene_annots = feature.get_annots()
-            
-            anntypes_list = annotator.get_anntypes_config().get_anntypes_list()
-            loaded_anntypes = annotator.get_loaded_anntypes()
+            tail = related_field(get_feature, _annots_tail(_loaded_anntypes_ids(annotator)))
             
-            # This is read like this to keep the same order of annotation types
-            # in all the records so that they can share column (and header title)
-            for anntype_id in [anntype_id for anntype_id in anntypes_list if anntype_id in loaded_anntypes]:
-                    
-                    # load gene_annots only of that anntype
-                    gene_annots_anntype = [gene_annot for gene_annot in gene_annots if gene_annot.get_anntype().get_anntype_id()==anntype_id]
-                    if len(gene_annots_anntype)>0:
-                        for gene_annot_anntype in gene_annots_anntype:
-                            data_line = ",".join(gene_annot_anntype.get_annot_data())
-                            feature_data.append(data_line)
-                    else:
-                        feature_data.append("-")
-        
-        current_row.extend(feature_data)
-        
-        return current_row
+        return RowTemplate(fields, tail)
 
 ## A printer to show MappingResults and FeatureMappings (markers, genes,)
 ## in rows at the same level
@@ -677,41 +716,23 @@ class CollapsedPrinter(OutputPrinter):
         
         return headers_row
     
-    def output_features_pos(self, pos, map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param,
-                            load_annot = False, annotator = None):
-        
-        #sys.stderr.write("CollapsedViewPrinter: "+str(load_annot)+" - "+str(annotator)+"\n")
-        
-        current_row = [pos.get_row_type()]
-        base_row = self.output_base_pos(pos, map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param)
-        current_row.extend(base_row)
-        feature_data = []
+    def features_row_template(self, map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param,
+                              load_annot = False, annotator = None):
         
-        feature_type = pos.get_feature_type()
+        fields = [methodcaller("get_row_type")]
+        fields.extend(self.base_fields(map_as_physical, map_has_cm_pos, map_has_bp_pos, multiple_param))
         
-        if load_annot and feature_type == DatasetsConfig.DATASET_TYPE_GENE:
-            gene_annots = pos.get_annots()
-            
-            anntypes_list = annotator.get_anntypes_config().get_anntypes_list()
-            loaded_anntypes = annotator.get_loaded_anntypes()
-            
-            # This is read like this to keep the same order of annotation types
-            # in all the records so that they can share column (and header title)
-            for anntype_id in [anntype_id for anntype_id in anntypes_list if anntype_id in loaded_anntypes]:
-                    
-                    # load gene_annots only of that anntype
-                    gene_annots_anntype = [gene_annot for gene_annot in gene_annots if gene_annot.get_anntype().get_anntype_id()==anntype_id]
-                    if len(gene_annots_anntype)>0:
-                        for gene_annot_anntype in gene_annots_anntype:
-                            data_line = ",".join(gene_annot_anntype.get_annot_data())
-                            feature_data.append(data_line)
-                    else:
-                        feature_data.append("-")
-        
-        #sys.stderr.write("\tfeature_data: "+str(feature_data)+"\n")
+        tail = None
+        if load_annot:
+            annots_tail = _annots_tail(_loaded_anntypes_ids(annotator))
         
-        current_row.extend(feature_data)
+            # only genes have annotations
+            def tail(pos):
+                if pos.get_feature_type() == DatasetsConfig.DATASET_TYPE_GENE:
+                    return annots_tail(pos)
+                else:
+                    return ""
         
-        return current_row
+        return RowTemplate(fields, tail)
 
-## END
\ No newline at end of file
+## END
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# OutputMerger.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Merges the outputs of the shards of a job (--shard of bmap_align, bmap_find and bmap_locate)
+## into the output of the whole job (see bmap_merge).
+##
+## Each output has the same sections (">" and the map name, with the titles of OutputFacade),
+## each one with the rows of the queries of its shard sorted as barleymap sorts them,
+## so that the rows of each section are merged reading the outputs at the same time,
+## with the sort keys of the mapped positions (chromosome order, position, secondary
+## position and query), of the unmapped (query, contig, has_pos_maps) and of the unaligned (query).
+## Sections with features (-a, -g, -m) can not be merged.
+
+import sys, heapq
+
+from barleymapcore.maps.MapsBase import MapTypes
+from barleymapcore.maps.reader.MapReader import MapReader
+from barleymapcore.m2p_exception import m2pException
+from barleymapcore.output.OutputFacade import MAPPED_TITLE, UNMAPPED_TITLE, UNALIGNED_TITLE
+import barleymapcore.utils.profile_utils as profile_utils
+
+## Value of the positions which are not shown (e.g. cM of a map with only bp)
+NO_POS = -1.0
+
+def _float_pos(field):
+    try:
+        return float(field)
+    except ValueError:
+        return NO_POS
+
+## Reads the sections of an output, one after another
+class ShardOutputReader(object):
+    
+    _output_path = ""
+    _output_file = None
+    _line = None
+    
+    def __init__(self, output_path):
+        self._output_path = output_path
+        self._output_file = open(output_path, 'r')
+        self._line = self._output_file.readline()
+    
+    def get_output_path(self):
+        return self._output_path
+    
+    def close(self):
+        self._output_file.close()
+    
+    ## The title and header lines of the next section, or None at the end of the output
+    def next_section(self):
+        
+        # rows of the previous section not read
+        while self._line != "" and not self._line.startswith(">"):
+            self._line = self._output_file.readline()
+        
+        if self._line == "":
+            return None
+        
+        title = self._line[1:].rstrip("\n")
+        
+        headers = []
+        self._line = self._output_file.readline()
+        while self._line.startswith("#"):
+            headers.append(self._line)
+            self._line = self._output_file.readline()
+        
+        return (title, headers)
+    
+    ## The rows of the current section
+    def rows(self):
+        while self._line != "" and not self._line.startswith(">"):
+            yield self._line if self._line.endswith("\n") else self._line+"\n"
+            self._line = self._output_file.readline()
+
+class OutputMerger(object):
+    
+    _maps_path = ""
+    _sort_param = ""
+    _default_sort_param = ""
+    _verbose = False
+    
+    # map_config by map name
+    _maps_configs = None
+    # key function of the rows by section title
+    _keys_funcs = None
+    
+    def __init__(self, maps_path, maps_configs, sort_param, default_sort_param, verbose = False):
+        self._maps_path = maps_path
+        self._sort_param = sort_param
+        self._default_sort_param = default_sort_param
+        self._verbose = verbose
+        
+        self._maps_configs = dict([(map_config.get_name(), map_config) for map_config in maps_configs])
+        self._keys_funcs = {}
+    
+    ## Writes the sections of the outputs, with the rows of each one merged, to output_desc
+    def merge(self, outputs_paths, output_desc):
+        
+        readers = [ShardOutputReader(output_path) for output_path in outputs_paths]
+        
+        try:
+            while True:
+                sections = [reader.next_section() for reader in readers]
+                
+                if all([section == None for section in sections]):
+                    break
+                
+                for (reader, section) in zip(readers, sections):
+                    if section == None or section[0] != sections[0][0]:
+                        raise m2pException("OutputMerger: the sections of "+reader.get_output_path()+" "+\
+                                           "do not match those of "+readers[0].get_output_path()+". "+\
+                                           "The outputs have to be from the same job, with the same parameters.")
+                
+                (title, headers) = sections[0]
+                key_func = self._get_key_func(title)
+                
+                if self._verbose: sys.stderr.write("OutputMerger: merging section "+title+"\n")
+                
+                output_desc.write(">"+title+"\n")
+                for header in headers:
+                    output_desc.write(header)
+                
+                num_rows = 0
+                with profile_utils.timer("merge/"+title):
+                    keyed_rows = [self._keyed_rows(reader, shard_index, key_func) \
+                                  for (shard_index, reader) in enumerate(readers)]
+                    
+                    for (row_key, row) in heapq.merge(*keyed_rows):
+                        output_desc.write(row)
+                        num_rows += 1
+                
+                profile_utils.count("merge/rows", num_rows)
+                
+                if self._verbose: sys.stderr.write("\trows merged "+str(num_rows)+"\n")
+        
+        finally:
+            for reader in readers:
+                reader.close()
+        
+        return
+    
+    ## The rows are unique by shard and row index, and so the rows themselves are never compared
+    def _keyed_rows(self, reader, shard_index, key_func):
+        for (row_index, row) in enumerate(reader.rows()):
+            yield ((key_func(row), shard_index, row_index), row)
+    
+    def _get_key_func(self, title):
+        
+        if title in self._keys_funcs:
+            return self._keys_funcs[title]
+        
+        if self._get_map_config(title, MAPPED_TITLE) != None:
+            key_func = self._mapped_key_func(self._get_map_config(title, MAPPED_TITLE))
+        
+        elif self._get_map_config(title, UNMAPPED_TITLE) != None:
+            # marker, contig, has_pos_maps ("False" and "True" sort as the booleans)
+            key_func = lambda row: tuple(row.rstrip("\n").split("\t")[:3])
+        
+        elif self._get_map_config(title, UNALIGNED_TITLE) != None:
+            key_func = lambda row: row.rstrip("\n")
+        
+        else:
+            raise m2pException("OutputMerger: the section "+title+" can not be merged. "+\
+                               "Only the sections of mapped, unmapped and unaligned queries of the maps in the configuration "+\
+                               "(without -a, -g and -m) can be merged.")
+        
+        self._keys_funcs[title] = key_func
+        
+        return key_func
+    
+    ## The map_config of a section with this map title (see OutputFacade), or None
+    def _get_map_config(self, title, map_title):
+        if not title.endswith(map_title): return None
+        
+        return self._maps_configs.get(title[:len(title)-len(map_title)])
+    
+    ## The sort key of the mapped positions (see Mapper.get_positions_sort_key),
+    ## obtained from the columns of the rows
+    def _mapped_key_func(self, map_config):
+        
+        sort_by = map_config.check_sort_param(map_config, self._sort_param, self._default_sort_param)
+        
+        chrom_dict = MapReader(self._maps_path, map_config, self._verbose).get_chrom_dict()
+        
+        if map_config.as_physical():
+            # marker, chr, start, end, strand
+            cm_column = None
+            bp_column = 2
+        else:
+            # marker, chr, cM and/or bp
+            cm_column = 2 if map_config.has_cm_pos() else None
+            if map_config.has_bp_pos():
+                bp_column = 3 if map_config.has_cm_pos() else 2
+            else:
+                bp_column = None
+        
+        def get_pos(fields, column):
+            return _float_pos(fields[column]) if column != None else NO_POS
+        
+        def mapped_key(row):
+            fields = row.rstrip("\n").split("\t")
+            
+            chrom_name = fields[1]
+            if chrom_name not in chrom_dict:
+                raise m2pException("OutputMerger: chromosome "+chrom_name+" is not in map "+map_config.get_name()+".")
+            
+            cm_pos = get_pos(fields, cm_column)
+            bp_pos = get_pos(fields, bp_column)
+            
+            if sort_by == MapTypes.MAP_SORT_PARAM_CM:
+                return (int(chrom_dict[chrom_name]), cm_pos, bp_pos, fields[0])
+            else:
+                return (int(chrom_dict[chrom_name]), bp_pos, cm_pos, fields[0])
+        
+        return mapped_key
+
+## END
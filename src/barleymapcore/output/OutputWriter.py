@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# OutputWriter.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Buffered output of rows formatted with row templates.
+##
+## A RowTemplate is created once for each kind of output (physical or cM/bp map,
+## with or without features and annotations, alignments, ...) with the functions
+## which obtain each field of a record, and formats every record with a single
+## "%s\t%s...\n" operation. Its tail function, if any, returns the variable fields
+## of a record (e.g. annotations), already joined and preceded by a tab.
+##
+## OutputWriter formats the records of any iterable (lists or generators,
+## which are consumed by chunks and never as a whole) and writes them
+## to the output file in chunks of up to buffer_size bytes.
+
+from itertools import islice
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# Records formatted at once
+CHUNK_ROWS = 1000
+
+## A function to obtain a field of a record from an object related to it
+## (e.g. the feature of a MappingResult)
+def related_field(get_related, field):
+    return lambda record: field(get_related(record))
+
+class RowTemplate(object):
+    
+    _fields = None
+    _tail = None
+    _row_format = ""
+    
+    def __init__(self, fields, tail = None):
+        self._fields = fields
+        self._tail = tail
+        self._row_format = "\t".join(["%s"] * len(fields))
+        
+        if tail == None:
+            self._row_format += "\n"
+    
+    def get_num_fields(self):
+        return len(self._fields)
+    
+    def format_row(self, record):
+        row = self._row_format % tuple([field(record) for field in self._fields])
+        
+        if self._tail != None:
+            row = row+self._tail(record)+"\n"
+        
+        return row
+
+class OutputWriter(object):
+    
+    _output_desc = None
+    _buffer = None
+    _buffer_len = 0
+    _buffer_size = DEFAULT_BUFFER_SIZE
+    
+    def __init__(self, output_desc, buffer_size = DEFAULT_BUFFER_SIZE):
+        self._output_desc = output_desc
+        self._buffer = []
+        self._buffer_len = 0
+        self._buffer_size = buffer_size
+    
+    def get_output_desc(self):
+        return self._output_desc
+    
+    def write(self, text):
+        self._buffer.append(text)
+        self._buffer_len += len(text)
+        
+        if self._buffer_len >= self._buffer_size:
+            self.flush()
+        
+        return
+    
+    ## Formats and writes the records. Returns the number of records written
+    def write_rows(self, records, row_template):
+        num_rows = 0
+        
+        format_row = row_template.format_row
+        records = iter(records)
+        while True:
+            chunk = [format_row(record) for record in islice(records, CHUNK_ROWS)]
+            if len(chunk) == 0: break
+            
+            self.write("".join(chunk))
+            num_rows += len(chunk)
+        
+        return num_rows
+    
+    ## Writes lines already formatted (without the newline)
+    def write_lines(self, lines):
+        num_lines = 0
+        
+        lines = iter(lines)
+        while True:
+            chunk = list(islice(lines, CHUNK_ROWS))
+            if len(chunk) == 0: break
+            
+            self.write("\n".join(chunk)+"\n")
+            num_lines += len(chunk)
+        
+        return num_lines
+    
+    def flush(self):
+        if self._buffer_len > 0:
+            self._output_desc.write("".join(self._buffer))
+            self._buffer = []
+            self._buffer_len = 0
+        
+        return
+
+## END
@@ -5,7 +5,24 @@
 # Copyright (C)  2013-2014  Carlos P Cantalapiedra.
 # (terms of use can be found within the distributed LICENSE file).
 
-import os, tempfile
+import sys, os, re, tempfile, hashlib, math, signal, threading
+from subprocess import Popen, PIPE, STDOUT
+
+from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+
+# Lower bound of the identity of the hits which pass the threshold of barleymap,
+# which compares the identity reported by blast, rounded to 2 or 3 decimals
+PREFILTER_MARGIN = 0.01
+
+# Help of each aligner command, by command (see aligner_options)
+_aligners_help = {}
+
+# Aligner commands running in each thread which can be stopped (see begin_aligner_commands),
+# by ID of the thread: {"processes":set of Popen, "stopped":bool},
+# the same for the threads started by another one to align for it
+_threads_commands = {}
+_threads_commands_lock = threading.Lock()
 
 def load_fasta_lengths(fasta_path):
     len_dict = {}
@@ -27,12 +44,53 @@ def load_fasta_lengths(fasta_path):
     
     return len_dict
 
-def get_fasta_headers(fasta_path):
-    fasta_headers = []
+# Identifier (header up to the first space) and MD5 of the sequence (upper case, no line breaks)
+# of each record, in the order of the FASTA file
+def iter_fasta_hashes(fasta_path):
+    fasta_id = None
+    seq_hash = None
+    for fasta_line in open(fasta_path, 'r'):
+        if fasta_line.startswith(">"):
+            if fasta_id != None:
+                yield (fasta_id, seq_hash.hexdigest())
+            fasta_id = fasta_line[1:].strip().split(" ")[0]
+            seq_hash = hashlib.md5()
+        elif fasta_id != None:
+            seq_hash.update(fasta_line.strip().upper())
+    
+    if fasta_id != None:
+        yield (fasta_id, seq_hash.hexdigest())
+    
+# MD5 of each sequence (upper case, no line breaks)
+# by identifier (header up to the first space)
+def load_fasta_hashes(fasta_path):
+    return dict(iter_fasta_hashes(fasta_path))
+
+# The sequences of a FASTA file, as (identifier, sequence in upper case) tuples,
+# the identifier being the header up to the first space
+def read_fasta_sequences(fasta_path):
+    seq_id = None
+    seq_lines = []
     
     for fasta_line in open(fasta_path, 'r'):
         if fasta_line.startswith(">"):
-            fasta_headers.append(fasta_line[1:].strip())
+            if seq_id != None:
+                yield (seq_id, "".join(seq_lines).upper())
+            seq_id = fasta_line[1:].strip().split(" ")[0]
+            seq_lines = []
+        elif seq_id != None:
+            seq_lines.append(fasta_line.strip())
+    
+    if seq_id != None:
+        yield (seq_id, "".join(seq_lines).upper())
+
+def get_fasta_headers(fasta_path):
+    fasta_headers = []
+    
+    with profile_utils.timer("query/parse"):
+        for fasta_line in open(fasta_path, 'r'):
+            if fasta_line.startswith(">"):
+                fasta_headers.append(fasta_line[1:].strip())
     
     return fasta_headers
 
@@ -84,4 +142,204 @@ def extract_fasta_headers(fasta_path, headers_list, tmp_files_dir):
     
     return new_fasta_path
 
+# Writes the sequences of the identifiers in representatives_dict to a new FASTA file,
+# with the identifier of their representative (representatives_dict[identifier]) as header
+def write_fasta_representatives(fasta_path, representatives_dict, tmp_files_dir):
+    (file_desc, new_fasta_path) = tempfile.mkstemp(suffix="_m2p_dedup", dir=tmp_files_dir)
+    output_file = os.fdopen(file_desc, 'w')
+    try:
+        seq_found = False
+        for line in open(fasta_path, 'r'):
+            if line.startswith(">"):
+                seqid = line[1:].strip().split(" ")[0]
+                seq_found = seqid in representatives_dict
+                if seq_found:
+                    output_file.write(">"+representatives_dict[seqid]+"\n")
+                
+            elif seq_found:
+                output_file.write(line)
+    finally:
+        output_file.close()
+    
+    return new_fasta_path
+
+def _write_fasta_chunk(chunk_lines, tmp_files_dir):
+    (file_desc, chunk_path) = tempfile.mkstemp(suffix="_m2p_chunk", dir=tmp_files_dir)
+    chunk_file = os.fdopen(file_desc, 'w')
+    try:
+        chunk_file.writelines(chunk_lines)
+    finally:
+        chunk_file.close()
+    
+    return chunk_path
+
+## Splits a FASTA file in chunks of up to chunk_size sequences.
+## Yields the path of each chunk, a temporary file which
+## is removed when the next chunk is requested.
+def split_fasta(fasta_path, chunk_size, tmp_files_dir):
+    chunk_lines = []
+    num_seqs = 0
+    
+    with open(fasta_path, 'r') as fasta_file:
+        for fasta_line in fasta_file:
+            if fasta_line.startswith(">"):
+                if num_seqs == chunk_size:
+                    chunk_path = _write_fasta_chunk(chunk_lines, tmp_files_dir)
+                    chunk_lines = []
+                    num_seqs = 0
+                    try:
+                        yield chunk_path
+                    finally:
+                        os.remove(chunk_path)
+                
+                num_seqs += 1
+            
+            chunk_lines.append(fasta_line)
+    
+    if num_seqs > 0:
+        chunk_path = _write_fasta_chunk(chunk_lines, tmp_files_dir)
+        try:
+            yield chunk_path
+        finally:
+            os.remove(chunk_path)
+
+## Runs the command of an aligner (a shell command line), returning
+## its output, its error output (None if verbose, since it goes to stderr) and its return code.
+## Raises m2pException if the aligner commands of the thread have been stopped.
+def run_aligner_command(cmd, verbose = False):
+    thread_id = threading.current_thread().ident
+    
+    with _threads_commands_lock:
+        thread_commands = _threads_commands.get(thread_id)
+        if thread_commands != None and thread_commands["stopped"]:
+            raise m2pException("The alignment was stopped: "+cmd)
+        
+        p = Popen(cmd, shell=True, stdout=PIPE, stderr=sys.stderr if verbose else PIPE)
+        if thread_commands != None: thread_commands["processes"].add(p)
+    
+    try:
+        (output, output_err) = p.communicate()
+    finally:
+        if thread_commands != None:
+            with _threads_commands_lock:
+                thread_commands["processes"].discard(p)
+    
+    return (output, output_err, p.returncode)
+
+## The aligner commands run by the current thread, from now until end_aligner_commands,
+## can be stopped from other threads (stop_aligner_commands).
+## With the ID of the thread which started it (parent_thread_id), if that one can be stopped,
+## they are stopped along with those of that thread instead.
+def begin_aligner_commands(parent_thread_id = None):
+    with _threads_commands_lock:
+        thread_commands = _threads_commands.get(parent_thread_id)
+        if thread_commands == None: thread_commands = {"processes":set(), "stopped":False}
+        
+        _threads_commands[threading.current_thread().ident] = thread_commands
+    
+    return
+
+def end_aligner_commands():
+    with _threads_commands_lock:
+        _threads_commands.pop(threading.current_thread().ident, None)
+    
+    return
+
+## Kills the aligner commands running in the thread (and in the threads started by it), if any,
+## and makes the next ones fail (see run_aligner_command), until end_aligner_commands
+def stop_aligner_commands(thread_id):
+    with _threads_commands_lock:
+        thread_commands = _threads_commands.get(thread_id)
+        if thread_commands == None: return
+        
+        thread_commands["stopped"] = True
+        for p in thread_commands["processes"]:
+            if p.poll() == None: _kill_process_tree(p.pid)
+    
+    return
+
+# Parent of each process, by process ID (empty if there is no /proc)
+def _get_parent_pids():
+    parent_pids = {}
+    
+    try:
+        proc_dirs = os.listdir("/proc")
+    except OSError:
+        return parent_pids
+    
+    for proc_dir in proc_dirs:
+        if not proc_dir.isdigit(): continue
+        try:
+            with open(os.path.join("/proc", proc_dir, "stat"), 'r') as stat_file:
+                stat = stat_file.read()
+        except IOError:
+            continue
+        # (the fields after the name, which is between parentheses, are state and parent)
+        parent_pids[int(proc_dir)] = int(stat[stat.rfind(")")+2:].split(" ")[1])
+    
+    return parent_pids
+
+## Kills the process and its descendants (e.g. the shell of an aligner command,
+## the aligner and the processes it runs), which are stopped first, so that
+## they do not start new processes meanwhile
+def _kill_process_tree(pid):
+    stopped = []
+    
+    tree = [pid]
+    while len(tree) > len(stopped):
+        for tree_pid in tree:
+            if tree_pid in stopped: continue
+            try:
+                os.kill(tree_pid, signal.SIGSTOP)
+            except OSError:
+                pass
+            stopped.append(tree_pid)
+        
+        parent_pids = _get_parent_pids()
+        tree = [pid]
+        for tree_pid in tree:
+            tree.extend([child_pid for (child_pid, parent_pid) in parent_pids.iteritems() if parent_pid == tree_pid])
+    
+    for tree_pid in stopped:
+        try:
+            os.kill(tree_pid, signal.SIGKILL)
+        except OSError:
+            pass
+    
+    return
+
+## Options listed in the help of an aligner (e.g. "blastn -help"),
+## which is run only once for each command.
+## Returns an empty set if the help can not be obtained.
+def aligner_options(help_cmd):
+    if not help_cmd in _aligners_help:
+        try:
+            p = Popen(help_cmd, shell=True, stdout=PIPE, stderr=STDOUT)
+            output = p.communicate()[0]
+        except OSError:
+            output = ""
+        
+        # e.g. "[-perc_identity float_value]", " -perc_identity <Real, 0..100>" or "  --ordered"
+        _aligners_help[help_cmd] = set(re.findall(r"(?:^|[\s\[])(--?\w+)", output))
+    
+    return _aligners_help[help_cmd]
+
+## Thresholds for the identity and query coverage (of the HSP) filters of blast
+## (-perc_identity and -qcov_hsp_perc), which keep at least the hits which pass
+## the barleymap filters.
+## Blast measures the coverage over the query span of the HSP, and barleymap
+## over the alignment length, which includes the gaps in the query. These gaps are
+## at most (100 - identity)% of the alignment length, and so for the hits which pass
+## both barleymap thresholds the query span covers at least threshold_cov * threshold_id / 100.
+## Returns (prefilter_id, prefilter_cov)
+def blast_prefilter_thresholds(threshold_id, threshold_cov):
+    prefilter_id = max(float(threshold_id) - PREFILTER_MARGIN, 0.0)
+    prefilter_cov = max(float(threshold_cov) * prefilter_id / 100.0 - PREFILTER_MARGIN, 0.0)
+    
+    # rounded down, so that the options do not filter more
+    prefilter_id = math.floor(prefilter_id * 100) / 100.0
+    prefilter_cov = math.floor(prefilter_cov * 100) / 100.0
+    
+    return (prefilter_id, prefilter_cov)
+
 ## END
\ No newline at end of file
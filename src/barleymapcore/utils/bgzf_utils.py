@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bgzf_utils.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Block compressed files (BGZF, as written by bgzip from htslib):
+## a series of gzip members of up to 64KB of uncompressed data each,
+## so that a row can be reached by seeking to a "virtual offset":
+## (compressed offset of its block << 16) | offset of the row within the block
+
+import os, struct, zlib
+
+from barleymapcore.m2p_exception import m2pException
+
+# gzip header with the "BC" extra subfield (block size - 1)
+BGZF_HEADER = "<4BI2BH2BHH"
+BGZF_HEADER_SIZE = struct.calcsize(BGZF_HEADER)
+BGZF_MAGIC = "\x1f\x8b\x08\x04"
+BGZF_FOOTER = "<2I"
+BGZF_FOOTER_SIZE = struct.calcsize(BGZF_FOOTER)
+
+# Maximum uncompressed data per block (as bgzip), so that
+# the compressed block always fits within 64KB
+BGZF_MAX_DATA = 0xff00
+
+BGZF_EOF = "\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+DEFAULT_LEVEL = 6
+
+def is_bgzf(file_path):
+    is_bgzf_file = False
+    
+    if os.path.exists(file_path) and os.path.isfile(file_path):
+        with open(file_path, 'rb') as file_f:
+            header = file_f.read(BGZF_HEADER_SIZE)
+        
+        is_bgzf_file = len(header) == BGZF_HEADER_SIZE and header.startswith(BGZF_MAGIC) and header[12:14] == "BC"
+    
+    return is_bgzf_file
+
+## Opens a data file (dataset or map) for reading,
+## either plain text or block compressed
+def open_data_file(file_path):
+    if is_bgzf(file_path):
+        data_f = BgzfReader(file_path)
+    else:
+        data_f = open(file_path, 'r')
+    
+    return data_f
+
+def make_virtual_offset(block_offset, data_offset):
+    return (block_offset << 16) | data_offset
+
+def split_virtual_offset(virtual_offset):
+    return (virtual_offset >> 16, virtual_offset & 0xffff)
+
+## Writes text to a block compressed file.
+## tell() returns the virtual offset of the next byte to be written.
+class BgzfWriter(object):
+    
+    _file = None
+    _level = DEFAULT_LEVEL
+    _block_offset = 0
+    _buffer = None
+    _buffer_size = 0
+    
+    def __init__(self, file_path, level = DEFAULT_LEVEL):
+        self._file = open(file_path, 'wb')
+        self._level = level
+        self._block_offset = 0
+        self._buffer = []
+        self._buffer_size = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data)+compressor.flush()
+        
+        block_size = BGZF_HEADER_SIZE+len(cdata)+BGZF_FOOTER_SIZE
+        
+        self._file.write(struct.pack(BGZF_HEADER, 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, block_size - 1))
+        self._file.write(cdata)
+        self._file.write(struct.pack(BGZF_FOOTER, zlib.crc32(data) & 0xffffffff, len(data)))
+        
+        self._block_offset += block_size
+    
+    def write(self, text):
+        self._buffer.append(text)
+        self._buffer_size += len(text)
+        
+        if self._buffer_size >= BGZF_MAX_DATA:
+            data = "".join(self._buffer)
+            
+            data_pos = 0
+            while len(data) - data_pos >= BGZF_MAX_DATA:
+                self._write_block(data[data_pos:data_pos+BGZF_MAX_DATA])
+                data_pos += BGZF_MAX_DATA
+            
+            data = data[data_pos:]
+            self._buffer = [data]
+            self._buffer_size = len(data)
+        
+        return
+    
+    def tell(self):
+        return make_virtual_offset(self._block_offset, self._buffer_size)
+    
+    def flush(self):
+        if self._buffer_size > 0:
+            self._write_block("".join(self._buffer))
+            self._buffer = []
+            self._buffer_size = 0
+        
+        self._file.flush()
+    
+    def close(self):
+        if self._file.closed: return
+        
+        self.flush()
+        self._file.write(BGZF_EOF)
+        self._file.close()
+
+## Reads lines from a block compressed file,
+## seeking to the virtual offsets obtained from tell() or from the indexes.
+class BgzfReader(object):
+    
+    _file = None
+    _block_offset = 0
+    _next_block_offset = 0
+    _data = ""
+    _data_pos = 0
+    
+    def __init__(self, file_path):
+        self._file = open(file_path, 'rb')
+        self._load_block(0)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line: break
+            yield line
+    
+    def _load_block(self, block_offset):
+        self._file.seek(block_offset)
+        self._block_offset = block_offset
+        self._data = ""
+        self._data_pos = 0
+        
+        header = self._file.read(12)
+        if len(header) < 12:
+            self._next_block_offset = block_offset
+            return
+        
+        if not header.startswith(BGZF_MAGIC):
+            raise m2pException("BgzfReader: wrong block header at offset "+str(block_offset)+" of "+self._file.name)
+        
+        # "BC" subfield with the size of the block
+        xlen = struct.unpack("<H", header[10:12])[0]
+        extra = self._file.read(xlen)
+        block_size = -1
+        extra_pos = 0
+        while extra_pos < xlen:
+            (si1, si2, slen) = struct.unpack("<2BH", extra[extra_pos:extra_pos+4])
+            if si1 == 66 and si2 == 67:
+                block_size = struct.unpack("<H", extra[extra_pos+4:extra_pos+6])[0] + 1
+            extra_pos += 4+slen
+        
+        if block_size == -1:
+            raise m2pException("BgzfReader: BC field not found at offset "+str(block_offset)+" of "+self._file.name)
+        
+        cdata = self._file.read(block_size - 12 - xlen - BGZF_FOOTER_SIZE)
+        (crc, data_size) = struct.unpack(BGZF_FOOTER, self._file.read(BGZF_FOOTER_SIZE))
+        
+        self._data = zlib.decompress(cdata, -15)
+        self._next_block_offset = block_offset + block_size
+        
+        if len(self._data) != data_size:
+            raise m2pException("BgzfReader: wrong block size at offset "+str(block_offset)+" of "+self._file.name)
+    
+    # Moves to the next block with data, if current one has been fully read.
+    # Returns False at the end of file
+    def _next_data(self):
+        while self._data_pos >= len(self._data):
+            if self._next_block_offset == self._block_offset: return False
+            self._load_block(self._next_block_offset)
+        
+        return True
+    
+    def tell(self):
+        if self._data_pos >= len(self._data) and self._next_block_offset != self._block_offset:
+            virtual_offset = make_virtual_offset(self._next_block_offset, 0)
+        else:
+            virtual_offset = make_virtual_offset(self._block_offset, self._data_pos)
+        
+        return virtual_offset
+    
+    def seek(self, virtual_offset):
+        (block_offset, data_pos) = split_virtual_offset(virtual_offset)
+        
+        if block_offset != self._block_offset or self._next_block_offset == self._block_offset:
+            self._load_block(block_offset)
+        
+        self._data_pos = data_pos
+    
+    def readline(self):
+        line_parts = []
+        
+        while self._next_data():
+            line_end = self._data.find("\n", self._data_pos)
+            if line_end == -1:
+                line_parts.append(self._data[self._data_pos:])
+                self._data_pos = len(self._data)
+            else:
+                line_parts.append(self._data[self._data_pos:line_end+1])
+                self._data_pos = line_end+1
+                break
+        
+        return "".join(line_parts)
+    
+    def close(self):
+        self._file.close()
+
+## Compresses a plain text file.
+## Note that offsets in the indexes of the plain file are not valid for the new one.
+def compress_file(input_path, output_path, level = DEFAULT_LEVEL):
+    
+    with BgzfWriter(output_path, level) as output_f:
+        with open(input_path, 'r') as input_f:
+            for line in input_f:
+                output_f.write(line)
+    
+    return output_path
+
+## END
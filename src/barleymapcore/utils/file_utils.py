@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# file_utils.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Hashes of the content of files, and files (and directories) written to a temporary
+## path which then replaces the final one, so that other processes, or the same job run again
+## after being interrupted, never read them partially written.
+## Used by the stores of the pipeline: raw hits (RawHitsStore), checkpoints (job_checkpoints),
+## indexes (m2p_exact), sketches (DatabasesPrescreen) and statistics (search_stats).
+
+import os, shutil, hashlib, tempfile, zlib
+import cPickle
+
+# Bytes of a file read at once to compute its hash
+READ_SIZE = 1024 * 1024
+
+# Errors of reading a file written by save_compressed_pickle (see load_compressed_pickle)
+PICKLE_ERRORS = (IOError, OSError, zlib.error, cPickle.UnpicklingError, EOFError)
+
+# hashes of the files already read, by path, size and modification time
+_files_hashes = {}
+
+## SHA-1 of the content of a file, which is read again only if it changes
+def get_file_hash(file_path):
+    file_stat = os.stat(file_path)
+    file_key = (os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime)
+    
+    if file_key in _files_hashes:
+        return _files_hashes[file_key]
+    
+    file_sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as file_desc:
+        while True:
+            data = file_desc.read(READ_SIZE)
+            if not data: break
+            file_sha1.update(data)
+    
+    _files_hashes[file_key] = file_sha1.hexdigest()
+    
+    return _files_hashes[file_key]
+
+## Writes a file with write_func(file_desc) to a temporary file, in the same directory,
+## which then replaces file_path. Raises IOError or OSError if it can not be written.
+def write_file_atomic(file_path, write_func, suffix = ".tmp", mode = 'wb'):
+    tmp_path = None
+    try:
+        (file_desc, tmp_path) = tempfile.mkstemp(suffix=suffix, dir=os.path.dirname(os.path.abspath(file_path)))
+        with os.fdopen(file_desc, mode) as tmp_file:
+            write_func(tmp_file)
+        os.chmod(tmp_path, 0644)
+        
+        os.rename(tmp_path, file_path)
+        tmp_path = None
+    finally:
+        if tmp_path != None and os.path.exists(tmp_path): os.remove(tmp_path)
+    
+    return
+
+## Writes a directory with write_func(dir_path) to a temporary directory, next to it,
+## which then replaces dir_path. Raises IOError or OSError if it can not be written.
+def write_dir_atomic(dir_path, write_func, suffix = ".tmp"):
+    tmp_path = None
+    try:
+        tmp_path = tempfile.mkdtemp(suffix=suffix, dir=os.path.dirname(os.path.abspath(dir_path)))
+        os.chmod(tmp_path, 0755)
+        write_func(tmp_path)
+        
+        if os.path.exists(dir_path): shutil.rmtree(dir_path)
+        os.rename(tmp_path, dir_path)
+        tmp_path = None
+    finally:
+        if tmp_path != None and os.path.exists(tmp_path): shutil.rmtree(tmp_path)
+    
+    return
+
+## Saves the data (cPickle, protocol 2, compressed with zlib) with write_file_atomic
+def save_compressed_pickle(file_path, data, suffix = ".tmp"):
+    write_file_atomic(file_path, lambda file_desc: file_desc.write(zlib.compress(cPickle.dumps(data, 2))), suffix)
+    
+    return
+
+## The data saved by save_compressed_pickle. Raises any of PICKLE_ERRORS if it can not be read.
+def load_compressed_pickle(file_path):
+    with open(file_path, 'rb') as file_desc:
+        return cPickle.loads(zlib.decompress(file_desc.read()))
+
+## END
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# job_checkpoints.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Checkpoints of the units of work of a job, written to a job directory
+## with the --resume option of the bmap_* scripts, so that a job interrupted
+## (out of memory, killed, a crashed aligner...) and run again with the same
+## job directory skips the units completed before.
+##
+## The units are the alignments to each database (see CheckpointAligner),
+## whose hits and unaligned queries are saved, and the map files of each dataset
+## of bmap_build_datasets. Each checkpoint is a file <job_path>/<kind>/<SHA-1 of its key>.ckpt,
+## with the key and data of the unit (see file_utils.save_compressed_pickle),
+## so that an interrupted job never leaves a checkpoint partially written. The key of a unit has everything
+## its results depend on (e.g. the hash of the content of the query FASTA),
+## so that other jobs, or the same one with other parameters, do not use it.
+##
+## Checkpoints are disabled unless configure() is called: load() returns None right away.
+
+import sys, os, hashlib
+
+from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.file_utils as file_utils
+
+ALIGNMENTS = "alignments"
+DATASETS = "datasets"
+
+CHECKPOINT_SUFFIX = ".ckpt"
+
+_job_path = None
+
+def configure(job_path):
+    global _job_path
+    
+    for kind in [ALIGNMENTS, DATASETS]:
+        kind_path = os.path.join(job_path, kind)
+        if not os.path.isdir(kind_path):
+            try:
+                os.makedirs(kind_path)
+            except OSError as e:
+                raise m2pException("job_checkpoints: could not create the job directory "+kind_path+": "+str(e))
+    
+    _job_path = job_path
+    
+    return
+
+def is_enabled():
+    return _job_path != None
+
+def _get_checkpoint_path(kind, key):
+    return os.path.join(_job_path, kind, hashlib.sha1("\t".join(key)).hexdigest()+CHECKPOINT_SUFFIX)
+
+## The data saved for the unit (kind ALIGNMENTS or DATASETS) with this key (a tuple of strings),
+## or None if there is no checkpoint of it
+def load(kind, key):
+    if not is_enabled(): return None
+    
+    checkpoint_path = _get_checkpoint_path(kind, key)
+    
+    data = None
+    
+    if os.path.exists(checkpoint_path):
+        try:
+            checkpoint = file_utils.load_compressed_pickle(checkpoint_path)
+            
+            if checkpoint["key"] == key:
+                data = checkpoint["data"]
+        
+        except file_utils.PICKLE_ERRORS as e:
+            sys.stderr.write("job_checkpoints: WARNING, could not read "+checkpoint_path+": "+str(e)+"\n")
+    
+    if data != None: profile_utils.count("checkpoints/"+kind+"/restored")
+    
+    return data
+
+## Saves the data of the unit to a temporary file which then replaces its checkpoint
+def save(kind, key, data):
+    if not is_enabled(): return
+    
+    checkpoint_path = _get_checkpoint_path(kind, key)
+    
+    try:
+        file_utils.save_compressed_pickle(checkpoint_path, {"key":key, "data":data}, CHECKPOINT_SUFFIX)
+        
+        profile_utils.count("checkpoints/"+kind+"/saved")
+    
+    except (IOError, OSError) as e:
+        sys.stderr.write("job_checkpoints: WARNING, the checkpoint could not be saved to "+checkpoint_path+": "+str(e)+"\n")
+    
+    return
+
+## END
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# profile_utils.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Timers and counters of the stages of the pipeline,
+## reported as JSON with the --profile option of the bmap_* scripts.
+##
+## Profiling is disabled unless enable() is called: timer() returns
+## a shared object which does nothing and count() returns right away,
+## so that the instrumented code does not pay for it.
+## Instrumentation is placed around whole stages (an alignment, a dataset scan, ...),
+## never for each row, and the counts of rows are accumulated by the caller.
+##
+## Stage and counter names are paths separated by "/" (e.g. "align/gmap/<db>").
+## Times of a stage include those of the stages nested within it.
+
+import sys, os, time, json
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_enabled = False
+_report_path = None
+_ini_wall = 0.0
+_ini_times = None
+_stages = None
+_counters = None
+
+class _NullTimer(object):
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _StageTimer(object):
+    
+    _stage = ""
+    _ini_wall = 0.0
+    _ini_times = None
+    
+    def __init__(self, stage):
+        self._stage = stage
+    
+    def __enter__(self):
+        self._ini_times = os.times()
+        self._ini_wall = time.time()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_time = time.time() - self._ini_wall
+        end_times = os.times()
+        
+        cpu_time = (end_times[0] - self._ini_times[0]) + (end_times[1] - self._ini_times[1])
+        # subprocesses (aligners) which were waited for within the stage
+        children_cpu_time = (end_times[2] - self._ini_times[2]) + (end_times[3] - self._ini_times[3])
+        
+        stage_data = _stages.get(self._stage)
+        if stage_data == None:
+            stage_data = {"calls":0, "wall_time":0.0, "cpu_time":0.0, "children_cpu_time":0.0}
+            _stages[self._stage] = stage_data
+        
+        stage_data["calls"] += 1
+        stage_data["wall_time"] += wall_time
+        stage_data["cpu_time"] += cpu_time
+        stage_data["children_cpu_time"] += children_cpu_time
+        
+        return False
+
+def enable(report_path):
+    global _enabled, _report_path, _ini_wall, _ini_times, _stages, _counters
+    
+    _enabled = True
+    _report_path = report_path
+    _ini_times = os.times()
+    _ini_wall = time.time()
+    _stages = {}
+    _counters = {}
+    
+    return
+
+def is_enabled():
+    return _enabled
+
+## with profile_utils.timer("stage"):
+##     ...
+def timer(stage):
+    if not _enabled: return _NULL_TIMER
+    
+    return _StageTimer(stage)
+
+def count(counter, value = 1):
+    if not _enabled: return
+    
+    _counters[counter] = _counters.get(counter, 0) + value
+    
+    return
+
+## Counters of a scan of a data file (dataset or map):
+## rows read from it, rows returned and bytes read
+def count_scan(data_path, rows_scanned, rows_matched, bytes_read):
+    if not _enabled: return
+    
+    data_name = os.path.basename(data_path)
+    count("datasets/"+data_name+"/scans")
+    count("datasets/"+data_name+"/rows_scanned", rows_scanned)
+    count("datasets/"+data_name+"/rows_matched", rows_matched)
+    count("datasets/"+data_name+"/bytes_read", bytes_read)
+    
+    return
+
+# "a/b/c" --> {"a":{"b":{"c":...}}}
+def _nest(flat_dict):
+    nested_dict = {}
+    
+    for name in sorted(flat_dict):
+        current_dict = nested_dict
+        name_parts = name.split("/")
+        for name_part in name_parts[:-1]:
+            current_dict = current_dict.setdefault(name_part, {})
+        current_dict[name_parts[-1]] = flat_dict[name]
+    
+    return nested_dict
+
+def get_report():
+    report = None
+    
+    if _enabled:
+        end_times = os.times()
+        
+        report = {"command":" ".join(sys.argv),
+                  "wall_time":time.time() - _ini_wall,
+                  "cpu_time":(end_times[0] - _ini_times[0]) + (end_times[1] - _ini_times[1]),
+                  "children_cpu_time":(end_times[2] - _ini_times[2]) + (end_times[3] - _ini_times[3]),
+                  "stages":dict(_stages),
+                  "counters":_nest(_counters)}
+        
+        if resource:
+            # kilobytes in Linux
+            report["max_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            report["children_max_rss"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    
+    return report
+
+## Writes the report to the path given to enable(), if profiling is enabled
+def write_report():
+    if not _enabled: return
+    
+    with open(_report_path, 'w') as report_f:
+        json.dump(get_report(), report_f, indent = 4, sort_keys = True)
+        report_f.write("\n")
+    
+    sys.stderr.write("profile_utils: profile report written to "+_report_path+"\n")
+    
+    return
+
+## END
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# search_stats.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Hit statistics of the databases and datasets searched, recorded across runs
+## in a JSON file with the --search-stats option of the bmap_* scripts.
+##
+## For each database (alignments) and dataset (searches by identifier) there are
+## the queries searched, those found and the seconds spent, added up over all the runs,
+## and their yield per unit cost is the number of queries found per second.
+##
+## With --adaptive-order, the datasets of a search by identifier are searched
+## from the highest yield per unit cost to the lowest (see sort_by_yield),
+## so that the queries are found, and the search stops, sooner. The databases
+## of a hierarchical search are not reordered, since their order changes the results,
+## but the order with the highest yield per unit cost is recommended (see recommend_order).
+##
+## Statistics are disabled unless enable() is called: record() returns right away.
+
+import sys, os, json
+
+import barleymapcore.utils.file_utils as file_utils
+
+DATABASES = "databases"
+DATASETS = "datasets"
+
+_enabled = False
+_adaptive = False
+_stats_path = None
+# statistics of the file when enabled, and those recorded by this process
+_stats = None
+_new_stats = None
+
+def enable(stats_path, adaptive = False):
+    global _enabled, _adaptive, _stats_path, _stats, _new_stats
+    
+    _enabled = True
+    _adaptive = adaptive
+    _stats_path = stats_path
+    _stats = _load_stats(stats_path)
+    _new_stats = {}
+    
+    return
+
+def is_enabled():
+    return _enabled
+
+def is_adaptive():
+    return _enabled and _adaptive
+
+def _load_stats(stats_path):
+    stats = {}
+    
+    if os.path.exists(stats_path):
+        try:
+            with open(stats_path, 'r') as stats_f:
+                stats = json.load(stats_f)
+        except ValueError as e:
+            sys.stderr.write("search_stats: WARNING, "+stats_path+" is not a valid statistics file ("+str(e)+"). "+\
+                             "It will be overwritten.\n")
+    
+    return stats
+
+def _add_stats(stats, kind, name, item_stats):
+    
+    name_stats = stats.setdefault(kind, {}).setdefault(name, {"queries":0, "found":0, "seconds":0.0})
+    
+    name_stats["queries"] += item_stats["queries"]
+    name_stats["found"] += item_stats["found"]
+    name_stats["seconds"] += item_stats["seconds"]
+    
+    return
+
+## Records a search of num_queries queries in a database or dataset (kind DATABASES or DATASETS)
+## which found num_found of them in the given seconds
+def record(kind, name, num_queries, num_found, seconds):
+    if not _enabled: return
+    
+    item_stats = {"queries":num_queries, "found":num_found, "seconds":seconds}
+    
+    _add_stats(_stats, kind, name, item_stats)
+    _add_stats(_new_stats, kind, name, item_stats)
+    
+    return
+
+## Queries found per second, or None if the database or dataset has no statistics yet
+def get_yield(kind, name):
+    if not _enabled: return None
+    
+    name_stats = _stats.get(kind, {}).get(name)
+    if name_stats == None or name_stats["queries"] == 0:
+        return None
+    
+    # searches too fast to be timed
+    seconds = max(name_stats["seconds"], 0.001)
+    
+    return name_stats["found"] / seconds
+
+## The names from the highest yield per unit cost to the lowest, after those without statistics
+## (which keep their order, so that they are searched and get them), and the order of the others for ties
+def sort_by_yield(kind, names):
+    
+    names_yields = [(name, get_yield(kind, name)) for name in names]
+    
+    no_stats = [name for (name, name_yield) in names_yields if name_yield == None]
+    with_stats = [(-name_yield, name_index, name) for (name_index, (name, name_yield)) in enumerate(names_yields) \
+                  if name_yield != None]
+    
+    return no_stats + [name for (minus_yield, name_index, name) in sorted(with_stats)]
+
+## Writes to stderr the order of the names with the highest yield per unit cost,
+## if all of them have statistics and it is not the given one,
+## for those searches in which the order can not be changed
+def recommend_order(kind, names, search):
+    if not is_adaptive(): return
+    
+    if None in [get_yield(kind, name) for name in names]: return
+    
+    sorted_names = sort_by_yield(kind, names)
+    
+    if sorted_names != list(names):
+        sys.stderr.write("search_stats: the "+kind+" "+",".join(names)+" would find the queries sooner as "+\
+                         ",".join(sorted_names)+" (queries found per second: "+\
+                         ", ".join([name+" %.2f" % get_yield(kind, name) for name in sorted_names])+\
+                         "), but their order changes the results of "+search+" searches, so it has not been changed.\n")
+    
+    return
+
+## Adds the statistics recorded by this process to those of the file, if enabled,
+## reading it again in case other processes updated it meanwhile
+def write_stats():
+    if not _enabled or len(_new_stats) == 0: return
+    
+    stats = _load_stats(_stats_path)
+    for kind in _new_stats:
+        for name in _new_stats[kind]:
+            _add_stats(stats, kind, name, _new_stats[kind][name])
+    
+    def write_json(stats_f):
+        json.dump(stats, stats_f, indent = 4, sort_keys = True)
+        stats_f.write("\n")
+    
+    try:
+        file_utils.write_file_atomic(_stats_path, write_json, ".json", 'w')
+    except (IOError, OSError) as e:
+        sys.stderr.write("search_stats: WARNING, the statistics could not be written to "+_stats_path+": "+str(e)+"\n")
+    
+    _new_stats.clear()
+    
+    return
+
+## END
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# shard_utils.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Shards of the queries of a job (--shard i/N of bmap_align, bmap_find and bmap_locate),
+## so that a large job can be run as N separate processes, e.g. in several nodes,
+## whose outputs are merged afterwards with bmap_merge.
+##
+## Each query is assigned to a shard from the MD5 of its identifier (the FASTA header
+## up to the first space, or the line of a file with a query per line), so that the
+## shards are disjoint, their union is the whole input, and a query is always in the
+## same shard, regardless of the other queries and of the node which runs it.
+##
+## The IDs of bmap_find which are synonyms of each other (see get_synonyms_shard_ids)
+## are assigned to the shard of the first of them instead, so that, as without shards,
+## the synonyms of a row found in the same job are joined in a single row (e.g. M1|SNP_1).
+
+import os, hashlib, tempfile
+
+from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+
+SHARD_SUFFIX = "_m2p_shard"
+
+## The shard (1 to N) and number of shards (N) of a --shard parameter ("i/N")
+def parse_shard(shard_param):
+    
+    try:
+        (shard_index, num_shards) = [int(value) for value in shard_param.split("/")]
+    except ValueError:
+        raise m2pException("Wrong --shard value "+shard_param+". It has to be i/N, e.g. 1/4.")
+    
+    if num_shards < 1 or shard_index < 1 or shard_index > num_shards:
+        raise m2pException("Wrong --shard value "+shard_param+". It has to be i/N, with i from 1 to N.")
+    
+    return (shard_index, num_shards)
+
+## The shard (1 to num_shards) of a query
+def get_query_shard(query_id, num_shards):
+    return int(hashlib.md5(query_id).hexdigest()[:8], 16) % num_shards + 1
+
+## The ID from which the shard of each ID with synonyms is obtained:
+## the first (in alphabetical order) of the IDs linked by the synonyms of any of the datasets
+## (each one a dict of lists of synonyms, as loaded by DatasetsRetriever.load_synonyms)
+def get_synonyms_shard_ids(datasets_synonyms):
+    
+    # union-find of the IDs, with the first one as the root of each set
+    parents = {}
+    
+    def find_root(syn_id):
+        root = syn_id
+        while parents[root] != root:
+            root = parents[root]
+        
+        while parents[syn_id] != root:
+            (parents[syn_id], syn_id) = (root, parents[syn_id])
+        
+        return root
+    
+    for dataset_synonyms in datasets_synonyms:
+        for syn_key in dataset_synonyms:
+            for syn_id in [syn_key]+dataset_synonyms[syn_key]:
+                if not syn_id in parents: parents[syn_id] = syn_id
+                
+                (key_root, id_root) = (find_root(syn_key), find_root(syn_id))
+                if key_root < id_root: parents[id_root] = key_root
+                elif id_root < key_root: parents[key_root] = id_root
+    
+    return dict([(syn_id, find_root(syn_id)) for syn_id in parents])
+
+## Writes the sequences of the shard of a FASTA file to a new (temporary) FASTA file
+def extract_fasta_shard(fasta_path, shard, tmp_files_dir):
+    (shard_index, num_shards) = shard
+    
+    num_queries = 0
+    num_shard_queries = 0
+    
+    (file_desc, shard_path) = tempfile.mkstemp(suffix=SHARD_SUFFIX, dir=tmp_files_dir)
+    shard_file = os.fdopen(file_desc, 'w')
+    try:
+        in_shard = False
+        for fasta_line in open(fasta_path, 'r'):
+            if fasta_line.startswith(">"):
+                query_id = fasta_line[1:].strip().split(" ")[0]
+                in_shard = get_query_shard(query_id, num_shards) == shard_index
+                
+                num_queries += 1
+                if in_shard: num_shard_queries += 1
+            
+            # (the last line of the file could lack its newline)
+            if in_shard:
+                shard_file.write(fasta_line if fasta_line.endswith("\n") else fasta_line+"\n")
+    finally:
+        shard_file.close()
+    
+    profile_utils.count("shard/queries", num_shard_queries)
+    profile_utils.count("shard/other_queries", num_queries - num_shard_queries)
+    
+    return shard_path
+
+## Writes the lines of the shard of a file with a query per line
+## (IDs of bmap_find, positions of bmap_locate) to a new (temporary) file.
+## The shard of the queries in shard_ids is that of their ID in it (see get_synonyms_shard_ids).
+def extract_lines_shard(file_path, shard, tmp_files_dir, shard_ids = {}):
+    (shard_index, num_shards) = shard
+    
+    num_queries = 0
+    num_shard_queries = 0
+    
+    (file_desc, shard_path) = tempfile.mkstemp(suffix=SHARD_SUFFIX, dir=tmp_files_dir)
+    shard_file = os.fdopen(file_desc, 'w')
+    try:
+        for line in open(file_path, 'r'):
+            num_queries += 1
+            query_id = line.strip()
+            if get_query_shard(shard_ids.get(query_id, query_id), num_shards) == shard_index:
+                shard_file.write(line if line.endswith("\n") else line+"\n")
+                num_shard_queries += 1
+    finally:
+        shard_file.close()
+    
+    profile_utils.count("shard/queries", num_shard_queries)
+    profile_utils.count("shard/other_queries", num_queries - num_shard_queries)
+    
+    return shard_path
+
+## END
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# sort_utils.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+import os, tempfile, heapq, cPickle
+
+from barleymapcore.utils.bgzf_utils import open_data_file
+import barleymapcore.utils.profile_utils as profile_utils
+
+DEFAULT_MAX_LINES = 500000
+
+# Memory budget of sort_records: keys sorted in memory at once
+DEFAULT_MAX_RECORDS = 1000000
+
+_max_records = DEFAULT_MAX_RECORDS
+_tmp_files_dir = None
+
+## Sets the memory budget and the directory of the runs of sort_records
+def configure(tmp_files_dir = None, max_records = DEFAULT_MAX_RECORDS):
+    global _tmp_files_dir, _max_records
+    
+    _tmp_files_dir = tmp_files_dir
+    _max_records = max_records
+    
+    return
+
+# The run and the position within it break ties, so that lines
+# with the same key keep the order of the input, as when sorted in memory
+def _keyed_lines(run_path, run_index, key_func):
+    with open(run_path, 'r') as run_file:
+        for (line_index, line) in enumerate(run_file):
+            yield (key_func(line), run_index, line_index, line)
+
+def _write_run(lines, key_func, tmp_files_dir):
+    lines.sort(key=key_func)
+    
+    (file_desc, run_path) = tempfile.mkstemp(suffix="_sort", dir=tmp_files_dir)
+    run_file = os.fdopen(file_desc, 'w')
+    try:
+        run_file.writelines(lines)
+    finally:
+        run_file.close()
+    
+    return run_path
+
+## Sorts the lines of a text file with bounded memory:
+## chunks of max_lines are sorted and spilled to temporary files
+## which are then k-way merged into output_path.
+## The sort is stable: lines with the same key keep their order.
+## Lines starting with any of the header_prefixes are kept at the top.
+## The input file can be block compressed (bgzf_utils), the output is plain text.
+def external_sort_lines(input_path, output_path, key_func, max_lines = DEFAULT_MAX_LINES,
+                        tmp_files_dir = None, header_prefixes = (">", "#")):
+    
+    header_lines = []
+    runs_list = []
+    
+    try:
+        lines = []
+        for line in open_data_file(input_path):
+            if line.startswith(header_prefixes):
+                header_lines.append(line)
+                continue
+            
+            if not line.endswith("\n"): line = line+"\n"
+            
+            lines.append(line)
+            if len(lines) >= max_lines:
+                runs_list.append(_write_run(lines, key_func, tmp_files_dir))
+                lines = []
+        
+        with open(output_path, 'w') as output_file:
+            output_file.writelines(header_lines)
+            
+            if len(runs_list) == 0:
+                lines.sort(key=key_func)
+                output_file.writelines(lines)
+            else:
+                if len(lines) > 0:
+                    runs_list.append(_write_run(lines, key_func, tmp_files_dir))
+                lines = []
+                
+                for keyed_line in heapq.merge(*[_keyed_lines(run_path, run_index, key_func)
+                                                for (run_index, run_path) in enumerate(runs_list)]):
+                    output_file.write(keyed_line[3])
+    
+    except Exception:
+        raise
+    finally:
+        for run_path in runs_list:
+            os.remove(run_path)
+    
+    return output_path
+
+## Sorts a list of records (AlignmentResult, MappingResult, ...) by key_func, like sorted().
+## Lists over the memory budget are not decorated as a whole: the keys of each slice
+## of max_records are computed once, sorted along with the index of their record
+## and spilled to a run. The runs of (key, index) are k-way merged and the
+## records taken in that order, so that the records themselves are never copied.
+def sort_records(records, key_func):
+    num_records = len(records)
+    
+    if num_records <= _max_records:
+        return sorted(records, key=key_func)
+    
+    runs_list = []
+    try:
+        with profile_utils.timer("sort/spill_runs"):
+            for first in xrange(0, num_records, _max_records):
+                last = min(first+_max_records, num_records)
+                # the index breaks ties as sorted() does (stable sort)
+                keyed_indexes = [(key_func(records[index]), index) for index in xrange(first, last)]
+                keyed_indexes.sort()
+                runs_list.append(write_records_run(keyed_indexes, _tmp_files_dir))
+                del keyed_indexes
+        
+        with profile_utils.timer("sort/merge_runs"):
+            sorted_records = [records[keyed_index[1]] for keyed_index in heapq.merge(*[_read_run(run_path) for run_path in runs_list])]
+        
+        profile_utils.count("sort/runs", len(runs_list))
+    
+    finally:
+        remove_runs(runs_list)
+    
+    return sorted_records
+
+## Sorted runs of records (any picklable objects: MappingResult, lists, strings...)
+## spilled to temporary files, so that only one record of each run
+## is kept in memory while the runs are k-way merged.
+
+## Writes the records, already sorted, to a run file. Returns its path.
+def write_records_run(records, tmp_files_dir = None):
+    (file_desc, run_path) = tempfile.mkstemp(suffix="_run", dir=tmp_files_dir)
+    run_file = os.fdopen(file_desc, 'wb')
+    try:
+        for record in records:
+            cPickle.dump(record, run_file, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        run_file.close()
+    
+    return run_path
+
+def _read_run(run_path):
+    with open(run_path, 'rb') as run_file:
+        while True:
+            try:
+                record = cPickle.load(run_file)
+            except EOFError:
+                break
+            
+            yield record
+
+# The run and the position within it break ties,
+# so that records themselves are never compared
+def _keyed_records(run_path, run_index, key_func):
+    for (record_index, record) in enumerate(_read_run(run_path)):
+        yield (key_func(record), run_index, record_index, record)
+
+## Yields the records of the runs in key_func order.
+## The run files are removed once the merge ends (or the generator is closed).
+def merge_records_runs(runs_list, key_func):
+    try:
+        for keyed_record in heapq.merge(*[_keyed_records(run_path, run_index, key_func)
+                                          for (run_index, run_path) in enumerate(runs_list)]):
+            yield keyed_record[3]
+    finally:
+        remove_runs(runs_list)
+
+def remove_runs(runs_list):
+    for run_path in runs_list:
+        if os.path.exists(run_path):
+            os.remove(run_path)
+    
+    return
+
+## END
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# tabular_utils.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Vectorized (NumPy) filtering of the tabular output of the aligners
+## (Blastn and HS-Blastn "-outfmt 6" lines).
+##
+## Instead of parsing every line into an AlignmentResult before checking the thresholds,
+## the rows are split in batches, the columns needed (identity, alignment and query lengths,
+## score) are converted to typed arrays, and the identity and query coverage masks and
+## the best score of each query are computed on them. Only the indexes of the rows which
+## survive are returned, so that the aligners create AlignmentResults just for those.
+## It requires NumPy: is_available() tells whether it can be used.
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Rows parsed at once
+BATCH_ROWS = 200000
+
+# Below this number of rows the per-line filter is as fast
+MIN_ROWS = 1000
+
+def is_available():
+    return np != None
+
+## Values of a column, as an array, for some of the rows of the fields of a batch
+def _column_values(fields, num_cols, col, rows):
+    return np.array([fields[row*num_cols+col] for row in rows.tolist()], dtype=np.float64)
+
+## Indexes of the rows which pass the identity and query coverage thresholds
+## and have the best score of their query among those which pass them,
+## in the order of the rows.
+## The query length is read from the col_query_len column or,
+## if it is None, from qlen_dict by query ID.
+## Returns None if a row has not num_cols fields.
+def filter_best_score_rows(rows, num_cols, col_query, col_ident, col_align_len, col_score,
+                           threshold_id, threshold_cov, col_query_len = None, qlen_dict = None):
+    
+    thres_id = float(threshold_id)
+    thres_cov = float(threshold_cov)
+    
+    kept_rows = []
+    kept_scores = []
+    kept_queries = []
+    
+    for first in xrange(0, len(rows), BATCH_ROWS):
+        batch = rows[first:first+BATCH_ROWS]
+        
+        # the fields of all the rows of the batch, one column every num_cols
+        fields = "\t".join(batch).split("\t")
+        if len(fields) != num_cols * len(batch):
+            return None
+        
+        # identity of all the rows, and the other columns only of those which pass it
+        align_ident = np.array(fields[col_ident::num_cols], dtype=np.float64)
+        passed = np.flatnonzero(align_ident >= thres_id)
+        
+        if len(passed) == 0: continue
+        
+        queries = [fields[row*num_cols+col_query] for row in passed.tolist()]
+        align_len = _column_values(fields, num_cols, col_align_len, passed)
+        
+        if col_query_len != None:
+            query_len = _column_values(fields, num_cols, col_query_len, passed)
+        else:
+            query_len = np.array([qlen_dict[query_id] for query_id in queries], dtype=np.float64)
+        
+        query_cov = (align_len / query_len) * 100
+        
+        covered = np.flatnonzero(query_cov >= thres_cov)
+        
+        if len(covered) == 0: continue
+        
+        passed = passed[covered]
+        
+        kept_rows.append(passed + first)
+        kept_scores.append(_column_values(fields, num_cols, col_score, passed))
+        kept_queries.extend([queries[row] for row in covered.tolist()])
+    
+    if len(kept_queries) == 0:
+        return []
+    
+    kept_rows = np.concatenate(kept_rows)
+    kept_scores = np.concatenate(kept_scores)
+    
+    # best score of each query
+    (query_ids, query_codes) = np.unique(np.array(kept_queries), return_inverse=True)
+    best_scores = np.full(len(query_ids), -np.inf)
+    np.maximum.at(best_scores, query_codes, kept_scores)
+    
+    return kept_rows[kept_scores == best_scores[query_codes]].tolist()
+
+## END
@@ -24,6 +24,16 @@ from barleymapcore.datasets.DatasetsFacade import DatasetsFacade
 from barleymapcore.annotators.GenesAnnotator import AnnotatorsFactory
 from barleymapcore.maps.MapMarkers import MapMarkers
 from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.search_stats as search_stats
+import barleymapcore.utils.job_checkpoints as job_checkpoints
+import barleymapcore.utils.shard_utils as shard_utils
+import barleymapcore.utils.sort_utils as sort_utils
+import barleymapcore.alignment.AlignerWorkers as AlignerWorkers
+import barleymapcore.alignment.DatabasesPrescreen as DatabasesPrescreen
+import barleymapcore.alignment.RawHitsStore as RawHitsStore
+import barleymapcore.alignment.Aligners as Aligners
+import barleymapcore.alignment.AlignmentEngines as AlignmentEngines
 from barleymapcore.output.OutputFacade import OutputFacade
 from barleymapcore.maps.enrichment.MapEnricher import SHOW_ON_INTERVALS, SHOW_ON_MARKERS
 
@@ -39,12 +49,13 @@ DEFAULT_THRES_COV = 95.0
 DEFAULT_N_THREADS = 1
 DEFAULT_SORT_PARAM = "map default"
 DEFAULT_EXTEND_WINDOW = 0.0
+DEFAULT_CHUNK_SIZE = 0
 
 def _print_parameters(fasta_path, genetic_map_name, aligner_list,
                       threshold_id, threshold_cov, n_threads,
                       sort_param, multiple_param, best_score,
                       show_anchored, show_genes, show_markers,
-                      extend_window, show_unmapped, collapsed_view):
+                      extend_window, show_unmapped, collapsed_view, chunk_size):
     sys.stderr.write("\nParameters:\n")
     sys.stderr.write("\tQuery fasta: "+fasta_path+"\n")
     sys.stderr.write("\tGenetic maps: "+genetic_map_name+"\n")
@@ -61,10 +72,12 @@ def _print_parameters(fasta_path, genetic_map_name, aligner_list,
     sys.stderr.write("\tExtend genes/markers search: "+str(extend_window)+"\n")
     sys.stderr.write("\tShow unmapped: "+str(show_unmapped)+"\n")
     sys.stderr.write("\tShow results as collapsed rows: "+str(collapsed_view)+"\n")
+    sys.stderr.write("\tQueries by chunk: "+str(chunk_size if chunk_size > 0 else "all")+"\n")
     
     return
 
 ############ BARLEYMAP_ALIGN_SEQS
+shard_path = None
 try:
     
     ## Usage
@@ -81,6 +94,9 @@ try:
                      'The "gmap" option means to use only GMAP. '+\
                      'The "blastn" option means to use only Blastn. '+\
                      'The "hsblastn" option means to use only HS-Blastn. '+\
+                     'The "exact" option resolves only the queries with exact, full-length matches, without aligning them '+\
+                     '(useful as first aligner, e.g. exact,gmap). Those queries are not aligned with the next aligners, '+\
+                     'and so their alignments below 100% identity which pass --thres-id (e.g. to paralogs) are not reported. '+\
                      'The order and aligners can be explicitly specified by separating the names by ","'+\
                      ' (e.g.: blastn,gmap --> First Blastn, then GMAP).')
     
@@ -139,12 +155,67 @@ try:
     optParser.add_option('-f', action='store_true', dest='format_numbers', \
                          help='cM positions will be output with all decimals (default, 2 decimals).')
     
+    optParser.add_option('--chunk-size', action='store', dest='chunk_size', type='string',
+                         help='Align and map the queries in chunks of this number of sequences, '+\
+                         'merging the sorted results of the chunks from temporary files, so that memory '+\
+                         'does not grow with the number of queries. Not compatible with -a, -g and -m '+\
+                         '(default '+str(DEFAULT_CHUNK_SIZE)+': all the queries at once).')
+    
+    optParser.add_option('--shard', action='store', dest='shard', type='string',
+                         help='Process only the shard i of N (e.g. 1/4) of the queries, assigned by a hash of their identifiers, '+\
+                         'so that a job can be run as N separate processes, whose outputs are then merged with bmap_merge. Not compatible with -a, -g and -m.')
+    
+    optParser.add_option('--aligner-workers', action='store_true', dest='aligner_workers',
+                         help='Keep the GMAP processes running, with their databases loaded, '+\
+                         'to align all the queries sent to the same database (e.g. for several maps or chunks), '+\
+                         'instead of running GMAP for each alignment.')
+    
+    optParser.add_option('--prescreen', action='store', dest='prescreen', type='string',
+                         help='Align to each database only the queries which share at least this fraction '+\
+                         'of their sampled minimizers with the database (e.g. 0.1), '+\
+                         'which are obtained from its FASTA file in exact_dbs_path (default: align all the queries).')
+    
+    optParser.add_option('--route-by-length', action='store', dest='route_by_length', type='string',
+                         help='With several aligners (e.g. gmap,blastn), align first the queries shorter than this length '+\
+                         'with Blastn or HS-Blastn and the others with GMAP, running them at the same time, '+\
+                         'and then the queries still unaligned with the other aligners (default: all the queries with each aligner in order).')
+    
+    optParser.add_option('--speculative', action='store', dest='speculative', type='string',
+                         help='In hierarchical searches, align up to this number of databases at the same time, '+\
+                         'each one with the queries not found yet in the previous databases when it starts, '+\
+                         'and discard then the hits of the queries found in a previous database, '+\
+                         'so that the results are the same (default 1: one database after another).')
+    
+    optParser.add_option('--hit-store', action='store', dest='hit_store', type='string',
+                         help='Keep the raw hits of GMAP, Blastn and HS-Blastn in this directory, so that aligning the same queries '+\
+                         'to the same database again, with equal or higher thresholds (--thres-id, --thres-cov), '+\
+                         'only filters those hits instead of running the aligner.')
+    
+    optParser.add_option('--resume', action='store', dest='resume_path', type='string',
+                         help='Job directory where the alignments to each database are saved as they finish. '+\
+                         'If the job is interrupted, running it again with the same directory '+\
+                         'restores them instead of aligning again.')
+    
+    optParser.add_option('--search-stats', action='store', dest='search_stats', type='string',
+                         help='Add the queries searched, found and the time spent in each database to the statistics of this JSON file.')
+    
+    optParser.add_option('--adaptive-order', action='store_true', dest='adaptive_order',
+                         help='Report the order of the databases of hierarchical searches which would find more queries per second, '+\
+                         'according to --search-stats. They are not reordered, since their order changes the results.')
+    
+    optParser.add_option('--profile', action='store', dest='profile_path', type='string',
+                         help='Write a JSON report with the time spent in each stage and the rows, bytes and hits processed to this file.')
+    
     optParser.add_option('-v', '--verbose', action='store_true', dest='verbose', help='More information printed.')
     
     ########### Read parameters
     ###########
     (options, arguments) = optParser.parse_args()
     
+    if options.profile_path: profile_utils.enable(options.profile_path)
+    if options.search_stats: search_stats.enable(options.search_stats, options.adaptive_order)
+    elif options.adaptive_order: optParser.exit(0, "--adaptive-order requires --search-stats.\n")
+    
     if not arguments or len(arguments)==0:
         optParser.exit(0, "You may wish to run '-help' option.\n")
     
@@ -224,12 +295,33 @@ try:
     # Collapsed view
     collapsed_view = options.collapse if options.collapse else False
     
+    # Queries by chunk
+    if options.chunk_size: chunk_size = int(options.chunk_size)
+    else: chunk_size = DEFAULT_CHUNK_SIZE
+    
+    if chunk_size > 0 and (show_anchored or show_genes or show_markers):
+        raise Exception("Features (-a, -g, -m) can not be shown when queries are processed in chunks (--chunk-size).")
+    
+    # Shard of the queries
+    if options.shard: shard = shard_utils.parse_shard(options.shard)
+    else: shard = None
+    
+    if shard and (show_anchored or show_genes or show_markers):
+        raise Exception("Features (-a, -g, -m) can not be shown when queries are processed in shards (--shard).")
+    
     ######### Read configuration files
     #########
     app_abs_path = os.path.dirname(os.path.abspath(__file__))
     
     paths_config = PathsConfig()
     paths_config.load_config(app_abs_path)
+    sort_utils.configure(paths_config.get_tmp_files_path())
+    if options.aligner_workers: AlignerWorkers.configure(verbose = verbose_param)
+    if options.prescreen: DatabasesPrescreen.configure(paths_config.get_exact_dbs_path(), float(options.prescreen), verbose_param)
+    if options.route_by_length: Aligners.configure_routing(int(options.route_by_length))
+    if options.speculative: AlignmentEngines.configure_speculative(int(options.speculative))
+    if options.hit_store: RawHitsStore.configure(options.hit_store, verbose_param)
+    if options.resume_path: job_checkpoints.configure(options.resume_path)
     __app_path = paths_config.get_app_path()
     
     # Maps
@@ -253,7 +345,7 @@ try:
                       threshold_id, threshold_cov, n_threads,
                       sort_param, multiple_param, best_score,
                       show_anchored, show_genes, show_markers,
-                      extend_window, show_unmapped, collapsed_view)
+                      extend_window, show_unmapped, collapsed_view, chunk_size)
     
     ############### MAIN
     if verbose_param: sys.stderr.write("\n")
@@ -301,6 +393,10 @@ try:
     # Temp directory
     tmp_files_dir = paths_config.get_tmp_files_path()
     
+    if shard:
+        shard_path = shard_utils.extract_fasta_shard(query_fasta_path, shard, tmp_files_dir)
+        query_fasta_path = shard_path
+    
     ########### Create maps
     ###########
     for map_id in maps_ids:
@@ -313,6 +409,25 @@ try:
         
         mapMarkers = MapMarkers(maps_path, map_config, alignment_facade, verbose_param)
         
+        if chunk_size > 0:
+            ## Queries in chunks: the map is merged from disk while it is printed
+            try:
+                mapMarkers.perform_mappings_by_chunks(query_fasta_path, chunk_size, databases_ids, databases_config, aligner_list,
+                                                      threshold_id, threshold_cov, n_threads,
+                                                      best_score, sort_by, multiple_param, tmp_files_dir)
+                mapping_results = mapMarkers.get_mapping_results()
+                
+                with profile_utils.timer("output"):
+                    outputPrinter.print_map(mapping_results.get_mapped(), map_config, multiple_param)
+                    
+                    if show_unmapped:
+                        outputPrinter.print_unmapped(mapping_results.get_unmapped(), map_config)
+                        outputPrinter.print_unaligned(mapping_results.get_unaligned(), map_config)
+            finally:
+                mapMarkers.remove_runs()
+            
+            continue
+        
         mapMarkers.perform_mappings(query_fasta_path, databases_ids, databases_config, aligner_list,
                                     threshold_id, threshold_cov, n_threads,
                                     best_score, sort_by, multiple_param, tmp_files_dir)
@@ -327,18 +442,19 @@ try:
         mapping_results = mapMarkers.get_mapping_results()
         
         ############################################################ OUTPUT
-        if show_markers:
-            outputPrinter.print_map_with_markers(mapping_results.get_map_with_markers(), map_config, multiple_param)
-        elif show_genes:
-            outputPrinter.print_map_with_genes(mapping_results.get_map_with_genes(), map_config, multiple_param, load_annot, annotator)
-        elif show_anchored:
-            outputPrinter.print_map_with_anchored(mapping_results.get_map_with_anchored(), map_config, multiple_param)
-        else:
-            outputPrinter.print_map(mapping_results.get_mapped(), map_config, multiple_param)
-        
-        if show_unmapped:
-            outputPrinter.print_unmapped(mapping_results.get_unmapped(), map_config)
-            outputPrinter.print_unaligned(mapping_results.get_unaligned(), map_config)
+        with profile_utils.timer("output"):
+            if show_markers:
+                outputPrinter.print_map_with_markers(mapping_results.get_map_with_markers(), map_config, multiple_param)
+            elif show_genes:
+                outputPrinter.print_map_with_genes(mapping_results.get_map_with_genes(), map_config, multiple_param, load_annot, annotator)
+            elif show_anchored:
+                outputPrinter.print_map_with_anchored(mapping_results.get_map_with_anchored(), map_config, multiple_param)
+            else:
+                outputPrinter.print_map(mapping_results.get_mapped(), map_config, multiple_param)
+            
+            if show_unmapped:
+                outputPrinter.print_unmapped(mapping_results.get_unmapped(), map_config)
+                outputPrinter.print_unaligned(mapping_results.get_unaligned(), map_config)
 
 except m2pException as m2pe:
     sys.stderr.write("\nThere was an error.\n")
@@ -351,6 +467,9 @@ except Exception as e:
     sys.stderr.write('If you can not solve it please contact compbio@eead.csic.es ('+\
                                    'laboratory of computational biology at EEAD).\n')
 finally:
-    pass
+    if shard_path != None and os.path.exists(shard_path): os.remove(shard_path)
+    AlignerWorkers.close_workers()
+    profile_utils.write_report()
+    search_stats.write_stats()
 
 ## END
\ No newline at end of file
@@ -22,6 +22,15 @@ from barleymapcore.alignment.AlignmentEngines import ALIGNMENT_TYPE_GREEDY
 from barleymapcore.db.DatabasesConfig import REF_TYPE_STD, DatabasesConfig
 from barleymapcore.output.OutputFacade import OutputFacade
 from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.search_stats as search_stats
+import barleymapcore.utils.job_checkpoints as job_checkpoints
+import barleymapcore.utils.sort_utils as sort_utils
+import barleymapcore.alignment.AlignerWorkers as AlignerWorkers
+import barleymapcore.alignment.DatabasesPrescreen as DatabasesPrescreen
+import barleymapcore.alignment.RawHitsStore as RawHitsStore
+import barleymapcore.alignment.Aligners as Aligners
+import barleymapcore.alignment.AlignmentEngines as AlignmentEngines
 
 DATABASES_CONF = ConfigBase.DATABASES_CONF
 
@@ -67,6 +76,9 @@ try:
                          'The "gmap" option means to use only GMAP. '+\
                          'The "blastn" option means to use only Blastn. '+\
                          'The "hsblastn" option means to use only HS-Blastn. '+\
+                         'The "exact" option resolves only the queries with exact, full-length matches, without aligning them '+\
+                         '(useful as first aligner, e.g. exact,gmap). Those queries are not aligned with the next aligners, '+\
+                         'and so their alignments below 100% identity which pass --thres-id (e.g. to paralogs) are not reported. '+\
                          'The order and aligners can be explicitly specified by separating the names by ","'+\
                          ' (e.g.: blastn,gmap --> First Blastn, then GMAP).')
     
@@ -88,10 +100,55 @@ try:
     optParser.add_option('--ref-type', action='store', dest='ref_type', type='string',
                          help='Whether use GMAP (std) or GMAPL (big), when using --databases-ids only.')
     
+    optParser.add_option('--aligner-workers', action='store_true', dest='aligner_workers',
+                         help='Keep the GMAP processes running, with their databases loaded, '+\
+                         'to align all the queries sent to the same database (e.g. for several maps or chunks), '+\
+                         'instead of running GMAP for each alignment.')
+    
+    optParser.add_option('--prescreen', action='store', dest='prescreen', type='string',
+                         help='Align to each database only the queries which share at least this fraction '+\
+                         'of their sampled minimizers with the database (e.g. 0.1), '+\
+                         'which are obtained from its FASTA file in exact_dbs_path (default: align all the queries).')
+    
+    optParser.add_option('--route-by-length', action='store', dest='route_by_length', type='string',
+                         help='With several aligners (e.g. gmap,blastn), align first the queries shorter than this length '+\
+                         'with Blastn or HS-Blastn and the others with GMAP, running them at the same time, '+\
+                         'and then the queries still unaligned with the other aligners (default: all the queries with each aligner in order).')
+    
+    optParser.add_option('--speculative', action='store', dest='speculative', type='string',
+                         help='In hierarchical searches, align up to this number of databases at the same time, '+\
+                         'each one with the queries not found yet in the previous databases when it starts, '+\
+                         'and discard then the hits of the queries found in a previous database, '+\
+                         'so that the results are the same (default 1: one database after another).')
+    
+    optParser.add_option('--hit-store', action='store', dest='hit_store', type='string',
+                         help='Keep the raw hits of GMAP, Blastn and HS-Blastn in this directory, so that aligning the same queries '+\
+                         'to the same database again, with equal or higher thresholds (--thres-id, --thres-cov), '+\
+                         'only filters those hits instead of running the aligner.')
+    
+    optParser.add_option('--resume', action='store', dest='resume_path', type='string',
+                         help='Job directory where the alignments to each database are saved as they finish. '+\
+                         'If the job is interrupted, running it again with the same directory '+\
+                         'restores them instead of aligning again.')
+    
+    optParser.add_option('--search-stats', action='store', dest='search_stats', type='string',
+                         help='Add the queries searched, found and the time spent in each database to the statistics of this JSON file.')
+    
+    optParser.add_option('--adaptive-order', action='store_true', dest='adaptive_order',
+                         help='Report the order of the databases of hierarchical searches which would find more queries per second, '+\
+                         'according to --search-stats. They are not reordered, since their order changes the results.')
+    
+    optParser.add_option('--profile', action='store', dest='profile_path', type='string',
+                         help='Write a JSON report with the time spent in each stage and the rows, bytes and hits processed to this file.')
+    
     optParser.add_option('-v', '--verbose', action='store_true', dest='verbose', help='More information printed.')
     
     (options, arguments) = optParser.parse_args()
     
+    if options.profile_path: profile_utils.enable(options.profile_path)
+    if options.search_stats: search_stats.enable(options.search_stats, options.adaptive_order)
+    elif options.adaptive_order: optParser.exit(0, "--adaptive-order requires --search-stats.\n")
+    
     if not arguments or len(arguments)==0:
         optParser.exit(0, "You may wish to run '-help' option.\n")
     
@@ -110,6 +167,13 @@ try:
     
     paths_config = PathsConfig()
     paths_config.load_config(app_abs_path)
+    sort_utils.configure(paths_config.get_tmp_files_path())
+    if options.aligner_workers: AlignerWorkers.configure(verbose = verbose_param)
+    if options.prescreen: DatabasesPrescreen.configure(paths_config.get_exact_dbs_path(), float(options.prescreen), verbose_param)
+    if options.route_by_length: Aligners.configure_routing(int(options.route_by_length))
+    if options.speculative: AlignmentEngines.configure_speculative(int(options.speculative))
+    if options.hit_store: RawHitsStore.configure(options.hit_store, verbose_param)
+    if options.resume_path: job_checkpoints.configure(options.resume_path)
     __app_path = paths_config.get_app_path()
     
     # Aligners list
@@ -180,7 +244,8 @@ try:
     sys.stderr.write("\n")
     
     alignments_printer = OutputFacade.get_alignments_printer(search_type, databases_config)
-    alignments_printer.output_results(aligned, databases_ids)
+    with profile_utils.timer("output"):
+        alignments_printer.output_results(aligned, databases_ids)
     
 except m2pException as m2pe:
     sys.stderr.write("\nThere was an error.\n")
@@ -193,7 +258,9 @@ except Exception as e:
     sys.stderr.write('If you can not solve it please contact compbio@eead.csic.es ('+\
                                    'laboratory of computational biology at EEAD).\n')
 finally:
-    pass
+    AlignerWorkers.close_workers()
+    profile_utils.write_report()
+    search_stats.write_stats()
 
 sys.stderr.write("Finished.\n")
 
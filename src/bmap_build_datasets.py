@@ -9,20 +9,29 @@
 ## Script to show the configuration data of Barleymap.
 ###########################
 
-import sys, os, traceback
-from subprocess import Popen, PIPE
+import sys, os, traceback, hashlib
 from optparse import OptionParser
 
 from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.job_checkpoints as job_checkpoints
+import barleymapcore.utils.file_utils as file_utils
+import barleymapcore.utils.sort_utils as sort_utils
 from barleymapcore.db.DatasetsConfig import DatasetsConfig
 from barleymapcore.db.ConfigBase import ConfigBase
 from barleymapcore.db.PathsConfig import PathsConfig
 from barleymapcore.db.MapsConfig import MapsConfig
+from barleymapcore.db.DatabasesConfig import DatabasesConfig
+from barleymapcore.alignment.AlignmentFacade import AlignmentFacade
 from barleymapcore.maps.MapMarkers import MapMarkers
-#from barleymapcore.maps.reader.MapReader import MapReader
+from barleymapcore.maps.reader.MapReader import MapReader
+from barleymapcore.maps.reader.DatasetIndex import DatasetIndex, DatasetIndexWriter
+from barleymapcore.maps.reader.ColumnarDataset import ColumnarDataset
 from barleymapcore.output.OutputFacade import OutputFacade
 from barleymapcore.utils.parse_gtf_file import parse_gtf_file, parse_bed_file
 from barleymapcore.utils.data_utils import read_paths
+import barleymapcore.utils.alignment_utils as alignment_utils
+from barleymapcore.utils.bgzf_utils import BgzfWriter, is_bgzf, open_data_file
 
 _SCRIPT = os.path.basename(__file__)
 
@@ -33,67 +42,253 @@ DEFAULT_THRES_COV = 95.0
 DEFAULT_N_THREADS = 1
 DEFAULT_ALIGNER = "gmap"
 
-def __features_to_map_file(features, maps_path, map_config, map_output_path, verbose_param):
+UPDATE_BY_ID = "id"
+UPDATE_BY_HASH = "hash"
+DEFAULT_UPDATE_BY = UPDATE_BY_ID
+
+## Writes the map file of a dataset, creating its ID and positional indexes
+## in the same pass (see DatasetIndex). If the rows were not sorted
+## as required by the readers, the file is sorted and indexed again.
+## If removed_ids is not None (--update), the rows are merged into the existing file instead,
+## after removing from it the rows of removed_ids.
+## If compress (--bgzip), the file is written block compressed (see bgzf_utils).
+def __write_map_file(mapping_results, maps_path, map_config, map_output_path, records, removed_ids,
+                     compress, tmp_files_dir, verbose_param):
     
     multiple_param = True
+    sort_by = map_config.get_default_sort_by()
     
-    mapMarkers = MapMarkers(maps_path, map_config, verbose = verbose_param)
-    
-    unaligned = [] # Better this than None
-    mapMarkers.create_map(features, unaligned, map_config.get_default_sort_by(), multiple_param)
+    chrom_dict = MapReader(maps_path, map_config, verbose_param).get_chrom_dict()
     
-    mapping_results = mapMarkers.get_mapping_results()
-    
-    sys.stderr.write("Mapped results "+str(len(mapping_results.get_mapped()))+"\n")
+    if removed_ids != None:
+        prev_records = DatasetIndex.load_records(map_output_path)
+        if prev_records == None: prev_records = {}
+        prev_records.update(records)
+        records = prev_records
+        
+        delta_output_path = map_output_path+".delta"
+        
+        # an updated file is kept compressed
+        if is_bgzf(map_output_path): compress = True
+        
+        map_output = open(delta_output_path, 'w')
+    else:
+        delta_output_path = map_output_path
+        
+        map_output = BgzfWriter(delta_output_path) if compress else open(delta_output_path, 'w')
     
-    map_output = open(map_output_path, 'w')
     try:
+        index_writer = DatasetIndexWriter(map_output, map_config, chrom_dict, sort_by, verbose = verbose_param)
         
-        outputPrinter = OutputFacade.get_expanded_printer(map_output, verbose = verbose_param,
+        outputPrinter = OutputFacade.get_expanded_printer(index_writer, verbose = verbose_param,
                                                           beauty_nums = False, show_headers = True)
         
-        outputPrinter.print_map(mapping_results.get_mapped(), map_config, multiple_param)
+        with profile_utils.timer("output"):
+            outputPrinter.print_map(mapping_results.get_mapped(), map_config, multiple_param)
+        
+        index_writer.flush()
         
     except Exception as e:
         raise e
     finally:
         map_output.close()
     
+    if removed_ids != None:
+        try:
+            with profile_utils.timer("index/merge"):
+                index_writer.merge_and_index(map_output_path, delta_output_path, removed_ids, tmp_files_dir, compress)
+        finally:
+            os.remove(delta_output_path)
+    elif index_writer.is_sorted():
+        index_writer.write_indexes(map_output_path)
+    else:
+        sys.stderr.write("\t\tRows of "+map_output_path+" are not sorted. Sorting...\n")
+        with profile_utils.timer("index/sort"):
+            index_writer.sort_and_index(map_output_path, tmp_files_dir, compress)
+    
+    DatasetIndex.write_records(map_output_path, records)
+    
+    sys.stderr.write("\t\tindexes created for "+map_output_path+"\n")
+    
+    # The columnar version (bmap_convert), if any, is created again
+    if os.path.exists(ColumnarDataset.get_path(map_output_path)):
+        if ColumnarDataset.is_available():
+            with profile_utils.timer("columnar/convert"):
+                ColumnarDataset.convert_dataset(map_output_path, map_config, chrom_dict, sort_by, verbose_param)
+        else:
+            ColumnarDataset.remove(map_output_path)
+    
+    return
+
+## Records (IDs and hashes) of the source of a dataset
+## which have to be added to an existing map file (--update).
+## A record is updated if its ID is not in the map file yet or,
+## when updating by hash, if its hash changed (its old rows are removed).
+def __get_records_to_update(dataset_records, map_output_path, update_by):
+    update_records = {}
+    removed_ids = set()
+    
+    prev_records = DatasetIndex.load_records(map_output_path)
+    
+    # Datasets built before records were kept: IDs from the index or the map file
+    if prev_records == None:
+        prev_records = {}
+        id_index = DatasetIndex.load_id_index(map_output_path)
+        if id_index != None:
+            prev_records = dict([(record_id, "-") for record_id in DatasetIndex.get_id_index_ids(id_index)])
+        else:
+            for line in open_data_file(map_output_path):
+                if line.startswith(">") or line.startswith("#"): continue
+                prev_records[line.split("\t", 1)[0]] = "-"
+    
+    for record_id in dataset_records:
+        record_hash = dataset_records[record_id]
+        
+        if not record_id in prev_records:
+            update_records[record_id] = record_hash
+            
+        elif update_by == UPDATE_BY_HASH:
+            prev_hash = prev_records[record_id]
+            if prev_hash != "-" and prev_hash != record_hash:
+                update_records[record_id] = record_hash
+                removed_ids.add(record_id)
+    
+    return (update_records, removed_ids)
+
+## Which records of a dataset have to be processed for a given map file
+## Returns None if there is nothing to do
+def __get_map_records(dataset_records, map_output_path, update_param, update_by):
+    map_records = None
+    
+    if os.path.exists(map_output_path):
+        if update_param:
+            (update_records, removed_ids) = __get_records_to_update(dataset_records, map_output_path, update_by)
+            
+            if len(update_records) == 0:
+                sys.stdout.write("\t\tPath "+map_output_path+" is up to date.\n\n")
+            else:
+                sys.stderr.write("\t\tRecords to update "+str(len(update_records))+\
+                                 " (previous rows to remove "+str(len(removed_ids))+")\n")
+                map_records = (update_records, removed_ids)
+        else:
+            sys.stdout.write("\t\tPath "+map_output_path+" already exists and it will be skipeed.\n"+\
+                             "\t\tPlease, remove before re-building the dataset data (or use --update).\n\n")
+    else:
+        map_records = (dataset_records, None)
+    
+    return map_records
+
+## Records of features from a GTF or BED file:
+## a hash of the positions of each feature ID
+def __get_features_records(features):
+    features_hashes = {}
+    
+    for feature in features:
+        feature_id = feature.get_query_id()
+        if not feature_id in features_hashes:
+            features_hashes[feature_id] = hashlib.md5()
+        
+        features_hashes[feature_id].update(":".join([str(feature.get_subject_id()), str(feature.get_local_position()),
+                                                     str(feature.get_end_position()), str(feature.get_strand())]))
+    
+    features_records = dict([(feature_id, features_hashes[feature_id].hexdigest()) for feature_id in features_hashes])
+    
+    return features_records
+
+def __features_to_map_file(features, maps_path, map_config, map_output_path, records, removed_ids,
+                           compress, tmp_files_dir, verbose_param):
+    
+    multiple_param = True
+    
+    mapMarkers = MapMarkers(maps_path, map_config, verbose = verbose_param)
+    
+    unaligned = [] # Better this than None
+    mapMarkers.create_map(features, unaligned, map_config.get_default_sort_by(), multiple_param)
+    
+    mapping_results = mapMarkers.get_mapping_results()
+    
+    sys.stderr.write("Mapped results "+str(len(mapping_results.get_mapped()))+"\n")
+    
+    __write_map_file(mapping_results, maps_path, map_config, map_output_path, records, removed_ids,
+                     compress, tmp_files_dir, verbose_param)
+    
     return
 
-def __write_command(map_name, file_path, output_path, threads, verbose = False):
-    cmd = "bmap_align"
-    raw_numbers = "-f"
-    aligner = "--aligner="+DEFAULT_ALIGNER
-    thres_id = "--thres-id="+str(DEFAULT_THRES_ID)
-    thres_cov = "--thres-cov="+str(DEFAULT_THRES_COV)
-    _threads = "--threads="+str(threads)
-    maps = "--maps="+map_name
-    show_multiple = "-k"
-    best_score = "-b"
-    out = "> "+output_path
-    err = "2> "+output_path+".err"
-    
-    command = [cmd, raw_numbers, aligner, thres_id, thres_cov,
-                        _threads, maps, show_multiple, best_score, file_path, out, err]
-    
-    if verbose: command.append("-v")
-    command = " ".join(command)
-    
-    return command
+def __alignments_to_map_file(alignment_facade, query_fasta_path, maps_path, map_config, databases_config,
+                             n_threads, tmp_files_dir, map_output_path, records, removed_ids, compress, verbose_param):
+    
+    # Same as "bmap_align -f -k -b" but in-process, so that the alignments
+    # to each DB are reused (AlignmentFacade cache) by all the maps sharing that DB
+    multiple_param = True
+    best_score = True
+    aligner_list = [DEFAULT_ALIGNER]
+    
+    mapMarkers = MapMarkers(maps_path, map_config, alignment_facade, verbose = verbose_param)
+    
+    mapMarkers.perform_mappings(query_fasta_path, map_config.get_db_list(), databases_config, aligner_list,
+                                DEFAULT_THRES_ID, DEFAULT_THRES_COV, n_threads,
+                                best_score, map_config.get_default_sort_by(), multiple_param, tmp_files_dir)
+    
+    mapping_results = mapMarkers.get_mapping_results()
+    
+    sys.stderr.write("Mapped results "+str(len(mapping_results.get_mapped()))+"\n")
+    
+    __write_map_file(mapping_results, maps_path, map_config, map_output_path, records, removed_ids,
+                     compress, tmp_files_dir, verbose_param)
+    
+    return
+
+## Key of the map file of a dataset in the job checkpoints (--resume),
+## or None if they are not enabled
+def __map_file_unit(dataset_file_path, map_output_path):
+    map_unit = None
+    
+    if job_checkpoints.is_enabled():
+        map_unit = (os.path.abspath(map_output_path), file_utils.get_file_hash(dataset_file_path))
+    
+    return map_unit
+
+## Size and modification time of a file, or None if it does not exist
+def __get_file_state(file_path):
+    file_state = None
+    
+    if os.path.exists(file_path):
+        file_stat = os.stat(file_path)
+        file_state = (file_stat.st_size, file_stat.st_mtime)
+    
+    return file_state
 
-def __run_command(cmd):
+## Whether the map file was completed by a previous run of the job (--resume), so that it is skipped.
+## If a previous run started it but did not complete it, and the file changed since then,
+## the file is removed, so that it is built again from scratch.
+def __resume_map_file(map_unit, map_output_path):
+    if map_unit == None: return False
     
-    sys.stderr.write(_SCRIPT+": running command:\n")
-    sys.stderr.write("\t"+cmd+"\n")
-    #p = Popen(cmd, shell=True, stdout=PIPE, stderr=sys.stderr)
-    p = Popen(cmd, shell=True)
-    com_list = p.communicate()
-    retValue = p.returncode
+    checkpoint = job_checkpoints.load(job_checkpoints.DATASETS, map_unit)
+    if checkpoint == None: return False
+    
+    if checkpoint["completed"]:
+        sys.stdout.write("\t\tPath "+map_output_path+" was completed by a previous run of the job and it will be skipped.\n\n")
+        return True
+    
+    if os.path.exists(map_output_path) and __get_file_state(map_output_path) != checkpoint["map_file"]:
+        sys.stderr.write("\t\tPath "+map_output_path+" was not completed by a previous run of the job. "+\
+                         "It will be built again.\n")
+        os.remove(map_output_path)
+    
+    return False
+
+## Saves to the job checkpoints (--resume) that the map file is being built (completed False),
+## with the state of the file before, or that it has been completed
+def __checkpoint_map_file(map_unit, map_output_path, completed):
+    if map_unit == None: return
     
-    if retValue != 0: raise m2pException(_SCRIPT+": return != 0. "+cmd+"\n")
+    if completed:
+        map_file_state = None
+    else:
+        map_file_state = __get_file_state(map_output_path)
     
-    sys.stderr.write(_SCRIPT+": return value "+str(retValue)+"\n")
+    job_checkpoints.save(job_checkpoints.DATASETS, map_unit, {"completed":completed, "map_file":map_file_state})
     
     return
 
@@ -138,10 +333,32 @@ try:
     optParser.add_option('--dataset', action='store', dest='dataset_param', type='string',
                     help='A single dataset to process. By default all datasets are processed..')
     
+    optParser.add_option('--update', action='store_true', dest='update_param',
+                    help='Existing datasets are updated with the records not processed yet, instead of being skipped.')
+    
+    optParser.add_option('--update-by', action='store', dest='update_by', type='string',
+                    help='With --update, whether a record is new if its ID is new ("'+UPDATE_BY_ID+'"), '+\
+                    'or also if its sequence or position changed ("'+UPDATE_BY_HASH+'") '+\
+                    '(default "'+DEFAULT_UPDATE_BY+'").')
+    
+    optParser.add_option('--bgzip', action='store_true', dest='bgzip_param',
+                    help='Dataset files are written block compressed (BGZF). '+\
+                    'They can be read by barleymap as plain text ones.')
+    
+    optParser.add_option('--resume', action='store', dest='resume_path', type='string',
+                    help='Job directory where the alignments to each database and the map files completed are saved. '+\
+                    'If the job is interrupted, running it again with the same directory '+\
+                    'skips the map files completed and restores the alignments instead of aligning again.')
+    
+    optParser.add_option('--profile', action='store', dest='profile_path', type='string',
+                         help='Write a JSON report with the time spent in each stage and the rows, bytes and hits processed to this file.')
+    
     optParser.add_option('-v', '--verbose', action='store_true', dest='verbose', help='More information printed.')
     
     (options, arguments) = optParser.parse_args()
     
+    if options.profile_path: profile_utils.enable(options.profile_path)
+    
     verbose_param = options.verbose if options.verbose else False
     
     if verbose_param: sys.stderr.write("Command: "+" ".join(sys.argv)+"\n")
@@ -154,12 +371,28 @@ try:
     if options.dataset_param: dataset_param = options.dataset_param
     else: dataset_param = ""
     
+    # Update existing datasets
+    update_param = options.update_param if options.update_param else False
+    
+    if options.update_by: update_by = options.update_by
+    else: update_by = DEFAULT_UPDATE_BY
+    
+    if update_by != UPDATE_BY_ID and update_by != UPDATE_BY_HASH:
+        raise m2pException("Unrecognized --update-by value "+update_by+".")
+    
+    # Compress dataset files
+    bgzip_param = options.bgzip_param if options.bgzip_param else False
+    
+    # Checkpoints of the job
+    if options.resume_path: job_checkpoints.configure(options.resume_path)
+    
     ## Read conf file
     app_abs_path = os.path.dirname(os.path.abspath(__file__))+"/"
     
     #paths_config = PathsConfig(app_abs_path) # data_utils.read_paths
     paths_config = PathsConfig()
     paths_config.load_config(app_abs_path)
+    sort_utils.configure(paths_config.get_tmp_files_path())
     
     # App path
     __app_path = paths_config.get_app_path()
@@ -216,6 +449,7 @@ try:
         ###########
         ### 1) FASTA FILES
         ### bmap_align dataset_file_path maps > dataset_path/dataset_id.map
+        ### (performed in-process, aligning the fasta only once to each DB)
         if dataset_file_type == DatasetsConfig.FILE_TYPE_FNA:
             
             ### Create the new directory
@@ -224,27 +458,20 @@ try:
             maps_conf_file = __app_path+ConfigBase.MAPS_CONF
             maps_config = MapsConfig(maps_conf_file, verbose = verbose_param)
             
+            databases_conf_file = __app_path+ConfigBase.DATABASES_CONF
+            databases_config = DatabasesConfig(databases_conf_file, verbose_param)
+            
+            maps_path = paths_config.get_maps_path()
+            tmp_files_dir = paths_config.get_tmp_files_path()
+            
+            # maps which the dataset will be aligned to
+            maps_list = []
+            
             # align to all the maps
             if (len(dataset_db_list)==1) and (dataset_db_list[0] == DatasetsConfig.DATABASES_ANY):
                 
                 for map_id in maps_config.get_maps():
-                    
-                    map_config = maps_config.get_map_config(map_id)
-                    map_name = map_config.get_name()
-                    map_dir = map_config.get_map_dir()
-                    dataset_mapping_path = dataset_path+dataset_id+"."+map_dir
-                    
-                    if os.path.exists(dataset_mapping_path):
-                        sys.stdout.write("\t\tPath "+dataset_mapping_path+" already exists and it will be skipeed.\n"+\
-                                         "\t\tPlease, remove before re-building the dataset data.\n\n")
-                        continue
-                    
-                    sys.stderr.write("\tMap: "+map_name+"\n")
-                    sys.stderr.write("\t\toutput file "+dataset_mapping_path+"\n")
-                    
-                    command = __write_command(map_name, dataset_file_path, dataset_mapping_path, n_threads)
-                    
-                    __run_command(command)
+                    maps_list.append(maps_config.get_map_config(map_id))
                 
             # align to maps which are associated to databases also associated to this dataset
             else:
@@ -258,22 +485,69 @@ try:
                     # refactor to: set(map_db_lis).intersection(dataset_db_list)
                     
                     if len(common_dbs)>0:
-                        
-                        map_name = map_config.get_name()
-                        map_dir = map_config.get_map_dir()
-                        dataset_mapping_path = dataset_path+dataset_id+"."+map_dir
-                        
-                        if os.path.exists(dataset_mapping_path):
-                            sys.stdout.write("\t\tPath "+dataset_mapping_path+" already exists and it will be skipeed.\n"+\
-                                             "\t\tPlease, remove before re-building the dataset data.\n\n")
-                            continue
-                        
-                        sys.stderr.write("\tMap: "+map_name+"\n")
-                        sys.stderr.write("\t\toutput file "+dataset_mapping_path+"\n")
-                        
-                        command = __write_command(map_name, dataset_file_path, dataset_mapping_path, n_threads)
-                        
-                        __run_command(command)
+                        maps_list.append(map_config)
+            
+            # records to process for each map (all of them, or only new ones with --update)
+            dataset_records = alignment_utils.load_fasta_hashes(dataset_file_path)
+            
+            maps_records = []
+            query_ids = set()
+            full_build = False
+            for map_config in maps_list:
+                
+                dataset_mapping_path = dataset_path+dataset_id+"."+map_config.get_map_dir()
+                
+                map_unit = __map_file_unit(dataset_file_path, dataset_mapping_path)
+                if __resume_map_file(map_unit, dataset_mapping_path): continue
+                
+                map_records = __get_map_records(dataset_records, dataset_mapping_path, update_param, update_by)
+                if map_records == None: continue
+                
+                (records, removed_ids) = map_records
+                if removed_ids == None: full_build = True
+                query_ids.update(records.keys())
+                
+                maps_records.append((map_config, dataset_mapping_path, records, removed_ids, map_unit))
+            
+            # the query fasta is aligned only once to each DB (AlignmentFacade cache)
+            # If only some records have to be updated, only those are aligned
+            tmp_fasta_list = []
+            try:
+                if full_build or len(maps_records) == 0:
+                    query_fasta_path = dataset_file_path
+                else:
+                    query_fasta_path = alignment_utils.extract_fasta_headers(dataset_file_path, query_ids, tmp_files_dir)
+                    tmp_fasta_list.append(query_fasta_path)
+                
+                alignment_facade = AlignmentFacade(paths_config, verbose = verbose_param)
+                alignment_facade.enable_cache(query_fasta_path)
+                
+                for (map_config, dataset_mapping_path, records, removed_ids, map_unit) in maps_records:
+                    
+                    map_name = map_config.get_name()
+                    
+                    sys.stderr.write("\tMap: "+map_name+"\n")
+                    sys.stderr.write("\t\toutput file "+dataset_mapping_path+"\n")
+                    
+                    if len(records) == len(query_ids):
+                        map_fasta_path = query_fasta_path
+                    else:
+                        map_fasta_path = alignment_utils.extract_fasta_headers(query_fasta_path, records.keys(), tmp_files_dir)
+                        tmp_fasta_list.append(map_fasta_path)
+                    
+                    __checkpoint_map_file(map_unit, dataset_mapping_path, False)
+                    
+                    __alignments_to_map_file(alignment_facade, map_fasta_path, maps_path, map_config, databases_config,
+                                             n_threads, tmp_files_dir, dataset_mapping_path, records, removed_ids,
+                                             bgzip_param, verbose_param)
+                    
+                    __checkpoint_map_file(map_unit, dataset_mapping_path, True)
+                
+                alignment_facade.disable_cache()
+                
+            finally:
+                for tmp_fasta_path in tmp_fasta_list:
+                    os.remove(tmp_fasta_path)
             
             sys.stdout.write(_SCRIPT+": dataset "+dataset_name+" with id "+dataset_id+" created.\n")
         
@@ -299,6 +573,7 @@ try:
                 #config_path_dict = read_paths(paths_conf_file) # data_utils.read_paths
                 #__app_path = config_path_dict["app_path"]
                 maps_path = paths_config.get_maps_path()
+                tmp_files_dir = paths_config.get_tmp_files_path()
                 
                 parsed_gtf = False
                 for map_id in maps_config.get_maps():
@@ -315,19 +590,33 @@ try:
                         map_dir = map_config.get_map_dir()
                         dataset_mapping_path = dataset_path+dataset_id+"."+map_dir
                         
-                        if os.path.exists(dataset_mapping_path):
-                            sys.stdout.write("\t\tPath "+dataset_mapping_path+" already exists and it will be skipeed.\n"+\
-                                             "\t\tPlease, remove before re-building the dataset data.\n\n")
-                            continue
+                        map_unit = __map_file_unit(dataset_file_path, dataset_mapping_path)
+                        if __resume_map_file(map_unit, dataset_mapping_path): continue
                         
                         if not parsed_gtf:
                             features = parse_gtf_file(dataset_file_path, dataset_db_list, dataset_type, dataset_file_type) # barleymapcore.utils
+                            features_records = __get_features_records(features)
                             parsed_gtf = True
                         
+                        map_records = __get_map_records(features_records, dataset_mapping_path, update_param, update_by)
+                        if map_records == None: continue
+                        
+                        (records, removed_ids) = map_records
+                        
                         sys.stderr.write("\tMap: "+map_name+"\n")
                         sys.stderr.write("\t\toutput file "+dataset_mapping_path+"\n")
                         
-                        __features_to_map_file(features, maps_path, map_config, dataset_mapping_path, verbose_param)
+                        if removed_ids == None:
+                            map_features = features
+                        else:
+                            map_features = [feature for feature in features if feature.get_query_id() in records]
+                        
+                        __checkpoint_map_file(map_unit, dataset_mapping_path, False)
+                        
+                        __features_to_map_file(map_features, maps_path, map_config, dataset_mapping_path, records, removed_ids,
+                                               bgzip_param, tmp_files_dir, verbose_param)
+                        
+                        __checkpoint_map_file(map_unit, dataset_mapping_path, True)
             
             sys.stdout.write(_SCRIPT+": dataset "+dataset_name+" with id "+dataset_id+" created.\n")
         
@@ -352,6 +641,7 @@ try:
                 #__app_path = config_path_dict["app_path"]
                 #maps_path = __app_path+config_path_dict["maps_path"]
                 maps_path = paths_config.get_maps_path()
+                tmp_files_dir = paths_config.get_tmp_files_path()
                 
                 parsed_bed = False
                 for map_id in maps_config.get_maps():
@@ -368,19 +658,33 @@ try:
                         map_dir = map_config.get_map_dir()
                         dataset_mapping_path = dataset_path+dataset_id+"."+map_dir
                         
-                        if os.path.exists(dataset_mapping_path):
-                            sys.stdout.write("\t\tPath "+dataset_mapping_path+" already exists and it will be skipeed.\n"+\
-                                             "\t\tPlease, remove before re-building the dataset data.\n\n")
-                            continue
+                        map_unit = __map_file_unit(dataset_file_path, dataset_mapping_path)
+                        if __resume_map_file(map_unit, dataset_mapping_path): continue
                         
                         if not parsed_bed:
                             features = parse_bed_file(dataset_file_path, dataset_db_list) # barleymapcore.utils
+                            features_records = __get_features_records(features)
                             parsed_bed = True
                         
+                        map_records = __get_map_records(features_records, dataset_mapping_path, update_param, update_by)
+                        if map_records == None: continue
+                        
+                        (records, removed_ids) = map_records
+                        
                         sys.stderr.write("\tMap: "+map_name+"\n")
                         sys.stderr.write("\t\toutput file "+dataset_mapping_path+"\n")
                         
-                        __features_to_map_file(features, maps_path, map_config, dataset_mapping_path, verbose_param)
+                        if removed_ids == None:
+                            map_features = features
+                        else:
+                            map_features = [feature for feature in features if feature.get_query_id() in records]
+                        
+                        __checkpoint_map_file(map_unit, dataset_mapping_path, False)
+                        
+                        __features_to_map_file(map_features, maps_path, map_config, dataset_mapping_path, records, removed_ids,
+                                               bgzip_param, tmp_files_dir, verbose_param)
+                        
+                        __checkpoint_map_file(map_unit, dataset_mapping_path, True)
             
             sys.stdout.write(_SCRIPT+": dataset "+dataset_name+" with id "+dataset_id+" processed.\n")
         
@@ -458,6 +762,8 @@ except Exception as e:
     sys.stderr.write("\n")
     traceback.print_exc(file=sys.stderr)
 
+profile_utils.write_report()
+
 sys.stderr.write("\n")
 sys.stderr.write(_SCRIPT+": Finished.\n")
 sys.stderr.write("\n")
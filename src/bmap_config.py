@@ -13,6 +13,7 @@
 import sys, os
 from optparse import OptionParser
 from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
 
 from barleymapcore.db.ConfigBase import ConfigBase
 from barleymapcore.db.PathsConfig import PathsConfig
@@ -70,8 +71,13 @@ try:
     __usage = "usage: bmap_config.py"
     optParser = OptionParser(__usage)
     
+    optParser.add_option('--profile', action='store', dest='profile_path', type='string',
+                         help='Write a JSON report with the time spent in each stage and the rows, bytes and hits processed to this file.')
+    
     (options, arguments) = optParser.parse_args()
     
+    if options.profile_path: profile_utils.enable(options.profile_path)
+    
     sys.stdout.write("Warning: this command outputs to stderr.\n")
     
     sys.stderr.write("Command: "+" ".join(sys.argv)+"\n")
@@ -277,6 +283,8 @@ except Exception as e:
     sys.stderr.write('An error was detected. If you can not solve it please contact compbio@eead.csic.es ('+\
                                    'laboratory of computational biology at EEAD).\n')
 
+profile_utils.write_report()
+
 sys.stderr.write("End.\n")
 
 ## END
\ No newline at end of file
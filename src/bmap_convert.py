@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bmap_convert.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+############################################
+# This script creates the columnar version (.cols)
+# of dataset files (datasets/<dataset>/<dataset>.<map>)
+# and map files (maps/<map>/<map>.<db>), which
+# barleymap reads instead of the text files (requires NumPy).
+############################################
+
+import sys, os, traceback
+from optparse import OptionParser
+
+from barleymapcore.db.ConfigBase import ConfigBase
+from barleymapcore.db.PathsConfig import PathsConfig
+from barleymapcore.db.MapsConfig import MapsConfig
+from barleymapcore.db.DatasetsConfig import DatasetsConfig
+from barleymapcore.maps.MapsBase import MapTypes
+from barleymapcore.maps.reader.MapReader import MapReader
+from barleymapcore.maps.reader.ColumnarDataset import ColumnarDataset
+from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+
+_SCRIPT = os.path.basename(__file__)
+
+MAPS_CONF = ConfigBase.MAPS_CONF
+DATASETS_CONF = ConfigBase.DATASETS_CONF
+
+DEFAULT_SORT_PARAM = "map default"
+
+def _convert_file(data_path, convert_func, remove_param, verbose_param):
+    
+    if not os.path.exists(data_path):
+        if verbose_param: sys.stderr.write("\t\t"+data_path+" does not exist and it will be skipped.\n")
+        return
+    
+    if remove_param:
+        sys.stderr.write("\t\tremoving "+ColumnarDataset.get_path(data_path)+"\n")
+        ColumnarDataset.remove(data_path)
+    else:
+        sys.stderr.write("\t\tconverting "+data_path+"\n")
+        with profile_utils.timer("columnar/convert"):
+            convert_func(data_path)
+    
+    return
+
+try:
+    ## Argument parsing
+    __usage = "usage: "+_SCRIPT+" [OPTIONS]"
+    optParser = OptionParser(__usage)
+    
+    optParser.add_option('--datasets', action='store', dest='datasets_param', type='string',
+                    help='Comma delimited list of dataset IDs to convert (default all).')
+    
+    optParser.add_option('--maps', action='store', dest='maps_param', type='string',
+                    help='Comma delimited list of map IDs whose files will be converted (default all).')
+    
+    optParser.add_option('--map-files', action='store_true', dest='map_files_param',
+                    help='Convert also the map files (maps/<map>/<map>.<db>) of the maps.')
+    
+    optParser.add_option('--sort', action='store', dest='sort_param', type='string',
+                    help='Sort dataset rows by cM ('+MapTypes.MAP_SORT_PARAM_CM+') or bp ('+MapTypes.MAP_SORT_PARAM_BP+\
+                    ') positions (default '+DEFAULT_SORT_PARAM+'). '+\
+                    'The columnar version is used for positional queries with the same sort only.')
+    
+    optParser.add_option('--remove', action='store_true', dest='remove_param',
+                    help='Remove the columnar versions instead of creating them.')
+    
+    optParser.add_option('--profile', action='store', dest='profile_path', type='string',
+                         help='Write a JSON report with the time spent in each stage and the rows, bytes and hits processed to this file.')
+    
+    optParser.add_option('-v', '--verbose', action='store_true', dest='verbose', help='More information printed.')
+    
+    (options, arguments) = optParser.parse_args()
+    
+    if options.profile_path: profile_utils.enable(options.profile_path)
+    
+    verbose_param = options.verbose if options.verbose else False
+    
+    if verbose_param: sys.stderr.write("Command: "+" ".join(sys.argv)+"\n")
+    
+    remove_param = options.remove_param if options.remove_param else False
+    
+    map_files_param = options.map_files_param if options.map_files_param else False
+    
+    if options.sort_param: sort_param = options.sort_param
+    else: sort_param = DEFAULT_SORT_PARAM
+    
+    if not remove_param and not ColumnarDataset.is_available():
+        raise m2pException("NumPy is required to create columnar files.")
+    
+    ## Read conf file
+    app_abs_path = os.path.dirname(os.path.abspath(__file__))+"/"
+    
+    paths_config = PathsConfig()
+    paths_config.load_config(app_abs_path)
+    
+    __app_path = paths_config.get_app_path()
+    datasets_path = paths_config.get_datasets_path()
+    maps_path = paths_config.get_maps_path()
+    
+    maps_config = MapsConfig(__app_path+MAPS_CONF, verbose = verbose_param)
+    datasets_config = DatasetsConfig(__app_path+DATASETS_CONF, verbose = verbose_param)
+    
+    if options.maps_param: maps_ids = options.maps_param.strip().split(",")
+    else: maps_ids = maps_config.get_maps_list()
+    
+    if options.datasets_param: datasets_ids = options.datasets_param.strip().split(",")
+    else: datasets_ids = datasets_config.get_datasets_list()
+    
+    for map_id in maps_ids:
+        
+        map_config = maps_config.get_map_config(map_id)
+        map_dir = map_config.get_map_dir()
+        
+        sort_by = map_config.check_sort_param(map_config, sort_param, DEFAULT_SORT_PARAM)
+        
+        sys.stderr.write(_SCRIPT+": map "+map_config.get_name()+" (sort by "+sort_by+")\n")
+        
+        chrom_dict = MapReader(maps_path, map_config, verbose_param).get_chrom_dict()
+        
+        ## Map files
+        if map_files_param:
+            for db in map_config.get_db_list():
+                map_path = maps_path+map_dir+"/"+map_dir+"."+db
+                
+                _convert_file(map_path,
+                              lambda data_path: ColumnarDataset.convert_map(data_path, map_config, verbose_param),
+                              remove_param, verbose_param)
+        
+        ## Dataset files
+        for dataset_id in datasets_ids:
+            dataset_mapping_path = datasets_path+dataset_id+"/"+dataset_id+"."+map_dir
+            
+            _convert_file(dataset_mapping_path,
+                          lambda data_path: ColumnarDataset.convert_dataset(data_path, map_config, chrom_dict, sort_by, verbose_param),
+                          remove_param, verbose_param)
+
+except m2pException as e:
+    sys.stderr.write("\nbarleymap reports an error:\n")
+    sys.stderr.write(str(e)+"\n")
+    sys.stderr.write('If you can not solve it please contact compbio@eead.csic.es ('+\
+                        'laboratory of computational biology at EEAD).\n')
+
+except Exception as e:
+    sys.stderr.write("\n")
+    sys.stderr.write('An error was detected. If you can not solve it please contact compbio@eead.csic.es ('+\
+                                   'laboratory of computational biology at EEAD).\n')
+    sys.stderr.write("\n")
+    traceback.print_exc(file=sys.stderr)
+
+profile_utils.write_report()
+
+sys.stderr.write("\n")
+sys.stderr.write(_SCRIPT+": Finished.\n")
+sys.stderr.write("\n")
+
+## END
@@ -14,9 +14,17 @@ import sys, os, traceback
 import cPickle
 #import json It seems json is slower than cPickle with protocol 2
 
+from barleymapcore.utils.bgzf_utils import open_data_file
+from barleymapcore.maps.reader.DatasetIndex import DatasetIndex
+import barleymapcore.utils.profile_utils as profile_utils
+
 file_to_index = sys.argv[1]
 index_file = file_to_index+".idx"
 
+# bmap_datasets_index.py FILE [--profile REPORT_FILE]
+if len(sys.argv) > 3 and sys.argv[2] == "--profile":
+    profile_utils.enable(sys.argv[3])
+
 index = {}
 
 sys.stderr.write("File to index: "+str(file_to_index)+"\n")
@@ -26,7 +34,8 @@ prev = False
 #i=0
 curr_byte = 0
 sys.stderr.write("Indexing rows...\n")
-with open(file_to_index, 'r') as f_i:
+# (virtual offsets if the file is block compressed)
+with profile_utils.timer("index/rows"), open_data_file(file_to_index) as f_i:
     #for i, line in enumerate(f_i):
     while True:
         line = f_i.readline()
@@ -39,7 +48,13 @@ with open(file_to_index, 'r') as f_i:
         line_data = line.strip().split("\t")
         
         # Assign the previous bytes
-        index[line_data[0]] = curr_byte
+        # (a list of bytes for IDs with multiple rows, see DatasetIndex.write_id_index)
+        if line_data[0] in index:
+            prev_bytes = index[line_data[0]]
+            if isinstance(prev_bytes, list): prev_bytes.append(curr_byte)
+            else: index[line_data[0]] = [prev_bytes, curr_byte]
+        else:
+            index[line_data[0]] = curr_byte
         # Obtain bytes for the next line
         curr_byte = f_i.tell()
         
@@ -50,6 +65,11 @@ with open(file_to_index, 'r') as f_i:
     
 sys.stderr.write("Final lines in index "+str(len(index))+"\n")
 
+# (the rows are those of the index, counted only if profiling)
+if profile_utils.is_enabled():
+    num_rows = sum([len(prev_bytes) if isinstance(prev_bytes, list) else 1 for prev_bytes in index.itervalues()])
+    profile_utils.count_scan(file_to_index, num_rows, num_rows, os.path.getsize(file_to_index))
+
 # example of how to read using bytes
 #with open(file_to_index, 'r') as f_i:
 #    f_i.seek(0)
@@ -59,8 +79,8 @@ sys.stderr.write("Final lines in index "+str(len(index))+"\n")
 sys.stderr.write("Writing the index to "+index_file+"...\n")
 
 ## Serialize the dictionary
-with open(index_file, 'w') as index_f:
-    cPickle.dump(index, index_f, protocol = 2)
+with profile_utils.timer("index/write"):
+    DatasetIndex.write_id_index(file_to_index, index)
     #json.dump(index, index_f)
 
 sys.stderr.write("Loading the index to "+index_file+"...\n")
@@ -70,4 +90,6 @@ with open(index_file, 'r') as index_f:
 
 sys.stderr.write("finished indexing "+file_to_index+" to "+index_file+"\n")
 
+profile_utils.write_report()
+
 ## END
\ No newline at end of file
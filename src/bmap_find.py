@@ -22,6 +22,10 @@ from barleymapcore.datasets.DatasetsFacade import DatasetsFacade
 from barleymapcore.annotators.GenesAnnotator import AnnotatorsFactory
 from barleymapcore.maps.MapMarkers import MapMarkers
 from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+import barleymapcore.utils.search_stats as search_stats
+import barleymapcore.utils.shard_utils as shard_utils
+import barleymapcore.utils.sort_utils as sort_utils
 from barleymapcore.maps.enrichment.MapEnricher import SHOW_ON_INTERVALS, SHOW_ON_MARKERS
 
 from barleymapcore.output.OutputFacade import OutputFacade
@@ -57,6 +61,7 @@ def _print_parameters(query_ids_path, genetic_map_name, \
     return
     
 ############# BARLEYMAP_FIND_MARKERS
+shard_path = None
 try:
     
     ## Usage
@@ -106,12 +111,33 @@ try:
     optParser.add_option('-f', action='store_true', dest='format_numbers', \
                          help='cM positions will be output with all decimals (default, 2 decimals).')
     
+    optParser.add_option('--shard', action='store', dest='shard', type='string',
+                         help='Process only the shard i of N (e.g. 1/4) of the queries, assigned by a hash of their identifiers '+\
+                         '(the same for the synonyms of the datasets), '+\
+                         'so that a job can be run as N separate processes, whose outputs are then merged with bmap_merge. '+\
+                         'Not compatible with -a, -g and -m.')
+    
+    optParser.add_option('--search-stats', action='store', dest='search_stats', type='string',
+                         help='Add the queries searched, found and the time spent in each dataset to the statistics of this JSON file.')
+    
+    optParser.add_option('--adaptive-order', action='store_true', dest='adaptive_order',
+                         help='Search the datasets from the one which found more queries per second to the one which found less, '+\
+                         'according to --search-stats, so that the search stops sooner. A query is searched only until it is found, '+\
+                         'and so the results change for the queries found in more than one dataset.')
+    
+    optParser.add_option('--profile', action='store', dest='profile_path', type='string',
+                         help='Write a JSON report with the time spent in each stage and the rows, bytes and hits processed to this file.')
+    
     optParser.add_option('-v', '--verbose', action='store_true', dest='verbose', help='More information printed.')
     
     ########### Read parameters
     ###########
     (options, arguments) = optParser.parse_args()
     
+    if options.profile_path: profile_utils.enable(options.profile_path)
+    if options.search_stats: search_stats.enable(options.search_stats, options.adaptive_order)
+    elif options.adaptive_order: optParser.exit(0, "--adaptive-order requires --search-stats.\n")
+    
     if not arguments or len(arguments)==0:
         optParser.exit(0, "You may wish to run '-help' option.\n")
     
@@ -170,12 +196,20 @@ try:
     # Collapsed view
     collapsed_view = options.collapse if options.collapse else False
     
+    # Shard of the queries
+    if options.shard: shard = shard_utils.parse_shard(options.shard)
+    else: shard = None
+    
+    if shard and (show_anchored or show_genes or show_markers):
+        raise Exception("Features (-a, -g, -m) can not be shown when queries are processed in shards (--shard).")
+    
     ######### Read configuration files
     #########
     app_abs_path = os.path.dirname(os.path.abspath(__file__))
     
     paths_config = PathsConfig()
     paths_config.load_config(app_abs_path)
+    sort_utils.configure(paths_config.get_tmp_files_path())
     __app_path = paths_config.get_app_path()
     
     # Datasets
@@ -233,6 +267,14 @@ try:
     else:
         outputPrinter = OutputFacade.get_expanded_printer(sys.stdout, verbose = verbose_param, beauty_nums = beauty_nums, show_headers = True)
     
+    if shard:
+        # synonyms are in the same shard, so that they are joined in a single row as without shards
+        datasets_synonyms = [datasets_facade.load_synonyms(datasets_config.get_dataset_config(dataset_id).get_synonyms())
+                             for dataset_id in datasets_ids]
+        shard_path = shard_utils.extract_lines_shard(query_ids_path, shard, paths_config.get_tmp_files_path(),
+                                                     shard_utils.get_synonyms_shard_ids(datasets_synonyms))
+        query_ids_path = shard_path
+    
     ########### Create maps
     ###########
     for map_id in maps_ids:
@@ -256,18 +298,19 @@ try:
         mapping_results = mapMarkers.get_mapping_results()
         
         ############################################################ OUTPUT
-        if show_markers:
-            outputPrinter.print_map_with_markers(mapping_results.get_map_with_markers(), map_config, multiple_param)
-        elif show_genes:
-            outputPrinter.print_map_with_genes(mapping_results.get_map_with_genes(), map_config, multiple_param, load_annot, annotator)
-        elif show_anchored:
-            outputPrinter.print_map_with_anchored(mapping_results.get_map_with_anchored(), map_config, multiple_param)
-        else:
-            outputPrinter.print_map(mapping_results.get_mapped(), map_config, multiple_param)
-        
-        if show_unmapped:
-            # Markers not found in datasets are included in unaligned map but is clearer show them as unmapped
-            outputPrinter.print_unaligned(mapping_results.get_unaligned(), map_config)
+        with profile_utils.timer("output"):
+            if show_markers:
+                outputPrinter.print_map_with_markers(mapping_results.get_map_with_markers(), map_config, multiple_param)
+            elif show_genes:
+                outputPrinter.print_map_with_genes(mapping_results.get_map_with_genes(), map_config, multiple_param, load_annot, annotator)
+            elif show_anchored:
+                outputPrinter.print_map_with_anchored(mapping_results.get_map_with_anchored(), map_config, multiple_param)
+            else:
+                outputPrinter.print_map(mapping_results.get_mapped(), map_config, multiple_param)
+            
+            if show_unmapped:
+                # Markers not found in datasets are included in unaligned map but is clearer show them as unmapped
+                outputPrinter.print_unaligned(mapping_results.get_unaligned(), map_config)
 
 except m2pException as m2pe:
     sys.stderr.write("\nThere was an error.\n")
@@ -280,6 +323,8 @@ except Exception as e:
     sys.stderr.write('If you can not solve it please contact compbio@eead.csic.es ('+\
                                    'laboratory of computational biology at EEAD).\n')
 finally:
-    pass
+    if shard_path != None and os.path.exists(shard_path): os.remove(shard_path)
+    profile_utils.write_report()
+    search_stats.write_stats()
 
 ## END
\ No newline at end of file
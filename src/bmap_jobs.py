@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bmap_jobs.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+############################################
+# This script runs a pool of workers which run the jobs
+# of bmap_align, bmap_find and bmap_locate submitted
+# to a local queue (workers), and submits jobs to the queue,
+# checks their status and gets their results
+# (submit, status, fetch, purge).
+############################################
+
+import sys, os, time, traceback
+from optparse import OptionParser
+
+from barleymapcore.db.PathsConfig import PathsConfig
+from barleymapcore.jobs.JobQueue import JobQueue, TOOLS_PRIORITIES, DEFAULT_RESULT_TTL, STATUS_QUEUED
+from barleymapcore.jobs.JobWorkers import JobWorkers, DEFAULT_NUM_WORKERS, DEFAULT_LOOKUP_WORKERS, DEFAULT_POLL_INTERVAL
+from barleymapcore.m2p_exception import m2pException
+
+_SCRIPT = os.path.basename(__file__)
+
+COMMAND_WORKERS = "workers"
+COMMAND_SUBMIT = "submit"
+COMMAND_STATUS = "status"
+COMMAND_FETCH = "fetch"
+COMMAND_PURGE = "purge"
+
+COMMANDS_NUM_ARGS = {COMMAND_WORKERS:0, COMMAND_SUBMIT:2, COMMAND_STATUS:1, COMMAND_FETCH:1, COMMAND_PURGE:0}
+
+DEFAULT_JOBS_DIR = "jobs"
+
+TIME_FIELDS = ["submitted", "started", "finished", "expires"]
+
+try:
+    ## Argument parsing
+    __usage = "usage: "+_SCRIPT+" "+COMMAND_WORKERS+" [OPTIONS]\n"+\
+              "       "+_SCRIPT+" "+COMMAND_SUBMIT+" [OPTIONS] TOOL INPUT_FILE [-- TOOL_OPTIONS]\n"+\
+              "       "+_SCRIPT+" "+COMMAND_STATUS+" [OPTIONS] JOB_ID\n"+\
+              "       "+_SCRIPT+" "+COMMAND_FETCH+" [OPTIONS] JOB_ID\n"+\
+              "       "+_SCRIPT+" "+COMMAND_PURGE+" [OPTIONS]\n\n"+\
+              "tools: "+",".join(sorted(TOOLS_PRIORITIES))+"\n"+\
+              "typical: "+_SCRIPT+" "+COMMAND_SUBMIT+" bmap_find queries.ids -- --maps=MorexGenome -u"
+    optParser = OptionParser(__usage)
+    
+    optParser.add_option('--queue', action='store', dest='queue_path', type='string',
+                    help='Directory of the queue (default jobs_path of paths.conf, or tmp_files_path/'+DEFAULT_JOBS_DIR+').')
+    
+    optParser.add_option('--workers', action='store', dest='num_workers', type='string',
+                    help='workers: number of jobs run at the same time (default '+str(DEFAULT_NUM_WORKERS)+').')
+    
+    optParser.add_option('--lookup-workers', action='store', dest='lookup_workers', type='string',
+                    help='workers: how many of them run only bmap_find and bmap_locate jobs (or others with their priority), '+\
+                    'so that these are not delayed by long alignments (default '+str(DEFAULT_LOOKUP_WORKERS)+').')
+    
+    optParser.add_option('--poll', action='store', dest='poll_interval', type='string',
+                    help='workers: seconds between checks of the queue of idle workers (default '+str(DEFAULT_POLL_INTERVAL)+').')
+    
+    optParser.add_option('--python', action='store', dest='python', type='string',
+                    help='workers: Python interpreter to run the bmap_ tools (default the one running '+_SCRIPT+').')
+    
+    optParser.add_option('--priority', action='store', dest='priority', type='string',
+                    help='submit: priority of the job, lower first (default '+\
+                    ", ".join([tool+" "+str(TOOLS_PRIORITIES[tool]) for tool in sorted(TOOLS_PRIORITIES)])+').')
+    
+    optParser.add_option('--ttl', action='store', dest='result_ttl', type='string',
+                    help='submit: seconds the result is kept after the job finishes (default '+str(DEFAULT_RESULT_TTL)+').')
+    
+    optParser.add_option('--log', action='store_true', dest='fetch_log',
+                    help='fetch: get the log (stderr) of the tool instead of its output.')
+    
+    optParser.add_option('-v', '--verbose', action='store_true', dest='verbose', help='More information printed.')
+    
+    (options, arguments) = optParser.parse_args()
+    
+    if not arguments or not arguments[0] in COMMANDS_NUM_ARGS:
+        optParser.exit(0, "You may wish to run '-help' option.\n")
+    
+    command = arguments[0]
+    
+    # the options of the tool of submit follow "--"
+    if command == COMMAND_SUBMIT:
+        command_args = arguments[1:3]
+        tool_args = arguments[3:]
+    else:
+        command_args = arguments[1:]
+        tool_args = []
+    
+    if len(command_args) != COMMANDS_NUM_ARGS[command]:
+        optParser.exit(0, "You may wish to run '-help' option.\n")
+    
+    verbose_param = options.verbose if options.verbose else False
+    
+    if verbose_param: sys.stderr.write("Command: "+" ".join(sys.argv)+"\n")
+    
+    ## Read conf file
+    app_abs_path = os.path.dirname(os.path.abspath(__file__))+"/"
+    
+    paths_config = PathsConfig()
+    paths_config.load_config(app_abs_path)
+    
+    if options.queue_path: queue_path = options.queue_path
+    elif paths_config.get_jobs_path() != "": queue_path = paths_config.get_jobs_path()
+    else: queue_path = os.path.join(paths_config.get_tmp_files_path(), DEFAULT_JOBS_DIR)
+    
+    if command == COMMAND_WORKERS:
+        num_workers = int(options.num_workers) if options.num_workers else DEFAULT_NUM_WORKERS
+        lookup_workers = int(options.lookup_workers) if options.lookup_workers else DEFAULT_LOOKUP_WORKERS
+        poll_interval = float(options.poll_interval) if options.poll_interval else DEFAULT_POLL_INTERVAL
+        python = options.python if options.python else sys.executable
+        
+        job_workers = JobWorkers(queue_path, paths_config.get_app_path(), python,
+                                 num_workers, lookup_workers, poll_interval, verbose_param)
+        job_workers.run()
+    
+    else:
+        job_queue = JobQueue(queue_path, verbose_param)
+        
+        try:
+            if command == COMMAND_SUBMIT:
+                (tool, input_path) = command_args
+                priority = int(options.priority) if options.priority else None
+                result_ttl = float(options.result_ttl) if options.result_ttl else DEFAULT_RESULT_TTL
+                
+                job_id = job_queue.submit(tool, input_path, tool_args, priority, result_ttl)
+                sys.stdout.write(job_id+"\n")
+            
+            elif command == COMMAND_STATUS:
+                job_id = command_args[0]
+                
+                job_status = job_queue.get_status(job_id)
+                if job_status == None:
+                    raise m2pException("Job "+job_id+" does not exist.")
+                
+                for field in ["job_id", "status", "tool", "args", "priority", "submitted", "started", "finished", "expires", "return_code"]:
+                    value = job_status[field]
+                    if value == None: value = "-"
+                    elif field == "args": value = " ".join(value)
+                    elif field in TIME_FIELDS: value = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(value))
+                    
+                    sys.stdout.write(field+"\t"+str(value)+"\n")
+                
+                if job_status["status"] == STATUS_QUEUED:
+                    sys.stdout.write("jobs_before\t"+str(job_status["jobs_before"])+"\n")
+            
+            elif command == COMMAND_FETCH:
+                fetch_log = options.fetch_log if options.fetch_log else False
+                
+                job_queue.fetch(command_args[0], sys.stdout, fetch_log)
+            
+            elif command == COMMAND_PURGE:
+                num_expired = job_queue.purge_expired()
+                sys.stderr.write(_SCRIPT+": "+str(num_expired)+" results expired.\n")
+        finally:
+            job_queue.close()
+
+except m2pException as e:
+    sys.stderr.write("\nbarleymap reports an error:\n")
+    sys.stderr.write(str(e)+"\n")
+    sys.stderr.write('If you can not solve it please contact compbio@eead.csic.es ('+\
+                        'laboratory of computational biology at EEAD).\n')
+
+except Exception as e:
+    sys.stderr.write("\n")
+    sys.stderr.write('An error was detected. If you can not solve it please contact compbio@eead.csic.es ('+\
+                                   'laboratory of computational biology at EEAD).\n')
+    sys.stderr.write("\n")
+    traceback.print_exc(file=sys.stderr)
+
+## END
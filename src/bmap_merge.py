@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bmap_merge.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+############################################
+# This script merges the outputs of the shards
+# of a job (bmap_align, bmap_find or bmap_locate
+# with --shard i/N) into the output which the job
+# would have had without shards.
+############################################
+
+import sys, os, traceback
+from optparse import OptionParser
+
+from barleymapcore.db.ConfigBase import ConfigBase
+from barleymapcore.db.PathsConfig import PathsConfig
+from barleymapcore.db.MapsConfig import MapsConfig
+from barleymapcore.maps.MapsBase import MapTypes
+from barleymapcore.output.OutputMerger import OutputMerger
+from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.profile_utils as profile_utils
+
+_SCRIPT = os.path.basename(__file__)
+
+MAPS_CONF = ConfigBase.MAPS_CONF
+
+DEFAULT_SORT_PARAM = "map default"
+
+try:
+    ## Argument parsing
+    __usage = "usage: "+_SCRIPT+" [OPTIONS] [SHARD_OUTPUT_FILE]+"
+    optParser = OptionParser(__usage)
+    
+    optParser.add_option('--sort', action='store', dest='sort_param', type='string',
+                    help='Sort used by the shards, by cM ('+MapTypes.MAP_SORT_PARAM_CM+') or bp ('+MapTypes.MAP_SORT_PARAM_BP+\
+                    ') positions (default '+DEFAULT_SORT_PARAM+'). '+\
+                    'For maps sorted by cM, the shards should be run with -f, since rows within 0.01 cM may be merged in other order otherwise.')
+    
+    optParser.add_option('--profile', action='store', dest='profile_path', type='string',
+                         help='Write a JSON report with the time spent in each stage and the rows, bytes and hits processed to this file.')
+    
+    optParser.add_option('-v', '--verbose', action='store_true', dest='verbose', help='More information printed.')
+    
+    (options, arguments) = optParser.parse_args()
+    
+    if options.profile_path: profile_utils.enable(options.profile_path)
+    
+    if not arguments or len(arguments)==0:
+        optParser.exit(0, "You may wish to run '-help' option.\n")
+    
+    verbose_param = options.verbose if options.verbose else False
+    
+    if verbose_param: sys.stderr.write("Command: "+" ".join(sys.argv)+"\n")
+    
+    if options.sort_param: sort_param = options.sort_param
+    else: sort_param = DEFAULT_SORT_PARAM
+    
+    outputs_paths = arguments
+    for output_path in outputs_paths:
+        if not os.path.isfile(output_path):
+            raise m2pException("The output file "+output_path+" does not exist.")
+    
+    ## Read conf file
+    app_abs_path = os.path.dirname(os.path.abspath(__file__))+"/"
+    
+    paths_config = PathsConfig()
+    paths_config.load_config(app_abs_path)
+    
+    __app_path = paths_config.get_app_path()
+    maps_path = paths_config.get_maps_path()
+    
+    maps_config = MapsConfig(__app_path+MAPS_CONF, verbose = verbose_param)
+    maps_configs = [maps_config.get_map_config(map_id) for map_id in maps_config.get_maps_list()]
+    
+    sys.stderr.write(_SCRIPT+": merging "+str(len(outputs_paths))+" outputs\n")
+    
+    output_merger = OutputMerger(maps_path, maps_configs, sort_param, DEFAULT_SORT_PARAM, verbose_param)
+    output_merger.merge(outputs_paths, sys.stdout)
+
+except m2pException as e:
+    sys.stderr.write("\nbarleymap reports an error:\n")
+    sys.stderr.write(str(e)+"\n")
+    sys.stderr.write('If you can not solve it please contact compbio@eead.csic.es ('+\
+                        'laboratory of computational biology at EEAD).\n')
+
+except Exception as e:
+    sys.stderr.write("\n")
+    sys.stderr.write('An error was detected. If you can not solve it please contact compbio@eead.csic.es ('+\
+                                   'laboratory of computational biology at EEAD).\n')
+    sys.stderr.write("\n")
+    traceback.print_exc(file=sys.stderr)
+
+profile_utils.write_report()
+
+sys.stderr.write("\n")
+sys.stderr.write(_SCRIPT+": Finished.\n")
+sys.stderr.write("\n")
+
+## END
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# test_alignment_utils.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Tests of the aligner commands which can be stopped (alignment_utils)
+##
+## python -m unittest discover -s tests
+
+import sys, os, shutil, tempfile, time, threading, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from barleymapcore.m2p_exception import m2pException
+import barleymapcore.utils.alignment_utils as alignment_utils
+from barleymapcore.alignment.Aligners import BaseAligner, GMAPAligner, HSBlastnAligner, ListAligner, AlignerThread
+
+SLEEP_CMD = "sh -c 'sleep 30; true' | cat"
+
+ROUTING_LENGTH = 100
+
+class AlignerCommandsTest(unittest.TestCase):
+    
+    def _run_commands(self, cmds, results, started):
+        alignment_utils.begin_aligner_commands()
+        try:
+            for cmd in cmds:
+                started.set()
+                try:
+                    results.append(alignment_utils.run_aligner_command(cmd)[2])
+                except m2pException:
+                    results.append("stopped")
+        finally:
+            alignment_utils.end_aligner_commands()
+    
+    # the command running is killed, with the processes it runs, and the next ones are not run
+    def test_stop(self):
+        results = []
+        started = threading.Event()
+        thread = threading.Thread(target = self._run_commands,
+                                  args = (["sh -c 'sleep 30; true' | cat", "true"], results, started))
+        
+        ini_time = time.time()
+        thread.start()
+        started.wait()
+        time.sleep(0.5)
+        
+        alignment_utils.stop_aligner_commands(thread.ident)
+        thread.join()
+        
+        self.assertTrue(time.time() - ini_time < 10)
+        self.assertNotEqual(results[0], 0)
+        self.assertEqual(results[1], "stopped")
+    
+    def test_not_stopped(self):
+        (output, output_err, return_code) = alignment_utils.run_aligner_command("echo hit")
+        
+        self.assertEqual((output, return_code), ("hit\n", 0))
+
+## Runs an aligner command which does not finish until it is stopped
+class SleepingAligner(BaseAligner):
+    
+    def __init__(self, started):
+        BaseAligner.__init__(self, "", 1, "")
+        self._started = started
+        self._results_hits = []
+        self._results_unaligned = []
+    
+    def align(self, fasta_path, db, ref_type, threshold_id, threshold_cov):
+        self._started.set()
+        alignment_utils.run_aligner_command(SLEEP_CMD)
+        self._results_unaligned = alignment_utils.get_fasta_headers(fasta_path)
+        
+        return self.get_hits()
+
+class SleepingGMAPAligner(SleepingAligner, GMAPAligner): pass
+
+class SleepingHSBlastnAligner(SleepingAligner, HSBlastnAligner): pass
+
+class RoutedAlignerThreadTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.gmap_started = threading.Event()
+        self.hsblastn_started = threading.Event()
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+    
+    def _stop_routed(self, queries_lengths, started_events):
+        fasta_path = os.path.join(self.tmp_dir, "queries.fasta")
+        with open(fasta_path, 'w') as fasta_f:
+            for (query_index, query_length) in enumerate(queries_lengths):
+                fasta_f.write(">Q"+str(query_index)+"\n"+"A"*query_length+"\n")
+        
+        list_aligner = ListAligner([SleepingGMAPAligner(self.gmap_started), SleepingHSBlastnAligner(self.hsblastn_started)],
+                                   self.tmp_dir, ROUTING_LENGTH)
+        thread = AlignerThread(list_aligner, fasta_path, "genome", "std", 98, 95)
+        
+        ini_time = time.time()
+        thread.start()
+        for started in started_events:
+            started.wait()
+        time.sleep(0.5)
+        
+        thread.stop()
+        thread.join()
+        
+        self.assertTrue(time.time() - ini_time < 10)
+        self.assertEqual(thread.get_error(), None)
+        self.assertEqual(list_aligner.get_unaligned(), ["Q"+str(query_index) for query_index in xrange(len(queries_lengths))])
+    
+    # the aligner of a single partition runs in the thread being stopped
+    def test_stop_single_partition(self):
+        self._stop_routed([50, 60], [self.hsblastn_started])
+    
+    # the aligners of several partitions run in threads started by the thread being stopped
+    def test_stop_partitions(self):
+        self._stop_routed([50, 500], [self.hsblastn_started, self.gmap_started])
+
+if __name__ == "__main__":
+    unittest.main()
+
+## END
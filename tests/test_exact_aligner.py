@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# test_exact_aligner.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Tests of the "exact" aligner (m2p_exact)
+##
+## python -m unittest discover -s tests
+
+import sys, os, shutil, tempfile, random, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import barleymapcore.alignment.m2p_exact as m2p_exact
+
+# its own reverse complement
+PALINDROME = "ACGTTGCAAGCTTGCAATTGCAAGCTTGCAACGT"
+
+@unittest.skipUnless(m2p_exact.is_available(), "NumPy is required by the exact aligner")
+class ExactAlignerTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        
+        rand = random.Random(1)
+        flank = "".join([rand.choice("ACGT") for pos in xrange(200)])
+        self.forward = flank[50:90]
+        
+        with open(os.path.join(self.tmp_dir, "genome.fa"), 'w') as db_f:
+            db_f.write(">chr1H\n"+flank[:100]+PALINDROME+flank[100:]+"\n")
+        
+        self.query_fasta_path = os.path.join(self.tmp_dir, "queries.fasta")
+        with open(self.query_fasta_path, 'w') as query_f:
+            query_f.write(">palindrome\n"+PALINDROME+"\n>forward\n"+self.forward+"\n")
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+    
+    # a palindromic query gets a single hit for each start
+    def test_palindrome(self):
+        results = m2p_exact.get_best_score_hits(self.query_fasta_path, self.tmp_dir, "genome", 98, 95)
+        
+        hits = sorted([(result.get_query_id(), result.get_subject_id(), result.get_local_position(), result.get_strand())
+                       for result in results])
+        
+        self.assertEqual(hits, [("forward", "chr1H", 51, "+"), ("palindrome", "chr1H", 101, "+")])
+
+if __name__ == "__main__":
+    unittest.main()
+
+## END
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# test_file_utils.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Tests of the hashes of files and the files written atomically (file_utils)
+##
+## python -m unittest discover -s tests
+
+import sys, os, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import barleymapcore.utils.file_utils as file_utils
+
+class FileUtilsTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_dir, "data.pickle")
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+    
+    def test_compressed_pickle(self):
+        file_utils.save_compressed_pickle(self.file_path, {"key":("Q1", 95), "data":[1, 2]})
+        
+        self.assertEqual(file_utils.load_compressed_pickle(self.file_path), {"key":("Q1", 95), "data":[1, 2]})
+        self.assertEqual(os.listdir(self.tmp_dir), ["data.pickle"])
+    
+    # the file is not replaced, nor the temporary file left, if it can not be written
+    def test_write_failed(self):
+        file_utils.save_compressed_pickle(self.file_path, "previous")
+        
+        def write_failed(file_desc):
+            file_desc.write("partial")
+            raise IOError("disk full")
+        
+        self.assertRaises(IOError, file_utils.write_file_atomic, self.file_path, write_failed)
+        self.assertEqual(file_utils.load_compressed_pickle(self.file_path), "previous")
+        self.assertEqual(os.listdir(self.tmp_dir), ["data.pickle"])
+    
+    def test_write_dir(self):
+        dir_path = os.path.join(self.tmp_dir, "index")
+        
+        for content in ["first", "second"]:
+            def write_index(tmp_path):
+                with open(os.path.join(tmp_path, content), 'w') as index_f:
+                    index_f.write(content)
+            
+            file_utils.write_dir_atomic(dir_path, write_index)
+        
+        self.assertEqual(os.listdir(dir_path), ["second"])
+        self.assertEqual(os.listdir(self.tmp_dir), ["index"])
+    
+    def test_file_hash(self):
+        with open(self.file_path, 'w') as data_f:
+            data_f.write("ACGT")
+        file_hash = file_utils.get_file_hash(self.file_path)
+        
+        with open(self.file_path, 'w') as data_f:
+            data_f.write("ACGTA")
+        
+        self.assertNotEqual(file_utils.get_file_hash(self.file_path), file_hash)
+
+if __name__ == "__main__":
+    unittest.main()
+
+## END
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# test_job_queue.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Tests of the queue of jobs of bmap_jobs (JobQueue)
+##
+## python -m unittest discover -s tests
+
+import sys, os, shutil, tempfile, time, unittest
+from subprocess import Popen
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from barleymapcore.m2p_exception import m2pException
+from barleymapcore.jobs.JobQueue import JobQueue, TOOL_ALIGN, TOOL_FIND, STATUS_QUEUED
+
+class JobQueueTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.tmp_dir, "queries.ids")
+        with open(self.input_path, 'w') as input_f:
+            input_f.write("Q1\n")
+        
+        self.job_queue = JobQueue(os.path.join(self.tmp_dir, "jobs"))
+    
+    def tearDown(self):
+        self.job_queue.close()
+        shutil.rmtree(self.tmp_dir)
+    
+    def test_options(self):
+        self.job_queue.submit(TOOL_ALIGN, self.input_path, ["--maps=PhysMap", "-k", "--thres-id=95", "--extend=5"])
+        self.job_queue.submit(TOOL_FIND, self.input_path, [])
+        
+        for args in [["--hit-store=/tmp/store"], ["--resume=/tmp/job"], ["--profile=/tmp/report.json"],
+                     ["--hit=/tmp/store"], ["-ku"], ["--maps", "PhysMap"], ["--thres-id=95"]]:
+            self.assertRaises(m2pException, self.job_queue.submit, TOOL_FIND, self.input_path, args)
+    
+    # the tool of a job whose worker was killed is stopped before the job is queued again
+    def test_requeue_orphans(self):
+        job_id = self.job_queue.submit(TOOL_FIND, self.input_path, ["-k"])
+        
+        dead_worker = Popen(["true"])
+        dead_worker.wait()
+        self.job_queue.take_next(dead_worker.pid)
+        
+        tool_process = Popen([sys.executable, "-c", "import time; time.sleep(60)", self.job_queue.get_input_path(job_id)],
+                             preexec_fn = os.setsid)
+        self.job_queue.set_tool_pgid(job_id, tool_process.pid)
+        
+        try:
+            self.assertEqual(self.job_queue.requeue_orphans(), 1)
+            
+            for wait in xrange(50):
+                if tool_process.poll() != None: break
+                time.sleep(0.1)
+            
+            self.assertNotEqual(tool_process.poll(), None)
+        finally:
+            if tool_process.poll() == None: tool_process.kill()
+        
+        job_status = self.job_queue.get_status(job_id)
+        self.assertEqual(job_status["status"], STATUS_QUEUED)
+        self.assertEqual(job_status["tool_pgid"], None)
+
+if __name__ == "__main__":
+    unittest.main()
+
+## END
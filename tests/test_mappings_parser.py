@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# test_mappings_parser.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Tests of the readers of datasets (MappingsParser):
+## reading a dataset with its indexes, or its columnar version, has to return the same as reading the text file.
+##
+## python -m unittest discover -s tests
+
+import sys, os, shutil, tempfile, random, unittest
+import cPickle
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from barleymapcore.db.MapsConfig import MapConfig
+from barleymapcore.db.DatasetsConfig import DatasetsConfig
+from barleymapcore.maps.MapsBase import MapTypes
+from barleymapcore.maps.MapInterval import MapInterval, FeaturedMapInterval
+from barleymapcore.maps.reader.MappingsParser import MappingsParser
+from barleymapcore.maps.reader.DatasetIndex import DatasetIndex, DatasetIndexWriter, ID_INDEX_EXT
+from barleymapcore.maps.reader.ColumnarDataset import ColumnarDataset, KIND_MAP
+
+CHROM_DICT = {"chr1H":"1", "chr2H":"2", "chr3H":"3"}
+
+# marker, chr, start, end, strand, multiple_positions, other_alignments
+DATASET = ">PhysMap\n"+\
+          "#Marker\tchr\tstart\tend\tstrand\tmultiple_positions\tother_alignments\n"+\
+          "M1\tchr1H\t100\t200\t+\tNo\tNo\n"+\
+          "M2\tchr1H\t150\t300\t-\tNo\tNo\n"+\
+          "M3\tchr1H\t400\t500\t+\tYes\tNo\n"+\
+          "M4\tchr2H\t50\t80\t+\tNo\tNo\n"+\
+          "M3\tchr2H\t90\t190\t+\tYes\tNo\n"+\
+          "M5\tchr2H\t300\t350\t-\tNo\tNo\n"
+
+# as loaded by DatasetsRetriever.load_synonyms
+SYNONYMS = {"M2":["M2", "SNP_2", "BOPA_2"],
+            "M4":["M4", "SNP_4"]}
+
+def get_map_config():
+    return MapConfig("PhysMap", "physmap", False, True, MapTypes.MAP_SORT_PARAM_BP,
+                     True, "greedy", ["genome"], "physmap", ["dataset"])
+
+def get_rows(mapping_results):
+    return [(mapping_result.get_marker_id(), mapping_result.get_chrom_name(),
+             str(mapping_result.get_bp_pos()), str(mapping_result.get_bp_end_pos()))
+            for mapping_result in mapping_results]
+
+## Writes the dataset file and its indexes, as bmap_build_datasets
+def write_dataset(data_path, map_config, dataset, block_rows = 1000):
+    with open(data_path, 'w') as data_f:
+        index_writer = DatasetIndexWriter(data_f, map_config, CHROM_DICT, MapTypes.MAP_SORT_PARAM_BP, block_rows)
+        index_writer.write(dataset)
+        index_writer.flush()
+    
+    index_writer.write_indexes(data_path)
+    
+    return
+
+class MappingsParserByIdTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.tmp_dir, "dataset.physmap")
+        self.map_config = get_map_config()
+        
+        write_dataset(self.data_path, self.map_config, DATASET)
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+    
+    def _find(self, queries, multiple_param, synonyms, indexed):
+        query_ids_dict = dict([(query, 0) for query in queries])
+        
+        mappings_parser = MappingsParser()
+        if indexed:
+            mapping_results = mappings_parser.parse_mapping_file_by_id(query_ids_dict, self.data_path, self.map_config, CHROM_DICT,
+                                                                       multiple_param, synonyms, set(queries))
+        else:
+            mapping_results = mappings_parser._parse_mapping_file_by_id(query_ids_dict, self.data_path, self.map_config, CHROM_DICT,
+                                                                        multiple_param, synonyms, set(queries))
+        
+        return (get_rows(mapping_results), query_ids_dict)
+    
+    def _assert_same(self, queries, multiple_param, synonyms):
+        text_found = self._find(queries, multiple_param, synonyms, False)
+        index_found = self._find(queries, multiple_param, synonyms, True)
+        
+        self.assertEqual(text_found, index_found)
+        
+        if ColumnarDataset.is_available():
+            ColumnarDataset.convert_dataset(self.data_path, self.map_config, CHROM_DICT, MapTypes.MAP_SORT_PARAM_BP)
+            columnar_found = self._find(queries, multiple_param, synonyms, True)
+            ColumnarDataset.remove(self.data_path)
+            
+            self.assertEqual(text_found, columnar_found)
+        
+        return index_found
+    
+    def test_synonyms(self):
+        (rows, query_ids_dict) = self._assert_same(["SNP_2", "M1", "SNP_4", "M9"], False, SYNONYMS)
+        
+        self.assertEqual([row[0] for row in rows], ["M1", "SNP_2", "SNP_4"])
+        self.assertEqual(query_ids_dict, {"SNP_2":1, "M1":1, "SNP_4":1, "M9":0})
+    
+    def test_synonyms_and_id(self):
+        (rows, query_ids_dict) = self._assert_same(["BOPA_2", "M2"], False, SYNONYMS)
+        
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(sorted(rows[0][0].split("|")), ["BOPA_2", "M2"])
+    
+    def test_multiple_positions(self):
+        (rows, query_ids_dict) = self._assert_same(["M3"], True, {})
+        
+        self.assertEqual(rows, [("M3", "chr1H", "400", "500"), ("M3", "chr2H", "90", "190")])
+        
+        (rows, query_ids_dict) = self._assert_same(["M3"], False, {})
+        
+        self.assertEqual(rows, [])
+        self.assertEqual(query_ids_dict, {"M3":1})
+    
+    # the IDs have a single offset, as the indexes of previous versions
+    def test_index_format(self):
+        with open(self.data_path+ID_INDEX_EXT, 'r') as index_f:
+            index = cPickle.load(index_f)
+        
+        for query_id in DatasetIndex.get_id_index_ids(index):
+            self.assertTrue(isinstance(index[query_id], (int, long)))
+        
+        self.assertEqual(len(DatasetIndex.get_id_offsets(index, "M3")), 2)
+    
+    def test_previous_index_format(self):
+        with open(self.data_path+ID_INDEX_EXT, 'r') as index_f:
+            index = cPickle.load(index_f)
+        
+        prev_index = dict([(query_id, index[query_id]) for query_id in DatasetIndex.get_id_index_ids(index)])
+        with open(self.data_path+ID_INDEX_EXT, 'w') as index_f:
+            cPickle.dump(prev_index, index_f, protocol = 2)
+        
+        (rows, query_ids_dict) = self._assert_same(["M1", "SNP_2"], False, SYNONYMS)
+        
+        self.assertEqual([row[0] for row in rows], ["M1", "SNP_2"])
+
+class MappingsParserByPosTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.tmp_dir, "dataset.physmap")
+        self.map_config = get_map_config()
+        
+        # rows of different lengths, so that they overlap each other
+        rand = random.Random(1)
+        self.rows = []
+        for (chrom_name, num_rows) in [("chr1H", 60), ("chr2H", 5), ("chr3H", 60)]:
+            for row_pos in xrange(num_rows):
+                start = rand.randint(1, 10000)
+                self.rows.append(("M"+str(len(self.rows)), chrom_name, start, start+rand.choice([10, 100, 2000])))
+        
+        self.rows.sort(key = lambda row: (int(CHROM_DICT[row[1]]), row[2], row[3], row[0]))
+        
+        dataset = "".join(["\t".join([marker_id, chrom_name, str(start), str(end), "+", "No", "No"])+"\n"
+                           for (marker_id, chrom_name, start, end) in self.rows])
+        
+        # small blocks, so that the positional index is used to skip rows
+        write_dataset(self.data_path, self.map_config, dataset, block_rows = 4)
+        
+        # sorted by chromosome and first position, as created by MapEnricher,
+        # some overlapping each other and the last one of chr1H ending after all its rows
+        self.intervals = [("chr1H", 0, 50), ("chr1H", 500, 4000), ("chr1H", 600, 700), ("chr1H", 2000, 2100),
+                          ("chr1H", 5000, 5200), ("chr1H", 9000, 100000),
+                          ("chr3H", 1000, 1500), ("chr3H", 1200, 1300), ("chr3H", 7000, 7100)]
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+    
+    def _get_overlapping(self, chrom_name, ini_pos, end_pos):
+        return [(marker_id, row_chrom, str(start), str(end)) for (marker_id, row_chrom, start, end) in self.rows
+                if row_chrom == chrom_name and start <= end_pos and end >= ini_pos]
+    
+    def _by_pos(self):
+        map_intervals = [MapInterval(chrom_name, float(ini_pos), float(end_pos)) for (chrom_name, ini_pos, end_pos) in self.intervals]
+        
+        mapping_results = MappingsParser().parse_mapping_file_by_pos(map_intervals, self.data_path, CHROM_DICT,
+                                                                     self.map_config, MapTypes.MAP_SORT_PARAM_BP)
+        
+        return get_rows(mapping_results)
+    
+    def _on_pos(self):
+        map_intervals = [FeaturedMapInterval(MapInterval(chrom_name, float(ini_pos), float(end_pos)))
+                         for (chrom_name, ini_pos, end_pos) in self.intervals]
+        
+        MappingsParser().parse_mapping_file_on_pos(map_intervals, self.data_path, CHROM_DICT, self.map_config, MapTypes.MAP_SORT_PARAM_BP,
+                                                   "dataset", "Dataset", DatasetsConfig.DATASET_TYPE_GENETIC_MARKER)
+        
+        return [get_rows([feature.get_mapping_result() for feature in featured_map_interval.get_features()])
+                for featured_map_interval in map_intervals]
+    
+    # rows overlapping any interval, in the order of the file
+    def test_by_pos(self):
+        overlapping = set([row for interval in self.intervals for row in self._get_overlapping(*interval)])
+        expected = [row for row in self._get_overlapping("chr1H", 0, 100000)+self._get_overlapping("chr3H", 0, 100000)
+                    if row in overlapping]
+        
+        self.assertEqual(self._by_pos(), expected)
+    
+    # rows overlapping each interval
+    def test_on_pos(self):
+        expected = [self._get_overlapping(*interval) for interval in self.intervals]
+        
+        self.assertEqual(self._on_pos(), expected)
+    
+    @unittest.skipUnless(ColumnarDataset.is_available(), "NumPy is required by the columnar version")
+    def test_columnar(self):
+        text_by_pos = self._by_pos()
+        text_on_pos = self._on_pos()
+        
+        ColumnarDataset.convert_dataset(self.data_path, self.map_config, CHROM_DICT, MapTypes.MAP_SORT_PARAM_BP)
+        
+        self.assertEqual(self._by_pos(), text_by_pos)
+        self.assertEqual(self._on_pos(), text_on_pos)
+
+@unittest.skipUnless(ColumnarDataset.is_available(), "NumPy is required by the columnar version")
+class ColumnarMapTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.maps_path = self.tmp_dir+"/"
+        os.mkdir(os.path.join(self.tmp_dir, "physmap"))
+        self.map_path = os.path.join(self.tmp_dir, "physmap", "physmap.genome")
+        self.map_config = get_map_config()
+        
+        # contig, chr, cM, bp
+        self.rows = [["C1", "chr1H", "0.0", "1000"], ["C2", "chr1H", "0.0", "2500"], ["C3", "chr2H", "0.0", "300"]]
+        
+        with open(self.map_path, 'w') as map_f:
+            map_f.write(">physmap\n#contig\tchr\tcM\tbp\n")
+            for row in self.rows:
+                map_f.write("\t".join(row)+"\n")
+            map_f.write("\n")
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+    
+    def _by_contig(self):
+        return MappingsParser().parse_mapping_file_by_contig(set(["C1", "C3", "C9"]), self.map_config, self.maps_path, False)
+    
+    # the headers of the map file are not rows
+    def test_headers(self):
+        text_found = self._by_contig()
+        
+        ColumnarDataset.convert_map(self.map_path, self.map_config)
+        columnar = ColumnarDataset.load(self.map_path, KIND_MAP)
+        
+        self.assertEqual(columnar.get_num_rows(), len(self.rows))
+        self.assertEqual([[row_data[0], row_data[1], row_data[3]] for row_data in
+                          [columnar.get_row_data(row) for row in xrange(columnar.get_num_rows())]],
+                         [[contig_id, chrom_name, bp_pos] for (contig_id, chrom_name, cm_pos, bp_pos) in self.rows])
+        
+        self.assertEqual(self._by_contig(), text_found)
+
+if __name__ == "__main__":
+    unittest.main()
+
+## END
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# test_raw_hits_store.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Tests of the store of raw hits of the aligners (RawHitsStore)
+##
+## python -m unittest discover -s tests
+
+import sys, os, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from barleymapcore.alignment.RawHitsStore import RawHitsStore
+
+RAW_HITS = [">Q1 1 100 100 ...", ">Q2 1 80 100 ..."]
+
+class RawHitsStoreTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dbs_path = os.path.join(self.tmp_dir, "dbs")
+        self.store_path = os.path.join(self.tmp_dir, "store")
+        os.makedirs(os.path.join(self.dbs_path, "genome"))
+        os.makedirs(self.store_path)
+        
+        self.db_file = os.path.join(self.dbs_path, "genome", "genome.ref153positions")
+        with open(self.db_file, 'w') as db_f:
+            db_f.write("index")
+        
+        self.fasta_path = os.path.join(self.tmp_dir, "queries.fasta")
+        with open(self.fasta_path, 'w') as fasta_f:
+            fasta_f.write(">Q1\nACGT\n>Q2\nACGA\n")
+        
+        self.hits_store = RawHitsStore(self.store_path)
+        self.hits_store.save("GMAP", "gmap", self.dbs_path, "genome", self.fasta_path, 95, 90, RAW_HITS)
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+    
+    def _load(self, threshold_id, threshold_cov):
+        return self.hits_store.load("GMAP", "gmap", self.dbs_path, "genome", self.fasta_path, threshold_id, threshold_cov)
+    
+    # only for thresholds equal or higher than those of the stored hits
+    def test_thresholds(self):
+        self.assertEqual(self._load(95, 90), RAW_HITS)
+        self.assertEqual(self._load(98.5, 95), RAW_HITS)
+        self.assertEqual(self._load(94.9, 90), None)
+        self.assertEqual(self._load(95, 80), None)
+    
+    # not once the files of the database change
+    def test_database_changed(self):
+        with open(self.db_file, 'w') as db_f:
+            db_f.write("index built again")
+        
+        self.assertEqual(self._load(95, 90), None)
+
+if __name__ == "__main__":
+    unittest.main()
+
+## END
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# test_shards.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Tests of the jobs run in shards (--shard, shard_utils) and merged afterwards (bmap_merge):
+## the merged output has to be the output of the job without shards.
+##
+## python -m unittest discover -s tests
+
+import sys, os, shutil, tempfile, unittest
+from subprocess import Popen, PIPE
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+sys.path.insert(0, SRC_PATH)
+
+import barleymapcore.utils.shard_utils as shard_utils
+
+NUM_SHARDS = 4
+NUM_MARKERS = 40
+
+PATHS_CONF = ["app_path {app}/", "genmap_path app_aux/", "split_blast_path app_aux/", "tmp_files_path {app}/tmp_files",
+              "datasets_path {app}/datasets/", "annot_path {app}/datasets_annotation/", "maps_path {app}/maps/",
+              "blastn_app_path none", "blastn_dbs_path none", "gmap_app_path none", "gmap_dbs_path none",
+              "gmapl_app_path none", "hsblastn_app_path none", "hsblastn_dbs_path none",
+              "citation none", "stdalone_app none"]
+
+class SynonymsShardIdsTest(unittest.TestCase):
+    
+    # the IDs linked by the synonyms of several datasets have the same shard ID
+    def test_groups(self):
+        shard_ids = shard_utils.get_synonyms_shard_ids([{"M2":["M2", "SNP_2"], "M4":["M4", "SNP_4"]},
+                                                        {"X1":["X1", "SNP_2", "BOPA_2"]}])
+        
+        self.assertEqual(shard_ids, {"M2":"BOPA_2", "SNP_2":"BOPA_2", "X1":"BOPA_2", "BOPA_2":"BOPA_2",
+                                     "M4":"M4", "SNP_4":"M4"})
+
+class FindShardsTest(unittest.TestCase):
+    
+    ## A barleymap app with a physical map and a dataset of markers, some of them with synonyms
+    def setUp(self):
+        self.app_path = tempfile.mkdtemp()
+        
+        for app_dir in ["bin", "conf", "tmp_files", "maps/physmap", "datasets/markers"]:
+            os.makedirs(os.path.join(self.app_path, app_dir))
+        
+        for tool in ["bmap_find", "bmap_merge"]:
+            os.symlink(os.path.join(SRC_PATH, tool+".py"), os.path.join(self.app_path, "bin", tool))
+        
+        self._write("bin/paths.conf", [line.format(app = self.app_path) for line in PATHS_CONF])
+        self._write("conf/maps.conf", ["PhysMap physmap cm_false bp_true bp physical greedy genome physmap markers"])
+        self._write("conf/datasets.conf", ["Markers markers genetic_marker "+self.app_path+"/markers.fasta fna ANY "+\
+                                           self.app_path+"/markers.syns no"])
+        self._write("maps/physmap/physmap.chrom", ["chr1H\t1\t1000000", "chr2H\t2\t1000000"])
+        
+        # a few markers at the same positions, which are sorted by their IDs
+        markers = []
+        for marker_index in xrange(NUM_MARKERS):
+            pos = 1000 * (marker_index / 3 + 1)
+            markers.append(["M%03d" % marker_index, "chr%dH" % (marker_index % 2 + 1), str(pos), str(pos + 200), "+", "No", "No"])
+        markers.sort(key = lambda marker: (marker[1], int(marker[2]), marker[0]))
+        self._write("datasets/markers/markers.physmap", ["\t".join(marker) for marker in markers])
+        
+        self._write("markers.syns", ["M%03d\tSNP_%03d\tBOPA_%03d" % (marker_index, marker_index, marker_index)
+                                     for marker_index in xrange(0, NUM_MARKERS, 2)])
+        
+        # every marker with synonyms is searched by two of its IDs
+        self.queries_path = os.path.join(self.app_path, "queries.ids")
+        queries = []
+        for marker_index in xrange(NUM_MARKERS):
+            if marker_index % 2 == 0:
+                queries.extend([("SNP_%03d", "M%03d", "BOPA_%03d")[marker_index % 3] % marker_index,
+                                "BOPA_%03d" % marker_index if marker_index % 3 == 0 else "SNP_%03d" % marker_index])
+            else:
+                queries.append("M%03d" % marker_index)
+        self._write("queries.ids", queries+["UNKNOWN_1", "UNKNOWN_2"])
+    
+    def tearDown(self):
+        shutil.rmtree(self.app_path)
+    
+    def _write(self, rel_path, lines):
+        with open(os.path.join(self.app_path, rel_path), 'w') as conf_f:
+            conf_f.write("\n".join(lines)+"\n")
+    
+    def _run(self, tool, args):
+        process = Popen([sys.executable, os.path.join(self.app_path, "bin", tool)]+args, stdout = PIPE, stderr = PIPE)
+        (output, output_err) = process.communicate()
+        
+        self.assertEqual(output_err.count("There was an error"), 0, output_err)
+        
+        return output
+    
+    def test_synonyms(self):
+        output = self._run("bmap_find", ["--maps=PhysMap", "-u", self.queries_path])
+        
+        shards_paths = []
+        for shard_index in xrange(1, NUM_SHARDS + 1):
+            shards_paths.append(os.path.join(self.app_path, "shard_"+str(shard_index)))
+            with open(shards_paths[-1], 'w') as shard_f:
+                shard_f.write(self._run("bmap_find", ["--maps=PhysMap", "-u", "--shard", str(shard_index)+"/"+str(NUM_SHARDS),
+                                                      self.queries_path]))
+        
+        self.assertEqual(len([row for row in output.split("\n") if "|" in row]), NUM_MARKERS / 2)
+        self.assertEqual(self._run("bmap_merge", shards_paths), output)
+
+if __name__ == "__main__":
+    unittest.main()
+
+## END
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# test_sort_utils.py is part of Barleymap.
+# Copyright (C)  2017  Carlos P Cantalapiedra.
+# (terms of use can be found within the distributed LICENSE file).
+
+## Tests of the sorts with bounded memory (sort_utils)
+##
+## python -m unittest discover -s tests
+
+import sys, os, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from barleymapcore.utils.sort_utils import external_sort_lines
+
+# rows with the same chromosome and position, in an order other than that of the text
+LINES = ["Z1\tchr2H\t10\n", "B1\tchr1H\t5\n", "Y1\tchr1H\t5\n", "A1\tchr1H\t5\n",
+         "X1\tchr2H\t10\n", "C1\tchr1H\t1\n", "W1\tchr2H\t10\n", "A2\tchr1H\t5\n"]
+
+def get_key(line):
+    line_data = line.strip().split("\t")
+    return (line_data[1], int(line_data[2]))
+
+class ExternalSortLinesTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.tmp_dir, "input")
+        
+        with open(self.input_path, 'w') as input_f:
+            input_f.write("#header\n")
+            input_f.writelines(LINES)
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+    
+    def _sort(self, max_lines):
+        output_path = os.path.join(self.tmp_dir, "output."+str(max_lines))
+        external_sort_lines(self.input_path, output_path, get_key, max_lines = max_lines, tmp_files_dir = self.tmp_dir)
+        
+        with open(output_path, 'r') as output_f:
+            return output_f.readlines()
+    
+    # ties keep the order of the input, in memory and with runs spilled to files
+    def test_stable(self):
+        expected = ["#header\n"]+sorted(LINES, key = get_key)
+        
+        self.assertEqual(self._sort(len(LINES)+1), expected)
+        
+        for max_lines in [1, 2, 3]:
+            self.assertEqual(self._sort(max_lines), expected)
+
+if __name__ == "__main__":
+    unittest.main()
+
+## END